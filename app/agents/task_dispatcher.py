@@ -230,13 +230,14 @@ class TaskDispatcher(AgentProtocol):
             logger.info(f"TaskDispatcher执行单个任务: {step.get('step_id')} -> {agent_type}")
             
             # 设置任务特定的上下文
+            fork_message_count = len(state.get("messages") or [])
             task_state = self._prepare_task_state(step, state)
             
             # 执行智能体
             result_state = agent.run(task_state)
             
             # 合并结果状态
-            state = self._merge_task_result(state, result_state, step)
+            state = self._merge_task_result(state, result_state, step, fork_message_count)
             
             # 更新任务进度
             task_plan = state.get("metadata", {}).get("task_plan", {})
@@ -254,8 +255,9 @@ class TaskDispatcher(AgentProtocol):
         """处理并行任务执行"""
         logger.info(f"TaskDispatcher开始并行执行{len(steps)}个任务")
         
-        # 提交所有任务到线程池
+        # 提交所有任务到线程池（各任务的状态分支都从同一消息数开始）
         futures = {}
+        fork_message_count = len(state.get("messages") or [])
         for step in steps:
             agent_type = step.get("agent", "general_analysis")
             agent = self._get_agent_instance(agent_type)
@@ -285,7 +287,8 @@ class TaskDispatcher(AgentProtocol):
                 completed_results[step_id] = {
                     "result": result,
                     "step": step,
-                    "duration": time.time() - start_time
+                    "duration": time.time() - start_time,
+                    "fork_message_count": fork_message_count
                 }
                 
                 logger.info(f"并行任务{step_id}执行完成")
@@ -323,9 +326,13 @@ class TaskDispatcher(AgentProtocol):
             return task_state
     
     def _prepare_task_state(self, step: Dict[str, Any], base_state: IsotopeSystemState) -> IsotopeSystemState:
-        """为特定任务准备状态上下文"""
-        import copy
-        task_state = copy.deepcopy(base_state)
+        """为特定任务准备状态上下文
+        
+        使用写时复制的状态分支，消息和工具结果等内容与原状态共享，
+        任务特定信息只写入分支自己的元数据。
+        """
+        task_state = StateManager.fork_state(base_state)
+        task_state.setdefault("metadata", {})
         
         # 添加任务特定信息
         task_state["metadata"]["current_step"] = step
@@ -341,15 +348,27 @@ class TaskDispatcher(AgentProtocol):
         self, 
         base_state: IsotopeSystemState, 
         result_state: IsotopeSystemState, 
-        step: Dict[str, Any]
+        step: Dict[str, Any],
+        fork_message_count: Optional[int] = None
     ) -> IsotopeSystemState:
-        """合并单个任务的执行结果"""
+        """合并单个任务的执行结果
+        
+        Args:
+            base_state: 原状态
+            result_state: 任务执行后的状态
+            step: 任务步骤
+            fork_message_count: 创建任务状态分支时原状态的消息数；给出时只合并分支上新增的消息
+        """
         
         # 合并消息
         if "messages" in result_state:
             if "messages" not in base_state:
                 base_state["messages"] = []
-            base_state["messages"].extend(result_state["messages"])
+            if fork_message_count is None:
+                new_messages = result_state["messages"]
+            else:
+                new_messages = StateManager.messages_added_since_fork(base_state, result_state, fork_message_count)
+            base_state["messages"].extend(new_messages)
         
         # 合并生成的文件
         if "files" in result_state:
@@ -386,7 +405,9 @@ class TaskDispatcher(AgentProtocol):
             step = result_info["step"]
             duration = result_info["duration"]
             
-            base_state = self._merge_task_result(base_state, result_state, step)
+            base_state = self._merge_task_result(
+                base_state, result_state, step, result_info.get("fork_message_count")
+            )
         
         # 记录失败的任务
         for step_id, error_info in failed_results.items():
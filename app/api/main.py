@@ -29,6 +29,7 @@ if project_root not in sys.path:
 
 from app.core.engine import IsotopeEngine
 from app.core.config import ConfigManager
+from app.core.run_manager import get_run_manager
 from app.api.routes import chat, sessions, files, system
 from app.api.websocket import WebSocketManager
 from app.api.models import APIResponse, ErrorResponse
@@ -63,7 +64,11 @@ async def lifespan(app: FastAPI):
         # 设置全局引擎实例供依赖注入使用
         set_engine(engine_instance)
         
-        # 3. 初始化WebSocket管理器
+        # 3. 初始化运行管理器（后台运行调度与工具限流）
+        run_manager = get_run_manager(config.get("runs"), config.get("ui", {}).get("stream_replay"))
+        logger.info(f"运行管理器并发上限: {run_manager.limits}")
+        
+        # 4. 初始化WebSocket管理器
         websocket_manager = WebSocketManager(engine=engine_instance)
         
         logger.info("✅ 后端API服务初始化完成")
@@ -75,6 +80,9 @@ async def lifespan(app: FastAPI):
         raise
     finally:
         logger.info("🛑 关闭后端API服务...")
+        await get_run_manager().shutdown()
+        if engine_instance is not None:
+            engine_instance.shutdown()
 
 def create_app() -> FastAPI:
     """创建FastAPI应用实例
@@ -114,6 +122,10 @@ def create_app() -> FastAPI:
     from .routes.data import router as data_router
     app.include_router(data_router, prefix="/api/v1/data", tags=["数据管理"])
     
+    # 流式事件中大负载的内容寻址获取接口
+    from .routes.blobs import router as blobs_router
+    app.include_router(blobs_router, prefix="/api/v1/blobs", tags=["大负载内容"])
+    
     # 静态文件服务
     if os.path.exists("data/generated"):
         app.mount("/static", StaticFiles(directory="data/generated"), name="static")
@@ -160,6 +172,17 @@ def create_app() -> FastAPI:
                 error=str(e)
             )
     
+    @app.get("/api/v1/websocket/metrics", response_model=APIResponse)
+    async def websocket_metrics():
+        """WebSocket扇出指标 - 每个连接的排队深度、发送延迟、丢弃与合并次数"""
+        if not websocket_manager:
+            raise HTTPException(status_code=503, detail="WebSocket管理器未初始化")
+        return APIResponse(
+            success=True,
+            message="获取WebSocket指标成功",
+            data=websocket_manager.get_fanout_metrics()
+        )
+    
     @app.websocket("/ws/{session_id}")
     async def websocket_endpoint(websocket: WebSocket, session_id: str):
         """WebSocket端点 - 实时双向通信"""
@@ -230,7 +253,9 @@ def run_api_server(
         reload=reload,
         log_level=log_level,
         
-        # WebSocket配置
+        # WebSocket配置：启用permessage-deflate，客户端协商后每条消息压缩传输
+        ws="websockets",
+        ws_per_message_deflate=True,
         ws_ping_interval=30,
         ws_ping_timeout=30,
         
@@ -9,7 +9,7 @@ API数据模型 - 定义请求和响应的数据结构
 5. 多模态数据模型
 """
 
-from typing import Dict, Any, Optional, List, Union
+from typing import Dict, Any, Optional, List, Union, Literal
 from pydantic import BaseModel, Field
 from datetime import datetime
 from enum import Enum
@@ -62,12 +62,23 @@ class ChatMessage(BaseModel):
     metadata: Optional[Dict[str, Any]] = Field(None, description="消息元数据")
     timestamp: datetime = Field(default_factory=datetime.now, description="时间戳")
 
+class StreamDeliveryOptions(BaseModel):
+    """流式下发选项（未设置的字段使用配置ui.stream_delivery中的默认值）"""
+    mode: Optional[Literal["coalesced", "token"]] = Field(
+        None, description="coalesced: 合并相邻token并只在流开始时发送信封字段; token: 逐token下发完整事件"
+    )
+    flush_interval_ms: Optional[int] = Field(None, ge=0, le=1000, description="token合并时间窗口（毫秒）")
+    flush_bytes: Optional[int] = Field(None, ge=1, le=65536, description="合并缓冲达到该字节数时立即下发")
+
 class ChatRequest(BaseModel):
     """聊天请求模型"""
     message: str = Field(description="用户消息")
     session_id: Optional[str] = Field(None, description="会话ID")
     stream: bool = Field(default=True, description="是否使用流式输出")
     context: Optional[Dict[str, Any]] = Field(None, description="额外上下文")
+    delivery: Optional[StreamDeliveryOptions] = Field(None, description="流式下发选项")
+    include_state: bool = Field(default=False, description="是否推送状态差量（state_diff事件）")
+    background: bool = Field(default=False, description="后台运行：客户端断开后继续执行，可凭run_id重新附着")
 
 class ChatResponse(APIResponse):
     """聊天响应模型"""
@@ -6,6 +6,7 @@ API路由模块 - 定义各种API端点
 2. sessions - 会话管理API
 3. files - 文件管理API
 4. system - 系统管理API
+5. blobs - 大负载内容API
 """
 
 from .system import router as system_router
@@ -14,6 +15,7 @@ from .chat import router as chat_router
 from .sessions import router as sessions_router
 from .visualization import router as visualization_router
 from .data import router as data_router
+from .blobs import router as blobs_router
 
 __all__ = [
     "system_router",
@@ -21,5 +23,6 @@ __all__ = [
     "chat_router",
     "sessions_router",
     "visualization_router",
-    "data_router"
+    "data_router",
+    "blobs_router"
 ] 
\ No newline at end of file
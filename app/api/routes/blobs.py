@@ -0,0 +1,74 @@
+"""
+大负载内容API路由 - 按内容摘要获取流式事件中被替换为引用的大负载
+
+功能包括：
+1. 按sha256摘要获取内容（内容不可变，响应可被浏览器和代理长期缓存）；
+   启用shared_state时本进程未命中的内容从共享层读取
+2. 支持If-None-Match条件请求
+3. 存储指标
+"""
+
+import logging
+import re
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+
+from app.core.engine import IsotopeEngine
+from app.api.dependencies import get_engine
+from app.api.models import APIResponse
+from app.core.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# 内容按摘要寻址，同一URL的内容永不变化
+_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/metrics", response_model=APIResponse)
+async def get_blob_metrics(
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """获取大负载存储指标"""
+    store = get_blob_store(engine.config.get("ui", {}).get("large_payloads"), engine.shared_state)
+    return APIResponse(
+        success=True,
+        message="获取大负载存储指标成功",
+        data=store.get_metrics()
+    )
+
+
+@router.get("/{digest}")
+async def get_blob(
+    digest: str,
+    if_none_match: Optional[str] = Header(None),
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """按摘要获取大负载内容
+
+    Args:
+        digest: 内容的十六进制sha256摘要（事件引用中的url）
+        if_none_match: 条件请求头，与ETag一致时返回304
+        engine: 引擎实例
+
+    Returns:
+        原始内容，Content-Type为存入时的类型
+    """
+    if not _DIGEST_PATTERN.match(digest):
+        raise HTTPException(status_code=400, detail=f"无效的内容摘要: {digest}")
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": _IMMUTABLE_CACHE_CONTROL}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    store = get_blob_store(engine.config.get("ui", {}).get("large_payloads"), engine.shared_state)
+    blob = store.get(digest)
+    if blob is None:
+        raise HTTPException(status_code=404, detail=f"内容不存在或已被回收: {digest}")
+
+    data, content_type = blob
+    return Response(content=data, media_type=content_type, headers=headers)
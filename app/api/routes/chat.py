@@ -8,16 +8,17 @@
 4. 中断和恢复处理
 """
 
+import asyncio
 import logging
 import uuid
 from typing import Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Header
 from fastapi.responses import StreamingResponse
 import json
 import time
 from datetime import datetime
 
-from app.core.engine import IsotopeEngine
+from app.core.engine import IsotopeEngine, HISTORY_SOURCE_TURNS, HISTORY_SOURCE_MESSAGES
 from app.api.dependencies import get_engine
 from app.api.models import (
     ChatRequest, 
@@ -31,6 +32,21 @@ from app.api.models import (
 
 # 导入 StreamMessageType 枚举
 from app.ui.streaming_types import StreamMessageType
+from app.ui.sse import (
+    encode_sse_frame,
+    encode_sse_event,
+    build_stream_payload,
+    format_event_id,
+    parse_event_id,
+    negotiate_sse_encoding,
+    compress_sse_stream,
+    SSE_KEEPALIVE
+)
+from app.ui.stream_coalescer import StreamDeliveryConfig, resolve_delivery_config, acoalesce
+from app.core.state_codec import get_state_codec
+from app.core.stream_replay import StreamReplayBuffer
+from app.core.blob_store import get_payload_externalizer
+from app.core.run_manager import RunManager, RunQueueFullError, SessionRunActiveError, get_run_manager
 
 logger = logging.getLogger(__name__)
 
@@ -74,10 +90,10 @@ async def send_message(
                 detail="流式模式建议使用WebSocket连接（/ws/{session_id}）"
             )
         
-        logger.info("准备调用process_message_streaming...")
+        logger.info("准备调用aprocess_message_streaming...")
         
         # 处理消息（同步模式） - 使用流式方法然后消费所有结果
-        stream_generator = engine.process_message_streaming(
+        stream_generator = engine.aprocess_message_streaming(
             message=request.message,
             session_id=session_id,
             stream_mode=engine.config.get("ui", {}).get("stream_mode", ["messages", "custom", "updates", "values"])
@@ -89,9 +105,10 @@ async def send_message(
         # 消费流并收集AI回复
         ai_responses = []
         
-        for chunk in stream_generator:
-            # 添加调试信息
-            logger.info(f"收到chunk类型: {type(chunk)}, 内容: {chunk}")
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        async for chunk in stream_generator:
+            if debug_enabled:
+                logger.debug(f"收到chunk类型: {type(chunk)}, 内容: {chunk}")
             
             # 检查是否包含AI消息 - 格式是 {"role": "assistant", "content": "..."}
             if isinstance(chunk, dict):
@@ -162,15 +179,200 @@ async def send_message(
         logger.error(f"发送消息失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理消息时出错: {str(e)}")
 
+def _get_run_manager(engine: IsotopeEngine) -> RunManager:
+    """运行管理器（按runs和ui.stream_replay配置创建）"""
+    return get_run_manager(engine.config.get("runs"), engine.config.get("ui", {}).get("stream_replay"))
+
+
+def _append_stream_event(buffer: StreamReplayBuffer, payload: Dict[str, Any]) -> int:
+    """将事件编码后写入运行的回放缓冲，返回序号"""
+    body = get_state_codec().dumps_json(payload)
+    return buffer.append(body, len(body))
+
+
+async def _produce_stream_frames(
+    engine: IsotopeEngine,
+    message: str,
+    session_id: str,
+    stream_mode: Any,
+    include_state: bool,
+    delivery: StreamDeliveryConfig,
+    buffer: StreamReplayBuffer
+) -> None:
+    """消费引擎异步流，将事件按序号写入运行的回放缓冲
+    
+    由运行管理器在获得资源槽位后调用，与连接解耦：客户端断开后运行继续，
+    重连的客户端从缓冲补读缺失的尾部；缓冲按事件数和字节数有界。
+    运行被取消时，引擎的异步生成器随之关闭。
+    合并模式下相邻token按时间窗口/字节阈值合并成一帧，session_id等
+    信封字段只在start事件中发送一次。
+    非token事件中的大负载（图片、表格、HTML报告）替换为内容引用后再写入缓冲。
+    """
+    chunk_count = 0
+    # 紧凑模式下记录已下发的信封字段；逐token模式为None（每帧带完整信封）
+    envelope = {} if delivery.coalesce else None
+    externalizer = get_payload_externalizer(engine.config.get("ui", {}).get("large_payloads"), engine.shared_state)
+    try:
+        # 发送开始标记
+        _append_stream_event(buffer, {
+            "type": "start",
+            "session_id": session_id,
+            "run_id": buffer.run_id,
+            "delivery": delivery.to_dict()
+        })
+        
+        stream = engine.aprocess_message_streaming(
+            message=message,
+            session_id=session_id,
+            stream_mode=stream_mode,
+            include_state=include_state
+        )
+        async for chunk in acoalesce(stream, delivery):
+            chunk_count += 1
+            if not chunk:
+                continue
+            
+            payload = build_stream_payload(chunk, session_id, chunk_count, envelope)
+            if payload is None:
+                continue
+            if externalizer is not None and payload["type"] != "token":
+                payload = externalizer.externalize(payload, owner=buffer)
+            _append_stream_event(buffer, payload)
+        
+        # 发送结束标记
+        _append_stream_event(buffer, {
+            "type": "end",
+            "session_id": session_id,
+            "total_chunks": chunk_count,
+            "timestamp": time.time()
+        })
+    except asyncio.CancelledError:
+        logger.info(f"会话 {session_id} 的流式生产者已取消，已处理 {chunk_count} 个数据块")
+        raise
+    except Exception as e:
+        logger.error(f"流式处理错误: {str(e)}")
+        _append_stream_event(buffer, {
+            "type": "error",
+            "error": str(e),
+            "session_id": session_id,
+            "timestamp": time.time()
+        })
+
+
+async def _tail_replay_buffer(
+    manager: RunManager,
+    run_id: str,
+    last_seq: int,
+    http_request: Request,
+    heartbeat_seconds: float
+):
+    """附着到运行，从回放缓冲中last_seq之后的位置发送SSE帧，直到运行结束
+    
+    重连点已被淘汰时先发送gap事件，告知客户端缺失的序号区间。
+    客户端断开即脱离运行，运行本身继续执行。
+    """
+    buffer = manager.attach(run_id)
+    if buffer is None:
+        return
+    try:
+        while True:
+            events, truncated = buffer.read_after(last_seq)
+            if truncated:
+                resume_from = events[0][0] if events else buffer.last_seq + 1
+                yield encode_sse_frame({
+                    "type": "gap",
+                    "run_id": buffer.run_id,
+                    "from_seq": last_seq + 1,
+                    "to_seq": resume_from - 1
+                })
+                last_seq = resume_from - 1
+            for seq, body in events:
+                yield encode_sse_event(body, format_event_id(buffer.run_id, seq))
+                last_seq = seq
+            
+            if buffer.closed and last_seq >= buffer.last_seq:
+                break
+            if not await buffer.wait(last_seq, timeout=heartbeat_seconds):
+                # 长时间无数据（如工具执行中）：检查连接并发送心跳注释
+                if await http_request.is_disconnected():
+                    logger.info(f"客户端已断开运行 {buffer.run_id}，可凭Last-Event-ID续传")
+                    break
+                yield SSE_KEEPALIVE
+    finally:
+        manager.detach(buffer)
+
+
+# SSE响应头 - 添加所有可能的无缓冲headers
+def _sse_headers(run_id: str, encoding: Optional[str] = None) -> Dict[str, str]:
+    return {
+        # 基本的无缓冲设置
+        "Cache-Control": "no-cache, no-store, must-revalidate, private",
+        "Pragma": "no-cache",
+        "Expires": "0",
+        "Connection": "keep-alive",
+        
+        # CORS设置
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Expose-Headers": "X-Run-Id",
+        
+        # 关键的服务器无缓冲设置
+        "X-Accel-Buffering": "no",        # 禁用nginx缓冲
+        "X-Proxy-Buffering": "no",        # 禁用代理缓冲
+        # 压缩流每帧同步flush，不会被缓冲；未协商到编码时为identity
+        "Content-Encoding": encoding or "identity",
+        "Vary": "Accept-Encoding",
+        
+        # 额外的HTTP/1.1无缓冲设置
+        "Transfer-Encoding": "chunked",   # 使用分块传输
+        "X-Content-Type-Options": "nosniff",
+        
+        # 确保浏览器不缓冲
+        "Last-Modified": datetime.now().strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        "ETag": f'"{int(time.time())}"',
+        
+        # 续传时使用的运行ID
+        "X-Run-Id": run_id
+    }
+
+
+def _sse_response(frames, run_id: str, http_request: Request, ui_config: Dict[str, Any]) -> StreamingResponse:
+    """构建SSE响应，按Accept-Encoding和ui.sse_compression配置压缩"""
+    compression = ui_config.get("sse_compression") or {}
+    encoding = negotiate_sse_encoding(
+        http_request.headers.get("accept-encoding"),
+        compression.get("mode", "auto")
+    )
+    return StreamingResponse(
+        compress_sse_stream(
+            frames, encoding,
+            gzip_level=compression.get("gzip_level", 6),
+            brotli_quality=compression.get("brotli_quality", 5)
+        ),
+        media_type="text/event-stream",
+        headers=_sse_headers(run_id, encoding)
+    )
+
+
 @router.post("/send-stream")
 async def send_message_stream(
     request: ChatRequest,
+    http_request: Request,
     engine: IsotopeEngine = Depends(get_engine)
 ):
     """发送聊天消息（流式模式）
     
+    图执行作为运行提交给运行管理器（按资源类别限流排队），事件按序号写入
+    本次运行的回放缓冲，响应生成器附着到运行并发送。每个事件带
+    "id: <run_id>:<序号>"，客户端断线后可通过 GET /stream/{run_id}
+    （Last-Event-ID）只补读缺失部分。前台运行在所有客户端断开超过
+    宽限期后取消；background为True时运行继续直到完成。
+    同一会话已有未结束的运行时返回409，X-Run-Id头给出该运行，客户端可附着。
+    
     Args:
         request: 聊天请求
+        http_request: 原始HTTP请求（用于检测客户端断开）
         engine: 引擎实例
         
     Returns:
@@ -186,342 +388,196 @@ async def send_message_stream(
         if not engine.get_session_by_id(session_id):
             session_id = engine.create_session(session_id)
         
-        def sync_stream_generator():
-            """同步流式数据生成器 - 确保真正的实时输出"""
-            import sys
-            import os
-            
-            try:
-                # 使用引擎的流式处理
-                stream_iter = engine.process_message_streaming(
-                    message=request.message,
-                    session_id=session_id,
-                    stream_mode=engine.config.get("ui", {}).get("stream_mode", ["messages", "custom", "updates", "values"])
-                )
-                
-                # 发送开始标记
-                start_data = json.dumps({'type': 'start', 'session_id': session_id}, ensure_ascii=False)
-                yield f"data: {start_data}\n\n"
-                
-                # 强制刷新每一个输出
-                sys.stdout.flush()
-                
-                # 处理流式数据
-                chunk_count = 0
-                for chunk in stream_iter:
-                    chunk_count += 1
-                    
-                    if chunk:
-                        # 提取消息的基本信息
-                        msg_type = chunk.get("type")
-                        role = chunk.get("role")
-                        content = chunk.get("content", "")
-                        source = chunk.get("source", "")
-                        
-                        # 调试：记录chunk结构
-                        logger.debug(f"处理chunk: type={msg_type}, role={role}, source={source}, content_length={len(str(content))}")
-                        
-                        # 根据 StreamMessageType 枚举来处理不同类型的消息
-                        if msg_type == StreamMessageType.LLM_TOKEN:
-                            # LLM token 流 - 直接发送给前端用于文本流显示
-                            if content:
-                                token_data = {
-                                    "type": "token",  # 前端期待的token类型
-                                    "content": content,
-                                    "session_id": session_id,
-                                    "chunk_id": chunk_count,
-                                    "timestamp": time.time(),
-                                    "source": source,
-                                    "llm_model": chunk.get("llm_model", "unknown")
-                                }
-                                
-                                logger.debug(f"🔤 发送LLM Token: source={source}, content_length={len(content)}")
-                                
-                                # 生成JSON并立即输出
-                                chunk_json = json.dumps(token_data, ensure_ascii=False)
-                                sse_line = f"data: {chunk_json}\n\n"
-                                yield sse_line
-                                
-                                # 立即刷新
-                                sys.stdout.flush()
-                                if hasattr(sys.stdout, 'buffer'):
-                                    sys.stdout.buffer.flush()
-                        
-                        elif msg_type in [StreamMessageType.NODE_START, StreamMessageType.NODE_COMPLETE, StreamMessageType.NODE_ERROR]:
-                            # 节点状态消息
-                            node_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "node_name": chunk.get("node_name", "unknown"),
-                                    "status": chunk.get("status", "unknown"),
-                                    "details": chunk.get("details", ""),
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"🔧 发送节点状态: type={msg_type}, node={chunk.get('node_name', 'unknown')}")
-                            
-                            chunk_json = json.dumps(node_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        elif msg_type == StreamMessageType.AGENT_THINKING:
-                            # Agent 思考过程
-                            thinking_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "agent_name": chunk.get("agent_name", "unknown"),
-                                    "thinking_type": chunk.get("thinking_type", "analysis"),
-                                    "content": content,
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"🤔 发送Agent思考: agent={chunk.get('agent_name', 'unknown')}, type={chunk.get('thinking_type', 'analysis')}")
-                            
-                            chunk_json = json.dumps(thinking_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        elif msg_type in [StreamMessageType.TOOL_START, StreamMessageType.TOOL_PROGRESS, 
-                                         StreamMessageType.TOOL_COMPLETE, StreamMessageType.TOOL_ERROR]:
-                            # 工具执行相关消息
-                            tool_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "tool_name": chunk.get("tool_name", "unknown"),
-                                    "action": chunk.get("action", "unknown"),
-                                    "progress": chunk.get("progress"),
-                                    "output": chunk.get("output", ""),
-                                    "error_message": chunk.get("error_message", ""),
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"🔧 发送工具消息: type={msg_type}, tool={chunk.get('tool_name', 'unknown')}")
-                            
-                            chunk_json = json.dumps(tool_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        elif msg_type in [StreamMessageType.FILE_GENERATED, StreamMessageType.FILE_UPLOADED]:
-                            # 文件相关消息
-                            file_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "file_id": chunk.get("file_id", ""),
-                                    "file_name": chunk.get("file_name", "unknown"),
-                                    "file_type": chunk.get("file_type", "unknown"),
-                                    "file_path": chunk.get("file_path", ""),
-                                    "file_size": chunk.get("file_size"),
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"📁 发送文件消息: type={msg_type}, file={chunk.get('file_name', 'unknown')}")
-                            
-                            chunk_json = json.dumps(file_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        elif msg_type in [StreamMessageType.ROUTE_DECISION, StreamMessageType.ROUTE_CHANGE]:
-                            # 路由决策消息
-                            route_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "from_node": chunk.get("from_node", ""),
-                                    "to_node": chunk.get("to_node", ""),
-                                    "reason": chunk.get("reason", ""),
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"🛣️ 发送路由消息: type={msg_type}, from={chunk.get('from_node', '')} to={chunk.get('to_node', '')}")
-                            
-                            chunk_json = json.dumps(route_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        elif msg_type in [StreamMessageType.ERROR, StreamMessageType.INFO, StreamMessageType.DEBUG]:
-                            # 系统消息
-                            system_data = {
-                                "type": "data",
-                                "content": {
-                                    "type": msg_type,
-                                    "message": content,
-                                    "error_code": chunk.get("error_code", ""),
-                                    "level": chunk.get("level", "info"),
-                                    "source": source,
-                                    "timestamp": chunk.get("timestamp", time.time())
-                                },
-                                "session_id": session_id,
-                                "chunk_id": chunk_count,
-                                "timestamp": time.time()
-                            }
-                            
-                            logger.debug(f"ℹ️ 发送系统消息: type={msg_type}, level={chunk.get('level', 'info')}")
-                            
-                            chunk_json = json.dumps(system_data, ensure_ascii=False)
-                            sse_line = f"data: {chunk_json}\n\n"
-                            yield sse_line
-                            
-                            sys.stdout.flush()
-                            if hasattr(sys.stdout, 'buffer'):
-                                sys.stdout.buffer.flush()
-                        
-                        else:
-                            # 未知类型或兼容性处理
-                            # 检查是否是旧格式的assistant消息
-                            if role == "assistant" and content:
-                                # 作为token流处理
-                                token_data = {
-                                    "type": "token",
-                                    "content": content,
-                                    "session_id": session_id,
-                                    "chunk_id": chunk_count,
-                                    "timestamp": time.time(),
-                                    "source": source
-                                }
-                                
-                                logger.debug(f"📝 发送兼容性Token: source={source}, content_length={len(content)}")
-                                
-                                chunk_json = json.dumps(token_data, ensure_ascii=False)
-                                sse_line = f"data: {chunk_json}\n\n"
-                                yield sse_line
-                                
-                                sys.stdout.flush()
-                                if hasattr(sys.stdout, 'buffer'):
-                                    sys.stdout.buffer.flush()
-                            else:
-                                # 其他未知消息类型，发送完整数据
-                                unknown_data = {
-                                    "type": "data",
-                                    "content": chunk,
-                                    "session_id": session_id,
-                                    "chunk_id": chunk_count,
-                                    "timestamp": time.time()
-                                }
-                                
-                                logger.debug(f"❓ 发送未知消息: type={msg_type}, role={role}")
-                                
-                                chunk_json = json.dumps(unknown_data, ensure_ascii=False)
-                                sse_line = f"data: {chunk_json}\n\n"
-                                yield sse_line
-                                
-                                sys.stdout.flush()
-                                if hasattr(sys.stdout, 'buffer'):
-                                    sys.stdout.buffer.flush()
-                
-                # 发送结束标记
-                end_data = json.dumps({
-                    'type': 'end', 
-                    'session_id': session_id, 
-                    'total_chunks': chunk_count,
-                    'timestamp': time.time()
-                }, ensure_ascii=False)
-                yield f"data: {end_data}\n\n"
-                
-                # 最终刷新
-                sys.stdout.flush()
-                if hasattr(sys.stdout, 'buffer'):
-                    sys.stdout.buffer.flush()
-                
-            except Exception as e:
-                logger.error(f"流式处理错误: {str(e)}")
-                error_data = {
-                    "type": "error",
-                    "error": str(e),
-                    "session_id": session_id,
-                    "timestamp": time.time()
-                }
-                error_json = json.dumps(error_data, ensure_ascii=False)
-                yield f"data: {error_json}\n\n"
-                
-                sys.stdout.flush()
-                if hasattr(sys.stdout, 'buffer'):
-                    sys.stdout.buffer.flush()
-        
-        # 返回SSE流响应 - 添加所有可能的无缓冲headers
-        return StreamingResponse(
-            sync_stream_generator(),
-            media_type="text/event-stream",
-            headers={
-                # 基本的无缓冲设置
-                "Cache-Control": "no-cache, no-store, must-revalidate, private",
-                "Pragma": "no-cache",
-                "Expires": "0",
-                "Connection": "keep-alive",
-                
-                # CORS设置
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                
-                # 关键的服务器无缓冲设置
-                "X-Accel-Buffering": "no",        # 禁用nginx缓冲
-                "X-Proxy-Buffering": "no",        # 禁用代理缓冲
-                "Content-Encoding": "identity",   # 禁用gzip压缩缓冲
-                
-                # 额外的HTTP/1.1无缓冲设置
-                "Transfer-Encoding": "chunked",   # 使用分块传输
-                "X-Content-Type-Options": "nosniff",
-                
-                # 确保浏览器不缓冲
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Last-Modified": datetime.now().strftime("%a, %d %b %Y %H:%M:%S GMT"),
-                "ETag": f'"{int(time.time())}"'
-            }
+        ui_config = engine.config.get("ui", {})
+        stream_mode = ui_config.get("stream_mode", ["messages", "custom", "updates"])
+        heartbeat_seconds = ui_config.get("stream_heartbeat_seconds", 15)
+        delivery = resolve_delivery_config(
+            request.delivery.dict() if request.delivery else None,
+            ui_config.get("stream_delivery")
         )
         
+        manager = _get_run_manager(engine)
+        run = manager.submit(
+            lambda buffer: _produce_stream_frames(
+                engine, request.message, session_id, stream_mode,
+                request.include_state, delivery, buffer
+            ),
+            session_id=session_id,
+            cancel_on_orphan=not request.background
+        )
+        
+        return _sse_response(
+            _tail_replay_buffer(manager, run.run_id, 0, http_request, heartbeat_seconds),
+            run.run_id, http_request, ui_config
+        )
+        
+    except SessionRunActiveError as e:
+        logger.warning(f"拒绝流式请求: {str(e)}")
+        raise HTTPException(status_code=409, detail=str(e), headers={"X-Run-Id": e.run_id})
+    except RunQueueFullError as e:
+        logger.warning(f"拒绝流式请求: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"流式发送消息失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"流式处理失败: {str(e)}")
 
+
+@router.get("/stream/{run_id}")
+async def resume_message_stream(
+    run_id: str,
+    http_request: Request,
+    after: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """续传流式运行：从Last-Event-ID（或after参数）之后补发事件
+    
+    运行仍在进行时补发缺失的尾部后继续实时输出；已结束的运行在保留期内
+    可补读剩余事件。重连点已被淘汰时先收到gap事件。
+    
+    Args:
+        run_id: 运行ID（start事件和X-Run-Id响应头中返回）
+        http_request: 原始HTTP请求
+        after: 已收到的最后序号（未携带Last-Event-ID时使用）
+        last_event_id: 浏览器EventSource自动回传的最后事件ID
+        engine: 引擎实例
+        
+    Returns:
+        流式响应
+    """
+    manager = _get_run_manager(engine)
+    buffer = manager.get_buffer(run_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail=f"流式运行不存在或已过期: {run_id}")
+    
+    last_seq = after or 0
+    parsed = parse_event_id(last_event_id)
+    if parsed is not None and parsed[0] == run_id:
+        last_seq = parsed[1]
+    
+    logger.info(f"续传运行 {run_id}: 从序号 {last_seq} 之后开始，当前最新序号 {buffer.last_seq}")
+    ui_config = engine.config.get("ui", {})
+    return _sse_response(
+        _tail_replay_buffer(
+            manager, run_id, last_seq, http_request,
+            ui_config.get("stream_heartbeat_seconds", 15)
+        ),
+        run_id, http_request, ui_config
+    )
+
+
+@router.post("/runs", response_model=APIResponse)
+async def submit_run(
+    request: ChatRequest,
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """提交后台运行，立即返回run_id
+    
+    运行在资源槽位可用时开始执行，不依赖任何客户端连接；
+    通过 GET /stream/{run_id} 附着到事件流，GET /runs/{run_id} 查询状态。
+    同一会话已有未结束的运行时返回409。
+    
+    Args:
+        request: 聊天请求
+        engine: 引擎实例
+        
+    Returns:
+        运行信息
+    """
+    try:
+        session_id = request.session_id
+        if not session_id or not engine.get_session_by_id(session_id):
+            session_id = engine.create_session(session_id)
+        
+        ui_config = engine.config.get("ui", {})
+        stream_mode = ui_config.get("stream_mode", ["messages", "custom", "updates"])
+        delivery = resolve_delivery_config(
+            request.delivery.dict() if request.delivery else None,
+            ui_config.get("stream_delivery")
+        )
+        
+        manager = _get_run_manager(engine)
+        run = manager.submit(
+            lambda buffer: _produce_stream_frames(
+                engine, request.message, session_id, stream_mode,
+                request.include_state, delivery, buffer
+            ),
+            session_id=session_id
+        )
+        return APIResponse(
+            success=True,
+            message="运行已提交",
+            data={**run.to_dict(), "stream_url": f"stream/{run.run_id}"}
+        )
+    except SessionRunActiveError as e:
+        logger.warning(f"拒绝后台运行: {str(e)}")
+        raise HTTPException(status_code=409, detail=str(e), headers={"X-Run-Id": e.run_id})
+    except RunQueueFullError as e:
+        logger.warning(f"拒绝后台运行: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        logger.error(f"提交后台运行失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交运行失败: {str(e)}")
+
+
+@router.get("/runs", response_model=APIResponse)
+async def list_runs(
+    active_only: bool = False,
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """运行调度概况：排队数、各资源类别占用和每个运行的耗时
+    
+    Args:
+        active_only: 只列出排队中和执行中的运行
+        engine: 引擎实例
+        
+    Returns:
+        调度指标和运行列表
+    """
+    manager = _get_run_manager(engine)
+    return APIResponse(
+        success=True,
+        message="获取运行列表成功",
+        data={
+            **manager.get_metrics(),
+            "runs": manager.list_runs(include_finished=not active_only)
+        }
+    )
+
+
+@router.get("/runs/{run_id}", response_model=APIResponse)
+async def get_run(
+    run_id: str,
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """查询运行状态和耗时"""
+    manager = _get_run_manager(engine)
+    run = manager.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"运行不存在: {run_id}")
+    return APIResponse(
+        success=True,
+        message="获取运行状态成功",
+        data=run.to_dict(manager.get_buffer(run_id))
+    )
+
+
+@router.delete("/runs/{run_id}", response_model=APIResponse)
+async def cancel_run(
+    run_id: str,
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """取消排队中或执行中的运行"""
+    manager = _get_run_manager(engine)
+    if manager.get(run_id) is None:
+        raise HTTPException(status_code=404, detail=f"运行不存在: {run_id}")
+    cancelled = manager.cancel(run_id)
+    return APIResponse(
+        success=cancelled,
+        message="已取消运行" if cancelled else "运行已结束，无需取消",
+        data={"run_id": run_id}
+    )
+
 def _get_message_role(msg) -> str:
     """从消息对象中提取角色信息"""
     # 处理字典格式的消息
@@ -595,25 +651,46 @@ def _get_message_content(msg) -> str:
 @router.get("/{session_id}/history", response_model=APIResponse)
 async def get_chat_history(
     session_id: str,
+    response: Response,
     limit: Optional[int] = 50,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    max_content_chars: Optional[int] = None,
+    source: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     engine: IsotopeEngine = Depends(get_engine)
 ):
-    """获取聊天历史
+    """获取聊天历史（游标分页）
     
     Args:
         session_id: 会话ID
         limit: 返回消息数量限制
+        before: 向前翻页游标（返回序号小于该值的消息），取上一页响应中的start
+        after: 向后翻页游标（返回序号不小于该值的消息），取上一页响应中的end
+        max_content_chars: 工具消息内容超过该长度时截断，完整内容通过 /{session_id}/history/{index} 获取
+        source: 游标所属的序号空间（turns或messages），取上一页响应中的source
+        if_none_match: 客户端缓存的ETag，未变化时返回304
         engine: 引擎实例
         
     Returns:
         聊天历史
     """
+    if source not in (None, HISTORY_SOURCE_TURNS, HISTORY_SOURCE_MESSAGES):
+        raise HTTPException(status_code=400, detail=f"无效的历史来源: {source}")
+    
     try:
-        logger.info(f"获取会话历史: {session_id}")
-        
-        # 首先检查会话是否存在
-        session = engine.get_session_by_id(session_id)
-        if not session:
+        logger.debug(f"获取会话历史: {session_id}, limit={limit}, before={before}, after={after}, source={source}")
+        
+        page = engine.get_session_history_page(
+            session_id,
+            limit=limit,
+            before=before,
+            after=after,
+            max_content_chars=max_content_chars,
+            if_none_match=if_none_match,
+            source=source
+        )
+        if page is None:
             logger.warning(f"会话不存在: {session_id}")
             return APIResponse(
                 success=True,
@@ -621,77 +698,40 @@ async def get_chat_history(
                 data={"messages": [], "session_id": session_id}
             )
         
-        # 获取会话历史
-        history = engine.get_session_history(session_id)
-        logger.info(f"从引擎获取到 {len(history) if history else 0} 条原始消息")
-        
-        if not history:
-            logger.info("会话历史为空")
-            return APIResponse(
-                success=True,
-                message="会话历史为空",
-                data={"messages": [], "session_id": session_id}
-            )
+        if page["not_modified"]:
+            return Response(status_code=304, headers={"ETag": page["etag"]})
         
-        # 转换消息格式为API标准格式
+        # 转换消息格式为API标准格式，只添加有内容的消息
         api_messages = []
-        for i, msg in enumerate(history):
-            try:
-                logger.debug(f"处理消息 {i+1}: 类型={type(msg)}, 内容={str(msg)[:100]}...")
-                
-                if isinstance(msg, dict):
-                    # 字典格式的消息
-                    content = _get_message_content(msg)
-                    role = _get_message_role(msg)
-                    
-                    api_msg = {
-                        "id": msg.get("id", str(uuid.uuid4())),
-                        "role": role,
-                        "content": content,
-                        "timestamp": msg.get("timestamp", datetime.now().isoformat()),
-                        "type": msg.get("message_type", "text"),
-                        "metadata": msg.get("metadata", {})
-                    }
-                    
-                    logger.debug(f"转换字典消息: role={role}, content_length={len(content)}")
-                else:
-                    # 其他格式的消息（可能是LangChain消息对象）
-                    content = _get_message_content(msg)
-                    role = _get_message_role(msg)
-                    
-                    api_msg = {
-                        "id": getattr(msg, "id", str(uuid.uuid4())),
-                        "role": role,
-                        "content": content,
-                        "timestamp": getattr(msg, "timestamp", datetime.now().isoformat()),
-                        "type": "text",
-                        "metadata": {}
-                    }
-                    
-                    logger.debug(f"转换对象消息: role={role}, content_length={len(content)}")
-                
-                # 只添加有内容的消息
-                if content and content.strip():
-                    api_messages.append(api_msg)
-                    logger.debug(f"消息 {i+1} 已添加到API结果")
-                else:
-                    logger.warning(f"消息 {i+1} 内容为空，跳过")
-                    
-            except Exception as msg_error:
-                logger.error(f"处理消息 {i+1} 时出错: {str(msg_error)}")
+        for msg in page["messages"]:
+            content = _get_message_content(msg)
+            if not content or not content.strip():
                 continue
-        
-        logger.info(f"成功转换 {len(api_messages)} 条消息")
-        
-        # 应用分页限制
-        if limit and len(api_messages) > limit:
-            api_messages = api_messages[-limit:]
-            logger.info(f"应用分页限制，返回最后 {len(api_messages)} 条消息")
-        
+            api_messages.append({
+                "id": msg.get("id", str(uuid.uuid4())),
+                "index": msg["index"],
+                "role": _get_message_role(msg),
+                "content": content,
+                "timestamp": msg.get("timestamp", datetime.now().isoformat()),
+                "type": msg.get("message_type", "text"),
+                "metadata": msg.get("metadata", {})
+            })
+        
+        response.headers["ETag"] = page["etag"]
         return APIResponse(
             success=True,
             message=f"获取到{len(api_messages)}条消息",
-            data={"messages": api_messages, "session_id": session_id}
+            data={
+                "messages": api_messages,
+                "session_id": session_id,
+                "total": page["total"],
+                "start": page["start"],
+                "end": page["end"],
+                "has_more_before": page["has_more_before"],
+                "has_more_after": page["has_more_after"],
+                "source": page["source"],
+                "cursor_reset": page["cursor_reset"]
+            }
         )
         
     except Exception as e:
@@ -700,6 +740,55 @@ async def get_chat_history(
         logger.error(f"完整错误栈: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"获取会话历史失败: {str(e)}")
 
+@router.get("/{session_id}/history/{index}", response_model=APIResponse)
+async def get_chat_history_message(
+    session_id: str,
+    index: int,
+    source: Optional[str] = None,
+    engine: IsotopeEngine = Depends(get_engine)
+):
+    """获取单条历史消息的完整内容（用于展开被截断的工具输出）
+    
+    Args:
+        session_id: 会话ID
+        index: 消息序号
+        source: 序号所属的空间（turns或messages），取历史分页响应中的source
+        engine: 引擎实例
+        
+    Returns:
+        完整消息
+    """
+    if source not in (None, HISTORY_SOURCE_TURNS, HISTORY_SOURCE_MESSAGES):
+        raise HTTPException(status_code=400, detail=f"无效的历史来源: {source}")
+    
+    try:
+        page = engine.get_session_history_page(session_id, limit=1, after=index, source=source)
+        if page is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
+        if page["cursor_reset"] or not page["messages"] or page["messages"][0]["index"] != index:
+            raise HTTPException(status_code=404, detail="消息不存在")
+        
+        msg = page["messages"][0]
+        return APIResponse(
+            success=True,
+            message="消息获取成功",
+            data={
+                "id": msg.get("id", str(uuid.uuid4())),
+                "index": index,
+                "role": _get_message_role(msg),
+                "content": _get_message_content(msg),
+                "timestamp": msg.get("timestamp", datetime.now().isoformat()),
+                "type": msg.get("message_type", "text"),
+                "metadata": msg.get("metadata", {})
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取历史消息失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取历史消息失败: {str(e)}")
+
 @router.post("/{session_id}/interrupt", response_model=APIResponse)
 async def interrupt_session(
     session_id: str,
@@ -14,6 +14,7 @@ from datetime import datetime, date
 from fastapi import APIRouter, HTTPException, Depends
 
 from app.core.engine import IsotopeEngine
+from app.core.file_manager import file_manager
 from app.api.dependencies import get_engine
 from app.api.models import APIResponse
 
@@ -21,6 +22,17 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def _collect_files(engine: IsotopeEngine, session_id: Optional[str]) -> List[Dict[str, Any]]:
+    """获取会话的文件，未指定会话时遍历一次文件索引获取所有会话的文件"""
+    if session_id:
+        return engine.get_session_files(session_id)
+    return [
+        file_info for file_info in file_manager.get_all_files()
+        if file_info.get("session_id") and file_info["session_id"] in engine.sessions
+    ]
+
+
 @router.get("/statistics", response_model=APIResponse)
 async def get_data_statistics(
     session_id: Optional[str] = None,
@@ -36,53 +48,15 @@ async def get_data_statistics(
         数据统计信息
     """
     try:
-        # 获取文件列表
-        if session_id:
-            files = engine.get_session_files(session_id)
-        else:
-            files = []
-            for sid in engine.sessions:
-                files.extend(engine.get_session_files(sid))
-        
-        # 计算统计信息
-        total_files = len(files)
-        file_types = {}
-        total_size = 0
-        uploaded_today = 0
-        generated_today = 0
-        
-        today = date.today()
-        
-        for file_info in files:
-            # 文件类型统计
-            file_name = file_info.get("file_name", "")
-            extension = file_name.split('.')[-1].lower() if '.' in file_name else 'unknown'
-            file_types[extension] = file_types.get(extension, 0) + 1
-            
-            # 大小统计
-            size = file_info.get("size", 0)
-            if isinstance(size, (int, float)):
-                total_size += size
-            
-            # 今日文件统计
-            upload_time = file_info.get("upload_time", "")
-            try:
-                if upload_time:
-                    file_date = datetime.fromisoformat(upload_time.replace('Z', '+00:00')).date()
-                    if file_date == today:
-                        if file_info.get("is_generated", False):
-                            generated_today += 1
-                        else:
-                            uploaded_today += 1
-            except (ValueError, AttributeError):
-                pass
+        # 文件统计来自随文件索引写入维护的汇总，不遍历会话和文件
+        file_summary = file_manager.summary.snapshot(session_id)
         
         statistics = {
-            "total_files": total_files,
-            "file_types": file_types,
-            "total_size": total_size,
-            "uploaded_today": uploaded_today,
-            "generated_today": generated_today,
+            "total_files": file_summary["total_files"],
+            "file_types": file_summary["file_types"],
+            "total_size": file_summary["total_size"],
+            "uploaded_today": file_summary["uploaded_today"],
+            "generated_today": file_summary["generated_today"],
             "sessions_count": len(engine.sessions) if engine.sessions else 0
         }
         
@@ -112,12 +86,7 @@ async def get_data_quality(
     """
     try:
         # 获取文件列表
-        if session_id:
-            files = engine.get_session_files(session_id)
-        else:
-            files = []
-            for sid in engine.sessions:
-                files.extend(engine.get_session_files(sid))
+        files = _collect_files(engine, session_id)
         
         # 简单的数据质量评估逻辑
         total_files = len(files)
@@ -225,44 +194,10 @@ async def get_data_summary(
         数据摘要信息
     """
     try:
-        # 获取文件列表
-        if session_id:
-            files = engine.get_session_files(session_id)
-            sessions_count = 1
-        else:
-            files = []
-            for sid in engine.sessions:
-                files.extend(engine.get_session_files(sid))
-            sessions_count = len(engine.sessions)
-        
-        # 计算各种统计
-        file_types_count = {}
-        total_size = 0
-        earliest_upload = None
-        latest_upload = None
-        
-        for file_info in files:
-            # 文件类型统计
-            file_name = file_info.get("file_name", "")
-            extension = file_name.split('.')[-1].lower() if '.' in file_name else 'unknown'
-            file_types_count[extension] = file_types_count.get(extension, 0) + 1
-            
-            # 大小统计
-            size = file_info.get("size", 0)
-            if isinstance(size, (int, float)):
-                total_size += size
-            
-            # 时间统计
-            upload_time = file_info.get("upload_time", "")
-            try:
-                if upload_time:
-                    dt = datetime.fromisoformat(upload_time.replace('Z', '+00:00'))
-                    if earliest_upload is None or dt < earliest_upload:
-                        earliest_upload = dt
-                    if latest_upload is None or dt > latest_upload:
-                        latest_upload = dt
-            except (ValueError, AttributeError):
-                pass
+        # 文件统计来自随文件索引写入维护的汇总，不遍历会话和文件
+        file_summary = file_manager.summary.snapshot(session_id)
+        sessions_count = 1 if session_id else len(engine.sessions)
+        total_size = file_summary["total_size"]
         
         # 格式化文件大小
         def format_file_size(bytes_size):
@@ -274,15 +209,15 @@ async def get_data_summary(
         
         summary = {
             "overview": {
-                "total_files": len(files),
+                "total_files": file_summary["total_files"],
                 "total_sessions": sessions_count,
                 "total_size": total_size,
                 "total_size_formatted": format_file_size(total_size)
             },
-            "file_types": file_types_count,
+            "file_types": file_summary["file_types"],
             "time_range": {
-                "earliest_upload": earliest_upload.isoformat() if earliest_upload else None,
-                "latest_upload": latest_upload.isoformat() if latest_upload else None
+                "earliest_upload": file_summary["earliest_upload"],
+                "latest_upload": file_summary["latest_upload"]
             },
             "recommendations": [
                 "定期备份重要数据文件",
@@ -319,12 +254,7 @@ async def cleanup_data(
     """
     try:
         # 获取文件列表
-        if session_id:
-            files = engine.get_session_files(session_id)
-        else:
-            files = []
-            for sid in engine.sessions:
-                files.extend(engine.get_session_files(sid))
+        files = _collect_files(engine, session_id)
         
         # 找出需要清理的文件
         cleanup_candidates = []
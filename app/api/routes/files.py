@@ -543,12 +543,9 @@ async def associate_file_to_session(
         
         # 更新文件索引中的session_id
         if file_id in file_manager.file_index:
-            # 更新索引
-            file_manager.file_index[file_id]["session_id"] = request.target_session_id
-            
-            # 强制保存索引，确保持久化
+            # 更新索引（同时维护会话文件索引与统计汇总），并强制保存索引，确保持久化
             try:
-                file_manager._save_index()
+                file_manager.assign_file_to_session(file_id, request.target_session_id)
                 logger.info(f"文件索引已保存，文件 {file_id} 关联到会话 {request.target_session_id}")
             except Exception as save_error:
                 logger.error(f"保存文件索引失败: {str(save_error)}")
@@ -12,6 +12,7 @@ import logging
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import Response
 
 from app.core.engine import IsotopeEngine
 from app.api.dependencies import get_engine
@@ -24,6 +25,7 @@ from app.api.models import (
     ErrorResponse
 )
 from app.core.postgres_session_manager import get_postgres_session_manager
+from app.core.state_codec import get_state_codec, MSGPACK_AVAILABLE
 
 logger = logging.getLogger(__name__)
 
@@ -116,21 +118,31 @@ async def list_sessions(
     limit: Optional[int] = 50,
     offset: Optional[int] = 0,
     engine: IsotopeEngine = Depends(get_engine),
-    include_metadata: bool = Query(default=True, description="是否包含会话元数据")
+    include_metadata: bool = Query(default=True, description="是否包含会话元数据"),
+    sort_by: str = Query(default="last_updated", description="排序字段（last_updated、created_at、message_count、file_count）"),
+    order: str = Query(default="desc", description="排序方向（asc或desc）"),
+    search: Optional[str] = Query(default=None, description="按会话名称过滤")
 ):
     """获取会话列表
     
+    过滤、排序和分页在会话目录上完成，不加载会话的完整状态。
+    
     Args:
         limit: 返回数量限制
         offset: 偏移量
         engine: 引擎实例
         include_metadata: 是否包含会话元数据
+        sort_by: 排序字段
+        order: 排序方向
+        search: 按会话名称过滤
         
     Returns:
         会话列表
     """
     try:
-        # 获取所有会话
+        if sort_by not in ("last_updated", "created_at", "message_count", "file_count"):
+            raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort_by}")
+        
         all_sessions = []
         
         # 安全地解析时间字符串，处理时区问题
@@ -156,51 +168,49 @@ async def list_sessions(
                 # 如果解析失败，返回默认时间
                 return default_dt or datetime.now()
         
-        for session_id, session_data in engine.sessions.items():
+        total, page = engine.sessions.catalog_page(
+            limit=limit or None,
+            offset=offset or 0,
+            sort_by=sort_by,
+            descending=order.lower() != "asc",
+            name_filter=search
+        )
+        
+        for session_id, catalog_entry in page:
             try:
-                state = session_data.get("state", {})
+                created_at = safe_parse_datetime(catalog_entry.get("created_at"), session_id=session_id)
+                last_updated = safe_parse_datetime(catalog_entry.get("last_updated"), session_id=session_id)
                 
-                # 合并会话级别的元数据和状态中的元数据
-                session_metadata = session_data.get("metadata", {})
-                state_metadata = state.get("metadata", {})
-                merged_metadata = {**state_metadata, **session_metadata}
-                
-                created_at = safe_parse_datetime(session_data.get("created_at"), session_id=session_id)
-                last_updated = safe_parse_datetime(session_data.get("last_updated"), session_id=session_id)
+                # 已加载的会话合并状态中的元数据，未加载的会话只使用目录中的会话级元数据
+                session_metadata = catalog_entry.get("metadata") or {}
+                merged_metadata = session_metadata
+                if engine.sessions.is_loaded(session_id):
+                    state = engine.sessions[session_id].get("state", {})
+                    merged_metadata = {**state.get("metadata", {}), **session_metadata}
                 
                 session_info = SessionInfo(
                     session_id=session_id,
                     status=SessionStatus.ACTIVE,
                     created_at=created_at,
                     last_updated=last_updated,
-                    message_count=len(state.get("messages", [])),
-                    metadata=merged_metadata  # 使用合并后的元数据
+                    message_count=catalog_entry.get("message_count", 0),
+                    metadata=merged_metadata
                 )
                 
-                if include_metadata:
-                    session_info.metadata = merged_metadata
-                
                 all_sessions.append(session_info)
             except Exception as e:
                 logger.error(f"处理会话 {session_id} 时出错: {str(e)}")
                 continue
         
-        # 按最后更新时间排序
-        all_sessions.sort(key=lambda x: x.last_updated, reverse=True)
-        
-        # 应用分页
-        if offset:
-            all_sessions = all_sessions[offset:]
-        if limit:
-            all_sessions = all_sessions[:limit]
-        
         return SessionListResponse(
             success=True,
             message=f"获取到{len(all_sessions)}个会话",
-            data={"total": len(engine.sessions)},
+            data={"total": total},
             sessions=all_sessions
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取会话列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取会话列表失败: {str(e)}")
@@ -354,7 +364,7 @@ async def export_session(
     
     Args:
         session_id: 会话ID
-        format: 导出格式（json, csv等）
+        format: 导出格式（json；msgpack为压缩的二进制状态编码，可用StateCodec.decode还原）
         engine: 引擎实例
         
     Returns:
@@ -368,6 +378,22 @@ async def export_session(
         
         session = engine.get_session_by_id(session_id)
         
+        if format.lower() == "msgpack":
+            if not MSGPACK_AVAILABLE:
+                raise HTTPException(status_code=400, detail="服务端未安装msgpack，不支持二进制导出")
+            # 二进制导出：导出完整状态，消息等对象由编解码器按类型编码
+            export_data = {
+                "session_id": session_id,
+                "created_at": session.get("created_at"),
+                "last_updated": session.get("last_updated"),
+                "state": state
+            }
+            return Response(
+                content=get_state_codec().encode(export_data, compress=True),
+                media_type="application/x-msgpack",
+                headers={"Content-Disposition": f'attachment; filename="session_{session_id}.msgpack"'}
+            )
+        
         if format.lower() == "json":
             # JSON格式导出
             export_data = {
@@ -494,16 +520,17 @@ async def list_sessions(
     """获取所有会话列表"""
     try:
         sessions = []
-        for session_id, session_data in engine.sessions.items():
+        # 读取会话目录，不加载未在内存中的会话
+        for session_id, catalog_entry in engine.sessions.catalog_items():
             session_info = {
                 "session_id": session_id,
-                "created_at": session_data.get("created_at"),
-                "last_updated": session_data.get("last_updated"),
-                "message_count": len(session_data.get("state", {}).get("messages", []))
+                "created_at": catalog_entry.get("created_at"),
+                "last_updated": catalog_entry.get("last_updated"),
+                "message_count": catalog_entry.get("message_count", 0)
             }
             
             if include_metadata:
-                session_info["metadata"] = session_data.get("metadata", {})
+                session_info["metadata"] = catalog_entry.get("metadata") or {}
             
             sessions.append(session_info)
         
@@ -606,15 +633,21 @@ async def delete_session(
 async def list_postgres_sessions(
     limit: int = Query(default=50, description="返回数量限制"),
     offset: int = Query(default=0, description="偏移量"),
-    include_inactive: bool = Query(default=False, description="是否包含非活跃会话")
+    include_inactive: bool = Query(default=False, description="是否包含非活跃会话"),
+    sort_by: str = Query(default="last_updated", description="排序字段（last_updated、created_at、message_count）"),
+    order: str = Query(default="desc", description="排序方向（asc或desc）"),
+    search: Optional[str] = Query(default=None, description="按会话名称过滤")
 ):
-    """获取PostgreSQL中的会话列表"""
+    """获取PostgreSQL中的会话列表（过滤、排序和分页在数据库中完成）"""
     try:
         postgres_manager = get_postgres_session_manager()
         sessions = postgres_manager.list_sessions(
             limit=limit,
             offset=offset,
-            include_inactive=include_inactive
+            include_inactive=include_inactive,
+            order_by=sort_by,
+            descending=order.lower() != "asc",
+            name_filter=search
         )
         return sessions
     except Exception as e:
@@ -737,7 +770,11 @@ async def test_postgres_connection():
 
 # 兼容性端点（保持向后兼容）
 @router.get("/restored", response_model=Dict[str, Any])
-async def get_restored_sessions_info(engine: IsotopeEngine = Depends(get_engine)):
+async def get_restored_sessions_info(
+    engine: IsotopeEngine = Depends(get_engine),
+    limit: int = Query(default=100, description="返回的会话明细数量"),
+    offset: int = Query(default=0, description="偏移量")
+):
     """获取已恢复会话的统计信息（兼容性端点）"""
     try:
         # 如果启用了PostgreSQL会话持久化，返回PostgreSQL统计信息
@@ -749,7 +786,8 @@ async def get_restored_sessions_info(engine: IsotopeEngine = Depends(get_engine)
                 "current_memory_sessions": len(engine.sessions)
             }
         else:
-            # 否则返回内存会话统计
+            # 否则返回内存会话统计（读取会话目录，不加载完整会话）
+            _, page = engine.sessions.catalog_page(limit=limit, offset=offset)
             return {
                 "source": "memory",
                 "total_sessions": len(engine.sessions),
@@ -757,11 +795,11 @@ async def get_restored_sessions_info(engine: IsotopeEngine = Depends(get_engine)
                 "sessions": [
                     {
                         "session_id": session_id,
-                        "created_at": session_data.get("created_at"),
-                        "last_updated": session_data.get("last_updated"),
-                        "message_count": len(session_data.get("state", {}).get("messages", []))
+                        "created_at": catalog_entry.get("created_at"),
+                        "last_updated": catalog_entry.get("last_updated"),
+                        "message_count": catalog_entry.get("message_count", 0)
                     }
-                    for session_id, session_data in engine.sessions.items()
+                    for session_id, catalog_entry in page
                 ]
             }
     except Exception as e:
@@ -15,7 +15,7 @@ import psutil
 import platform
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 
 from app.core.engine import IsotopeEngine
 from app.api.dependencies import get_engine
@@ -177,7 +177,8 @@ async def get_system_metrics(
         metrics = {
             "sessions": {
                 "total": len(engine.sessions) if engine else 0,
-                "active": len([s for s in engine.sessions.values() if s.get("active", False)]) if engine else 0
+                # 只检查已加载的会话，不触发水合
+                "active": len([s for _, s in engine.sessions.loaded_items() if s.get("active", False)]) if engine else 0
             },
             "memory": {
                 "process_memory": psutil.Process().memory_info().rss,
@@ -193,6 +194,11 @@ async def get_system_metrics(
             }
         }
         
+        # 记忆写后队列指标（队列深度、刷新延迟）
+        memory_integration = getattr(engine, "enhanced_memory_integration", None)
+        if memory_integration is not None and hasattr(memory_integration, "get_integration_stats"):
+            metrics["memory_write_queue"] = memory_integration.get_integration_stats().get("write_queue", {})
+        
         return APIResponse(
             success=True,
             message="系统指标获取成功",
@@ -205,12 +211,16 @@ async def get_system_metrics(
 
 @router.get("/sessions/restored", response_model=APIResponse)
 async def get_restored_sessions_info(
-    engine: IsotopeEngine = Depends(get_engine)
+    engine: IsotopeEngine = Depends(get_engine),
+    limit: int = Query(default=100, description="返回的会话明细数量"),
+    offset: int = Query(default=0, description="偏移量")
 ):
     """获取已恢复会话的统计信息
     
     Args:
         engine: 引擎实例
+        limit: 返回的会话明细数量
+        offset: 偏移量
         
     Returns:
         已恢复会话的详细统计信息
@@ -220,7 +230,7 @@ async def get_restored_sessions_info(
             raise HTTPException(status_code=503, detail="引擎未初始化")
         
         # 获取恢复会话的统计信息
-        sessions_info = engine.get_restored_sessions_info()
+        sessions_info = engine.get_restored_sessions_info(limit=limit, offset=offset)
         
         return APIResponse(
             success=True,
@@ -354,8 +364,9 @@ async def cleanup_system(
             current_time = datetime.now()
             expired_sessions = []
             
-            for session_id, session_data in engine.sessions.items():
-                last_updated = session_data.get("last_updated")
+            # 读取会话目录，不加载未在内存中的会话
+            for session_id, catalog_entry in engine.sessions.catalog_items():
+                last_updated = catalog_entry.get("last_updated")
                 if last_updated:
                     last_updated_time = datetime.fromisoformat(last_updated)
                     if (current_time - last_updated_time).days >= 1:
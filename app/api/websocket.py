@@ -7,6 +7,10 @@ WebSocket管理器 - 处理实时双向通信和流式数据传输
 3. 流式数据传输
 4. 多模态数据支持
 5. 会话状态同步
+6. 启用共享状态时跨进程推送（客户端连接在其他工作进程上也能收到消息）
+7. 断线续传（流式消息带run_id/seq，重连后发送resume只补发缺失部分）
+8. 扇出：每个会话一个生产者，每个连接独立的有界发送队列和发送任务，
+   慢连接（旁观者）按策略合并或丢弃，不拖慢其他连接
 """
 
 import json
@@ -18,6 +22,12 @@ import uuid
 
 from fastapi import WebSocket, WebSocketDisconnect
 from app.core.engine import IsotopeEngine
+from app.ui.stream_coalescer import StreamDeliveryConfig, resolve_delivery_config, acoalesce
+from app.ui.stream_fanout import ConnectionSender, OutboundFrame, resolve_fanout_config
+from app.ui.streaming_types import StreamMessageType
+from app.core.stream_replay import StreamReplayBuffer
+from app.core.blob_store import get_payload_externalizer
+from app.core.run_manager import RunQueueFullError, SessionRunActiveError, get_run_manager
 from app.api.models import (
     WebSocketMessage, 
     WebSocketMessageType, 
@@ -42,9 +52,26 @@ class WebSocketManager:
         # 连接管理
         self.active_connections: Dict[str, Set[WebSocket]] = {}  # session_id -> websockets
         self.connection_sessions: Dict[WebSocket, str] = {}  # websocket -> session_id
+        self.senders: Dict[WebSocket, ConnectionSender] = {}  # websocket -> 发送队列
+        self.fanout_config = resolve_fanout_config(engine.config.get("ui", {}).get("websocket_fanout"))
         
-        # 消息缓冲
-        self.message_buffer: Dict[str, List[Dict[str, Any]]] = {}  # session_id -> messages
+        # 聊天作为后台运行执行；流式消息写入运行的回放缓冲（有界，供重连后续传）
+        self.runs = get_run_manager(engine.config.get("runs"), engine.config.get("ui", {}).get("stream_replay"))
+        self.replay = self.runs.replay
+        # 大负载替换为内容引用（/api/v1/blobs/{digest}），回放缓冲和各连接只传引用
+        self.externalizer = get_payload_externalizer(
+            engine.config.get("ui", {}).get("large_payloads"), getattr(engine, "shared_state", None)
+        )
+        
+        # 跨进程事件：其他进程发布的会话消息推送给本进程的连接
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        self._shared_events = getattr(getattr(engine, "shared_state", None), "events", None)
+        if self._shared_events is not None:
+            self._shared_events.subscribe(self._on_remote_event)
         
         logger.info("WebSocket管理器初始化完成")
     
@@ -56,6 +83,8 @@ class WebSocketManager:
             session_id: 会话ID
         """
         await websocket.accept()
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
         
         # 将连接添加到管理器
         if session_id not in self.active_connections:
@@ -63,9 +92,17 @@ class WebSocketManager:
         self.active_connections[session_id].add(websocket)
         self.connection_sessions[websocket] = session_id
         
-        # 初始化消息缓冲
-        if session_id not in self.message_buffer:
-            self.message_buffer[session_id] = []
+        # 该连接的所有发送都经由独立的发送任务，慢连接不阻塞其他连接
+        sender = ConnectionSender(
+            websocket.send_text,
+            self.fanout_config,
+            encode=lambda message: message.model_dump_json(),
+            merge=self._merge_token_messages,
+            gap_notice=lambda run_id, start, end: self._gap_message(session_id, run_id, start, end).model_dump_json(),
+            name=f"{session_id}:{id(websocket):x}"
+        )
+        self.senders[websocket] = sender
+        sender.start()
         
         logger.info(f"WebSocket连接建立: session_id={session_id}, 总连接数={self.get_connection_count()}")
         
@@ -104,6 +141,10 @@ class WebSocketManager:
         if websocket in self.connection_sessions:
             del self.connection_sessions[websocket]
         
+        sender = self.senders.pop(websocket, None)
+        if sender is not None:
+            sender.close()
+        
         logger.info(f"WebSocket连接断开: session_id={session_id}, 剩余连接数={self.get_connection_count()}")
     
     async def handle_message(self, websocket: WebSocket, session_id: str, data: str):
@@ -122,6 +163,8 @@ class WebSocketManager:
             
             if message_type == "chat":
                 await self._handle_chat_message(websocket, session_id, content)
+            elif message_type == "resume":
+                await self._handle_resume(websocket, session_id, content)
             elif message_type == "ping":
                 await self._handle_ping(websocket, session_id)
             elif message_type == "system":
@@ -139,6 +182,10 @@ class WebSocketManager:
     async def _handle_chat_message(self, websocket: WebSocket, session_id: str, content: Dict[str, Any]):
         """处理聊天消息
         
+        图执行作为后台运行提交给运行管理器后立即返回，接收循环不被阻塞；
+        运行不随连接断开而停止，流式消息推送给会话的所有连接，
+        断线的客户端重连后通过resume补读。
+        
         Args:
             websocket: WebSocket连接
             session_id: 会话ID
@@ -149,55 +196,184 @@ class WebSocketManager:
             await self.send_error(websocket, "消息内容不能为空", "EMPTY_MESSAGE")
             return
         
-        # 发送流开始通知
-        await self.send_to_connection(
-            websocket,
-            WebSocketMessage(
-                type=WebSocketMessageType.STREAM_START,
-                data={
-                    "message": "开始处理您的消息...",
-                    "user_message": user_message
-                },
+        # 客户端可通过delivery字段覆盖token下发方式
+        ui_config = self.engine.config.get("ui", {})
+        delivery = resolve_delivery_config(content.get("delivery"), ui_config.get("stream_delivery"))
+        
+        # 每个会话同时只有一个运行（由运行管理器保证，HTTP提交的运行同样计入）；
+        # 其他连接通过会话推送观看同一运行
+        try:
+            self.runs.submit(
+                lambda buffer: self._run_chat(session_id, user_message, content, delivery, buffer),
                 session_id=session_id
             )
+        except SessionRunActiveError as e:
+            await self.send_error(websocket, str(e), "SESSION_BUSY")
+        except RunQueueFullError as e:
+            await self.send_error(websocket, str(e), "RUN_QUEUE_FULL")
+    
+    async def _run_chat(
+        self,
+        session_id: str,
+        user_message: str,
+        content: Dict[str, Any],
+        delivery: StreamDeliveryConfig,
+        buffer: StreamReplayBuffer
+    ):
+        """执行一次聊天运行，流式消息写入回放缓冲并推送给会话的所有连接"""
+        ui_config = self.engine.config.get("ui", {})
+        
+        # 发送流开始通知
+        start_message = WebSocketMessage(
+            type=WebSocketMessageType.STREAM_START,
+            data={
+                "message": "开始处理您的消息...",
+                "user_message": user_message,
+                "delivery": delivery.to_dict()
+            },
+            session_id=session_id
         )
+        await self._emit(buffer, session_id, start_message)
         
         try:
             # 使用引擎的流式处理方法
-            stream_generator = self.engine.process_message_streaming(
+            stream_generator = self.engine.aprocess_message_streaming(
                 message=user_message,
                 session_id=session_id,
-                stream_mode=self.engine.config.get("ui", {}).get("stream_mode", ["messages", "custom", "updates", "events"])
+                stream_mode=ui_config.get("stream_mode", ["messages", "custom", "updates"]),
+                include_state=bool(content.get("include_state", False))
             )
             
             # 处理流式响应
             message_count = 0
-            for stream_chunk in stream_generator:
+            async for stream_chunk in acoalesce(stream_generator, delivery):
                 message_count += 1
                 
                 # 将流数据转换为WebSocket消息
                 ws_message = await self._convert_stream_to_websocket(stream_chunk, session_id)
                 if ws_message:
-                    await self.send_to_connection(websocket, ws_message)
+                    await self._emit(buffer, session_id, ws_message)
             
             # 发送流结束通知
-            await self.send_to_connection(
-                websocket,
-                WebSocketMessage(
-                    type=WebSocketMessageType.STREAM_END,
-                    data={
-                        "message": "消息处理完成",
-                        "total_chunks": message_count
-                    },
-                    session_id=session_id
-                )
+            end_message = WebSocketMessage(
+                type=WebSocketMessageType.STREAM_END,
+                data={
+                    "message": "消息处理完成",
+                    "total_chunks": message_count
+                },
+                session_id=session_id
             )
+            await self._emit(buffer, session_id, end_message)
             
             logger.info(f"完成流式处理: session_id={session_id}, 处理了{message_count}个数据块")
             
         except Exception as e:
             logger.error(f"流式处理错误: {str(e)}")
-            await self.send_error(websocket, f"处理消息时出错: {str(e)}", "STREAM_PROCESSING_ERROR")
+            await self._emit(buffer, session_id, WebSocketMessage(
+                type=WebSocketMessageType.ERROR,
+                data={
+                    "error": f"处理消息时出错: {str(e)}",
+                    "error_code": "STREAM_PROCESSING_ERROR"
+                },
+                session_id=session_id
+            ))
+    
+    async def _emit(self, buffer: StreamReplayBuffer, session_id: str, message: WebSocketMessage):
+        """记录到回放缓冲后推送给会话的所有连接（包括其他进程上的连接）"""
+        message_json = self._record(buffer, message)
+        await self.publish_to_session(session_id, message, message_json=message_json)
+    
+    def _record(self, buffer: StreamReplayBuffer, message: WebSocketMessage) -> str:
+        """为流式消息分配序号并写入回放缓冲（每个运行只有一个写入方），返回编码结果
+        
+        非token消息中的大负载先替换为内容引用。
+        """
+        if self.externalizer is not None and message.data.get("type") != StreamMessageType.LLM_TOKEN.value:
+            message.data = self.externalizer.externalize(message.data, owner=buffer)
+        seq = buffer.last_seq + 1
+        message.data["run_id"] = buffer.run_id
+        message.data["seq"] = seq
+        message_json = message.model_dump_json()
+        buffer.append(message_json, len(message_json))
+        return message_json
+    
+    @staticmethod
+    def _frame_for(message: WebSocketMessage, message_json: Optional[str] = None) -> OutboundFrame:
+        """构建待发送帧：带序号的流式消息可被丢弃（可回放），token消息可合并"""
+        data = message.data
+        merge_key = None
+        if message.type == WebSocketMessageType.STREAM_DATA and data.get("type") == StreamMessageType.LLM_TOKEN.value:
+            merge_key = (data.get("run_id"), data.get("role"))
+        return OutboundFrame(
+            message_json if message_json is not None else message.model_dump_json(),
+            payload=message,
+            merge_key=merge_key,
+            run_id=data.get("run_id"),
+            seq=data.get("seq")
+        )
+    
+    @staticmethod
+    def _merge_token_messages(earlier: WebSocketMessage, later: WebSocketMessage) -> WebSocketMessage:
+        """合并两条尚未发出的token消息，序号区间为[seq_start, seq]"""
+        data = dict(earlier.data)
+        data["content"] = f"{earlier.data.get('content', '')}{later.data.get('content', '')}"
+        data["seq_start"] = earlier.data.get("seq_start", earlier.data.get("seq"))
+        data["seq"] = later.data.get("seq")
+        data["token_count"] = earlier.data.get("token_count", 1) + later.data.get("token_count", 1)
+        return earlier.model_copy(update={"data": data})
+    
+    @staticmethod
+    def _gap_message(session_id: str, run_id: str, from_seq: int, to_seq: int) -> WebSocketMessage:
+        """缺口通知：客户端可发送resume补读[from_seq, to_seq]"""
+        return WebSocketMessage(
+            type=WebSocketMessageType.STREAM_DATA,
+            data={
+                "type": "gap",
+                "run_id": run_id,
+                "from_seq": from_seq,
+                "to_seq": to_seq
+            },
+            session_id=session_id
+        )
+    
+    async def _handle_resume(self, websocket: WebSocket, session_id: str, content: Dict[str, Any]):
+        """处理断线续传：补发运行中last_seq之后的消息
+        
+        运行仍在进行时，后续消息照常通过会话推送到达本连接；补发与实时
+        推送之间可能有重叠，客户端按seq去重。
+        
+        Args:
+            websocket: WebSocket连接
+            session_id: 会话ID
+            content: {"run_id": 运行ID（缺省为会话最近一次运行）, "last_seq": 已收到的最后序号}
+        """
+        run_id = content.get("run_id")
+        buffer = self.replay.get(run_id) if run_id else self.replay.latest_for_session(session_id)
+        if buffer is None or buffer.session_id != session_id:
+            await self.send_error(websocket, "流式运行不存在或已过期", "STREAM_NOT_FOUND")
+            return
+        
+        try:
+            last_seq = int(content.get("last_seq", 0))
+        except (TypeError, ValueError):
+            last_seq = 0
+        
+        events, truncated = buffer.read_after(last_seq)
+        if truncated:
+            resume_from = events[0][0] if events else buffer.last_seq + 1
+            await self.send_to_connection(
+                websocket,
+                self._gap_message(session_id, buffer.run_id, last_seq + 1, resume_from - 1)
+            )
+        
+        # 补发的消息经本连接的发送队列按序发出（等待空位，不丢弃），只影响本连接
+        sender = self.senders.get(websocket)
+        if sender is None:
+            return
+        for _, message_json in events:
+            if not await sender.put(OutboundFrame(message_json)):
+                return
+        logger.info(f"WebSocket续传: session_id={session_id}, run_id={buffer.run_id}, 补发{len(events)}条消息")
     
     async def _convert_stream_to_websocket(
         self, 
@@ -256,6 +432,14 @@ class WebSocketManager:
             if "dag" in stream_chunk:
                 ws_data["dag"] = stream_chunk["dag"]
             
+            # 状态差量
+            if "ops" in stream_chunk:
+                ws_data["state_diff"] = {
+                    "ops": stream_chunk["ops"],
+                    "version": stream_chunk.get("version", 0),
+                    "base_version": stream_chunk.get("base_version", 0)
+                }
+            
             # 复制其他元数据
             for key in ["timestamp", "message_id", "agent_name"]:
                 if key in stream_chunk:
@@ -337,18 +521,42 @@ class WebSocketManager:
                 await self.send_error(websocket, "生成DAG可视化失败", "DAG_GENERATION_ERROR")
     
     async def send_to_connection(self, websocket: WebSocket, message: WebSocketMessage):
-        """向特定连接发送消息
+        """向特定连接发送消息（经该连接的发送队列，队列满时只等待本连接）
         
         Args:
             websocket: WebSocket连接
             message: 要发送的消息
         """
+        sender = self.senders.get(websocket)
+        if sender is not None:
+            await sender.put(self._frame_for(message))
+            return
         try:
             message_json = message.model_dump_json()
             await websocket.send_text(message_json)
         except Exception as e:
             logger.error(f"发送WebSocket消息失败: {str(e)}")
     
+    def _fan_out(
+        self,
+        session_id: str,
+        message: WebSocketMessage,
+        message_json: Optional[str] = None,
+        exclude: Optional[WebSocket] = None
+    ) -> None:
+        """将消息放入会话各连接的发送队列（不阻塞，慢连接按策略合并或丢弃）"""
+        connections = self.active_connections.get(session_id)
+        if not connections:
+            return
+        if message_json is None:
+            message_json = message.model_dump_json()
+        for websocket in list(connections):
+            if websocket is exclude:
+                continue
+            sender = self.senders.get(websocket)
+            if sender is not None:
+                sender.offer(self._frame_for(message, message_json))
+    
     async def send_to_session(self, session_id: str, message: WebSocketMessage):
         """向会话的所有连接发送消息
         
@@ -356,19 +564,43 @@ class WebSocketManager:
             session_id: 会话ID
             message: 要发送的消息
         """
-        if session_id in self.active_connections:
-            disconnected_connections = []
-            
-            for websocket in self.active_connections[session_id]:
-                try:
-                    await self.send_to_connection(websocket, message)
-                except Exception as e:
-                    logger.error(f"发送消息到连接失败: {str(e)}")
-                    disconnected_connections.append(websocket)
-            
-            # 清理断开的连接
-            for websocket in disconnected_connections:
-                self.disconnect(websocket, session_id)
+        self._fan_out(session_id, message)
+    
+    async def publish_to_session(
+        self,
+        session_id: str,
+        message: WebSocketMessage,
+        exclude: Optional[WebSocket] = None,
+        message_json: Optional[str] = None
+    ):
+        """向会话的所有连接推送消息，启用共享状态时同时发布给其他进程
+        
+        Args:
+            session_id: 会话ID
+            message: 要发送的消息
+            exclude: 不需要推送的本地连接（通常是已直接回复的发起方）
+            message_json: 已编码的消息（所有连接共享同一份编码）
+        """
+        self._fan_out(session_id, message, message_json, exclude)
+        
+        if self._shared_events is not None:
+            self._shared_events.publish(session_id, {
+                "kind": "websocket",
+                "message": message.model_dump(mode="json")
+            })
+    
+    def _on_remote_event(self, session_id: str, event: Dict[str, Any]):
+        """处理其他进程发布的会话消息（在订阅线程中调用，转交事件循环发送）"""
+        if event.get("kind") != "websocket" or session_id not in self.active_connections:
+            return
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            message = WebSocketMessage(**event["message"])
+        except Exception as e:
+            logger.error(f"解析跨进程WebSocket消息失败: {str(e)}")
+            return
+        asyncio.run_coroutine_threadsafe(self.send_to_session(session_id, message), self._loop)
     
     async def send_error(self, websocket: WebSocket, message: str, error_code: str):
         """发送错误消息
@@ -397,6 +629,27 @@ class WebSocketManager:
         """
         return sum(len(connections) for connections in self.active_connections.values())
     
+    def get_fanout_metrics(self) -> Dict[str, Any]:
+        """各连接的发送队列指标（排队深度、发送延迟、丢弃与合并次数）
+        
+        Returns:
+            按会话分组的连接指标
+        """
+        sessions: Dict[str, List[Dict[str, Any]]] = {}
+        for websocket, sender in list(self.senders.items()):
+            session_id = self.connection_sessions.get(websocket, "unknown")
+            sessions.setdefault(session_id, []).append(sender.get_metrics())
+        senders = list(self.senders.values())
+        return {
+            "policy": self.fanout_config.policy,
+            "queue_size": self.fanout_config.queue_size,
+            "connections": len(senders),
+            "total_dropped": sum(sender.stats["dropped"] for sender in senders),
+            "total_coalesced": sum(sender.stats["coalesced"] for sender in senders),
+            "max_queue_depth": max((sender.queue_depth for sender in senders), default=0),
+            "sessions": sessions
+        }
+    
     def get_session_connection_count(self, session_id: str) -> int:
         """获取特定会话的连接数
         
@@ -0,0 +1,311 @@
+"""
+内容寻址的大负载存储
+
+工具输出（完整分析报告、DataFrame预览、base64内联图片、DAG HTML）原本内联在
+流式事件中，随每次重放、每个连接重复传输。本模块把超过阈值的值按内容哈希
+存入有界存储，事件中只保留引用：
+
+    {"$ref": "sha256:<hex>", "url": "/api/v1/blobs/<hex>", "size": ..., "content_type": ...}
+
+客户端通过可缓存的HTTP接口获取一次（内容不变，URL即可永久缓存），
+相同内容只存一份。base64的data URI解码后按原始MIME类型存储，可直接用作图片地址。
+
+多进程部署时，事件引用可能由另一个工作进程的接口来解析。因此启用shared_state后，
+内容同时写入共享层（Redis），本进程LRU未命中时从共享层读取。进程内LRU淘汰时跳过
+仍被回放缓冲引用的内容，这样断线重连的客户端补读到的引用不会失效。
+"""
+
+import base64
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.state_codec import get_state_codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD_BYTES = 16 * 1024
+DEFAULT_MAX_STORE_BYTES = 256 * 1024 * 1024
+DEFAULT_URL_PREFIX = "/api/v1/blobs"
+DEFAULT_SHARED_TTL_SECONDS = 86400
+
+
+class BlobStore:
+    """按内容哈希存储的有界LRU存储（进程内，可选写穿到共享层）"""
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_STORE_BYTES,
+        shared: Optional[Any] = None,
+        key_prefix: str = "isotope",
+        shared_ttl_seconds: Optional[float] = DEFAULT_SHARED_TTL_SECONDS
+    ):
+        """
+        Args:
+            max_bytes: 进程内存储的字节上限
+            shared: 共享层键值代理（shared_state的broker），为None时只在进程内存储
+            key_prefix: 共享层键名前缀
+            shared_ttl_seconds: 共享层中内容的过期时间
+        """
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.key_prefix = key_prefix
+        self.shared_ttl_seconds = shared_ttl_seconds
+        self._blobs: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 摘要 -> 引用该内容的回放缓冲（弱引用，缓冲被回收后自动解除）
+        self._pins: Dict[str, "weakref.WeakSet"] = {}
+        self.stats = {
+            "stored": 0, "deduplicated": 0, "evicted": 0, "hits": 0, "misses": 0,
+            "shared_hits": 0, "shared_errors": 0
+        }
+
+    def _shared_key(self, digest: str) -> str:
+        return f"{self.key_prefix}:blob:{digest}"
+
+    def put(self, data: bytes, content_type: str, owner: Optional[Any] = None) -> str:
+        """存入内容，返回其摘要（十六进制sha256）
+
+        Args:
+            data: 内容
+            content_type: 内容类型
+            owner: 引用该内容的回放缓冲；其存活期间内容不会被LRU淘汰
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if owner is not None:
+                self._pins.setdefault(digest, weakref.WeakSet()).add(owner)
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                self.stats["deduplicated"] += 1
+                return digest
+            self._insert_locked(digest, data, content_type)
+            self.stats["stored"] += 1
+        self._put_shared(digest, data, content_type)
+        return digest
+
+    def get(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        """按摘要获取(内容, content_type)；本进程未命中时从共享层读取"""
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                self._blobs.move_to_end(digest)
+                self.stats["hits"] += 1
+                return blob
+
+        blob = self._get_shared(digest)
+        with self._lock:
+            if blob is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["shared_hits"] += 1
+            if digest not in self._blobs:
+                self._insert_locked(digest, *blob)
+        return blob
+
+    def _insert_locked(self, digest: str, data: bytes, content_type: str) -> None:
+        """放入进程内存储并按LRU淘汰（刚存入的和被回放缓冲引用的保留）"""
+        self._blobs[digest] = (data, content_type)
+        self._bytes += len(data)
+        if self._bytes <= self.max_bytes:
+            return
+        for candidate in list(self._blobs):
+            if self._bytes <= self.max_bytes:
+                break
+            if candidate == digest or self._is_pinned_locked(candidate):
+                continue
+            evicted, _ = self._blobs.pop(candidate)
+            self._bytes -= len(evicted)
+            self.stats["evicted"] += 1
+
+    def _is_pinned_locked(self, digest: str) -> bool:
+        owners = self._pins.get(digest)
+        if owners is None:
+            return False
+        if len(owners) == 0:
+            del self._pins[digest]
+            return False
+        return True
+
+    def _put_shared(self, digest: str, data: bytes, content_type: str) -> None:
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(
+                self._shared_key(digest),
+                content_type.encode("utf-8") + b"\n" + data,
+                ttl=self.shared_ttl_seconds
+            )
+        except Exception as e:
+            self.stats["shared_errors"] += 1
+            logger.error(f"写入共享大负载存储失败: {e}")
+
+    def _get_shared(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        if self.shared is None:
+            return None
+        try:
+            value = self.shared.get(self._shared_key(digest))
+        except Exception as e:
+            self.stats["shared_errors"] += 1
+            logger.error(f"读取共享大负载存储失败: {e}")
+            return None
+        if value is None:
+            return None
+        content_type, _, data = value.partition(b"\n")
+        return data, content_type.decode("utf-8")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            pinned = sum(1 for digest in list(self._pins) if digest in self._blobs and self._is_pinned_locked(digest))
+            return {
+                "blobs": len(self._blobs),
+                "stored_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pinned": pinned,
+                "shared": self.shared is not None,
+                **self.stats
+            }
+
+
+class PayloadExternalizer:
+    """将事件中的大值替换为内容引用"""
+
+    def __init__(
+        self,
+        store: BlobStore,
+        threshold_bytes: int = DEFAULT_THRESHOLD_BYTES,
+        url_prefix: str = DEFAULT_URL_PREFIX
+    ):
+        self.store = store
+        self.threshold_bytes = threshold_bytes
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def externalize(self, value: Any, owner: Optional[Any] = None) -> Any:
+        """递归替换超过阈值的字符串和列表，返回新值（不修改原对象）
+
+        字典保留结构，只替换其中的大字段；列表（如表格行）整体超过阈值时
+        序列化为JSON存储。
+
+        Args:
+            value: 事件负载
+            owner: 写入该事件的回放缓冲；其存活期间引用的内容不会被淘汰
+        """
+        return self._walk(value, owner)[0]
+
+    def _walk(self, value: Any, owner: Optional[Any] = None) -> Tuple[Any, int]:
+        """返回(替换后的值, 近似大小)"""
+        if isinstance(value, str):
+            # 字符数是UTF-8字节数的下界，未达阈值的短字符串不必编码
+            if len(value) < self.threshold_bytes // 4:
+                return value, len(value)
+            return self._externalize_string(value, owner)
+
+        if isinstance(value, dict):
+            changed = False
+            result = {}
+            total = 0
+            for key, item in value.items():
+                new_item, size = self._walk(item, owner)
+                changed = changed or new_item is not item
+                result[key] = new_item
+                total += size + len(str(key))
+            return (result if changed else value), total
+
+        if isinstance(value, (list, tuple)):
+            items = [self._walk(item, owner) for item in value]
+            total = sum(size for _, size in items)
+            if total >= self.threshold_bytes:
+                try:
+                    data = get_state_codec().dumps_json(value)
+                except Exception as e:
+                    logger.warning(f"大列表无法序列化，保持内联: {e}")
+                else:
+                    return self._reference(data, "application/json", owner), 0
+            if any(new_item is not item for (new_item, _), item in zip(items, value)):
+                return [new_item for new_item, _ in items], total
+            return value, total
+
+        return value, 8
+
+    def _externalize_string(self, value: str, owner: Optional[Any] = None) -> Tuple[Any, int]:
+        if value.startswith("data:") and ";base64," in value[:100]:
+            header, _, encoded = value.partition(",")
+            content_type = header[5:].split(";", 1)[0] or "application/octet-stream"
+            try:
+                data = base64.b64decode(encoded, validate=False)
+            except Exception:
+                data = value.encode("utf-8")
+                content_type = "text/plain; charset=utf-8"
+        else:
+            data = value.encode("utf-8")
+            if len(data) < self.threshold_bytes:
+                return value, len(data)
+            head = value[:64].lstrip().lower()
+            if head.startswith(("<!doctype html", "<html")):
+                content_type = "text/html; charset=utf-8"
+            else:
+                content_type = "text/plain; charset=utf-8"
+        if len(data) < self.threshold_bytes:
+            return value, len(data)
+        return self._reference(data, content_type, owner), 0
+
+    def _reference(self, data: bytes, content_type: str, owner: Optional[Any] = None) -> Dict[str, Any]:
+        digest = self.store.put(data, content_type, owner)
+        return {
+            "$ref": f"sha256:{digest}",
+            "url": f"{self.url_prefix}/{digest}",
+            "size": len(data),
+            "content_type": content_type
+        }
+
+
+_blob_store: Optional[BlobStore] = None
+_externalizer: Optional[PayloadExternalizer] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store(config: Optional[Dict[str, Any]] = None, shared_state: Optional[Any] = None) -> BlobStore:
+    """获取全局大负载存储（首次调用时按ui.large_payloads配置创建）
+
+    Args:
+        config: ui.large_payloads配置
+        shared_state: 共享状态层（SharedStateLayer）；提供时内容写穿到共享层，
+            其他工作进程也能解析本进程发出的引用
+    """
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                config = config or {}
+                _blob_store = BlobStore(
+                    config.get("max_store_bytes", DEFAULT_MAX_STORE_BYTES),
+                    shared=shared_state.broker if shared_state is not None else None,
+                    key_prefix=shared_state.sessions.key_prefix if shared_state is not None else "isotope",
+                    shared_ttl_seconds=config.get("shared_ttl_seconds", DEFAULT_SHARED_TTL_SECONDS)
+                )
+    return _blob_store
+
+
+def get_payload_externalizer(
+    config: Optional[Dict[str, Any]] = None,
+    shared_state: Optional[Any] = None
+) -> Optional[PayloadExternalizer]:
+    """获取全局大负载替换器；配置中禁用时返回None"""
+    global _externalizer
+    config = config or {}
+    if not config.get("enabled", True):
+        return None
+    if _externalizer is None:
+        store = get_blob_store(config, shared_state)
+        with _blob_store_lock:
+            if _externalizer is None:
+                _externalizer = PayloadExternalizer(
+                    store,
+                    threshold_bytes=config.get("threshold_bytes", DEFAULT_THRESHOLD_BYTES),
+                    url_prefix=config.get("url_prefix", DEFAULT_URL_PREFIX)
+                )
+    return _externalizer
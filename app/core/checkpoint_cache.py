@@ -0,0 +1,281 @@
+"""
+检查点读缓存 - 缓存每个线程的最新检查点，避免轮询时重复查询数据库
+
+本模块负责：
+1. 包装LangGraph检查点器（PostgresSaver/PyMySQLSaver），写操作直接透传到数据库
+2. 按(thread_id, checkpoint_ns)缓存最新检查点，put/put_writes/delete_thread时失效
+3. 以LRU方式限制缓存的线程数，并可设置条目存活时间
+4. 返回检查点副本，调用方（如LangGraph执行循环）修改检查点不会污染缓存
+
+未命中时的数据库读取不持锁，每个线程维护失效代数：读取期间线程被写入失效时，
+读到的结果可能早于写入，不再放入缓存。
+
+缓存为进程内缓存，只对本进程的写入实时失效；启用跨进程共享状态时不使用缓存。
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, AsyncIterator, Optional, Sequence, Tuple
+
+try:
+    from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, copy_checkpoint
+    LANGGRAPH_CHECKPOINT_AVAILABLE = True
+except ImportError:
+    BaseCheckpointSaver = object
+    CheckpointTuple = None
+    copy_checkpoint = None
+    LANGGRAPH_CHECKPOINT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(config: Dict[str, Any]) -> Tuple[Optional[str], str]:
+    configurable = (config or {}).get("configurable", {})
+    return configurable.get("thread_id"), configurable.get("checkpoint_ns", "")
+
+
+class CachedCheckpointer(BaseCheckpointSaver):
+    """带最新检查点读缓存的检查点器包装"""
+
+    def __init__(self, inner: Any, max_threads: int = 1000, ttl_seconds: Optional[float] = 300.0):
+        """
+        初始化检查点缓存
+
+        Args:
+            inner: 实际的LangGraph检查点器
+            max_threads: 最多缓存的线程（命名空间）数
+            ttl_seconds: 缓存条目存活秒数，None表示只在写入时失效
+        """
+        if LANGGRAPH_CHECKPOINT_AVAILABLE:
+            super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.max_threads = max(1, max_threads)
+        self.ttl_seconds = ttl_seconds
+
+        # (thread_id, checkpoint_ns) -> (缓存时间, CheckpointTuple或None)
+        self._cache: "OrderedDict[Tuple[Optional[str], str], Tuple[float, Any]]" = OrderedDict()
+        # thread_id -> 最近一次失效的代数；被淘汰的记录并入下限，未记录的线程按下限计算
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._generation_counter = 0
+        self._generation_floor = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "evictions": 0,
+            "stale_loads_dropped": 0
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        # 未覆盖的属性（conn、setup等）交给实际检查点器
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @property
+    def config_specs(self):
+        return self.inner.config_specs
+
+    # ---------- 缓存 ----------
+
+    def _lookup(self, config: Dict[str, Any]) -> Tuple[bool, Any, int]:
+        """查找缓存，返回(是否命中, 检查点元组, 线程当前的失效代数)
+
+        未命中时调用方从数据库读取，再以该代数调用_store。
+        """
+        key = _cache_key(config)
+        if key[0] is None:
+            return False, None, 0
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                cached_at, checkpoint_tuple = entry
+                expired = self.ttl_seconds is not None and time.time() - cached_at > self.ttl_seconds
+                if expired:
+                    del self._cache[key]
+                elif checkpoint_id is None or (
+                    checkpoint_tuple is not None
+                    and checkpoint_tuple.config["configurable"].get("checkpoint_id") == checkpoint_id
+                ):
+                    self._cache.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, self._copy_tuple(checkpoint_tuple), 0
+            self._stats["misses"] += 1
+            return False, None, self._generations.get(key[0], self._generation_floor)
+
+    def _store(self, config: Dict[str, Any], checkpoint_tuple: Any, generation: int) -> None:
+        """缓存最新检查点（只缓存未指定checkpoint_id的查询结果）
+
+        Args:
+            config: 查询配置
+            checkpoint_tuple: 从数据库读到的检查点元组
+            generation: 读取前_lookup返回的失效代数，读取期间线程被失效时丢弃结果
+        """
+        key = _cache_key(config)
+        if key[0] is None or config["configurable"].get("checkpoint_id"):
+            return
+        with self._lock:
+            if self._generations.get(key[0], self._generation_floor) != generation:
+                self._stats["stale_loads_dropped"] += 1
+                return
+            self._cache[key] = (time.time(), checkpoint_tuple)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_threads:
+                self._cache.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, thread_id: str, checkpoint_ns: Optional[str] = None) -> None:
+        """使线程的缓存失效，checkpoint_ns为None时失效该线程的所有命名空间"""
+        with self._lock:
+            self._bump_generation(thread_id)
+            keys = [
+                key for key in self._cache
+                if key[0] == thread_id and (checkpoint_ns is None or key[1] == checkpoint_ns)
+            ]
+            for key in keys:
+                del self._cache[key]
+            if keys:
+                self._stats["invalidations"] += len(keys)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._cache.clear()
+            # 正在进行的读取一律不再放入缓存
+            self._generation_counter += 1
+            self._generation_floor = self._generation_counter
+            self._generations.clear()
+
+    def _bump_generation(self, thread_id: str) -> None:
+        """推进线程的失效代数（需持有self._lock）"""
+        self._generation_counter += 1
+        self._generations[thread_id] = self._generation_counter
+        self._generations.move_to_end(thread_id)
+        # 记录数有界：淘汰的代数并入下限，读取期间记录被淘汰时结果按过期处理
+        while len(self._generations) > self.max_threads:
+            _, evicted = self._generations.popitem(last=False)
+            self._generation_floor = max(self._generation_floor, evicted)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取缓存指标"""
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["cached_threads"] = len(self._cache)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    @staticmethod
+    def _copy_tuple(checkpoint_tuple: Any) -> Any:
+        if checkpoint_tuple is None:
+            return None
+        return checkpoint_tuple._replace(
+            checkpoint=copy_checkpoint(checkpoint_tuple.checkpoint),
+            pending_writes=list(checkpoint_tuple.pending_writes or [])
+        )
+
+    def _invalidate_config(self, config: Dict[str, Any]) -> None:
+        thread_id, checkpoint_ns = _cache_key(config)
+        if thread_id is not None:
+            self.invalidate(thread_id, checkpoint_ns)
+
+    # ---------- 同步接口 ----------
+
+    def get_tuple(self, config: Dict[str, Any]) -> Optional[Any]:
+        hit, checkpoint_tuple, generation = self._lookup(config)
+        if hit:
+            return checkpoint_tuple
+        checkpoint_tuple = self.inner.get_tuple(config)
+        self._store(config, checkpoint_tuple, generation)
+        return self._copy_tuple(checkpoint_tuple)
+
+    def list(self, config: Optional[Dict[str, Any]], **kwargs: Any) -> Iterator[Any]:
+        return self.inner.list(config, **kwargs)
+
+    def put(self, config: Dict[str, Any], checkpoint: Any, metadata: Any, new_versions: Any) -> Dict[str, Any]:
+        try:
+            return self.inner.put(config, checkpoint, metadata, new_versions)
+        finally:
+            self._invalidate_config(config)
+
+    def put_writes(self, config: Dict[str, Any], writes: Sequence[Tuple[str, Any]], task_id: str, *args: Any) -> None:
+        try:
+            return self.inner.put_writes(config, writes, task_id, *args)
+        finally:
+            self._invalidate_config(config)
+
+    def delete_thread(self, thread_id: str) -> None:
+        try:
+            return self.inner.delete_thread(thread_id)
+        finally:
+            self.invalidate(thread_id)
+
+    def get_next_version(self, current: Any, channel: Any) -> Any:
+        return self.inner.get_next_version(current, channel)
+
+    # ---------- 异步接口 ----------
+
+    async def aget_tuple(self, config: Dict[str, Any]) -> Optional[Any]:
+        hit, checkpoint_tuple, generation = self._lookup(config)
+        if hit:
+            return checkpoint_tuple
+        checkpoint_tuple = await self.inner.aget_tuple(config)
+        self._store(config, checkpoint_tuple, generation)
+        return self._copy_tuple(checkpoint_tuple)
+
+    async def alist(self, config: Optional[Dict[str, Any]], **kwargs: Any) -> AsyncIterator[Any]:
+        async for item in self.inner.alist(config, **kwargs):
+            yield item
+
+    async def aput(self, config: Dict[str, Any], checkpoint: Any, metadata: Any, new_versions: Any) -> Dict[str, Any]:
+        try:
+            return await self.inner.aput(config, checkpoint, metadata, new_versions)
+        finally:
+            self._invalidate_config(config)
+
+    async def aput_writes(self, config: Dict[str, Any], writes: Sequence[Tuple[str, Any]], task_id: str, *args: Any) -> None:
+        try:
+            return await self.inner.aput_writes(config, writes, task_id, *args)
+        finally:
+            self._invalidate_config(config)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        try:
+            return await self.inner.adelete_thread(thread_id)
+        finally:
+            self.invalidate(thread_id)
+
+
+def create_cached_checkpointer(
+    inner: Any,
+    cache_config: Optional[Dict[str, Any]] = None,
+    shared_state_config: Optional[Dict[str, Any]] = None
+) -> Any:
+    """根据配置包装检查点器
+
+    Args:
+        inner: 实际的LangGraph检查点器
+        cache_config: 缓存配置（enabled、max_threads、ttl_seconds）
+        shared_state_config: 跨进程共享状态配置，启用时其他进程的写入无法使本进程缓存失效，不使用缓存
+
+    Returns:
+        带缓存的检查点器；未启用、启用共享状态、内存检查点器或LangGraph不可用时返回原检查点器
+    """
+    cache_config = cache_config or {}
+    if inner is None or not LANGGRAPH_CHECKPOINT_AVAILABLE or not cache_config.get("enabled", True):
+        return inner
+    if (shared_state_config or {}).get("enabled", False):
+        logger.info("已启用跨进程共享状态，检查点读缓存不生效")
+        return inner
+    if isinstance(inner, CachedCheckpointer) or type(inner).__name__ in ("MemorySaver", "InMemorySaver"):
+        return inner
+    return CachedCheckpointer(
+        inner,
+        max_threads=cache_config.get("max_threads", 1000),
+        ttl_seconds=cache_config.get("ttl_seconds", 300.0)
+    )
@@ -0,0 +1,157 @@
+"""
+检查点保留策略 - 限制PostgreSQL/MySQL检查点表的增长
+
+本模块负责：
+1. 定义保留策略：每个线程保留最近N个检查点、保留时间窗口内的全部检查点、永久保留中断/审批检查点
+2. 后台定时任务按策略调用检查点管理器分批删除，单批次持锁时间短
+3. 记录每次清理的效果（删除数量、表大小、列表查询延迟的前后对比）
+
+具体的SQL由各检查点管理器的apply_retention_policy实现，本模块只负责策略与调度。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# LangGraph中断写入使用的通道名
+INTERRUPT_CHANNEL = "__interrupt__"
+
+
+@dataclass
+class CheckpointRetentionPolicy:
+    """检查点保留策略（满足任一保留条件的检查点都不会被删除）"""
+    enabled: bool = True
+    keep_last_n: int = 20                   # 每个线程保留的最近检查点数
+    keep_within_hours: float = 24.0         # 该时间窗口内的检查点全部保留
+    protect_interrupts: bool = True         # 永久保留中断/审批检查点
+    protected_metadata_keys: List[str] = field(
+        default_factory=lambda: ["interrupt", "approval", "human_approval"]
+    )
+    batch_size: int = 500                   # 单批删除的检查点数
+    max_deletes_per_run: int = 50000        # 单次运行最多删除的检查点数
+    interval_seconds: float = 3600.0        # 定时任务间隔
+    latency_probe_limit: int = 100          # 测量列表延迟时查询的检查点数
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "CheckpointRetentionPolicy":
+        """从配置字典创建策略，未知字段忽略"""
+        config = config or {}
+        known_fields = cls.__dataclass_fields__.keys()
+        return cls(**{key: value for key, value in config.items() if key in known_fields})
+
+    @property
+    def keep_within_seconds(self) -> float:
+        return self.keep_within_hours * 3600
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class CheckpointRetentionJob:
+    """检查点保留定时任务"""
+
+    def __init__(self, manager: Any, policy: CheckpointRetentionPolicy, initial_delay: float = 60.0):
+        """
+        初始化定时任务
+
+        Args:
+            manager: 检查点管理器，需要提供apply_retention_policy(policy)方法
+            policy: 保留策略
+            initial_delay: 启动后首次运行前的等待秒数
+        """
+        self.manager = manager
+        self.policy = policy
+        self.initial_delay = initial_delay
+
+        self._stop_event = threading.Event()
+        self._run_lock = threading.Lock()
+        self._reports = deque(maxlen=20)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """启动后台线程"""
+        if self._thread is not None or not self.policy.enabled:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-retention", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"检查点保留任务已启动: 保留最近{self.policy.keep_last_n}个/"
+            f"{self.policy.keep_within_hours}小时内，间隔{self.policy.interval_seconds}秒"
+        )
+
+    def stop(self) -> None:
+        """停止后台线程（正在执行的批次会完成）"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def run_once(self) -> Dict[str, Any]:
+        """立即执行一次清理并返回报告"""
+        with self._run_lock:
+            try:
+                report = self.manager.apply_retention_policy(self.policy)
+            except Exception as e:
+                logger.error(f"执行检查点保留策略失败: {e}")
+                report = {"error": str(e), "ran_at": time.time()}
+        self._reports.append(report)
+        return report
+
+    def get_reports(self) -> List[Dict[str, Any]]:
+        """获取最近的清理报告"""
+        return list(self._reports)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取任务状态"""
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "policy": self.policy.to_dict(),
+            "last_report": self._reports[-1] if self._reports else None
+        }
+
+    def _run(self) -> None:
+        if self._stop_event.wait(self.initial_delay):
+            return
+        while not self._stop_event.is_set():
+            report = self.run_once()
+            if report.get("deleted_checkpoints"):
+                logger.info(
+                    f"检查点保留任务完成: 删除 {report['deleted_checkpoints']} 个检查点，"
+                    f"耗时 {report.get('duration_ms', 0):.0f}ms"
+                )
+            if self._stop_event.wait(self.policy.interval_seconds):
+                return
+
+
+def create_checkpoint_retention_job(
+    manager: Any,
+    retention_config: Optional[Dict[str, Any]] = None,
+    start: bool = True
+) -> Optional[CheckpointRetentionJob]:
+    """根据配置创建（并启动）检查点保留任务
+
+    Args:
+        manager: 检查点管理器
+        retention_config: 保留策略配置
+        start: 是否立即启动后台线程
+
+    Returns:
+        定时任务；管理器不支持或策略未启用时返回None
+    """
+    if manager is None or not hasattr(manager, "apply_retention_policy"):
+        return None
+    policy = CheckpointRetentionPolicy.from_config(retention_config)
+    if not policy.enabled:
+        logger.info("检查点保留策略未启用")
+        return None
+    job = CheckpointRetentionJob(manager, policy)
+    if start:
+        job.start()
+    return job
@@ -58,7 +58,48 @@ class ConfigManager:
                 "show_debug_info": False,
                 "default_language": "zh-CN",
                 "show_thinking": True,
-                "stream_mode": "messages,custom",
+                "stream_mode": "messages,custom",  # values仅在客户端请求include_state时订阅
+                "state_stream_keys": None,  # 状态差量只跟踪的顶层字段，None表示全部
+                "stream_heartbeat_seconds": 15,  # 无数据时发送心跳并检查客户端是否断开
+                # 断线续传的事件回放缓冲：单次运行按事件数/字节数有界，
+                # 已结束的运行保留retention_seconds，总字节数超限时回收最早结束的运行
+                "stream_replay": {
+                    "max_events_per_run": 2000,
+                    "max_bytes_per_run": 4 * 1024 * 1024,
+                    "max_total_bytes": 64 * 1024 * 1024,
+                    "retention_seconds": 300
+                },
+                # token下发方式，可被请求中的delivery字段覆盖：
+                # coalesced按时间窗口/字节阈值合并相邻token，token为逐token下发
+                "stream_delivery": {
+                    "mode": "coalesced",
+                    "flush_interval_ms": 30,
+                    "flush_bytes": 2048
+                },
+                # WebSocket扇出：每个连接独立的有界发送队列；慢连接的策略为
+                # coalesce（合并未发出的token帧，满时丢弃最早帧）或drop_oldest（只丢弃）
+                "websocket_fanout": {
+                    "queue_size": 256,
+                    "policy": "coalesce",
+                    "send_timeout_seconds": 10
+                },
+                # SSE压缩：auto按Accept-Encoding协商（br优先，需安装brotli），
+                # 也可固定为gzip/br或off；每帧同步flush，不影响实时性
+                "sse_compression": {
+                    "mode": "auto",
+                    "gzip_level": 6,
+                    "brotli_quality": 5
+                },
+                # 大负载（图片、表格、HTML报告）超过阈值时替换为内容引用，
+                # 客户端通过可缓存的/api/v1/blobs/{digest}接口获取一次；
+                # 启用shared_state时内容同时写入共享层，任一工作进程都能返回
+                "large_payloads": {
+                    "enabled": True,
+                    "threshold_bytes": 16 * 1024,
+                    "max_store_bytes": 256 * 1024 * 1024,
+                    "shared_ttl_seconds": 86400,  # 共享层中内容的保留时间
+                    "url_prefix": "/api/v1/blobs"
+                },
                 "manage_history": True,
                 "port": 7860,
                 "alternate_ports": [7868, 7869, 7870, 7871, 7872]
@@ -132,7 +173,22 @@ class ConfigManager:
             "graph": {
                 "human_in_loop": True,          # 是否启用人在回路
                 "checkpoint_enabled": True,      # 是否启用检查点
-                "checkpoint_dir": "./checkpoints"  # 检查点目录
+                "checkpoint_dir": "./checkpoints",  # 检查点目录
+                # 检查点保留策略（PostgreSQL/MySQL检查点后端）
+                "checkpoint_retention": {
+                    "enabled": True,
+                    "keep_last_n": 20,              # 每个线程保留的最近检查点数
+                    "keep_within_hours": 24,        # 该时间内的检查点全部保留
+                    "protect_interrupts": True,     # 永久保留中断/审批检查点
+                    "batch_size": 500,              # 单批删除数量
+                    "interval_seconds": 3600        # 清理间隔
+                },
+                # 最新检查点读缓存（每个线程缓存最新检查点，写入时失效；启用shared_state时不使用）
+                "checkpoint_cache": {
+                    "enabled": True,
+                    "max_threads": 1000,            # 最多缓存的线程数
+                    "ttl_seconds": 300              # 条目存活时间
+                }
             },
             
             # 内存管理配置
@@ -165,7 +221,10 @@ class ConfigManager:
                 "port": 5432,
                 "database": "isotope",
                 "max_connections": 100,
-                "stale_timeout": 30
+                "stale_timeout": 30,
+                "pool_min_size": 1,
+                "pool_max_size": 10,
+                "pool_timeout": 30
             },
             
             # RAGFlow配置
@@ -200,7 +259,28 @@ class ConfigManager:
                 "db": 0,
                 "password": None
             },
-            
+
+            # 多工作进程共享会话状态（使用上面的Redis配置，启用后无法连接Redis时拒绝启动）
+            "shared_state": {
+                "enabled": False,
+                "backend": "redis",  # redis 或 memory（仅单进程部署）
+                "key_prefix": "isotope",
+                "session_ttl_seconds": 86400,
+                "compact_every": 20,  # 连续追加多少次增量后重写共享会话快照
+                "max_pending_events": 10000  # 等待发布的跨进程事件数上限
+            },
+
+            # 后台运行调度：按资源类别限制并发，超出的运行排队
+            "runs": {
+                "concurrency": {"llm": 4, "cpu": 2},
+                "max_queued": 32,  # 排队运行数上限，超出时拒绝新运行
+                "max_finished_records": 200,  # 保留的已结束运行记录数
+                "orphan_grace_seconds": 30,  # 前台运行所有客户端断开后等待重连的时间，超时停止生成
+                "tool_slot_timeout_seconds": 600,  # 工具等待资源槽位的最长时间，超时后工具调用失败
+                # 执行时占用cpu槽位的工具分类
+                "tool_classes": {"meanderpy": "cpu", "reservior": "cpu"}
+            },
+
             # 存储配置
             "storage": {
                 "use_minio": True,  # 启用MinIO存储
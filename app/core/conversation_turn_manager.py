@@ -11,9 +11,10 @@
 import logging
 import time
 import uuid
-from typing import Dict, List, Optional, Any, Union, Tuple
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Any, Union, Tuple, Iterable, Set
 from datetime import datetime
-from dataclasses import dataclass, field
 from enum import Enum
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
@@ -37,37 +38,83 @@ class TurnStatus(str, Enum):
     ERROR = "error"            # 出错
 
 
-@dataclass
 class ConversationTurn:
-    """对话轮次数据类"""
-    turn_id: str = field(default_factory=lambda: str(uuid.uuid4()))
-    turn_type: TurnType = TurnType.ASSISTANT_RESPONSE
-    status: TurnStatus = TurnStatus.PENDING
-    session_id: Optional[str] = None
-    
-    # 消息内容
-    content_parts: List[str] = field(default_factory=list)  # 累积的内容片段
-    complete_content: str = ""  # 完整内容
-    
-    # 元数据
-    start_time: float = field(default_factory=time.time)
-    end_time: Optional[float] = None
-    source: Optional[str] = None  # 来源智能体/节点
-    
-    # 流式消息信息
-    stream_messages: List[Dict[str, Any]] = field(default_factory=list)  # 原始流式消息
-    metadata: Dict[str, Any] = field(default_factory=dict)
-    
-    # 工具相关（如果是工具执行轮次）
-    tool_name: Optional[str] = None
-    tool_input: Optional[Dict[str, Any]] = None
-    tool_output: Optional[Any] = None
-    
+    """对话轮次
+
+    使用__slots__的紧凑表示：长会话中每个轮次只保留必要字段。
+    流式内容按片段追加（O(1)），完整内容在首次读取时拼接一次并缓存，
+    之后的追加只使缓存失效，不会每个token重新拼接整段字符串。
+    """
+
+    __slots__ = (
+        "turn_id", "turn_type", "status", "session_id",
+        "content_parts", "_joined", "_length",
+        "start_time", "end_time", "source",
+        "stream_messages", "metadata",
+        "tool_name", "tool_input", "tool_output"
+    )
+
+    def __init__(
+        self,
+        turn_id: Optional[str] = None,
+        turn_type: TurnType = TurnType.ASSISTANT_RESPONSE,
+        status: TurnStatus = TurnStatus.PENDING,
+        session_id: Optional[str] = None,
+        content_parts: Optional[List[str]] = None,
+        complete_content: str = "",
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        source: Optional[str] = None,  # 来源智能体/节点
+        stream_messages: Optional[List[Dict[str, Any]]] = None,  # 原始流式消息
+        metadata: Optional[Dict[str, Any]] = None,
+        tool_name: Optional[str] = None,  # 工具相关（如果是工具执行轮次）
+        tool_input: Optional[Dict[str, Any]] = None,
+        tool_output: Optional[Any] = None
+    ):
+        self.turn_id = turn_id or str(uuid.uuid4())
+        self.turn_type = turn_type
+        self.status = status
+        self.session_id = session_id
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = end_time
+        self.source = source
+        self.stream_messages = stream_messages if stream_messages is not None else []
+        self.metadata = metadata if metadata is not None else {}
+        self.tool_name = tool_name
+        self.tool_input = tool_input
+        self.tool_output = tool_output
+        if content_parts:
+            self.content_parts = list(content_parts)
+            self._joined = None
+            self._length = sum(len(part) for part in self.content_parts)
+        else:
+            self.complete_content = complete_content
+
+    @property
+    def complete_content(self) -> str:
+        """完整内容（首次读取时拼接并合并为单个片段）"""
+        if self._joined is None:
+            self._joined = "".join(self.content_parts)
+            self.content_parts = [self._joined] if self._joined else []
+        return self._joined
+
+    @complete_content.setter
+    def complete_content(self, content: str) -> None:
+        self.content_parts = [content] if content else []
+        self._joined = content or ""
+        self._length = len(self._joined)
+
+    @property
+    def content_length(self) -> int:
+        """内容长度（无需拼接）"""
+        return self._length
+
     def add_content_part(self, part: str) -> None:
         """添加内容片段"""
         if part:
             self.content_parts.append(part)
-            self.complete_content += part
+            self._joined = None
+            self._length += len(part)
     
     def mark_completed(self) -> None:
         """标记轮次完成"""
@@ -85,16 +132,19 @@ class ConversationTurn:
         if self.turn_type == TurnType.USER_INPUT:
             return HumanMessage(
                 content=self.complete_content,
+                id=self.turn_id,
                 additional_kwargs={"turn_id": self.turn_id, "metadata": self.metadata}
             )
         elif self.turn_type == TurnType.ASSISTANT_RESPONSE:
             return AIMessage(
                 content=self.complete_content,
+                id=self.turn_id,
                 additional_kwargs={"turn_id": self.turn_id, "metadata": self.metadata}
             )
         elif self.turn_type == TurnType.SYSTEM_MESSAGE:
             return SystemMessage(
                 content=self.complete_content,
+                id=self.turn_id,
                 additional_kwargs={"turn_id": self.turn_id, "metadata": self.metadata}
             )
         elif self.turn_type == TurnType.TOOL_EXECUTION:
@@ -102,6 +152,7 @@ class ConversationTurn:
                 content=self.complete_content,
                 tool_call_id=self.metadata.get("tool_call_id", ""),
                 name=self.tool_name or "unknown",
+                id=self.turn_id,
                 additional_kwargs={"turn_id": self.turn_id, "metadata": self.metadata}
             )
         else:
@@ -133,22 +184,57 @@ class ConversationTurn:
 
 
 class ConversationTurnManager:
-    """对话轮次管理器"""
+    """对话轮次管理器
+    
+    已完成轮次存放在双端队列中，轮次完成时只做常数时间的记录：
+    1. LangChain消息在轮次完成时构建一次，追加到历史视图，
+       获取对话历史时不再逐轮重建消息对象
+    2. API历史只统计有内容的轮次计数，不再逐轮扫描
+    3. 超过max_completed_turns（或调用cleanup_completed_turns）时从队首淘汰最早的轮次
+    """
     
-    def __init__(self, session_id: Optional[str] = None):
+    def __init__(self, session_id: Optional[str] = None, max_completed_turns: Optional[int] = None):
         """
         初始化对话轮次管理器
         
         Args:
             session_id: 会话ID
+            max_completed_turns: 保留的已完成轮次上限，None表示不限
         """
         self.session_id = session_id
+        self.max_completed_turns = max_completed_turns
         self.active_turns: Dict[str, ConversationTurn] = {}  # 正在进行的轮次
-        self.completed_turns: List[ConversationTurn] = []    # 已完成的轮次
+        self.completed_turns: Deque[ConversationTurn] = deque()  # 已完成的轮次
         self.current_assistant_turn: Optional[ConversationTurn] = None  # 当前AI回复轮次
+        self.summarized_turn_ids: Set[str] = set()  # 已并入历史摘要的轮次（不再进入LLM上下文）
+        
+        # 未并入摘要的已完成轮次 -> LangChain消息，与completed_turns同序
+        self._history: Deque[Tuple[str, BaseMessage]] = deque()
+        self._api_turn_count = 0  # 有内容的已完成轮次数
         
         logger.info(f"对话轮次管理器初始化完成，会话ID: {session_id}")
     
+    def _append_completed(self, turn: ConversationTurn) -> None:
+        """记录已完成轮次并追加到历史视图（常数时间）"""
+        self.completed_turns.append(turn)
+        if turn.content_length:
+            self._api_turn_count += 1
+        if turn.turn_id not in self.summarized_turn_ids:
+            self._history.append((turn.turn_id, turn.to_message()))
+        if self.max_completed_turns is not None:
+            while len(self.completed_turns) > self.max_completed_turns:
+                self._evict_oldest()
+    
+    def _evict_oldest(self) -> ConversationTurn:
+        """从队首淘汰最早的已完成轮次"""
+        turn = self.completed_turns.popleft()
+        if turn.content_length:
+            self._api_turn_count -= 1
+        if self._history and self._history[0][0] == turn.turn_id:
+            self._history.popleft()
+        self.summarized_turn_ids.discard(turn.turn_id)
+        return turn
+    
     def start_user_turn(self, content: str, metadata: Optional[Dict[str, Any]] = None) -> str:
         """
         开始用户输入轮次
@@ -169,7 +255,7 @@ class ConversationTurnManager:
         )
         turn.mark_completed()
         
-        self.completed_turns.append(turn)
+        self._append_completed(turn)
         logger.info(f"用户输入轮次完成: {turn.turn_id}, 内容长度: {len(content)}")
         
         return turn.turn_id
@@ -231,7 +317,7 @@ class ConversationTurnManager:
         if stream_message:
             self.current_assistant_turn.stream_messages.append(stream_message)
         
-        logger.debug(f"添加助手内容片段: 长度={len(content)}, 总长度={len(self.current_assistant_turn.complete_content)}")
+        logger.debug(f"添加助手内容片段: 长度={len(content)}, 总长度={self.current_assistant_turn.content_length}")
         return True
     
     def complete_assistant_turn(self) -> Optional[str]:
@@ -251,12 +337,12 @@ class ConversationTurnManager:
         # 移除活跃轮次，添加到已完成列表
         if turn.turn_id in self.active_turns:
             del self.active_turns[turn.turn_id]
-        self.completed_turns.append(turn)
+        self._append_completed(turn)
         
         # 清除当前助手轮次
         self.current_assistant_turn = None
         
-        logger.info(f"助手回复轮次完成: {turn.turn_id}, 内容长度: {len(turn.complete_content)}")
+        logger.info(f"助手回复轮次完成: {turn.turn_id}, 内容长度: {turn.content_length}")
         return turn.turn_id
     
     def start_tool_turn(self, tool_name: str, tool_input: Dict[str, Any], 
@@ -314,7 +400,7 @@ class ConversationTurnManager:
         
         # 移除活跃轮次，添加到已完成列表
         del self.active_turns[turn_id]
-        self.completed_turns.append(turn)
+        self._append_completed(turn)
         
         logger.info(f"工具执行轮次完成: {turn_id}")
         return True
@@ -368,21 +454,89 @@ class ConversationTurnManager:
         Returns:
             LangChain消息列表
         """
-        messages = []
-        
-        # 添加已完成的轮次
-        for turn in self.completed_turns:
-            messages.append(turn.to_message())
+        # 已完成轮次的消息在轮次完成时已构建，这里只复制引用（已并入摘要的轮次不在视图中）
+        messages = [message for _, message in self._history]
         
         # 添加未完成的轮次（如果需要）
         if include_incomplete:
             for turn in self.active_turns.values():
-                if turn.complete_content:  # 只有有内容的才添加
+                if turn.content_length:  # 只有有内容的才添加
                     messages.append(turn.to_message())
         
         logger.debug(f"获取对话历史: {len(messages)} 条消息")
         return messages
     
+    def get_history_length(self) -> int:
+        """历史视图中的消息数（不含已并入摘要的轮次）"""
+        return len(self._history)
+    
+    def get_last_history_id(self) -> Optional[str]:
+        """历史视图中最后一条消息的轮次ID，视图为空时返回None"""
+        return self._history[-1][0] if self._history else None
+    
+    def get_history_after(self, turn_id: Optional[str]) -> Optional[List[BaseMessage]]:
+        """
+        获取指定轮次之后新增的历史消息（从队尾向前查找，开销只与新增轮次数相关）
+        
+        Args:
+            turn_id: 起点轮次ID，None表示起点时历史视图为空
+            
+        Returns:
+            新增的消息列表；起点轮次已不在历史视图中时返回None
+        """
+        if turn_id is None:
+            return [message for _, message in self._history]
+        messages = []
+        for history_turn_id, message in reversed(self._history):
+            if history_turn_id == turn_id:
+                messages.reverse()
+                return messages
+            messages.append(message)
+        return None
+    
+    def mark_turns_summarized(self, turn_ids: Iterable[str]) -> None:
+        """
+        标记轮次已并入历史摘要
+        
+        被标记的轮次不再出现在get_conversation_history中，但仍保留在API历史中供前端显示。
+        
+        Args:
+            turn_ids: 轮次ID（即消息ID）
+        """
+        new_ids = set(turn_ids) - self.summarized_turn_ids
+        if not new_ids:
+            return
+        self.summarized_turn_ids.update(new_ids)
+        # 只在历史压缩时发生，重建视图的开销不在每次回复的路径上
+        self._history = deque(item for item in self._history if item[0] not in new_ids)
+    
+    def merge_from(self, other: "ConversationTurnManager") -> int:
+        """
+        在本管理器之后追加另一个管理器中本管理器没有的已完成轮次，并接管其进行中的轮次
+        
+        用于本地副本基于的版本已被其他进程更新时，把本进程新增的轮次重新应用到最新版本上。
+        
+        Args:
+            other: 本进程的轮次管理器
+            
+        Returns:
+            追加的轮次数
+        """
+        known_ids = {turn.turn_id for turn in self.completed_turns}
+        self.mark_turns_summarized(other.summarized_turn_ids & known_ids)
+        self.summarized_turn_ids.update(other.summarized_turn_ids - known_ids)
+        
+        merged = 0
+        for turn in other.completed_turns:
+            if turn.turn_id not in known_ids:
+                self._append_completed(turn)
+                merged += 1
+        
+        self.active_turns.update(other.active_turns)
+        if other.current_assistant_turn is not None:
+            self.current_assistant_turn = other.current_assistant_turn
+        return merged
+    
     def get_api_conversation_history(self, include_incomplete: bool = False) -> List[Dict[str, Any]]:
         """
         获取对话历史（API格式）
@@ -397,18 +551,37 @@ class ConversationTurnManager:
         
         # 添加已完成的轮次
         for turn in self.completed_turns:
-            if turn.complete_content:  # 只有有内容的才添加
+            if turn.content_length:  # 只有有内容的才添加
                 messages.append(turn.to_api_format())
         
         # 添加未完成的轮次（如果需要）
         if include_incomplete:
             for turn in self.active_turns.values():
-                if turn.complete_content:  # 只有有内容的才添加
+                if turn.content_length:  # 只有有内容的才添加
                     messages.append(turn.to_api_format())
         
         logger.debug(f"获取API对话历史: {len(messages)} 条消息")
         return messages
-    
+
+    def get_api_history_length(self) -> int:
+        """已完成且有内容的轮次数（即API对话历史的消息数）"""
+        return self._api_turn_count
+
+    def get_api_history_window(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """获取API对话历史的[start, end)窗口，只转换窗口内的轮次
+
+        Args:
+            start: 起始序号（包含）
+            end: 结束序号（不包含）
+
+        Returns:
+            API格式的消息列表
+        """
+        if start >= end:
+            return []
+        turns = (turn for turn in self.completed_turns if turn.content_length)
+        return [turn.to_api_format() for turn in islice(turns, start, end)]
+
     def cleanup_completed_turns(self, keep_last_n: int = 10) -> int:
         """
         清理已完成的轮次，保留最后N个
@@ -419,11 +592,12 @@ class ConversationTurnManager:
         Returns:
             清理的轮次数量
         """
-        if len(self.completed_turns) <= keep_last_n:
+        removed_count = max(0, len(self.completed_turns) - keep_last_n)
+        if not removed_count:
             return 0
         
-        removed_count = len(self.completed_turns) - keep_last_n
-        self.completed_turns = self.completed_turns[-keep_last_n:]
+        for _ in range(removed_count):
+            self._evict_oldest()
         
         logger.info(f"清理了 {removed_count} 个已完成的轮次")
         return removed_count
@@ -435,30 +609,89 @@ class ConversationTurnManager:
             "completed_turns": len(self.completed_turns),
             "active_turns": len(self.active_turns),
             "current_assistant_turn_active": self.current_assistant_turn is not None,
-            "current_assistant_content_length": len(self.current_assistant_turn.complete_content) if self.current_assistant_turn else 0
+            "current_assistant_content_length": self.current_assistant_turn.content_length if self.current_assistant_turn else 0
+        }
+    
+    def export_state(self) -> Dict[str, Any]:
+        """导出已完成轮次（不含原始流式消息），用于在其他进程中重建管理器"""
+        return {
+            "session_id": self.session_id,
+            "summarized_turn_ids": list(self.summarized_turn_ids),
+            "completed_turns": [
+                {
+                    "turn_id": turn.turn_id,
+                    "turn_type": turn.turn_type.value,
+                    "status": turn.status.value,
+                    "complete_content": turn.complete_content,
+                    "start_time": turn.start_time,
+                    "end_time": turn.end_time,
+                    "source": turn.source,
+                    "metadata": turn.metadata,
+                    "tool_name": turn.tool_name,
+                    "tool_input": turn.tool_input,
+                    "tool_output": turn.tool_output
+                }
+                for turn in self.completed_turns
+            ]
         }
     
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ConversationTurnManager":
+        """从export_state的结果重建管理器"""
+        manager = cls(session_id=state.get("session_id"))
+        manager.summarized_turn_ids = set(state.get("summarized_turn_ids") or [])
+        for turn_data in state.get("completed_turns") or []:
+            manager._append_completed(ConversationTurn(
+                turn_id=turn_data["turn_id"],
+                turn_type=TurnType(turn_data.get("turn_type", TurnType.ASSISTANT_RESPONSE.value)),
+                status=TurnStatus(turn_data.get("status", TurnStatus.COMPLETED.value)),
+                session_id=manager.session_id,
+                complete_content=turn_data.get("complete_content") or "",
+                start_time=turn_data.get("start_time") or time.time(),
+                end_time=turn_data.get("end_time"),
+                source=turn_data.get("source"),
+                metadata=turn_data.get("metadata") or {},
+                tool_name=turn_data.get("tool_name"),
+                tool_input=turn_data.get("tool_input"),
+                tool_output=turn_data.get("tool_output")
+            ))
+        return manager
+    
     def reset(self) -> None:
         """重置管理器状态"""
         self.active_turns.clear()
         self.completed_turns.clear()
         self.current_assistant_turn = None
+        self.summarized_turn_ids.clear()
+        self._history.clear()
+        self._api_turn_count = 0
         logger.info("对话轮次管理器已重置")
 
 
 class MessageAccumulator:
-    """消息累积器 - 将流式token累积为完整消息"""
+    """消息累积器 - 将流式token累积为完整消息（片段追加，读取时拼接一次）"""
+    
+    __slots__ = ("message_parts", "_joined", "_length", "start_time", "last_update")
     
     def __init__(self):
-        self.accumulated_content = ""
-        self.message_parts = []
+        self.message_parts: List[str] = []
+        self._joined: Optional[str] = ""
+        self._length = 0
         self.start_time = time.time()
-        self.last_update = time.time()
+        self.last_update = self.start_time
+    
+    @property
+    def accumulated_content(self) -> str:
+        """已累积的完整内容"""
+        if self._joined is None:
+            self._joined = "".join(self.message_parts)
+        return self._joined
     
     def add_token(self, token: str) -> None:
         """添加token"""
-        self.accumulated_content += token
         self.message_parts.append(token)
+        self._joined = None
+        self._length += len(token)
         self.last_update = time.time()
     
     def get_complete_message(self) -> str:
@@ -467,14 +700,15 @@ class MessageAccumulator:
     
     def reset(self) -> None:
         """重置累积器"""
-        self.accumulated_content = ""
         self.message_parts.clear()
+        self._joined = ""
+        self._length = 0
         self.start_time = time.time()
-        self.last_update = time.time()
+        self.last_update = self.start_time
     
     def is_empty(self) -> bool:
         """检查是否为空"""
-        return len(self.accumulated_content) == 0
+        return self._length == 0
 
 
 def create_conversation_turn_manager(session_id: Optional[str] = None) -> ConversationTurnManager:
@@ -1,7 +1,8 @@
 """
 执行引擎模块 - 系统的中央协调组件
 """
-from typing import Dict, List, Any, Optional, Callable, Union, Generator, Tuple
+from typing import Dict, List, Any, Optional, Callable, Union, Generator, AsyncGenerator, Tuple
+import asyncio
 import logging
 import uuid
 import json
@@ -10,7 +11,6 @@ import os
 import traceback
 import time
 import hashlib
-import copy
 
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage,ToolMessage,RemoveMessage
@@ -49,9 +49,9 @@ from app.core.state import IsotopeSystemState, StateManager, TaskStatus
 from app.core.enhanced_graph_builder import EnhancedGraphBuilder, TaskType
 from app.tools.registry import get_tools_by_category
 from app.utils.qwen_chat import SFChatOpenAI
-from app.ui.streaming import LangGraphStreamer  # 使用自定义的LangGraphStreamer
+from app.ui.streaming import LangGraphStreamer, plan_stream_modes  # 使用自定义的LangGraphStreamer
 from app.core.memory.store import MemoryStore, MemoryItem
-from app.core.memory.history_manager import HistoryManager
+from app.core.memory.history_manager import HistoryManager, HISTORY_SUMMARY_MESSAGE_ID
 from app.core.memory.persistence import IsotopeCheckpointer
 from app.core.config import ConfigManager
 
@@ -60,10 +60,24 @@ from app.core.postgres_session_manager import get_postgres_session_manager, Post
 
 # 导入对话轮次管理器
 from app.core.conversation_turn_manager import ConversationTurnManager, create_conversation_turn_manager
+from app.core.session_working_set import SessionWorkingSet, SessionLoadError, build_catalog_entry
+from app.core.session_delta import (
+    SessionDeltaTracker, apply_session_deltas, merge_appended_items, APPEND_ONLY_FIELDS, DEFAULT_COMPACT_EVERY
+)
+from app.core.state_codec import get_state_codec
+from app.core.session_persistence_worker import SessionPersistenceWorker, atomic_write_bytes
+from app.core.shared_state import create_shared_state_layer, StaleSessionVersionError
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 历史分页的序号空间：轮次管理器的对话记录 / 会话状态中的消息
+HISTORY_SOURCE_TURNS = "turns"
+HISTORY_SOURCE_MESSAGES = "messages"
+
+# 共享会话写入因版本冲突被拒绝时，基于最新版本重新应用本地修改的最大尝试次数
+SHARED_PUBLISH_MAX_ATTEMPTS = 3
+
 class IsotopeEngine:
     """天然气碳同位素系统执行引擎
     
@@ -223,8 +237,32 @@ class IsotopeEngine:
             logger.info(f"使用默认LLM: {self.llm}")
                     
         
-        # 初始化会话管理
-        self.sessions = {}
+        # 多工作进程部署时的共享会话状态（未启用时为None）
+        self.shared_state = create_shared_state_layer(
+            self.config.get("shared_state"), self.config.get("redis")
+        )
+        
+        # 初始化会话管理：启动时只加载会话目录，完整状态在首次访问时按需加载
+        self.sessions = SessionWorkingSet(
+            loader=self._hydrate_session,
+            evictor=self._write_back_session,
+            max_loaded=self.config.get("max_loaded_sessions", 200),
+            idle_timeout=self.config.get("session_idle_timeout", 3600)
+        )
+        if self.shared_state is not None:
+            # 其他进程修改会话后丢弃本地副本
+            self.shared_state.sessions.add_listener(self._on_shared_session_changed)
+        
+        # 文件检查点的增量跟踪：两次快照之间只追加写入新增内容
+        self.session_delta_tracker = SessionDeltaTracker(
+            self.config.get("session_compact_every", DEFAULT_COMPACT_EVERY)
+        )
+        
+        # 自动保存由后台写入器执行，同一会话的多次保存请求合并
+        self.persistence_worker = SessionPersistenceWorker(
+            save_fn=self._save_session_snapshot,
+            coalesce_delay=self.config.get("autosave_coalesce_delay", 0.5)
+        )
         
         # 初始化对话轮次管理器字典（每个会话一个管理器）
         self.turn_managers = {}
@@ -669,6 +707,8 @@ class IsotopeEngine:
             except Exception as e:
                 logger.error(f"保存会话到PostgreSQL时出错: {str(e)}")
         
+        self._publish_shared_session(session_id)
+        
         logger.info(f"创建会话: {session_id}")
         return session_id
     
@@ -791,7 +831,7 @@ class IsotopeEngine:
             stream_generator = self.workflow_graph.stream(
                 updated_state,  # 使用更新后的状态
                 config=config,
-                stream_mode=self.config.get("ui", {}).get("stream_mode", ["messages", "custom", "updates", "values"]),
+                stream_mode=plan_stream_modes(self.config.get("ui", {}).get("stream_mode")),
                 **invoke_kwargs
             )
             
@@ -886,33 +926,46 @@ class IsotopeEngine:
         # 2. 回退到文件检查点加载
         return self._load_session_from_checkpoint(session_id)
     
-    def _save_session_to_persistence(self, session_id: str, state: IsotopeSystemState):
+    def _save_session_to_persistence(
+        self,
+        session_id: str,
+        state: IsotopeSystemState,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
         """保存会话状态到持久化存储
         
         Args:
             session_id: 会话ID
             state: 会话状态
+            metadata: 会话元数据，未提供时从会话目录读取（不触发会话加载）
+            
+        Returns:
+            是否已保存到PostgreSQL（未启用会话持久化时返回False）
         """
-        if self.session_persistence_enabled and self.postgres_session_manager:
-            try:
-                # 获取会话元数据
-                session = self.sessions.get(session_id, {})
-                metadata = session.get("metadata", {})
-                
-                success = self.postgres_session_manager.save_session(
-                    session_id=session_id,
-                    session_data=state,
-                    metadata=metadata,
-                    expires_in_hours=24 * 7  # 7天过期
-                )
-                
-                if success:
-                    logger.debug(f"会话 {session_id} 已保存到PostgreSQL")
-                else:
-                    logger.warning(f"会话 {session_id} 保存到PostgreSQL失败")
-                    
-            except Exception as e:
-                logger.error(f"保存会话到PostgreSQL时出错: {str(e)}")
+        if not (self.session_persistence_enabled and self.postgres_session_manager):
+            return False
+        try:
+            # 获取会话元数据
+            if metadata is None:
+                catalog_entry = self.sessions.get_catalog_entry(session_id) or {}
+                metadata = catalog_entry.get("metadata", {})
+            
+            success = self.postgres_session_manager.save_session(
+                session_id=session_id,
+                session_data=state,
+                metadata=metadata,
+                expires_in_hours=24 * 7  # 7天过期
+            )
+            
+            if success:
+                logger.debug(f"会话 {session_id} 已保存到PostgreSQL")
+            else:
+                logger.warning(f"会话 {session_id} 保存到PostgreSQL失败")
+            return bool(success)
+            
+        except Exception as e:
+            logger.error(f"保存会话到PostgreSQL时出错: {str(e)}")
+            return False
     
     def _load_session_from_checkpoint(self, session_id: str) -> bool:
         """从检查点加载会话状态
@@ -927,34 +980,41 @@ class IsotopeEngine:
             # 1. 尝试从文件检查点加载
             checkpoint_file = os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
             if os.path.exists(checkpoint_file):
-                with open(checkpoint_file, 'r', encoding='utf-8') as f:
-                    checkpoint_data = json.load(f)
+                loaded = self._read_session_file(checkpoint_file)
                 
                 # 检查数据格式
-                if "state" in checkpoint_data:
-                    state = checkpoint_data["state"]
+                if loaded:
+                    session_data = loaded[1]
                     
                     # 重建会话
                     self.sessions[session_id] = {
                         "session_id": session_id,
-                        "state": state,
-                        "created_at": checkpoint_data.get("timestamp", datetime.now().isoformat()),
-                        "last_updated": checkpoint_data.get("timestamp", datetime.now().isoformat()),
+                        "state": session_data["state"],
+                        "created_at": session_data["created_at"],
+                        "last_updated": session_data["last_updated"],
                         "interrupt_state": None
                     }
                     
                     logger.info(f"从文件检查点成功加载会话: {session_id}")
                     return True
             
-            # 2. 尝试从PostgreSQL检查点加载
-            if hasattr(self, 'use_enhanced_graph') and self.use_enhanced_graph:
-                try:
-                    config = self.graph_builder.create_thread_config(session_id)
-                    # 这里可以尝试从PostgreSQL检查点器获取状态
-                    # 具体实现取决于checkpointer的API
-                    logger.info(f"尝试从PostgreSQL检查点加载会话: {session_id}")
-                except Exception as pg_error:
-                    logger.warning(f"PostgreSQL检查点加载失败: {str(pg_error)}")
+            # 2. 尝试从LangGraph检查点加载（最新检查点经读缓存，轮询时不重复查询数据库）
+            try:
+                checkpoint_tuple = self.graph_builder.get_latest_checkpoint(session_id)
+                channel_values = checkpoint_tuple.checkpoint.get("channel_values") if checkpoint_tuple else None
+                if channel_values:
+                    checkpoint_ts = checkpoint_tuple.checkpoint.get("ts") or datetime.now().isoformat()
+                    self.sessions[session_id] = {
+                        "session_id": session_id,
+                        "state": dict(channel_values),
+                        "created_at": checkpoint_ts,
+                        "last_updated": checkpoint_ts,
+                        "interrupt_state": None
+                    }
+                    logger.info(f"从LangGraph检查点成功加载会话: {session_id}")
+                    return True
+            except Exception as pg_error:
+                logger.warning(f"LangGraph检查点加载失败: {str(pg_error)}")
             
             return False
             
@@ -1008,15 +1068,10 @@ class IsotopeEngine:
             # 更新会话状态
             self.sessions[session_id]["state"] = result
             self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
+            self._publish_shared_session(session_id)
             
             # 检查是否需要自动保存
-            current_time = time.time()
-            if current_time - self.last_autosave > self.autosave_interval:
-                try:
-                    self._auto_save_session(session_id, result)
-                    self.last_autosave = current_time
-                except Exception as auto_save_err:
-                    logger.error(f"自动保存会话时出错: {str(auto_save_err)}")
+            self._maybe_auto_save_session(session_id, result)
             
             return result
         except Exception as e:
@@ -1137,58 +1192,224 @@ class IsotopeEngine:
         # 转换消息为API格式
         result = []
         for i, msg in enumerate(messages):
-            try:
-                if isinstance(msg, BaseMessage):
-                    # 映射消息类型到角色
-                    role_mapping = {
-                        "human": "user",
-                        "ai": "assistant", 
-                        "system": "system",
-                        "tool": "tool"
-                    }
-                    
-                    api_msg = {
-                        "id": getattr(msg, "id", f"msg_{i}_{session_id}"),
-                        "role": role_mapping.get(msg.type, msg.type),
-                        "content": msg.content,
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "text",
-                        "metadata": {
-                            "source": "legacy_conversion",
-                            "original_type": msg.type
-                        }
-                    }
-                    
-                    # 添加额外属性
-                    if hasattr(msg, "name") and msg.name:
-                        api_msg["metadata"]["name"] = msg.name
-                    if hasattr(msg, "tool_calls") and msg.tool_calls:
-                        api_msg["metadata"]["tool_calls"] = msg.tool_calls
-                    
-                    result.append(api_msg)
-                elif isinstance(msg, dict):
-                    # 检查是否已经是API格式（来自轮次管理器）
-                    if "role" in msg and msg["role"] in ["user", "assistant", "system", "tool"]:
-                        # 已经是正确的API格式，直接使用
-                        result.append(msg)
-                    else:
-                        # 需要转换的字典格式
-                        api_msg = {
-                            "id": msg.get("id", f"msg_{i}_{session_id}"),
-                            "role": msg.get("role", msg.get("type", "unknown")),
-                            "content": msg.get("content", ""),
-                            "timestamp": msg.get("timestamp", datetime.now().isoformat()),
-                            "type": msg.get("message_type", msg.get("type", "text")),
-                            "metadata": msg.get("metadata", {})
-                        }
-                        result.append(api_msg)
-            except Exception as e:
-                logger.warning(f"转换消息 {i} 时出错: {str(e)}")
-                continue
+            api_msg = self._message_to_api_format(msg, i, session_id)
+            if api_msg is not None:
+                result.append(api_msg)
         
         logger.info(f"使用传统方式获取到 {len(result)} 条历史消息")
         return result
     
+    def _message_to_api_format(self, msg: Any, index: int, session_id: str) -> Optional[Dict[str, Any]]:
+        """将单条状态消息转换为API格式，无法转换时返回None"""
+        try:
+            if isinstance(msg, BaseMessage):
+                # 映射消息类型到角色
+                role_mapping = {
+                    "human": "user",
+                    "ai": "assistant", 
+                    "system": "system",
+                    "tool": "tool"
+                }
+                
+                api_msg = {
+                    "id": getattr(msg, "id", None) or f"msg_{index}_{session_id}",
+                    "role": role_mapping.get(msg.type, msg.type),
+                    "content": msg.content,
+                    "timestamp": datetime.now().isoformat(),
+                    "type": "text",
+                    "metadata": {
+                        "source": "legacy_conversion",
+                        "original_type": msg.type
+                    }
+                }
+                
+                # 添加额外属性
+                if hasattr(msg, "name") and msg.name:
+                    api_msg["metadata"]["name"] = msg.name
+                if hasattr(msg, "tool_calls") and msg.tool_calls:
+                    api_msg["metadata"]["tool_calls"] = msg.tool_calls
+                
+                return api_msg
+            elif isinstance(msg, dict):
+                # 检查是否已经是API格式（来自轮次管理器）
+                if "role" in msg and msg["role"] in ["user", "assistant", "system", "tool"]:
+                    # 已经是正确的API格式，直接使用
+                    return msg
+                # 需要转换的字典格式
+                return {
+                    "id": msg.get("id", f"msg_{index}_{session_id}"),
+                    "role": msg.get("role", msg.get("type", "unknown")),
+                    "content": msg.get("content", ""),
+                    "timestamp": msg.get("timestamp", datetime.now().isoformat()),
+                    "type": msg.get("message_type", msg.get("type", "text")),
+                    "metadata": msg.get("metadata", {})
+                }
+        except Exception as e:
+            logger.warning(f"转换消息 {index} 时出错: {str(e)}")
+        return None
+    
+    @staticmethod
+    def _resolve_history_window(
+        total: int,
+        limit: Optional[int],
+        before: Optional[int],
+        after: Optional[int]
+    ) -> Tuple[int, int]:
+        """计算历史窗口的[start, end)，未指定游标时返回最新的limit条"""
+        if after is not None:
+            start = min(max(after, 0), total)
+            end = total if not limit else min(total, start + limit)
+        else:
+            end = total if before is None else min(max(before, 0), total)
+            start = 0 if not limit else max(0, end - limit)
+        return start, end
+    
+    def get_session_history_page(
+        self,
+        session_id: str,
+        limit: Optional[int] = 50,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        max_content_chars: Optional[int] = None,
+        if_none_match: Optional[str] = None,
+        source: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """按游标分页获取会话历史，只转换（必要时只读取）请求的窗口
+        
+        消息序号（index）即游标：before取序号更小的消息（向前翻页），after取序号不小于该值的消息；
+        都未指定时返回最新的limit条。会话未加载到内存时直接从PostgreSQL读取窗口，不水合完整状态。
+        
+        序号有两个空间：轮次管理器的对话记录（turns）与会话状态中的消息（messages，
+        内存、PostgreSQL快照加增量、完整加载三种读取方式编号一致）。结果中的source标明所用空间，
+        翻页时随游标传回；游标所属空间在当前进程不可用时忽略游标，返回最新窗口并置cursor_reset。
+        
+        Args:
+            session_id: 会话ID
+            limit: 窗口大小，None或0表示不限制
+            before: 向前翻页游标
+            after: 向后翻页游标
+            max_content_chars: 工具消息内容超过该长度时截断，完整内容按序号单独获取
+            if_none_match: 客户端缓存的ETag，与当前一致时不返回消息
+            source: 游标所属的序号空间（turns或messages），None表示自动选择
+            
+        Returns:
+            分页结果；会话不存在时返回None。ETag匹配时结果中not_modified为True
+            
+        Raises:
+            ValueError: source不是turns或messages
+        """
+        if source not in (None, HISTORY_SOURCE_TURNS, HISTORY_SOURCE_MESSAGES):
+            raise ValueError(f"无效的历史来源: {source}")
+        
+        catalog_entry = self.sessions.get_catalog_entry(session_id)
+        if catalog_entry is None:
+            logger.warning(f"会话不存在: {session_id}")
+            return None
+        
+        # 轮次管理器有对话记录时默认使用turns空间，客户端可以显式要求messages空间
+        turn_manager = self.turn_managers.get(session_id)
+        has_turns = turn_manager is not None and turn_manager.get_api_history_length() > 0
+        resolved_source = (
+            HISTORY_SOURCE_TURNS if has_turns and source != HISTORY_SOURCE_MESSAGES
+            else HISTORY_SOURCE_MESSAGES
+        )
+        cursor_reset = False
+        if source is not None and source != resolved_source and (before is not None or after is not None):
+            # 游标属于另一个序号空间，在当前空间中没有意义
+            before = after = None
+            cursor_reset = True
+        
+        # ETag只由目录信息、序号空间和请求参数决定，匹配时无需读取任何消息
+        turn_count = len(turn_manager.completed_turns) if turn_manager else 0
+        etag_source = (
+            f"{session_id}:{resolved_source}:{catalog_entry.get('last_updated')}:"
+            f"{catalog_entry.get('message_count')}:{turn_count}:"
+            f"{limit}:{before}:{after}:{max_content_chars}:{cursor_reset}"
+        )
+        etag = f'W/"{hashlib.sha1(etag_source.encode("utf-8")).hexdigest()}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return {"session_id": session_id, "etag": etag, "source": resolved_source, "not_modified": True}
+        
+        window = None
+        
+        # 1. 轮次管理器中的完整对话记录
+        if resolved_source == HISTORY_SOURCE_TURNS:
+            total = turn_manager.get_api_history_length()
+            start, end = self._resolve_history_window(total, limit, before, after)
+            window = (total, start, turn_manager.get_api_history_window(start, end))
+        
+        # 2. 已加载的会话：只转换窗口内的消息
+        elif self.sessions.is_loaded(session_id):
+            messages = self.sessions[session_id]["state"].get("messages", [])
+            total = len(messages)
+            start, end = self._resolve_history_window(total, limit, before, after)
+            window = (total, start, [
+                self._message_to_api_format(msg, start + offset, session_id)
+                for offset, msg in enumerate(messages[start:end])
+            ])
+        
+        # 3. 未加载的会话：从PostgreSQL只读取窗口
+        elif self.session_persistence_enabled and self.postgres_session_manager:
+            page = self.postgres_session_manager.load_session_messages(
+                session_id, limit=limit or None, before=before, after=after
+            )
+            if page is not None:
+                codec = get_state_codec()
+                window = (page["total"], page["start"], [
+                    self._message_to_api_format(codec.restore_message(msg), page["start"] + offset, session_id)
+                    for offset, msg in enumerate(page["messages"])
+                ])
+        
+        # 4. 回退：加载完整会话
+        if window is None:
+            session = self.sessions.get(session_id)
+            if not session:
+                return None
+            messages = session["state"].get("messages", [])
+            total = len(messages)
+            start, end = self._resolve_history_window(total, limit, before, after)
+            window = (total, start, [
+                self._message_to_api_format(msg, start + offset, session_id)
+                for offset, msg in enumerate(messages[start:end])
+            ])
+        
+        total, start, api_messages = window
+        end = start + len(api_messages)
+        
+        result_messages = []
+        for offset, api_msg in enumerate(api_messages):
+            if api_msg is None:
+                continue
+            api_msg = {**api_msg, "index": start + offset}
+            content = api_msg.get("content")
+            if (
+                max_content_chars
+                and api_msg.get("role") == "tool"
+                and isinstance(content, str)
+                and len(content) > max_content_chars
+            ):
+                api_msg["content"] = content[:max_content_chars]
+                api_msg["metadata"] = {
+                    **(api_msg.get("metadata") or {}),
+                    "truncated": True,
+                    "content_length": len(content)
+                }
+            result_messages.append(api_msg)
+        
+        return {
+            "session_id": session_id,
+            "messages": result_messages,
+            "total": total,
+            "start": start,
+            "end": end,
+            "has_more_before": start > 0,
+            "has_more_after": end < total,
+            "source": resolved_source,
+            "cursor_reset": cursor_reset,
+            "etag": etag,
+            "not_modified": False
+        }
+    
     def handle_error(self, error: Exception, session_id: Optional[str]) -> Tuple[IsotopeSystemState, str]:
         """处理异常
         
@@ -1222,12 +1443,18 @@ class IsotopeEngine:
         
         return updated_state, error_message
     
-    def save_session_state(self, session_id: str, file_path: Optional[str] = None) -> bool:
+    def save_session_state(
+        self,
+        session_id: str,
+        file_path: Optional[str] = None,
+        state: Optional[IsotopeSystemState] = None
+    ) -> bool:
         """保存会话状态到检查点
         
         Args:
             session_id: 会话ID
             file_path: 文件路径（可选，如果不提供则使用默认路径）
+            state: 要保存的状态快照（可选，如果不提供则使用会话当前状态）
             
         Returns:
             保存是否成功
@@ -1238,8 +1465,9 @@ class IsotopeEngine:
                 logger.warning(f"尝试保存不存在的会话: {session_id}")
                 return False
             
-            session_info = self.sessions[session_id]
-            state = session_info.get("state")
+            if state is None:
+                session_info = self.sessions[session_id]
+                state = session_info.get("state")
             
             if state is None:
                 logger.warning(f"会话 {session_id} 没有状态数据")
@@ -1279,32 +1507,7 @@ class IsotopeEngine:
             
             # 2. 保存到文件检查点（作为备份）
             try:
-                # 确保检查点目录存在
-                os.makedirs(self.checkpoint_dir, exist_ok=True)
-                
-                # 确定文件路径
-                if file_path is None:
-                    file_path = os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
-                
-                # 准备序列化的状态
-                serializable_state = self._prepare_state_for_serialization(state)
-                
-                # 添加元数据
-                checkpoint_data = {
-                    "session_id": session_id,
-                    "timestamp": datetime.now().isoformat(),
-                    "state": serializable_state,
-                    "metadata": {
-                        "engine_version": "2.0",
-                        "checkpoint_type": "interrupt_recovery",
-                        "created_by": "engine.save_session_state"
-                    }
-                }
-                
-                # 保存到文件
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(checkpoint_data, f, indent=2, ensure_ascii=False)
-                
+                file_path = self._write_session_checkpoint_file(session_id, state, file_path)
                 logger.info(f"会话状态已保存到文件: {file_path}")
                 saved_any = True
                 
@@ -1340,110 +1543,118 @@ class IsotopeEngine:
             logger.error(f"错误详情: {traceback.format_exc()}")
             return False
     
-    def _prepare_state_for_serialization(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """将状态转换为可序列化格式
+    def _write_session_checkpoint_file(
+        self,
+        session_id: str,
+        state: IsotopeSystemState,
+        file_path: Optional[str] = None
+    ) -> str:
+        """将会话状态写入文件检查点
+        
+        使用默认路径时，若已有快照则只向增量文件追加新增内容，
+        增量数达到阈值或已持久化内容被修改时重写完整快照。
+        同一会话的增量计算、写入与记录在会话持久化锁内完成。
         
         Args:
-            state: 系统状态
+            session_id: 会话ID
+            state: 会话状态
+            file_path: 文件路径（可选，如果不提供则使用默认路径）
             
         Returns:
-            可序列化的状态字典
+            写入的文件路径
         """
-        if state is None:
-            return {}
-        
-        # 创建状态的深拷贝
-        serializable_state = {}
+        with self.session_delta_tracker.session_lock(session_id):
+            # 确保检查点目录存在
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            
+            # 确定文件路径
+            track_deltas = file_path is None
+            if track_deltas:
+                file_path = os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
+                delta = self.session_delta_tracker.compute_delta(session_id, state)
+                if delta is not None and os.path.exists(file_path):
+                    self._append_session_delta(session_id, state, delta)
+                    return file_path
+            
+            version = self.session_delta_tracker.get_version(session_id) + 1
+            
+            # 添加元数据（状态由编解码器在编码时按类型转换）
+            checkpoint_data = {
+                "session_id": session_id,
+                "timestamp": datetime.now().isoformat(),
+                "version": version,
+                "state": state if state is not None else {},
+                "metadata": {
+                    "engine_version": "2.0",
+                    "checkpoint_type": "interrupt_recovery",
+                    "created_by": "engine.save_session_state"
+                }
+            }
+            
+            # 原子写入文件（临时文件 + 重命名）
+            atomic_write_bytes(file_path, get_state_codec().dumps_json(checkpoint_data, indent=True))
+            
+            if track_deltas:
+                # 快照已包含全部内容，旧增量不再需要
+                delta_path = self._session_delta_file_path(session_id)
+                if os.path.exists(delta_path):
+                    os.remove(delta_path)
+                self.session_delta_tracker.mark_snapshot(session_id, state, version)
+            
+            return file_path
+    
+    def _session_delta_file_path(self, session_id: str) -> str:
+        """会话增量文件路径（每行一个增量）"""
+        return os.path.join(self.checkpoint_dir, f"session_{session_id}.delta.jsonl")
+    
+    def _append_session_delta(self, session_id: str, state: IsotopeSystemState, delta: Dict[str, Any]) -> None:
+        """向会话增量文件追加一行增量"""
+        record = {
+            "version": delta["version"],
+            "timestamp": datetime.now().isoformat(),
+            "appends": delta["appends"],
+            "fields": delta["fields"]
+        }
+        with open(self._session_delta_file_path(session_id), 'ab') as f:
+            f.write(get_state_codec().dumps_json(record) + b"\n")
         
-        # 递归处理每个键值对
-        for key, value in state.items():
-            serializable_state[key] = self._make_serializable(value)
+        self.session_delta_tracker.mark_delta(session_id, state, delta)
+        logger.debug(f"会话 {session_id} 增量已追加（版本 {delta['version']}）")
+    
+    def _read_session_deltas(self, session_id: str, snapshot_version: int) -> List[Dict[str, Any]]:
+        """读取快照版本之后的增量，忽略写入中断导致的不完整行"""
+        delta_path = self._session_delta_file_path(session_id)
+        if not os.path.exists(delta_path):
+            return []
         
-        return serializable_state
-
-    def _make_serializable(self, obj):
-        """递归地将对象转换为可序列化格式
+        deltas = []
+        with open(delta_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"会话 {session_id} 增量文件存在不完整的行，已跳过")
+                    continue
+                if record.get("version", 0) > snapshot_version:
+                    deltas.append(record)
+        deltas.sort(key=lambda record: record["version"])
+        return deltas
+    
+    def _prepare_state_for_serialization(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """将状态转换为可序列化格式
         
         Args:
-            obj: 任意对象
+            state: 系统状态
             
         Returns:
-            可序列化的对象
+            可序列化的状态字典
         """
-        # 处理None
-        if obj is None:
-            return None
-        
-        # 处理基本类型
-        if isinstance(obj, (str, int, float, bool)):
-            return obj
-        
-        # 跳过不可序列化的已知类型
-        from app.core.memory.store import MemoryStore
-        if isinstance(obj, MemoryStore):
-            return "<MemoryStore实例，已跳过序列化>"
+        if state is None:
+            return {}
         
-        # 处理Gradio Image对象
-        try:
-            import gradio as gr
-            if isinstance(obj, gr.Image):
-                # 如果是Gradio图片对象，尝试保存图片路径
-                if hasattr(obj, "value") and obj.value:
-                    image_path = str(obj.value)
-                    return f"__IMAGE_PATH__:{image_path}"
-                return "<gradio.Image对象，无法获取路径>"
-        except ImportError:
-            pass
-        
-        # 检查字符串是否包含图片对象描述
-        if isinstance(obj, str) and "<gradio.components.image.Image object at" in obj:
-            # 尝试从字符串中提取图片路径
-            import re
-            #不要使用绝对路径，要兼容Windows和Linux路径,程序路径在/xuzhiyao/code/the_agent/
-            path_match = re.search(r'[\'"](?:[a-zA-Z]:\\|/)?(?:[\w\-\.]+[/\\])*[\w\-\.]+\.(?:jpg|jpeg|png|gif|bmp|webp)[\'"]', obj)
-            if path_match:
-                image_path = path_match.group(0)
-                return f"__IMAGE_PATH__:{image_path}"
-        
-        # 处理消息对象
-        if isinstance(obj, BaseMessage):
-            msg_dict = {
-                "type": obj.type,
-                "content": self._make_serializable(obj.content)  # 递归处理内容
-            }
-            # 添加额外属性
-            if hasattr(obj, "name") and obj.name:
-                msg_dict["name"] = obj.name
-            if hasattr(obj, "tool_calls") and obj.tool_calls:
-                msg_dict["tool_calls"] = obj.tool_calls
-            if hasattr(obj, "additional_kwargs") and obj.additional_kwargs:
-                msg_dict["additional_kwargs"] = self._make_serializable(obj.additional_kwargs)
-            return msg_dict
-        
-        # 处理列表
-        if isinstance(obj, list):
-            return [self._make_serializable(item) for item in obj]
-        
-        # 处理字典
-        if isinstance(obj, dict):
-            # 特殊处理字典中的图片路径
-            if "image_path" in obj and isinstance(obj.get("content"), str) and "<gradio.components.image.Image object at" in obj.get("content"):
-                # 已经处理过的图片消息，保留图片路径
-                serialized_dict = {k: self._make_serializable(v) for k, v in obj.items()}
-                serialized_dict["content"] = f"__IMAGE_PATH__:{obj['image_path']}"
-                return serialized_dict
-            return {k: self._make_serializable(v) for k, v in obj.items()}
-        
-        # 处理其他类型
-        try:
-            # 尝试转换为字典
-            if hasattr(obj, "__dict__"):
-                return self._make_serializable(obj.__dict__)
-            # 尝试转换为字符串
-            return str(obj)
-        except:
-            # 如果无法序列化，则转换为字符串
-            return f"<不可序列化的对象: {type(obj).__name__}>"
+        return get_state_codec().to_serializable(state)
     
     def load_session_state(self, file_path: str) -> Optional[str]:
         """从文件加载会话状态
@@ -1618,7 +1829,8 @@ class IsotopeEngine:
         message: str, 
         session_id: Optional[str] = None,
         stream_mode: Union[str, List[str]] = "all",
-        manage_history: bool = True  # 添加历史管理参数
+        manage_history: bool = True,  # 添加历史管理参数
+        include_state: bool = False
     ) -> Generator[Dict[str, Any], None, None]:
         """处理用户消息并流式返回结果
         
@@ -1627,30 +1839,143 @@ class IsotopeEngine:
             session_id: 会话ID，如果不提供则创建新会话
             stream_mode: 流模式，可以是单一模式(str)或多种模式组合
             manage_history: 是否管理对话历史
+            include_state: 是否推送状态（以state_diff差量形式）
             
         Yields:
             流式消息，格式为{"role": "", "content": ""}
         """
-        # 标准化流模式参数
-        if isinstance(stream_mode, str):
-            if stream_mode.lower() == "all":
-                modes = ["messages", "custom", "updates", "values", "events"]
-            elif "," in stream_mode:
-                modes = [mode.strip() for mode in stream_mode.split(",")]
-            else:
-                modes = [stream_mode]
-        elif isinstance(stream_mode, list):
-            modes = stream_mode
-        else:
-            modes = ["messages", "custom", "updates", "values", "events"]
+        # 确保用户消息非空
+        if not message or message.strip() == "":
+            yield {"role": "system", "content": "用户消息不能为空"}
+            return
+        
+        turn = self._prepare_streaming_turn(message, session_id, stream_mode, manage_history, include_state)
+        session_id = turn["session_id"]
+        # 状态差量按流维护上一快照，需要独立的处理器实例
+        streamer = self._create_turn_streamer(turn) if include_state else self.streamer
+        
+        try:
+            logger.info(f"开始流式处理用户消息: {message[:30]}...")
             
-        logger.info(f"流式处理模式: {modes}")
+            # 使用stream方法执行工作流图
+            stream_generator = self.workflow_graph.stream(
+                turn["state"],
+                config=self.graph_builder.create_thread_config(session_id),
+                stream_mode=turn["modes"]
+            )
             
-        # 确保用户消息非空
+            # 根据环境变量设置调试模式
+            if os.environ.get("ISOTOPE_DEBUG", "0") == "1":
+                streamer.debug_mode = True
+                logger.info("开启详细流处理日志")
+            
+            # 使用LangGraphStreamer处理流，返回格式化消息
+            for message_item in streamer.process_stream(stream_generator):
+                self._absorb_streaming_item(turn, message_item)
+                # 产生消息
+                yield message_item
+            
+            self._finalize_streaming_turn(turn)
+            
+        except Exception as e:
+            # 错误处理
+            error_msg = f"流处理错误: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            yield {"role": "system", "content": error_msg}
+            
+            self._recover_streaming_turn(turn, e)
+    
+    async def aprocess_message_streaming(
+        self,
+        message: str,
+        session_id: Optional[str] = None,
+        stream_mode: Union[str, List[str]] = "all",
+        manage_history: bool = True,
+        include_state: bool = False
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """处理用户消息并异步流式返回结果
+        
+        基于CompiledGraph.astream的原生异步版本，产出的消息格式与
+        process_message_streaming完全一致。流式阶段不占用线程池线程；
+        历史压缩、记忆检索/保存等阻塞步骤通过asyncio.to_thread执行。
+        调用方关闭生成器（如客户端断开）时，图执行随之取消，已生成的
+        部分回复仍会写入会话历史（写入过程受asyncio.shield保护，不会被再次取消打断）。
+        
+        Args:
+            message: 用户消息内容
+            session_id: 会话ID，如果不提供则创建新会话
+            stream_mode: 流模式，可以是单一模式(str)或多种模式组合
+            manage_history: 是否管理对话历史
+            include_state: 是否推送状态（以state_diff差量形式）
+            
+        Yields:
+            流式消息，格式为{"role": "", "content": ""}
+        """
         if not message or message.strip() == "":
             yield {"role": "system", "content": "用户消息不能为空"}
             return
         
+        turn = await asyncio.to_thread(
+            self._prepare_streaming_turn, message, session_id, stream_mode, manage_history, include_state
+        )
+        session_id = turn["session_id"]
+        
+        # 每个流使用独立的处理器实例，避免并发流之间共享节点计时等状态
+        streamer = self._create_turn_streamer(turn)
+        if os.environ.get("ISOTOPE_DEBUG", "0") == "1":
+            streamer.debug_mode = True
+        
+        try:
+            logger.info(f"开始异步流式处理用户消息: {message[:30]}...")
+            
+            stream_iterator = self.workflow_graph.astream(
+                turn["state"],
+                config=self.graph_builder.create_thread_config(session_id),
+                stream_mode=turn["modes"]
+            )
+            
+            async for message_item in streamer.aprocess_stream(stream_iterator):
+                self._absorb_streaming_item(turn, message_item)
+                yield message_item
+            
+            turn["finished"] = True
+            await asyncio.shield(asyncio.to_thread(self._finalize_streaming_turn, turn))
+            
+        except Exception as e:
+            turn["finished"] = True
+            error_msg = f"流处理错误: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            yield {"role": "system", "content": error_msg}
+            
+            await asyncio.shield(asyncio.to_thread(self._recover_streaming_turn, turn, e))
+        finally:
+            if not turn["finished"]:
+                # 客户端断开或任务被取消：保留已生成的部分回复，跳过记忆写入。
+                # 保存在工作线程中执行，不阻塞事件循环；shield保证再次取消时保存仍会完成
+                logger.info(f"会话 {session_id} 的流式处理被中断，已产出 {turn['yielded_count']} 个响应")
+                turn["finished"] = True
+                await asyncio.shield(asyncio.to_thread(self._finalize_streaming_turn, turn, save_memory=False))
+    
+    def _prepare_streaming_turn(
+        self,
+        message: str,
+        session_id: Optional[str],
+        stream_mode: Union[str, List[str]],
+        manage_history: bool,
+        include_state: bool = False
+    ) -> Dict[str, Any]:
+        """流式处理前的准备工作（同步/异步流式处理共用）
+        
+        规划流模式、获取会话状态、按token预算压缩历史、记录用户轮次
+        并追加用户消息。
+        
+        Returns:
+            本轮流式处理的上下文，供_absorb_streaming_item/_finalize_streaming_turn使用
+        """
+        # 只订阅客户端需要的流模式：values仅在需要状态时订阅
+        modes = plan_stream_modes(stream_mode, include_state=include_state)
+        logger.info(f"流式处理模式: {modes}")
+        
         # 创建或获取会话
         if not session_id:
             session_id = self.create_session()
@@ -1664,44 +1989,43 @@ class IsotopeEngine:
             logger.info(f"为会话创建初始状态: {session_id}")
             state = self._create_initial_state(session_id)
         
-        # 在处理消息前，检查是否需要管理对话历史
+        # 获取或创建对话轮次管理器
+        turn_manager = self._get_turn_manager(session_id)
+        
+        # 在处理消息前，按token预算增量压缩对话历史
         if manage_history:
-            messages = state.get("messages", [])
+            history_config = self.config.get("memory", {}).get("history", {})
+            metadata = state.setdefault("metadata", {})
             
-            # 检查是否需要总结/删减历史
-            if HistoryManager.should_summarize(messages):
-                # 总结历史对话
-                summary = HistoryManager.summarize_messages(messages, self.llm)
-                
-                # 添加总结为系统消息，并删减历史
-                to_remove = HistoryManager.trim_messages(messages, max_messages=8)
-                summary_message = SystemMessage(content=f"对话历史总结: {summary}")
-                
-                # 更新状态
-                if to_remove:
-                    for msg in to_remove:
-                        if isinstance(msg, RemoveMessage) and "messages" in state:
-                            state["messages"] = [m for m in state["messages"] 
-                                                if not (hasattr(m, "id") and m.id == msg.id)]
-                
-                # 添加总结消息
-                if "messages" in state:
-                    state["messages"].append(summary_message)
+            compaction = HistoryManager.compact_history(
+                state.get("messages", []),
+                llm=self.llm,
+                running_summary=metadata.get("history_summary"),
+                max_tokens=history_config.get("max_tokens", 6000),
+                target_tokens=history_config.get("target_tokens", 4000),
+                keep_last_n=history_config.get("keep_last_n", 4)
+            )
+            
+            if compaction.compacted:
+                state["messages"] = compaction.messages
+                metadata["history_summary"] = compaction.summary
+                turn_manager.mark_turns_summarized(compaction.evicted_ids)
                 
                 # 保存到长期记忆
                 self.add_to_memory(
                     session_id=session_id,
-                    content=summary,
+                    content=compaction.summary,
                     memory_type="episodic"
                 )
                 
-                logger.info(f"会话 {session_id} 历史已总结和优化")
-        
-        # 获取或创建对话轮次管理器
-        if session_id not in self.turn_managers:
-            self.turn_managers[session_id] = create_conversation_turn_manager(session_id)
+                logger.info(f"会话 {session_id} 历史已压缩: 驱逐 {compaction.evicted_count} 条消息")
         
-        turn_manager = self.turn_managers[session_id]
+        # 记录本轮开始前的历史视图边界，完成时只追加本轮新增的轮次消息
+        history_base = {
+            "history_length": turn_manager.get_history_length(),
+            "last_turn_id": turn_manager.get_last_history_id(),
+            "compacted": manage_history and compaction.compacted
+        }
         
         # 记录用户输入轮次
         user_turn_id = turn_manager.start_user_turn(message)
@@ -1721,158 +2045,218 @@ class IsotopeEngine:
         # 更新状态消息
         if "messages" not in state:
             state["messages"] = []
+        history_base["message_count"] = len(state["messages"])
         state["messages"].append(user_message)
         
-        # 保存初始状态用于后续更新
-        latest_state = copy.deepcopy(state)
+        return {
+            "message": message,
+            "session_id": session_id,
+            "modes": modes,
+            "state": state,
+            # 保存初始状态用于后续更新（写时复制分支：消息等内容与会话状态共享，不做深拷贝）
+            "latest_state": StateManager.fork_state(state),
+            "turn_manager": turn_manager,
+            "history_base": history_base,
+            "include_state": include_state,
+            "yielded_count": 0,
+            "last_messages": [],
+            "current_ai_message": None,
+            "assistant_turn_started": False,
+            # 跟踪工具执行结果，确保能够向前端传递
+            "tool_executions": [],
+            "finished": False
+        }
+    
+    def _create_turn_streamer(self, turn: Dict[str, Any]) -> LangGraphStreamer:
+        """为单次流式处理创建独立的流处理器"""
+        ui_config = self.config.get("ui", {})
+        return LangGraphStreamer(
+            stream_modes=turn["modes"],
+            session_id=turn["session_id"],
+            config={
+                "state_diff": turn["include_state"],
+                "state_keys": ui_config.get("state_stream_keys")
+            }
+        )
+    
+    def _absorb_streaming_item(self, turn: Dict[str, Any], message_item: Any) -> None:
+        """将一条流式消息记入轮次管理器和会话状态
         
-        try:
-            logger.info(f"开始流式处理用户消息: {message[:30]}...")
-            
-            # 使用stream方法执行工作流图
-            stream_generator = self.workflow_graph.stream(
-                state,
-                config=self.graph_builder.create_thread_config(session_id),
-                stream_mode=modes
+        每个token都会经过这里，调试日志只在DEBUG级别开启时才格式化。
+        """
+        turn["yielded_count"] += 1
+        turn_manager = turn["turn_manager"]
+        latest_state = turn["latest_state"]
+        
+        # 处理消息并更新状态
+        if not message_item or not isinstance(message_item, dict):
+            return
+        
+        role = message_item.get("role")
+        content = message_item.get("content")
+        source = message_item.get("source", "unknown")
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[DEBUG] 收到消息项 #{turn['yielded_count']}: role='{role}', source={source}, content_length={len(str(content)) if content else 0}")
+        
+        if not (role and content):
+            return
+        
+        # 根据角色创建相应的消息对象
+        if role == "assistant":
+            # 开始助手轮次（如果还没有开始）
+            if not turn["assistant_turn_started"]:
+                turn_manager.start_assistant_turn(source=source)
+                turn["assistant_turn_started"] = True
+                logger.info(f"助手回复轮次开始")
+            
+            # 添加内容到轮次管理器
+            turn_manager.add_assistant_content(content, message_item)
+            
+            # 传统状态管理（保持向后兼容）
+            if turn["current_ai_message"] is None:
+                turn["current_ai_message"] = AIMessage(content=content)
+                latest_state["messages"].append(turn["current_ai_message"])
+            else:
+                turn["current_ai_message"].content = content
+            turn["last_messages"].append(message_item)
+        elif role == "system":
+            system_message = SystemMessage(content=content)
+            latest_state["messages"].append(system_message)
+        elif role == "tool":
+            tool_message = ToolMessage(
+                content=content,
+                tool_call_id=message_item.get("tool_call_id", ""),
+                name=message_item.get("name", "")
             )
+            latest_state["messages"].append(tool_message)
             
-            # 根据环境变量设置调试模式
-            if os.environ.get("ISOTOPE_DEBUG", "0") == "1":
-                self.streamer.debug_mode = True
-                logger.info("开启详细流处理日志")
-            
-            # 临时启用调试日志来排查问题
-            logger.setLevel(logging.DEBUG)
-            logging.getLogger("app.ui.streaming").setLevel(logging.DEBUG)
-            logger.info("临时启用调试级别日志以排查流式输出问题")
-            
-            # 使用LangGraphStreamer处理流，返回格式化消息
-            yielded_count = 0
-            last_messages = []
-            current_ai_message = None
-            assistant_turn_started = False
-            
-            # 跟踪工具执行结果，确保能够向前端传递
-            tool_executions = []
-            
-            for message_item in self.streamer.process_stream(stream_generator):
-                yielded_count += 1            
-                
-                # 调试：记录每个消息项的结构
-                logger.debug(f"[DEBUG] 收到消息项 #{yielded_count}: type={type(message_item)}, keys={list(message_item.keys()) if isinstance(message_item, dict) else 'N/A'}")
-                if isinstance(message_item, dict):
-                    logger.debug(f"[DEBUG] 消息内容: role={message_item.get('role')}, content_length={len(str(message_item.get('content', '')))}, has_content={bool(message_item.get('content'))}")
-                
-                # 处理消息并更新状态
-                if message_item and isinstance(message_item, dict):
-                    role = message_item.get("role")
-                    content = message_item.get("content")
-                    source = message_item.get("source", "unknown")
-                    
-                    # 调试：记录角色和内容
-                    logger.debug(f"[DEBUG] 提取字段: role='{role}', content_exists={content is not None}, content_length={len(str(content)) if content else 0}")
-                    
-                    if role and content:
-                        logger.info(f"✅ 有效消息: role={role}, content={str(content)[:100]}...")
-                        
-                        # 根据角色创建相应的消息对象
-                        if role == "assistant":
-                            # 开始助手轮次（如果还没有开始）
-                            if not assistant_turn_started:
-                                turn_manager.start_assistant_turn(source=source)
-                                assistant_turn_started = True
-                                logger.info(f"助手回复轮次开始")
-                            
-                            # 添加内容到轮次管理器
-                            turn_manager.add_assistant_content(content, message_item)
-                            
-                            # 传统状态管理（保持向后兼容）
-                            if current_ai_message is None:
-                                current_ai_message = AIMessage(content=content)
-                                latest_state["messages"].append(current_ai_message)
-                            else:
-                                        current_ai_message.content = content
-                            last_messages.append(message_item)
-                        elif role == "system":
-                            system_message = SystemMessage(content=content)
-                            latest_state["messages"].append(system_message)
-                        elif role == "tool":
-                            tool_message = ToolMessage(
-                                content=content,
-                                tool_call_id=message_item.get("tool_call_id", ""),
-                                name=message_item.get("name", "")
-                            )
-                            latest_state["messages"].append(tool_message)
-                            
-                            # 记录工具执行结果
-                            tool_executions.append(message_item)
-                    else:
-                        logger.warning(f"⚠️ 跳过消息: role='{role}', content_exists={content is not None}")
-                logger.info(f"打包后message_item: {message_item}")
-                # 产生消息
-                yield message_item
-            
-            logger.info(f"流处理完成，共生成 {yielded_count} 个响应")
-            
-            # 完成助手轮次
-            if assistant_turn_started:
+            # 记录工具执行结果
+            turn["tool_executions"].append(message_item)
+    
+    def _finalize_streaming_turn(self, turn: Dict[str, Any], save_memory: bool = True) -> None:
+        """流式处理结束后完成助手轮次、更新会话并保存记忆
+        
+        Args:
+            turn: _prepare_streaming_turn返回的上下文
+            save_memory: 是否将本轮对话写入长期记忆（流被中断时跳过）
+        """
+        session_id = turn["session_id"]
+        message = turn["message"]
+        turn_manager = turn["turn_manager"]
+        latest_state = turn["latest_state"]
+        
+        logger.info(f"流处理完成，共生成 {turn['yielded_count']} 个响应")
+        
+        # 完成助手轮次
+        if turn["assistant_turn_started"]:
+            completed_turn_id = turn_manager.complete_assistant_turn()
+            logger.info(f"助手轮次完成: {completed_turn_id}")
+        else:
+            # 关键修复：即使没有检测到assistant消息，也要尝试完成潜在的轮次
+            if turn_manager.current_assistant_turn:
+                logger.warning("检测到未完成的助手轮次，强制完成")
                 completed_turn_id = turn_manager.complete_assistant_turn()
-                logger.info(f"助手轮次完成: {completed_turn_id}")
-            else:
-                # 关键修复：即使没有检测到assistant消息，也要尝试完成潜在的轮次
-                if turn_manager.current_assistant_turn:
-                    logger.warning("检测到未完成的助手轮次，强制完成")
-                    completed_turn_id = turn_manager.complete_assistant_turn()
-                    logger.info(f"强制完成助手轮次: {completed_turn_id}")
-            
-            # 更新会话状态 - 修复：正确处理轮次管理器的历史记录
-            if session_id in self.sessions:
-                # 关键修复：从轮次管理器获取LangChain格式的完整对话历史，而不是API格式
-                complete_conversation = turn_manager.get_conversation_history()
-                latest_state["messages"] = complete_conversation
-                
-                logger.info(f"从轮次管理器更新会话历史: {len(complete_conversation)} 条消息")
-                
-                self.sessions[session_id]["state"] = latest_state
-                self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
+                logger.info(f"强制完成助手轮次: {completed_turn_id}")
+        
+        # 更新会话状态 - 修复：正确处理轮次管理器的历史记录
+        if session_id not in self.sessions:
+            return
+        
+        # 关键修复：会话历史使用轮次管理器中LangChain格式的对话记录，而不是API格式
+        self._sync_turn_history(turn, latest_state)
+        
+        self.sessions[session_id]["state"] = latest_state
+        self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
+        self._publish_shared_session(session_id)
+        
+        # 检查是否需要自动保存（后台写入，不阻塞流式响应）
+        self._maybe_auto_save_session(session_id, latest_state)
+        
+        if not save_memory:
+            return
+        
+        # 保存对话内容到记忆
+        try:
+            # 获取最后一条完整的AI消息用于保存
+            if turn_manager.completed_turns:
+                last_turn = turn_manager.completed_turns[-1]
+                last_message = ""
+                if hasattr(last_turn, 'complete_content') and last_turn.complete_content:
+                    last_message = last_turn.complete_content
+                # 保存完整对话
+                memory_id = self.add_to_memory(
+                    session_id=session_id,
+                    content=f"用户: {message}\n助手: {last_message}",
+                    memory_type="semantic"
+                )
+                logger.info(f"已保存对话到记忆，ID: {memory_id}")
                 
-                # 保存对话内容到记忆
-                try:
-                    # 获取最后一条完整的AI消息用于保存
-                    if turn_manager.completed_turns:
-                        last_turn = turn_manager.completed_turns[-1]
-                        if hasattr(last_turn, 'complete_content') and last_turn.complete_content:
-                            last_message = last_turn.complete_content
-                        # 保存完整对话
-                        memory_id = self.add_to_memory(
-                            session_id=session_id,
-                            content=f"用户: {message}\n助手: {last_message}",
-                            memory_type="semantic"
-                        )
-                        logger.info(f"已保存对话到记忆，ID: {memory_id}")
-                        
-                        # 如果对话内容较长，保存一个摘要版本方便检索
-                        if len(message) > 20 and len(last_message) > 100:
-                            summary_id = self.add_to_memory(
-                                session_id=session_id,
-                                content=f"用户问题: {message}\n回答要点: {last_message[:200]}",
-                                memory_type="semantic"
-                            )
-                            logger.info(f"已保存对话摘要到记忆，ID: {summary_id}")
-                except Exception as mem_error:
-                    logger.error(f"保存对话记忆失败: {str(mem_error)}")
-            
-        except Exception as e:
-            # 错误处理
-            error_msg = f"流处理错误: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            yield {"role": "system", "content": error_msg}
-            
-            # 尝试保留会话状态
-            if session_id in self.sessions:
-                self.sessions[session_id]["state"] = latest_state
-                self.sessions[session_id]["last_error"] = str(e)
-                self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
+                # 如果对话内容较长，保存一个摘要版本方便检索
+                if len(message) > 20 and len(last_message) > 100:
+                    summary_id = self.add_to_memory(
+                        session_id=session_id,
+                        content=f"用户问题: {message}\n回答要点: {last_message[:200]}",
+                        memory_type="semantic"
+                    )
+                    logger.info(f"已保存对话摘要到记忆，ID: {summary_id}")
+        except Exception as mem_error:
+            logger.error(f"保存对话记忆失败: {str(mem_error)}")
+    
+    def _sync_turn_history(self, turn: Dict[str, Any], latest_state: IsotopeSystemState) -> None:
+        """用轮次管理器的对话记录更新会话消息
+        
+        本轮开始前的消息与轮次历史一致时，只把本轮流式过程中追加的临时消息替换为
+        本轮新增轮次的消息；本轮前发生过历史压缩或两者不一致时重建完整消息列表。
+        """
+        turn_manager = turn["turn_manager"]
+        history_summary = latest_state.get("metadata", {}).get("history_summary")
+        messages = latest_state.get("messages")
+        base = turn.get("history_base")
+        
+        if base is not None and not base["compacted"] and messages is not None:
+            new_messages = turn_manager.get_history_after(base["last_turn_id"])
+            prefix_count = base["history_length"] + (1 if history_summary else 0)
+            if (
+                new_messages is not None
+                and base["message_count"] == prefix_count
+                and turn_manager.get_history_length() == base["history_length"] + len(new_messages)
+                and self._history_prefix_matches(messages, prefix_count, base["last_turn_id"], history_summary)
+            ):
+                del messages[prefix_count:]
+                messages.extend(new_messages)
+                logger.info(f"从轮次管理器追加本轮对话: {len(new_messages)} 条消息，共 {len(messages)} 条")
+                return
+        
+        complete_conversation = turn_manager.get_conversation_history()
+        if history_summary:
+            complete_conversation.insert(0, HistoryManager.build_summary_message(history_summary))
+        latest_state["messages"] = complete_conversation
+        logger.info(f"从轮次管理器重建会话历史: {len(complete_conversation)} 条消息")
+    
+    @staticmethod
+    def _history_prefix_matches(
+        messages: List[Any],
+        prefix_count: int,
+        last_turn_id: Optional[str],
+        history_summary: Optional[str]
+    ) -> bool:
+        """检查本轮之前的消息与轮次历史的边界是否一致（只比较首尾两条消息的ID）"""
+        if len(messages) < prefix_count:
+            return False
+        if history_summary and getattr(messages[0], "id", None) != HISTORY_SUMMARY_MESSAGE_ID:
+            return False
+        if last_turn_id is not None and getattr(messages[prefix_count - 1], "id", None) != last_turn_id:
+            return False
+        return True
+    
+    def _recover_streaming_turn(self, turn: Dict[str, Any], error: Exception) -> None:
+        """流式处理出错时尝试保留会话状态"""
+        session_id = turn["session_id"]
+        if session_id in self.sessions:
+            self.sessions[session_id]["state"] = turn["latest_state"]
+            self.sessions[session_id]["last_error"] = str(error)
+            self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
     
     def _is_image_result(self, content: str, tool_name: str) -> bool:
         """检查工具结果是否包含图片
@@ -2005,6 +2389,9 @@ class IsotopeEngine:
         try:
             # 1. 从内存中删除会话
             del self.sessions[session_id]
+            self.turn_managers.pop(session_id, None)
+            if self.shared_state is not None:
+                self.shared_state.sessions.delete_session(session_id)
             logger.info(f"从内存中删除会话: {session_id}")
             
             # 2. 如果启用了PostgreSQL会话持久化，也从数据库中删除
@@ -2018,12 +2405,16 @@ class IsotopeEngine:
                 except Exception as e:
                     logger.error(f"从PostgreSQL删除会话时出错: {str(e)}")
             
-            # 3. 删除文件检查点（如果存在）
+            # 3. 删除文件检查点及增量文件（如果存在）
             try:
-                checkpoint_file = os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
-                if os.path.exists(checkpoint_file):
-                    os.remove(checkpoint_file)
-                    logger.info(f"删除检查点文件: {checkpoint_file}")
+                self.session_delta_tracker.forget(session_id)
+                for checkpoint_file in (
+                    os.path.join(self.checkpoint_dir, f"session_{session_id}.json"),
+                    self._session_delta_file_path(session_id)
+                ):
+                    if os.path.exists(checkpoint_file):
+                        os.remove(checkpoint_file)
+                        logger.info(f"删除检查点文件: {checkpoint_file}")
             except Exception as e:
                 logger.warning(f"删除检查点文件失败: {str(e)}")
             
@@ -2363,6 +2754,7 @@ class IsotopeEngine:
             # 更新会话状态
             self.sessions[session_id]["state"] = state
             self.sessions[session_id]["last_updated"] = datetime.now().isoformat()
+            self._publish_shared_session(session_id)
             
             logger.info(f"会话 {session_id} 状态已更新")
             return True
@@ -2383,69 +2775,63 @@ class IsotopeEngine:
     
 
     
+    def _maybe_auto_save_session(self, session_id: str, state: IsotopeSystemState) -> None:
+        """达到自动保存间隔时提交后台保存"""
+        current_time = time.time()
+        if current_time - self.last_autosave <= self.autosave_interval:
+            return
+        try:
+            self._auto_save_session(session_id, state)
+            self.last_autosave = current_time
+        except Exception as auto_save_err:
+            logger.error(f"自动保存会话时出错: {str(auto_save_err)}")
+    
     def _auto_save_session(self, session_id: str, state: IsotopeSystemState) -> None:
-        """自动保存会话状态
+        """自动保存会话状态（提交到后台写入器，立即返回）
         
         Args:
             session_id: 会话ID
             state: 当前会话状态
         """
-        logger.info(f"达到自动保存间隔 ({self.autosave_interval}秒)，正在保存会话状态...")
-        self.save_session_state(session_id)
-        logger.info(f"会话状态已自动保存，最后保存时间更新为: {datetime.fromtimestamp(self.last_autosave)}")
+        logger.info(f"达到自动保存间隔 ({self.autosave_interval}秒)，已提交后台保存会话状态")
+        self.persistence_worker.schedule(session_id, state)
+    
+    def _save_session_snapshot(self, session_id: str, state: IsotopeSystemState) -> bool:
+        """后台写入器的保存函数：写入文件与PostgreSQL检查点"""
+        return self.save_session_state(session_id, state=state)
     
     def _restore_existing_sessions(self) -> None:
-        """恢复现有会话状态
+        """加载会话目录
         
-        优先从PostgreSQL恢复会话，如果PostgreSQL不可用则从文件检查点恢复
+        启动时只登记会话ID、元数据和时间戳，完整状态在首次访问时由
+        _hydrate_session按需加载。优先从PostgreSQL读取目录，如果PostgreSQL
+        不可用则扫描文件检查点。
         """
-        restored_count = 0
-        failed_count = 0
-        
         try:
-            # 1. 优先尝试从PostgreSQL恢复会话
+            # 1. 优先从PostgreSQL读取会话目录
             if self.session_persistence_enabled and self.postgres_session_manager:
-                logger.info("开始从PostgreSQL恢复会话...")
+                logger.info("开始从PostgreSQL加载会话目录...")
                 
                 try:
-                    restore_result = self.postgres_session_manager.restore_all_sessions()
+                    registered_count = 0
+                    for session_info in self.postgres_session_manager.list_sessions(limit=None):
+                        if session_info.get("status") == "expired":
+                            continue
+                        self.sessions.register(session_info["session_id"], session_info)
+                        registered_count += 1
                     
-                    if restore_result.get("success", False):
-                        # 恢复成功，将会话加载到内存
-                        postgres_sessions = restore_result.get("sessions", {})
-                        
-                        for session_id, session_data in postgres_sessions.items():
-                            try:
-                                # 重建会话结构
-                                self.sessions[session_id] = {
-                                    "state": session_data["state"],
-                                    "created_at": session_data["created_at"],
-                                    "last_updated": session_data["last_updated"],
-                                    "metadata": session_data["metadata"]
-                                }
-                                restored_count += 1
-                                logger.debug(f"从PostgreSQL成功恢复会话: {session_id}")
-                                
-                            except Exception as e:
-                                failed_count += 1
-                                logger.error(f"处理PostgreSQL会话 {session_id} 时出错: {str(e)}")
-                        
-                        logger.info(f"PostgreSQL会话恢复完成: 成功 {restored_count} 个，失败 {failed_count} 个")
-                        
-                        # 如果PostgreSQL恢复成功，就不需要从文件恢复了
-                        if restored_count > 0:
-                            self._log_restored_sessions_info(restored_count, failed_count)
-                            return
-
-                        
-                    else:
-                        logger.warning(f"PostgreSQL会话恢复失败: {restore_result.get('error', '未知错误')}")
+                    logger.info(f"PostgreSQL会话目录加载完成: {registered_count} 个会话")
+                    
+                    # 如果PostgreSQL中有会话，就不需要扫描文件了
+                    if registered_count > 0:
+                        self._log_restored_sessions_info(registered_count, 0)
+                        return
                         
                 except Exception as e:
-                    logger.error(f"从PostgreSQL恢复会话时出错: {str(e)}")
+                    logger.error(f"从PostgreSQL加载会话目录时出错: {str(e)}")
             
-            # 2. 回退到文件检查点恢复
-            logger.info("开始从文件检查点恢复会话...")
+            # 2. 回退到文件检查点目录
+            logger.info("开始从文件检查点加载会话目录...")
             self._restore_sessions_from_files()
             
         except Exception as e:
@@ -2453,9 +2839,8 @@ class IsotopeEngine:
             logger.error(f"错误详情: {traceback.format_exc()}")
     
     def _restore_sessions_from_files(self) -> None:
-        """从文件检查点恢复会话"""
-        restored_count = 0
-        failed_count = 0
+        """从文件检查点登记会话目录（只读取文件名和修改时间，不解析内容）"""
+        registered_count = 0
         
         try:
             # 确保检查点目录存在
@@ -2465,38 +2850,35 @@ class IsotopeEngine:
             
             logger.info(f"开始扫描检查点目录: {self.checkpoint_dir}")
             
-            # 扫描检查点目录中的所有会话文件
-            session_files = []
-            for filename in os.listdir(self.checkpoint_dir):
-                if filename.startswith("session_") and filename.endswith(".json"):
-                    session_files.append(filename)
-            
-            if not session_files:
+            with os.scandir(self.checkpoint_dir) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    if not (filename.startswith("session_") and filename.endswith(".json")):
+                        continue
+                    
+                    session_id = filename[8:-5]  # 去除"session_"前缀和".json"后缀
+                    if not session_id or session_id in self.sessions:
+                        continue
+                    
+                    try:
+                        modified_at = datetime.fromtimestamp(entry.stat().st_mtime).isoformat()
+                    except OSError as e:
+                        logger.warning(f"读取会话文件信息失败: {filename}, 错误: {str(e)}")
+                        continue
+                    
+                    self.sessions.register(session_id, {
+                        "created_at": modified_at,
+                        "last_updated": modified_at,
+                        "metadata": {}
+                    })
+                    registered_count += 1
+            
+            if registered_count == 0:
                 logger.info("检查点目录中没有找到会话文件")
                 return
             
-            logger.info(f"找到 {len(session_files)} 个会话文件，开始恢复...")
-            
-            # 逐个加载会话文件
-            for filename in session_files:
-                try:
-                    file_path = os.path.join(self.checkpoint_dir, filename)
-                    session_id = self._restore_single_session(file_path)
-                    
-                    if session_id:
-                        restored_count += 1
-                        logger.debug(f"成功恢复会话: {session_id}")
-                    else:
-                        failed_count += 1
-                        logger.warning(f"恢复会话文件失败: {filename}")
-                        
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"处理会话文件 {filename} 时出错: {str(e)}")
-            
-            # 记录恢复结果
-            logger.info(f"文件会话恢复完成: 成功 {restored_count} 个，失败 {failed_count} 个")
-            self._log_restored_sessions_info(restored_count, failed_count)
+            logger.info(f"文件会话目录加载完成: {registered_count} 个会话")
+            self._log_restored_sessions_info(registered_count, 0)
             
         except Exception as e:
             logger.error(f"从文件恢复会话时出错: {str(e)}")
@@ -2504,29 +2886,209 @@ class IsotopeEngine:
     def _log_restored_sessions_info(self, restored_count: int, failed_count: int) -> None:
         """记录恢复的会话信息"""
         if restored_count > 0:
-            logger.info(f"当前活跃会话数: {len(self.sessions)}")
+            logger.info(f"当前会话目录数: {len(self.sessions)}")
             
-            # 显示恢复的会话信息
+            # 显示恢复的会话信息（只读取目录，不加载会话）
             if self.verbose:
-                for session_id, session_data in self.sessions.items():
-                    state = session_data.get("state", {})
-                    messages_count = len(state.get("messages", []))
-                    created_at = session_data.get("created_at", "未知")
-                    metadata = session_data.get("metadata", {})
+                for session_id, entry in self.sessions.catalog_items():
+                    metadata = entry.get("metadata") or {}
                     session_name = metadata.get("name", "未命名")
                     
                     logger.info(f"  会话 {session_id[:8]}... ({session_name}): "
-                              f"{messages_count} 条消息, 创建于 {created_at}")
+                              f"{entry.get('message_count', 0)} 条消息, 创建于 {entry.get('created_at') or '未知'}")
+    
+    def _get_turn_manager(self, session_id: str) -> ConversationTurnManager:
+        """获取会话的对话轮次管理器，本进程没有时从共享状态重建或新建"""
+        turn_manager = self.turn_managers.get(session_id)
+        if turn_manager is not None:
+            return turn_manager
+        
+        if self.shared_state is not None:
+            # 只取对话轮次，本地会话副本的写入基准不变
+            shared = self.shared_state.sessions.load_session(session_id, track=False)
+            if shared and shared.get("turns"):
+                turn_manager = ConversationTurnManager.from_state(shared["turns"])
+        if turn_manager is None:
+            turn_manager = create_conversation_turn_manager(session_id)
+        self.turn_managers[session_id] = turn_manager
+        return turn_manager
+    
+    def _publish_shared_session(self, session_id: str) -> None:
+        """将本进程中会话的增量写入共享状态并通知其他进程（未启用共享状态时不执行）
+        
+        本地副本基于的版本已被其他进程更新时写入被拒绝：重新加载最新版本，把本进程
+        新增的消息与轮次重新应用到最新版本上后重试；无法重新应用时丢弃本地副本，
+        下次访问时重新加载。
+        """
+        if self.shared_state is None or not self.sessions.is_loaded(session_id):
+            return
+        for attempt in range(1, SHARED_PUBLISH_MAX_ATTEMPTS + 1):
+            try:
+                session = self.sessions[session_id]
+                turn_manager = self.turn_managers.get(session_id)
+                self.shared_state.sessions.save_session(
+                    session_id,
+                    session,
+                    turn_state=turn_manager.export_state() if turn_manager is not None else None,
+                    catalog_entry=build_catalog_entry(session)
+                )
+                return
+            except StaleSessionVersionError as e:
+                if attempt < SHARED_PUBLISH_MAX_ATTEMPTS and self._rebase_shared_session(session_id):
+                    logger.warning(f"{str(e)}，已基于最新版本重新应用本地修改并重试")
+                    continue
+                logger.error(f"{str(e)}，无法重新应用本地修改，丢弃本地副本")
+                self.turn_managers.pop(session_id, None)
+                self.sessions.invalidate(session_id)
+                return
+            except Exception as e:
+                logger.error(f"发布共享会话 {session_id} 失败: {str(e)}")
+                return
+    
+    def _rebase_shared_session(self, session_id: str) -> bool:
+        """加载共享存储中的最新版本，把本地副本新增的内容重新应用到其上
+        
+        只追加字段（消息、动作历史、工具结果）与已完成轮次按标识合并：最新版本中已有的
+        保持不变，本地新增的按原顺序追加到末尾；其余字段以本进程刚写入的值为准。
+        合并结果原地写入本地会话，流式处理中持有的状态引用保持有效。
+        
+        Returns:
+            是否成功重新应用（最新版本已不存在时返回False）
+        """
+        latest = self.shared_state.sessions.load_session(session_id)
+        if not latest or not latest.get("session"):
+            return False
+        
+        session = self.sessions[session_id]
+        local_state = session.get("state")
+        remote_state = latest["session"].get("state") or {}
+        if local_state is None:
+            session["state"] = remote_state
+        else:
+            for field in APPEND_ONLY_FIELDS:
+                if field in local_state or field in remote_state:
+                    local_state[field] = merge_appended_items(
+                        remote_state.get(field) or [], local_state.get(field) or []
+                    )
+        
+        local_manager = self.turn_managers.get(session_id)
+        if latest.get("turns"):
+            merged_manager = ConversationTurnManager.from_state(latest["turns"])
+            if local_manager is not None:
+                merged_manager.merge_from(local_manager)
+            self.turn_managers[session_id] = merged_manager
+        return True
+    
+    def _on_shared_session_changed(
+        self,
+        op: str,
+        session_id: str,
+        catalog_entry: Optional[Dict[str, Any]]
+    ) -> None:
+        """其他进程修改或删除会话后，丢弃本地的会话副本与对话轮次管理器"""
+        self.turn_managers.pop(session_id, None)
+        self.sessions.invalidate(session_id, catalog_entry=catalog_entry, deleted=(op == "delete"))
+        logger.debug(f"会话 {session_id} 已被其他进程{'删除' if op == 'delete' else '更新'}，本地副本已失效")
+    
+    def _hydrate_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """按需加载完整会话（会话工作集的加载函数）
+        
+        Args:
+            session_id: 会话ID
+            
+        Returns:
+            会话数据，不存在时返回None
+            
+        Raises:
+            SessionLoadError: 存储暂时不可用且没有其他来源可以加载该会话
+        """
+        session_data = None
+        load_error = None
+        
+        # 0. 启用共享状态时优先读取其他进程写入的最新会话
+        if self.shared_state is not None:
+            shared = self.shared_state.sessions.load_session(session_id)
+            if shared and shared.get("session"):
+                session_data = shared["session"]
+                if shared.get("turns") and session_id not in self.turn_managers:
+                    self.turn_managers[session_id] = ConversationTurnManager.from_state(shared["turns"])
+        
+        # 1. 其次从PostgreSQL加载
+        if session_data is None and self.session_persistence_enabled and self.postgres_session_manager:
+            try:
+                stored = self.postgres_session_manager.load_session(session_id)
+                if stored:
+                    session_data = {
+                        "state": stored["state"],
+                        "created_at": stored["created_at"],
+                        "last_updated": stored["last_updated"],
+                        "metadata": stored["metadata"] or {}
+                    }
+            except Exception as e:
+                logger.error(f"从PostgreSQL加载会话 {session_id} 失败: {str(e)}")
+                load_error = e
+        
+        # 2. 回退到文件检查点
+        if session_data is None:
+            file_path = os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
+            if os.path.exists(file_path):
+                loaded = self._read_session_file(file_path)
+                if loaded:
+                    session_data = loaded[1]
+        
+        if session_data is None:
+            if load_error is not None:
+                # 数据库暂时不可用时不能判定会话不存在
+                raise SessionLoadError(str(load_error)) from load_error
+            return None
+        
+        # 刷新会话中的文件信息（如果有文件管理器）
+        try:
+            self._refresh_session_files(session_data["state"], session_id)
+        except Exception as refresh_error:
+            logger.debug(f"刷新会话文件信息时出错: {str(refresh_error)}")
+        
+        return session_data
+    
+    def _write_back_session(self, session_id: str, session: Dict[str, Any]) -> bool:
+        """会话被移出内存前写回持久化存储（会话工作集的回写函数）
+        
+        Returns:
+            是否写回成功；失败时会话工作集保留该会话并在之后重试
+        """
+        state = session.get("state")
+        if state is None:
+            return True
+        
+        if self.session_persistence_enabled and self.postgres_session_manager:
+            # 加载时优先读取PostgreSQL，写入失败不能回退到文件检查点，否则下次会读到旧数据
+            if not self._save_session_to_persistence(session_id, state, metadata=session.get("metadata") or {}):
+                return False
+        else:
+            # 写入失败时抛出异常，由会话工作集记录并重试
+            self._write_session_checkpoint_file(session_id, state)
+        logger.debug(f"会话 {session_id} 已写回存储并移出内存")
+        return True
     
-    def _restore_single_session(self, file_path: str) -> Optional[str]:
-        """恢复单个会话状态
+    def _read_session_file(self, file_path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """读取单个会话文件
+        
+        默认命名的会话文件在会话持久化锁内读取，快照与增量不会被并发的保存或压缩打断。
         
         Args:
             file_path: 会话文件路径
             
         Returns:
-            成功恢复的会话ID，失败返回None
+            (会话ID, 会话数据)，失败返回None
         """
+        filename = os.path.basename(file_path)
+        if filename.startswith("session_") and filename.endswith(".json"):
+            with self.session_delta_tracker.session_lock(filename[8:-5]):
+                return self._load_session_file(file_path)
+        return self._load_session_file(file_path)
+    
+    def _load_session_file(self, file_path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """解析会话文件并重放增量（由_read_session_file调用）"""
         try:
             # 读取会话文件
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -2548,17 +3110,27 @@ class IsotopeEngine:
                     logger.warning(f"无法从文件中提取会话ID: {file_path}")
                     return None
             
-            # 检查会话是否已经存在（避免重复加载）
-            if session_id in self.sessions:
-                logger.debug(f"会话 {session_id} 已存在，跳过恢复")
-                return session_id
-            
             # 提取状态数据
             state = checkpoint_data.get("state")
             if not state:
                 logger.warning(f"会话文件中没有状态数据: {file_path}")
                 return None
             
+            # 默认路径的快照需要重放之后的增量
+            if os.path.abspath(file_path) == os.path.abspath(
+                os.path.join(self.checkpoint_dir, f"session_{session_id}.json")
+            ):
+                version = checkpoint_data.get("version", 0)
+                deltas = self._read_session_deltas(session_id, version)
+                if deltas:
+                    state = apply_session_deltas(state, deltas)
+                    version = deltas[-1]["version"]
+                    checkpoint_data["timestamp"] = deltas[-1].get("timestamp", checkpoint_data.get("timestamp"))
+                self.session_delta_tracker.mark_snapshot(session_id, state, version)
+                if len(deltas) >= self.session_delta_tracker.compact_every:
+                    # 增量积累过多时让下一次保存写入快照
+                    self.session_delta_tracker.forget(session_id)
+            
             # 重建会话数据结构
             session_data = {
                 "state": state,
@@ -2572,31 +3144,13 @@ class IsotopeEngine:
             if state_metadata:
                 session_data["metadata"].update(state_metadata)
             
-            # 添加到会话字典
-            self.sessions[session_id] = session_data
-            
-            # 验证恢复的数据
-            restored_state = self.get_session_state(session_id)
-            if restored_state is None:
-                logger.warning(f"恢复后无法获取会话状态: {session_id}")
-                # 清理失败的会话
-                if session_id in self.sessions:
-                    del self.sessions[session_id]
-                return None
-            
-            # 刷新会话中的文件信息（如果有文件管理器）
-            try:
-                self._refresh_session_files(restored_state, session_id)
-            except Exception as refresh_error:
-                logger.debug(f"刷新会话文件信息时出错: {str(refresh_error)}")
-            
-            return session_id
+            return session_id, session_data
             
         except json.JSONDecodeError as e:
             logger.error(f"会话文件JSON格式错误: {file_path}, 错误: {str(e)}")
             return None
         except Exception as e:
-            logger.error(f"恢复会话文件时出错: {file_path}, 错误: {str(e)}")
+            logger.error(f"读取会话文件时出错: {file_path}, 错误: {str(e)}")
             return None
     
     def _refresh_session_files(self, state: IsotopeSystemState, session_id: str) -> None:
@@ -2642,48 +3196,43 @@ class IsotopeEngine:
         except Exception as e:
             logger.debug(f"刷新会话文件信息时出错: {str(e)}")
     
-    def get_restored_sessions_info(self) -> Dict[str, Any]:
+    def get_restored_sessions_info(self, limit: Optional[int] = 100, offset: int = 0) -> Dict[str, Any]:
         """获取已恢复会话的统计信息
         
+        汇总数据来自会话目录随写入维护的计数，会话明细只返回按最后更新时间排序的一页。
+        
+        Args:
+            limit: 返回的会话明细数量，None表示全部
+            offset: 会话明细偏移量
+        
         Returns:
             会话统计信息字典
         """
-        total_sessions = len(self.sessions)
-        total_messages = 0
-        sessions_with_files = 0
-        sessions_info = []
+        summary = self.sessions.get_catalog_summary()
+        total_sessions = summary["total_sessions"]
+        total_messages = summary["total_messages"]
         
-        for session_id, session_data in self.sessions.items():
-            state = session_data.get("state", {})
-            messages = state.get("messages", [])
-            files = state.get("files", {})
-            metadata = session_data.get("metadata", {})
-            
-            message_count = len(messages)
-            file_count = len(files)
-            total_messages += message_count
-            
-            if file_count > 0:
-                sessions_with_files += 1
-            
-            session_info = {
+        # 读取会话目录，不加载未在内存中的会话
+        _, page = self.sessions.catalog_page(limit=limit, offset=offset, sort_by="last_updated")
+        sessions_info = []
+        for session_id, session_data in page:
+            metadata = session_data.get("metadata") or {}
+            sessions_info.append({
                 "session_id": session_id,
                 "name": metadata.get("name", "未命名"),
-                "message_count": message_count,
-                "file_count": file_count,
+                "message_count": session_data.get("message_count", 0),
+                "file_count": session_data.get("file_count", 0),
                 "created_at": session_data.get("created_at"),
                 "last_updated": session_data.get("last_updated")
-            }
-            sessions_info.append(session_info)
-        
-        # 按最后更新时间排序
-        sessions_info.sort(key=lambda x: x.get("last_updated", ""), reverse=True)
+            })
         
         return {
             "total_sessions": total_sessions,
             "total_messages": total_messages,
-            "sessions_with_files": sessions_with_files,
+            "sessions_with_files": summary["sessions_with_files"],
             "average_messages_per_session": total_messages / total_sessions if total_sessions > 0 else 0,
+            "offset": offset,
+            "limit": limit,
             "sessions": sessions_info
         }
     
@@ -2758,12 +3307,23 @@ class IsotopeEngine:
         base_status = {
             "sessions_count": len(self.sessions),
             "total_messages": sum(
-                len(session["state"].get("messages", [])) 
-                for session in self.sessions.values()
+                entry.get("message_count", 0)
+                for _, entry in self.sessions.catalog_items()
             ),
+            "session_working_set": self.sessions.get_statistics(),
+            "session_persistence": self.persistence_worker.get_metrics(),
+            "shared_state": self.shared_state.get_metrics() if self.shared_state is not None else None,
             "agents_registered": len(agent_registry.get_all_agents()),
             "tools_available": len(self.tools),
             "checkpointer_backend": getattr(self.graph_builder, "checkpoint_backend", "unknown"),
+            "checkpoint_cache": (
+                self.graph_builder.checkpoint_cache.get_metrics()
+                if getattr(self.graph_builder, "checkpoint_cache", None) else None
+            ),
+            "checkpoint_retention": (
+                self.graph_builder.checkpoint_retention_job.get_status()
+                if getattr(self.graph_builder, "checkpoint_retention_job", None) else None
+            ),
             "timestamp": time.time()
         }
         
@@ -2822,9 +3382,11 @@ class IsotopeEngine:
                     "message": f"会话不存在: {session_id}"
                 }
             
-            # 保存当前状态检查点
+            # 保存当前状态检查点（同步写入，并取消该会话尚未写入的后台保存）
             if save_checkpoint:
-                checkpoint_saved = self.save_session_state(session_id)
+                checkpoint_saved = self.persistence_worker.save_now(
+                    session_id, self.sessions[session_id]["state"]
+                )
                 if not checkpoint_saved:
                     logger.warning(f"会话{session_id}检查点保存失败")
             
@@ -2924,4 +3486,47 @@ class IsotopeEngine:
         """清理过期的审批请求"""
         if self.human_approval_gate:
             self.human_approval_gate.cleanup_expired_approvals()
+    
+    def shutdown(self) -> None:
+        """关闭引擎，刷新后台队列中尚未持久化的数据"""
+        logger.info("正在关闭执行引擎...")
+        
+        # 写入所有待保存的会话
+        try:
+            self.persistence_worker.close()
+        except Exception as e:
+            logger.error(f"关闭会话持久化写入器失败: {str(e)}")
+        
+        # 重试此前回写失败的会话
+        try:
+            remaining = self.sessions.retry_failed_write_backs()
+            if remaining:
+                logger.error(f"仍有 {remaining} 个会话回写失败，未持久化的修改将丢失")
+        except Exception as e:
+            logger.error(f"重试会话回写失败: {str(e)}")
+        
+        # 关闭共享状态订阅
+        if self.shared_state is not None:
+            try:
+                self.shared_state.close()
+            except Exception as e:
+                logger.error(f"关闭共享会话状态失败: {str(e)}")
+        
+        # 停止检查点保留任务
+        retention_job = getattr(self.graph_builder, "checkpoint_retention_job", None)
+        if retention_job is not None:
+            retention_job.stop()
+        
+        # 刷新记忆写后队列（适配器持有独立的记忆集成实例）
+        memory_integrations = [self.enhanced_memory_integration]
+        if self.memory_adapter is not None:
+            memory_integrations.append(self.memory_adapter.enhanced_memory_integration)
+        for integration in memory_integrations:
+            if integration is not None and hasattr(integration, 'close'):
+                try:
+                    integration.close()
+                except Exception as e:
+                    logger.error(f"关闭记忆写后队列失败: {str(e)}")
+        
+        logger.info("执行引擎已关闭")
     
\ No newline at end of file
@@ -27,6 +27,8 @@ from langgraph.types import Command
 from app.core.state import IsotopeSystemState, StateManager, TaskStatus
 from app.core.config import ConfigManager
 from app.core.postgres_checkpoint import get_postgres_checkpoint_manager, PostgreSQLCheckpointManager
+from app.core.checkpoint_retention import create_checkpoint_retention_job
+from app.core.checkpoint_cache import CachedCheckpointer, create_cached_checkpointer
 from app.core.task_decorator import task_registry, get_task_by_name, apply_langgraph_decorator
 
 from app.core.dag_visualizer import DAGVisualizer, create_dag_visualizer_from_graph
@@ -173,10 +175,19 @@ class EnhancedGraphBuilder:
         self.postgres_checkpoint_manager = None
         self.mysql_checkpoint_manager = None
         
+        self.checkpoint_retention_job = None
+        self.checkpoint_cache = None
+        
         if self.checkpoint_backend == "postgres":
             self._init_postgres_checkpoint()
         elif self.checkpoint_backend == "mysql":
             self._init_mysql_checkpoint()
+        
+        # 启动检查点保留任务，限制检查点表增长
+        manager = self.postgres_checkpoint_manager or self.mysql_checkpoint_manager
+        if manager is not None:
+            retention_config = self.config.get("graph", {}).get("checkpoint_retention")
+            self.checkpoint_retention_job = create_checkpoint_retention_job(manager, retention_config)
     
     def _init_postgres_checkpoint(self):
         """初始化PostgreSQL检查点管理器"""
@@ -425,13 +436,44 @@ class EnhancedGraphBuilder:
             return self.checkpointer
         
         if self.checkpoint_backend == "postgres" and self.postgres_checkpoint_manager:
-            return self.postgres_checkpoint_manager.get_checkpointer()
+            return self._wrap_checkpoint_cache(self.postgres_checkpoint_manager.get_checkpointer())
         elif self.checkpoint_backend == "mysql" and self.mysql_checkpoint_manager:
-            return self.mysql_checkpoint_manager.get_checkpointer()
+            return self._wrap_checkpoint_cache(self.mysql_checkpoint_manager.get_checkpointer())
         else:
             # 使用内存检查点管理器作为fallback
             return MemorySaver()
     
+    def _wrap_checkpoint_cache(self, checkpointer: Any) -> Any:
+        """为数据库检查点器加上最新检查点读缓存（同一检查点器只包装一次）"""
+        if isinstance(self.checkpoint_cache, CachedCheckpointer) and self.checkpoint_cache.inner is checkpointer:
+            return self.checkpoint_cache
+        wrapped = create_cached_checkpointer(
+            checkpointer,
+            self.config.get("graph", {}).get("checkpoint_cache"),
+            self.config.get("shared_state")
+        )
+        if isinstance(wrapped, CachedCheckpointer):
+            self.checkpoint_cache = wrapped
+        return wrapped
+    
+    def get_latest_checkpoint(self, thread_id: str) -> Optional[Any]:
+        """获取线程的最新检查点（CheckpointTuple），优先读缓存
+        
+        Args:
+            thread_id: 线程ID（即会话ID）
+            
+        Returns:
+            检查点元组，不存在或检查点器不可用时返回None
+        """
+        checkpointer = self._get_active_checkpointer()
+        if checkpointer is None or isinstance(checkpointer, MemorySaver):
+            return None
+        try:
+            return checkpointer.get_tuple(self.create_thread_config(thread_id))
+        except Exception as e:
+            logger.error(f"获取最新检查点失败: {str(e)}")
+            return None
+    
     def create_thread_config(self, thread_id: Optional[str] = None) -> Dict[str, Any]:
         """创建线程配置"""
         if thread_id is None:
@@ -477,7 +519,9 @@ class EnhancedGraphBuilder:
             "specialized_agents_count": len(self.specialized_agents),
             "checkpoint_backend": self.checkpoint_backend,
             "postgres_available": self.postgres_checkpoint_manager is not None,
-            "mysql_available": self.mysql_checkpoint_manager is not None
+            "mysql_available": self.mysql_checkpoint_manager is not None,
+            "checkpoint_retention": self.checkpoint_retention_job.get_status() if self.checkpoint_retention_job else None,
+            "checkpoint_cache": self.checkpoint_cache.get_metrics() if self.checkpoint_cache else None
         }
     
     def validate_configuration(self) -> Dict[str, Any]:
@@ -8,7 +8,8 @@ import shutil
 import logging
 import json
 import mimetypes
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, date
 from typing import Dict, List, Any, Optional, Tuple, Union
 from pathlib import Path
 import time
@@ -19,6 +20,137 @@ from app.core.state import FileInfo
 # 配置日志
 logger = logging.getLogger(__name__)
 
+
+def _parse_upload_time(upload_time: Any) -> Optional[datetime]:
+    """解析索引中的上传时间（ISO格式或"%Y-%m-%d %H:%M:%S"），失败返回None"""
+    if not upload_time:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(upload_time).replace('Z', '+00:00'))
+        return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
+    except (ValueError, AttributeError):
+        return None
+
+
+class FileIndexSummary:
+    """文件索引汇总 - 文件登记/删除时增量维护，统计查询不遍历文件索引
+    
+    汇总范围：关联了会话的全部文件（None），以及每个会话各自的文件。
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+    
+    def reset(self) -> None:
+        """清空汇总"""
+        with self._lock:
+            # 范围（None或会话ID） -> 汇总数据
+            self._scopes: Dict[Optional[str], Dict[str, Any]] = {}
+            # 文件ID -> 计入汇总时的(会话ID, 扩展名, 大小, 上传时间)，删除时按此扣减
+            self._contributions: Dict[str, Tuple[str, str, float, Optional[datetime], bool]] = {}
+    
+    def add(self, file_id: str, file_info: Dict[str, Any]) -> None:
+        """计入文件（已计入的文件先扣减旧值）"""
+        with self._lock:
+            self.remove(file_id)
+            session_id = file_info.get("session_id")
+            if not session_id:
+                return
+            file_name = file_info.get("file_name", "")
+            extension = file_name.split('.')[-1].lower() if '.' in file_name else 'unknown'
+            size = file_info.get("size", 0)
+            size = size if isinstance(size, (int, float)) else 0
+            is_generated = file_info.get("source") == "generated" or bool(file_info.get("is_generated", False))
+            contribution = (session_id, extension, size, _parse_upload_time(file_info.get("upload_time")), is_generated)
+            self._contributions[file_id] = contribution
+            for scope in (None, session_id):
+                self._apply(scope, contribution, 1)
+    
+    def remove(self, file_id: str) -> Optional[str]:
+        """扣减文件，返回计入时关联的会话ID"""
+        with self._lock:
+            contribution = self._contributions.pop(file_id, None)
+            if contribution is None:
+                return None
+            for scope in (None, contribution[0]):
+                self._apply(scope, contribution, -1)
+            return contribution[0]
+    
+    def snapshot(self, session_id: Optional[str] = None, today: Optional[date] = None) -> Dict[str, Any]:
+        """获取汇总统计
+        
+        Args:
+            session_id: 会话ID，None表示全部关联会话的文件
+            today: 统计"今日"文件使用的日期，默认当天
+            
+        Returns:
+            文件总数、类型分布、总大小、今日上传/生成数、最早/最晚上传时间
+        """
+        today = today or date.today()
+        with self._lock:
+            scope = self._scopes.get(session_id)
+            if scope is None:
+                return {
+                    "total_files": 0,
+                    "file_types": {},
+                    "total_size": 0,
+                    "uploaded_today": 0,
+                    "generated_today": 0,
+                    "earliest_upload": None,
+                    "latest_upload": None
+                }
+            if scope["bounds_dirty"]:
+                scope["earliest"] = min(scope["times"]) if scope["times"] else None
+                scope["latest"] = max(scope["times"]) if scope["times"] else None
+                scope["bounds_dirty"] = False
+            return {
+                "total_files": scope["count"],
+                "file_types": {ext: count for ext, count in scope["types"].items() if count > 0},
+                "total_size": scope["size"],
+                "uploaded_today": scope["days"].get((today, False), 0),
+                "generated_today": scope["days"].get((today, True), 0),
+                "earliest_upload": scope["earliest"].isoformat() if scope["earliest"] else None,
+                "latest_upload": scope["latest"].isoformat() if scope["latest"] else None
+            }
+    
+    def _apply(self, scope_key: Optional[str], contribution: Tuple, sign: int) -> None:
+        _, extension, size, upload_dt, is_generated = contribution
+        scope = self._scopes.get(scope_key)
+        if scope is None:
+            scope = self._scopes[scope_key] = {
+                "count": 0,
+                "size": 0,
+                "types": Counter(),
+                "days": Counter(),
+                "times": Counter(),
+                "earliest": None,
+                "latest": None,
+                "bounds_dirty": False
+            }
+        scope["count"] += sign
+        scope["size"] += sign * size
+        scope["types"][extension] += sign
+        if upload_dt is not None:
+            day_key = (upload_dt.date(), is_generated)
+            scope["days"][day_key] += sign
+            scope["times"][upload_dt] += sign
+            if scope["days"][day_key] <= 0:
+                del scope["days"][day_key]
+            if scope["times"][upload_dt] <= 0:
+                del scope["times"][upload_dt]
+            if sign > 0:
+                if scope["earliest"] is None or upload_dt < scope["earliest"]:
+                    scope["earliest"] = upload_dt
+                if scope["latest"] is None or upload_dt > scope["latest"]:
+                    scope["latest"] = upload_dt
+            elif upload_dt in (scope["earliest"], scope["latest"]):
+                # 删除的是边界值时，下次查询再重新计算
+                scope["bounds_dirty"] = True
+        if scope["count"] <= 0 and scope_key is not None:
+            del self._scopes[scope_key]
+
+
 class FileManager:
     """文件管理类，提供统一的文件管理服务"""
     
@@ -53,6 +185,11 @@ class FileManager:
         # 文件索引
         self.file_index = {}
         
+        # 会话ID -> 文件ID集合，按会话查询文件时不遍历整个索引
+        self._session_file_ids: Dict[str, set] = {}
+        # 文件统计汇总，随索引增量维护
+        self.summary = FileIndexSummary()
+        
         # 从索引文件加载现有索引
         self._load_index()
         
@@ -160,6 +297,62 @@ class FileManager:
         else:
             logger.info("文件索引不存在，创建新索引")
             self.file_index = {}
+        self._rebuild_secondary_indexes()
+    
+    def _rebuild_secondary_indexes(self):
+        """根据文件索引重建会话索引与统计汇总"""
+        self._session_file_ids = {}
+        self.summary.reset()
+        for file_id, file_info in self.file_index.items():
+            self._add_secondary(file_id, file_info)
+    
+    def _add_secondary(self, file_id: str, file_info: Dict[str, Any]):
+        session_id = file_info.get("session_id")
+        if session_id:
+            self._session_file_ids.setdefault(session_id, set()).add(file_id)
+        self.summary.add(file_id, file_info)
+    
+    def _remove_secondary(self, file_id: str):
+        # 按计入时的会话扣减，会话关联被修改过也能正确移除
+        session_id = self.summary.remove(file_id)
+        file_ids = self._session_file_ids.get(session_id) if session_id else None
+        if file_ids is not None:
+            file_ids.discard(file_id)
+            if not file_ids:
+                del self._session_file_ids[session_id]
+    
+    def _index_file(self, file_id: str, file_info: Dict[str, Any]):
+        """写入文件索引并维护会话索引与统计汇总"""
+        previous = self.file_index.get(file_id)
+        if previous is not None:
+            self._remove_secondary(file_id)
+        self.file_index[file_id] = file_info
+        self._add_secondary(file_id, file_info)
+    
+    def _unindex_file(self, file_id: str):
+        """从文件索引移除文件并维护会话索引与统计汇总"""
+        file_info = self.file_index.pop(file_id, None)
+        if file_info is not None:
+            self._remove_secondary(file_id)
+    
+    def assign_file_to_session(self, file_id: str, session_id: str) -> bool:
+        """修改文件关联的会话并保存索引
+        
+        Args:
+            file_id: 文件ID
+            session_id: 目标会话ID
+            
+        Returns:
+            文件是否存在
+        """
+        file_info = self.file_index.get(file_id)
+        if file_info is None:
+            return False
+        self._remove_secondary(file_id)
+        file_info["session_id"] = session_id
+        self._add_secondary(file_id, file_info)
+        self._save_index()
+        return True
     
     def _save_index(self):
         """保存文件索引"""
@@ -319,7 +512,7 @@ class FileManager:
         }
         
         # 添加到索引
-        self.file_index[file_id] = file_info
+        self._index_file(file_id, file_info)
         
         # 保存索引
         self._save_index()
@@ -347,7 +540,7 @@ class FileManager:
             else:
                 logger.warning(f"文件已从磁盘删除: {file_info['file_path']}")
                 # 从索引中删除
-                del self.file_index[file_id]
+                self._unindex_file(file_id)
                 self._save_index()
         
         logger.warning(f"找不到文件: {file_id}")
@@ -368,7 +561,17 @@ class FileManager:
         """
         filtered_files = []
         
-        for file_id, file_info in self.file_index.items():
+        # 指定会话时只检查该会话的文件
+        if session_id is not None:
+            candidates = (
+                (file_id, self.file_index[file_id])
+                for file_id in list(self._session_file_ids.get(session_id, ()))
+                if file_id in self.file_index
+            )
+        else:
+            candidates = self.file_index.items()
+        
+        for file_id, file_info in candidates:
             # 过滤会话
             if session_id is not None and file_info.get("session_id") != session_id:
                 continue
@@ -405,7 +608,7 @@ class FileManager:
             file_path = file_info["file_path"]
             
             # 从索引中删除
-            del self.file_index[file_id]
+            self._unindex_file(file_id)
             
             # 保存索引
             self._save_index()
@@ -667,7 +870,7 @@ class FileManager:
                 file_info["metadata"] = metadata
             
             # 保存到索引
-            self.file_index[file_id] = file_info
+            self._index_file(file_id, file_info)
             self._save_index()
             
             logger.info(f"文件已保存: {file_id}, 路径: {file_path}")
@@ -825,7 +1028,7 @@ class FileManager:
                 else:
                     # 文件已被删除，从索引中移除
                     logger.warning(f"文件已从磁盘删除: {stored_path}")
-                    del self.file_index[file_id]
+                    self._unindex_file(file_id)
                     self._save_index()
                     break
         
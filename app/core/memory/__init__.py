@@ -38,6 +38,7 @@ from app.core.memory.memory_relevance_scorer import MemoryRelevanceScorer
 from app.core.memory.prompt_length_controller import PromptLengthController
 from app.core.memory.memory_usage_monitor import MemoryUsageMonitor
 from app.core.memory.adaptive_memory_optimizer import AdaptiveMemoryOptimizer
+from app.core.memory.memory_write_queue import MemoryWriteBehindQueue, MemoryWriteRequest
 
 # 引擎适配器
 from app.core.memory.engine_adapter import (
@@ -84,6 +85,8 @@ __all__ = [
     'PromptLengthController',
     'MemoryUsageMonitor',
     'AdaptiveMemoryOptimizer',
+    'MemoryWriteBehindQueue',
+    'MemoryWriteRequest',
     
     # 引擎适配器
     'MemoryAwareEngineAdapter',
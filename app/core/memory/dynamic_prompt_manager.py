@@ -9,6 +9,7 @@
 """
 
 import logging
+import threading
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
@@ -19,6 +20,7 @@ import re
 from .enhanced_memory_namespace import AgentRole, DomainTag, MemoryType
 from .agent_memory_filter import FilteredMemoryResult
 from .enhanced_langgraph_store import EnhancedMemoryEntry
+from .lru_cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -91,16 +93,41 @@ class GeneratedPrompt:
     confidence_score: float
 
 
+@dataclass
+class _OptimizedPromptEntry:
+    """优化结果缓存条目"""
+    optimized_prompt: str
+    optimization_applied: List[str]
+    prompt_confidence_factors: List[float]
+
+
+# 优化结果缓存在统计中使用的名称
+OPTIMIZATION_CACHE_NAME = "optimization"
+
+
 class DynamicPromptManager:
     """动态Prompt管理器"""
     
-    def __init__(self):
+    def __init__(self, section_cache_size: int = 512, optimization_cache_size: int = 128):
         self.logger = logging.getLogger(__name__)
         self.templates = self._load_agent_templates()
         self.section_builders = self._init_section_builders()
+        self.section_cache_keys = self._init_section_cache_keys()
         self.memory_integrators = self._init_memory_integrators()
         self.optimization_strategies = self._init_optimization_strategies()
         
+        # 片段缓存：(section, 输入键) -> 渲染结果
+        self.section_cache_size = section_cache_size
+        self._section_cache: "LRUCache[str]" = LRUCache(section_cache_size)
+        
+        # 优化结果缓存：组装后的prompt与优化参数不变时跳过优化和置信度计算
+        self.optimization_cache_size = optimization_cache_size
+        self._optimization_cache: "LRUCache[_OptimizedPromptEntry]" = LRUCache(optimization_cache_size)
+        
+        # 各部分缓存命中统计（管理器在多个请求线程间共享，统计更新需加锁）
+        self.cache_stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+        
         # 性能统计
         self.generation_stats = {
             "total_generated": 0,
@@ -140,10 +167,9 @@ class DynamicPromptManager:
             # 5. 组装完整prompt
             full_prompt = self._assemble_prompt(sections, adjusted_template)
             
-            # 6. 应用优化策略
-            optimized_prompt, optimization_applied = self._apply_optimization_strategies(
-                full_prompt, adjusted_template, context
-            )
+            # 6. 应用优化策略（组装结果未变化时直接复用缓存）
+            optimized_entry = self._get_optimized_prompt(full_prompt, adjusted_template, context)
+            optimized_prompt = optimized_entry.optimized_prompt
             
             # 7. 计算元数据
             metadata = self._calculate_prompt_metadata(
@@ -158,10 +184,11 @@ class DynamicPromptManager:
                 sections=sections,
                 metadata=metadata,
                 memory_integration_info=memory_integration_info,
-                optimization_applied=optimization_applied,
+                optimization_applied=list(optimized_entry.optimization_applied),
                 estimated_tokens=len(optimized_prompt.split()),
                 confidence_score=self._calculate_confidence_score(
-                    optimized_prompt, memory_result, context
+                    optimized_prompt, memory_result, context,
+                    prompt_factors=optimized_entry.prompt_confidence_factors
                 )
             )
             
@@ -236,14 +263,99 @@ class DynamicPromptManager:
             builder = self.section_builders.get(section)
             if builder:
                 try:
-                    section_content = builder(template, base_prompt, memory_result, context)
-                    sections[section] = section_content
+                    sections[section] = self._build_section_cached(
+                        section, builder, template, base_prompt, memory_result, context
+                    )
                 except Exception as e:
                     self.logger.warning(f"构建section {section} 失败: {str(e)}")
                     sections[section] = ""
         
         return sections
     
+    def _build_section_cached(
+        self,
+        section: PromptSection,
+        builder: callable,
+        template: PromptTemplate,
+        base_prompt: str,
+        memory_result: FilteredMemoryResult,
+        context: PromptContext
+    ) -> str:
+        """按输入键缓存渲染后的片段，未知片段（无键函数）每次重建"""
+        key_func = self.section_cache_keys.get(section)
+        if key_func is None:
+            return builder(template, base_prompt, memory_result, context)
+        
+        cache_key = (section, key_func(template, base_prompt, memory_result, context))
+        cached = self._section_cache.get(cache_key)
+        if cached is not None:
+            self._record_cache_access(section.value, True)
+            return cached
+        
+        content = builder(template, base_prompt, memory_result, context)
+        self._section_cache.put(cache_key, content)
+        self._record_cache_access(section.value, False)
+        return content
+    
+    def _get_optimized_prompt(
+        self,
+        full_prompt: str,
+        template: PromptTemplate,
+        context: PromptContext
+    ) -> _OptimizedPromptEntry:
+        """获取优化后的prompt，组装结果与优化参数不变时跳过各优化步骤"""
+        cache_key = (
+            full_prompt,
+            template.max_total_length,
+            template.style,
+            context.interaction_mode == "concise"
+        )
+        cached = self._optimization_cache.get(cache_key)
+        if cached is not None:
+            self._record_cache_access(OPTIMIZATION_CACHE_NAME, True)
+            return cached
+        
+        optimized_prompt, optimization_applied = self._apply_optimization_strategies(
+            full_prompt, template, context
+        )
+        entry = _OptimizedPromptEntry(
+            optimized_prompt=optimized_prompt,
+            optimization_applied=optimization_applied,
+            prompt_confidence_factors=self._calculate_prompt_confidence_factors(optimized_prompt, context)
+        )
+        self._optimization_cache.put(cache_key, entry)
+        self._record_cache_access(OPTIMIZATION_CACHE_NAME, False)
+        return entry
+    
+    def _record_cache_access(self, name: str, hit: bool) -> None:
+        """记录缓存命中情况"""
+        with self._stats_lock:
+            stats = self.cache_stats.setdefault(name, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+    
+    def get_cache_statistics(self) -> Dict[str, Any]:
+        """获取各部分缓存命中率"""
+        per_section = {}
+        with self._stats_lock:
+            snapshot = {name: dict(stats) for name, stats in self.cache_stats.items()}
+        for name, stats in snapshot.items():
+            total = stats["hits"] + stats["misses"]
+            per_section[name] = {
+                **stats,
+                "hit_rate": stats["hits"] / total if total else 0.0
+            }
+        return {
+            "sections": per_section,
+            "section_cache_size": len(self._section_cache),
+            "optimization_cache_size": len(self._optimization_cache),
+            "average_generation_time": self.generation_stats["average_generation_time"]
+        }
+    
+    def clear_cache(self) -> None:
+        """清空片段和优化结果缓存"""
+        self._section_cache.clear()
+        self._optimization_cache.clear()
+    
     def _integrate_memory_strategically(
         self,
         sections: Dict[PromptSection, str],
@@ -438,29 +550,36 @@ class DynamicPromptManager:
         self,
         prompt: str,
         memory_result: FilteredMemoryResult,
-        context: PromptContext
+        context: PromptContext,
+        prompt_factors: Optional[List[float]] = None
     ) -> float:
-        """计算prompt生成的置信度分数"""
+        """计算prompt生成的置信度分数
+        
+        prompt_factors为只依赖prompt文本的因子，可由优化结果缓存提供。
+        """
         confidence_factors = []
         
         # 记忆相关性
         if memory_result.confidence > 0:
             confidence_factors.append(memory_result.confidence)
         
-        # 模板匹配度
-        template_match = self._calculate_template_match(prompt, context)
-        confidence_factors.append(template_match)
-        
-        # 长度合理性
-        length_reasonableness = self._calculate_length_reasonableness(prompt)
-        confidence_factors.append(length_reasonableness)
-        
-        # 结构完整性
-        structure_completeness = self._calculate_structure_completeness(prompt)
-        confidence_factors.append(structure_completeness)
+        if prompt_factors is None:
+            prompt_factors = self._calculate_prompt_confidence_factors(prompt, context)
+        confidence_factors.extend(prompt_factors)
         
         return sum(confidence_factors) / len(confidence_factors) if confidence_factors else 0.5
     
+    def _calculate_prompt_confidence_factors(self, prompt: str, context: PromptContext) -> List[float]:
+        """计算只依赖prompt文本的置信度因子"""
+        return [
+            # 模板匹配度
+            self._calculate_template_match(prompt, context),
+            # 长度合理性
+            self._calculate_length_reasonableness(prompt),
+            # 结构完整性
+            self._calculate_structure_completeness(prompt)
+        ]
+    
     def _calculate_template_match(self, prompt: str, context: PromptContext) -> float:
         """计算模板匹配度"""
         # 基于关键词匹配
@@ -764,6 +883,34 @@ class DynamicPromptManager:
         
         return builders
     
+    def _init_section_cache_keys(self) -> Dict[PromptSection, callable]:
+        """初始化各部分的缓存键函数，键只包含对应构建器实际读取的输入"""
+        def role_key(template, base_prompt, memory_result, context):
+            return template.agent_role
+        
+        def memory_key(template, base_prompt, memory_result, context):
+            return tuple(memory.content for memory in memory_result.memories)
+        
+        def task_context_key(template, base_prompt, memory_result, context):
+            return (context.current_task, context.domain_focus, context.complexity_level)
+        
+        def instructions_key(template, base_prompt, memory_result, context):
+            return base_prompt
+        
+        def constraints_key(template, base_prompt, memory_result, context):
+            return (bool(context.time_constraints), bool(context.quality_requirements))
+        
+        return {
+            PromptSection.SYSTEM_IDENTITY: role_key,
+            PromptSection.ROLE_DESCRIPTION: role_key,
+            PromptSection.MEMORY_SECTION: memory_key,
+            PromptSection.TASK_CONTEXT: task_context_key,
+            PromptSection.INSTRUCTIONS: instructions_key,
+            PromptSection.OUTPUT_FORMAT: role_key,
+            PromptSection.EXAMPLES: role_key,
+            PromptSection.CONSTRAINTS: constraints_key
+        }
+    
     def _init_memory_integrators(self) -> Dict[str, callable]:
         """初始化记忆整合器"""
         integrators = {}
@@ -851,7 +998,8 @@ class DynamicPromptManager:
             "templates_loaded": len(self.templates),
             "section_builders": list(self.section_builders.keys()),
             "memory_integrators": list(self.memory_integrators.keys()),
-            "optimization_strategies": list(self.optimization_strategies.keys())
+            "optimization_strategies": list(self.optimization_strategies.keys()),
+            "cache_stats": self.get_cache_statistics()
         }
 
 
@@ -10,6 +10,7 @@
 """
 
 import logging
+import threading
 import time
 import uuid
 import json
@@ -209,6 +210,49 @@ class ElasticsearchVectorStore:
             logger.error(f"向量存储添加记忆失败: {e}")
             return False
     
+    def add_memories(self, memories: List[EnhancedMemoryEntry]) -> int:
+        """批量添加记忆到向量存储（一次批量向量化 + 一次bulk写入）
+        
+        Returns:
+            成功写入的记忆数量
+        """
+        if not self.es or not self.encoder or not memories:
+            return 0
+            
+        try:
+            from elasticsearch.helpers import bulk
+            
+            # 批量生成向量
+            vectors = self.encoder.embed_documents([memory.content for memory in memories])
+            
+            actions = [
+                {
+                    "_index": self.index_name,
+                    "_id": memory.id,
+                    "_source": {
+                        "content": memory.content,
+                        "vector": vector,
+                        "memory_type": memory.memory_type,
+                        "namespace": "/".join(memory.namespace),
+                        "agent_role": memory.agent_role,
+                        "domain": memory.domain,
+                        "importance_score": memory.importance_score,
+                        "created_at": self._format_timestamp(memory.created_at),
+                        "metadata": memory.metadata
+                    }
+                }
+                for memory, vector in zip(memories, vectors)
+            ]
+            
+            success_count, errors = bulk(self.es, actions, raise_on_error=False)
+            if errors:
+                logger.warning(f"向量存储批量写入部分失败: {len(errors)} 条")
+            return success_count
+            
+        except Exception as e:
+            logger.error(f"向量存储批量添加记忆失败: {e}")
+            return 0
+    
     def search_similar(self, query: str, agent_role: Optional[str] = None, 
                       limit: int = 10) -> List[Dict[str, Any]]:
         """搜索相似记忆"""
@@ -281,6 +325,9 @@ class LangGraphMemoryStore:
         self.index_name = index_name
         self.vector_store = ElasticsearchVectorStore(es_config, f"{index_name}-vectors")
         self.memories: Dict[str, Dict[str, Any]] = {}
+        # 写后队列的后台线程与请求线程并发读写内存缓存：写入和删除持锁，
+        # 遍历读取在锁内取快照后再迭代
+        self._memories_lock = threading.RLock()
         
         logger.info("LangGraph记忆存储初始化完成")
     
@@ -319,7 +366,8 @@ class LangGraphMemoryStore:
                 logger.warning(f"添加记忆到向量存储失败: {e}")
         
         # 存储到内存
-        self.memories[memory_key] = value
+        with self._memories_lock:
+            self.memories[memory_key] = value
         
         logger.debug(f"存储记忆: {memory_key}")
     
@@ -328,15 +376,15 @@ class LangGraphMemoryStore:
         namespace_str = "/".join(namespace)
         memory_key = f"{namespace_str}/{key}"
         
-        if memory_key in self.memories:
-            memory = self.memories[memory_key]
+        with self._memories_lock:
+            memory = self.memories.get(memory_key)
+            if memory is None:
+                return []
             # 更新访问信息
             memory['last_accessed'] = time.time()
             memory['access_count'] = memory.get('access_count', 0) + 1
-            
-            return [{"key": key, "value": memory, "namespace": list(namespace)}]
         
-        return []
+        return [{"key": key, "value": memory, "namespace": list(namespace)}]
     
     def search(self, namespace_prefix: Tuple[str, ...], query: str, 
                limit: int = 10) -> List[Dict[str, Any]]:
@@ -344,8 +392,11 @@ class LangGraphMemoryStore:
         namespace_prefix_str = "/".join(namespace_prefix)
         results = []
         
+        with self._memories_lock:
+            snapshot = list(self.memories.items())
+        
         # 简单的文本匹配搜索
-        for memory_key, memory_value in self.memories.items():
+        for memory_key, memory_value in snapshot:
             if memory_key.startswith(namespace_prefix_str):
                 content = memory_value.get('content', '')
                 if query.lower() in content.lower():
@@ -370,8 +421,9 @@ class LangGraphMemoryStore:
         namespace_str = "/".join(namespace)
         memory_key = f"{namespace_str}/{key}"
         
-        if memory_key in self.memories:
-            del self.memories[memory_key]
+        with self._memories_lock:
+            removed = self.memories.pop(memory_key, None)
+        if removed is not None:
             logger.debug(f"删除记忆: {memory_key}")
 
 
@@ -439,7 +491,8 @@ class EnhancedLangGraphMemoryStore(LangGraphMemoryStore):
         
         # 存储到增强缓存
         memory_key = f"{namespace.to_string()}/{memory_id}"
-        self.enhanced_memories[memory_key] = enhanced_memory
+        with self._memories_lock:
+            self.enhanced_memories[memory_key] = enhanced_memory
         
         # 添加到向量存储
         self.vector_store.add_memory(enhanced_memory)
@@ -447,6 +500,76 @@ class EnhancedLangGraphMemoryStore(LangGraphMemoryStore):
         logger.info(f"智能体记忆存储成功: {agent_role} -> {namespace.domain.value} -> {memory_id}")
         return memory_id
     
+    def put_agent_memories_bulk(self, requests: List[Any]) -> int:
+        """批量存储智能体记忆
+        
+        供记忆写后队列使用：先写入内存缓存，再统一批量向量化并bulk写入Elasticsearch，
+        每个批次只产生一次嵌入API调用和一次索引请求。
+        
+        Args:
+            requests: MemoryWriteRequest列表
+            
+        Returns:
+            成功存储的记忆数量；向量存储可用时为实际写入索引的数量
+        """
+        entries = []
+        cache_updates = []
+        for request in requests:
+            try:
+                namespace = self.namespace_manager.create_namespace(
+                    user_id=request.user_id,
+                    agent_role=request.agent_role,
+                    memory_type=request.memory_type,
+                    content=request.content,
+                    domain_hint=request.domain_hint
+                )
+                now = time.time()
+                enhanced_memory = EnhancedMemoryEntry(
+                    id=request.memory_id,
+                    content=request.content,
+                    memory_type=request.memory_type,
+                    namespace=namespace.to_tuple(),
+                    created_at=request.enqueued_at,
+                    last_accessed=now,
+                    access_count=0,
+                    importance_score=request.importance_score,
+                    metadata=request.metadata or {},
+                    agent_role=request.agent_role,
+                    domain=namespace.domain.value
+                )
+                
+                memory_key = f"{namespace.to_string()}/{request.memory_id}"
+                cache_updates.append((memory_key, {
+                    'content': request.content,
+                    'memory_type': request.memory_type,
+                    'importance_score': request.importance_score,
+                    'metadata': request.metadata or {},
+                    'agent_role': request.agent_role,
+                    'domain': namespace.domain.value,
+                    'created_at': request.enqueued_at,
+                    'last_accessed': now,
+                    'access_count': 0
+                }, enhanced_memory))
+                entries.append(enhanced_memory)
+            except Exception as e:
+                logger.error(f"构建批量记忆条目失败: {e}")
+        
+        # 整批在锁内写入两份缓存，读取方不会看到只写了一半的批次
+        with self._memories_lock:
+            for memory_key, value, enhanced_memory in cache_updates:
+                self.memories[memory_key] = value
+                self.enhanced_memories[memory_key] = enhanced_memory
+        
+        if not entries:
+            return 0
+        
+        indexed_count = self.vector_store.add_memories(entries)
+        logger.info(f"批量存储智能体记忆: {len(entries)} 条, 向量索引 {indexed_count} 条")
+        if self.vector_store.es is None or self.vector_store.encoder is None:
+            # 未配置向量存储时只有内存缓存，写入缓存即为成功
+            return len(entries)
+        return indexed_count
+    
     def search_agent_memories(
         self,
         user_id: str,
@@ -601,7 +724,8 @@ class EnhancedLangGraphMemoryStore(LangGraphMemoryStore):
                     
                     # 存储增强记忆
                     memory_key = f"migrated/{enhanced_memory.id}"
-                    self.enhanced_memories[memory_key] = enhanced_memory
+                    with self._memories_lock:
+                        self.enhanced_memories[memory_key] = enhanced_memory
                     
                     migrated_count += 1
                     
@@ -628,7 +752,9 @@ class EnhancedLangGraphMemoryStore(LangGraphMemoryStore):
         
         # 统计增强记忆
         agent_memories = []
-        for memory in self.enhanced_memories.values():
+        with self._memories_lock:
+            snapshot = list(self.enhanced_memories.values())
+        for memory in snapshot:
             if (memory.agent_role == agent_role and 
                 memory.namespace[0] == user_id):
                 agent_memories.append(memory)
@@ -667,22 +793,23 @@ class EnhancedLangGraphMemoryStore(LangGraphMemoryStore):
         current_time = time.time()
         max_age_seconds = max_age_days * 24 * 3600
         
-        # 收集要删除的记忆
-        to_delete = []
-        for memory_key, memory in self.enhanced_memories.items():
-            if (memory.agent_role == agent_role and 
-                memory.namespace[0] == user_id):
-                
-                # 检查重要性和年龄
-                age = current_time - memory.created_at
-                if (memory.importance_score < min_importance or 
-                    age > max_age_seconds):
-                    to_delete.append(memory_key)
-        
-        # 删除记忆
-        for memory_key in to_delete:
-            del self.enhanced_memories[memory_key]
-            cleaned_count += 1
+        with self._memories_lock:
+            # 收集要删除的记忆
+            to_delete = []
+            for memory_key, memory in self.enhanced_memories.items():
+                if (memory.agent_role == agent_role and 
+                    memory.namespace[0] == user_id):
+                    
+                    # 检查重要性和年龄
+                    age = current_time - memory.created_at
+                    if (memory.importance_score < min_importance or 
+                        age > max_age_seconds):
+                        to_delete.append(memory_key)
+            
+            # 删除记忆
+            for memory_key in to_delete:
+                del self.enhanced_memories[memory_key]
+                cleaned_count += 1
         
         logger.info(f"清理了 {cleaned_count} 条智能体记忆")
         return cleaned_count
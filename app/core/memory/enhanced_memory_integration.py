@@ -25,6 +25,7 @@ from app.core.memory.enhanced_memory_namespace import (
     DomainTag,
     MemoryType
 )
+from app.core.memory.memory_write_queue import MemoryWriteBehindQueue, MemoryWriteRequest
 from app.core.state import IsotopeSystemState
 from app.core.config import ConfigManager
 
@@ -80,6 +81,22 @@ class EnhancedMemoryIntegration:
             'enable_cross_agent_sharing': True
         }
         
+        # 写后队列：向量化和ES索引移出请求路径
+        if isinstance(config, ConfigManager):
+            memory_config = config.get_memory_config()
+        else:
+            memory_config = self.config.get('memory', {})
+        write_behind_config = memory_config.get('write_behind', {})
+        self.write_queue: Optional[MemoryWriteBehindQueue] = None
+        if write_behind_config.get('enabled', True):
+            self.write_queue = MemoryWriteBehindQueue(
+                self.enhanced_store,
+                max_queue_size=write_behind_config.get('max_queue_size', 1000),
+                batch_size=write_behind_config.get('batch_size', 32),
+                flush_interval=write_behind_config.get('flush_interval', 0.5),
+                put_timeout=write_behind_config.get('put_timeout', 0.05)
+            )
+        
         logger.info("增强记忆集成初始化完成")
     
     def extract_memories_from_state(
@@ -112,7 +129,7 @@ class EnhancedMemoryIntegration:
                     domain_hint = self._infer_domain_from_content(content, agent_role)
                     
                     # 保存智能体特定的记忆
-                    memory_id = self.enhanced_store.put_agent_memory(
+                    memory_id = self._put_agent_memory(
                         user_id=user_id,
                         agent_role=agent_role,
                         content=content,
@@ -141,7 +158,7 @@ class EnhancedMemoryIntegration:
                     # 推断工具相关的领域
                     domain_hint = self._infer_domain_from_tool(tool_name, agent_role)
                     
-                    memory_id = self.enhanced_store.put_agent_memory(
+                    memory_id = self._put_agent_memory(
                         user_id=user_id,
                         agent_role=agent_role,
                         content=content,
@@ -271,7 +288,7 @@ class EnhancedMemoryIntegration:
             domain_hint = self._infer_domain_from_content(interaction_summary, agent_role)
             
             # 保存为情节记忆
-            memory_id = self.enhanced_store.put_agent_memory(
+            memory_id = self._put_agent_memory(
                 user_id=user_id,
                 agent_role=agent_role,
                 content=content,
@@ -292,6 +309,26 @@ class EnhancedMemoryIntegration:
             logger.error(f"保存智能体交互记忆失败: {e}")
             return None
     
+    def flush_pending_writes(self, timeout: Optional[float] = None) -> bool:
+        """等待写后队列中的记忆全部写入"""
+        if self.write_queue is None:
+            return True
+        return self.write_queue.flush(timeout)
+    
+    def close(self) -> None:
+        """关闭记忆集成，刷新尚未写入的记忆"""
+        if self.write_queue is not None:
+            self.write_queue.close()
+    
+    def get_integration_stats(self) -> Dict[str, Any]:
+        """获取记忆集成统计信息"""
+        stats = {
+            'write_behind_enabled': self.write_queue is not None
+        }
+        if self.write_queue is not None:
+            stats['write_queue'] = self.write_queue.get_metrics()
+        return stats
+    
     def get_cross_agent_shared_memories(
         self,
         user_id: str,
@@ -332,6 +369,38 @@ class EnhancedMemoryIntegration:
             logger.error(f"智能体记忆迁移失败: {e}")
             return 0
     
+    def _put_agent_memory(
+        self,
+        user_id: str,
+        agent_role: str,
+        content: str,
+        memory_type: str = "semantic",
+        domain_hint: Optional[str] = None,
+        importance_score: float = 1.0,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """存储智能体记忆，启用写后队列时仅入队并立即返回预分配的ID"""
+        if self.write_queue is None:
+            return self.enhanced_store.put_agent_memory(
+                user_id=user_id,
+                agent_role=agent_role,
+                content=content,
+                memory_type=memory_type,
+                domain_hint=domain_hint,
+                importance_score=importance_score,
+                metadata=metadata
+            )
+        
+        return self.write_queue.submit(MemoryWriteRequest(
+            user_id=user_id,
+            agent_role=agent_role,
+            content=content,
+            memory_type=memory_type,
+            domain_hint=domain_hint,
+            importance_score=importance_score,
+            metadata=metadata or {}
+        ))
+    
     def _analyze_content_for_memory(self, content: str, agent_role: str) -> Tuple[Optional[str], float]:
         """分析内容确定记忆类型和重要性"""
         content_lower = content.lower()
@@ -3,6 +3,7 @@
 """
 
 import logging
+from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional, Union, Callable
 from langchain_core.messages import (
     BaseMessage, 
@@ -15,6 +16,8 @@ from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
 
+from app.core.memory.token_counter import count_message_tokens, get_message_content
+
 # 特殊消息类型，用于标记需要删除的消息
 class RemoveMessage(BaseMessage):
     """用于标记需要从历史记录中删除的消息"""
@@ -33,6 +36,22 @@ class RemoveMessage(BaseMessage):
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 滚动摘要系统消息的固定ID，每次压缩原地替换
+HISTORY_SUMMARY_MESSAGE_ID = "history_summary"
+
+
+@dataclass
+class HistoryCompactionResult:
+    """历史压缩结果"""
+    messages: List[Any]
+    summary: Optional[str] = None
+    compacted: bool = False
+    evicted_count: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+    evicted_ids: List[str] = field(default_factory=list)
+
+
 class HistoryManager:
     """会话历史管理器"""
     
@@ -261,6 +280,229 @@ class HistoryManager:
         
         return to_remove
     
+    @staticmethod
+    def compact_history(
+        messages: List[Any],
+        llm: Optional[BaseChatModel] = None,
+        running_summary: Optional[str] = None,
+        max_tokens: int = 6000,
+        target_tokens: int = 4000,
+        keep_last_n: int = 4
+    ) -> HistoryCompactionResult:
+        """基于token预算的增量历史压缩
+        
+        仅当历史超过max_tokens时触发：从最旧的非系统消息开始驱逐，直到总量降到
+        target_tokens以下（两个阈值之间的空间避免每轮都触发总结）。被驱逐的对话
+        只与已有的滚动摘要合并，不会重新总结整个历史。
+        
+        Args:
+            messages: 当前消息列表
+            llm: 用于扩展摘要的语言模型，为None时使用规则化总结
+            running_summary: 已有的滚动摘要
+            max_tokens: 触发压缩的token上限
+            target_tokens: 压缩后的目标token数
+            keep_last_n: 始终保留的最近消息数
+            
+        Returns:
+            压缩结果，compacted为False时messages为原列表
+        """
+        token_counts = [count_message_tokens(msg) for msg in messages]
+        tokens_before = sum(token_counts)
+        
+        if tokens_before <= max_tokens:
+            return HistoryCompactionResult(
+                messages=messages,
+                summary=running_summary,
+                tokens_before=tokens_before,
+                tokens_after=tokens_before
+            )
+        
+        # 按从旧到新顺序选择被驱逐的消息，最近keep_last_n条和系统消息始终保留；
+        # 带tool_calls的AI消息与其ToolMessage回复作为一个整体驱逐，避免留下孤立的工具结果
+        evictable_end = max(0, len(messages) - keep_last_n)
+        evicted_positions = set()
+        evicted_messages = []
+        remaining_tokens = tokens_before
+        i = 0
+        while i < evictable_end:
+            if remaining_tokens <= target_tokens:
+                break
+            if HistoryManager._is_system_message(messages[i]):
+                i += 1
+                continue
+            group_end = HistoryManager._tool_call_group_end(messages, i)
+            if group_end > evictable_end:
+                # 工具调用组延伸到保留区内，整组保留
+                break
+            for j in range(i, group_end):
+                evicted_positions.add(j)
+                evicted_messages.append(messages[j])
+                remaining_tokens -= token_counts[j]
+            i = group_end
+        
+        if not evicted_messages:
+            return HistoryCompactionResult(
+                messages=messages,
+                summary=running_summary,
+                tokens_before=tokens_before,
+                tokens_after=tokens_before
+            )
+        
+        # 只用新驱逐的对话扩展滚动摘要
+        summary = HistoryManager.extend_summary(running_summary, evicted_messages, llm)
+        summary_message = HistoryManager.build_summary_message(summary)
+        
+        # 单次遍历重建消息列表：按位置集合O(1)判断删除，原摘要消息原地替换
+        compacted_messages = []
+        summary_inserted = False
+        for i, msg in enumerate(messages):
+            if i in evicted_positions:
+                continue
+            if HistoryManager._get_message_id(msg) == HISTORY_SUMMARY_MESSAGE_ID:
+                if not summary_inserted:
+                    compacted_messages.append(summary_message)
+                    summary_inserted = True
+                continue
+            if not summary_inserted and not HistoryManager._is_system_message(msg):
+                compacted_messages.append(summary_message)
+                summary_inserted = True
+            compacted_messages.append(msg)
+        if not summary_inserted:
+            compacted_messages.append(summary_message)
+        
+        evicted_ids = [
+            msg_id for msg_id in (HistoryManager._get_message_id(msg) for msg in evicted_messages)
+            if msg_id
+        ]
+        tokens_after = remaining_tokens + count_message_tokens(summary_message)
+        
+        logger.info(
+            f"历史压缩完成: 驱逐 {len(evicted_messages)} 条消息, "
+            f"token {tokens_before} -> {tokens_after}"
+        )
+        
+        return HistoryCompactionResult(
+            messages=compacted_messages,
+            summary=summary,
+            compacted=True,
+            evicted_count=len(evicted_messages),
+            tokens_before=tokens_before,
+            tokens_after=tokens_after,
+            evicted_ids=evicted_ids
+        )
+    
+    @staticmethod
+    def build_summary_message(summary: str) -> SystemMessage:
+        """构建滚动摘要系统消息"""
+        return SystemMessage(
+            content=f"对话历史总结: {summary}",
+            id=HISTORY_SUMMARY_MESSAGE_ID
+        )
+    
+    @staticmethod
+    def extend_summary(
+        running_summary: Optional[str],
+        new_messages: List[Any],
+        llm: Optional[BaseChatModel] = None
+    ) -> str:
+        """将新驱逐的对话合并进已有摘要
+        
+        Args:
+            running_summary: 已有的滚动摘要
+            new_messages: 新驱逐的消息
+            llm: 用于总结的语言模型
+            
+        Returns:
+            更新后的摘要
+        """
+        dialogue = [
+            msg for msg in new_messages
+            if HistoryManager._get_message_type(msg) in ("human", "ai")
+        ]
+        if not dialogue:
+            return running_summary or ""
+        
+        if llm is None:
+            new_part = HistoryManager._rule_based_summarize([
+                msg if isinstance(msg, BaseMessage) else
+                (HumanMessage if HistoryManager._get_message_type(msg) == "human" else AIMessage)(
+                    content=get_message_content(msg)
+                )
+                for msg in dialogue
+            ])
+            return f"{running_summary}\n{new_part}" if running_summary else new_part
+        
+        try:
+            history_text = "\n".join([
+                f"{'用户' if HistoryManager._get_message_type(msg) == 'human' else 'AI'}: {get_message_content(msg)}"
+                for msg in dialogue
+            ])
+            
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", "你是一个专业的对话总结助手。你会收到已有的对话摘要和之后新增的对话，请输出合并后的简洁摘要，保留所有重要的事实、决策和上下文。"),
+                ("human", "已有摘要:\n{summary}\n\n新增对话:\n{history}")
+            ])
+            
+            chain = prompt | llm
+            result = chain.invoke({
+                "summary": running_summary or "（无）",
+                "history": history_text
+            })
+            
+            if hasattr(result, "content"):
+                return result.content
+            elif isinstance(result, dict) and "content" in result:
+                return result["content"]
+            else:
+                return str(result)
+        
+        except Exception as e:
+            logger.error(f"使用LLM扩展历史摘要失败: {str(e)}")
+            return HistoryManager.extend_summary(running_summary, dialogue, None)
+    
+    @staticmethod
+    def _get_message_type(message: Any) -> Optional[str]:
+        """获取消息类型，兼容BaseMessage与字典格式"""
+        if isinstance(message, dict):
+            return message.get("type") or {
+                "user": "human", "assistant": "ai"
+            }.get(message.get("role"), message.get("role"))
+        return getattr(message, "type", None)
+    
+    @staticmethod
+    def _get_message_id(message: Any) -> Optional[str]:
+        """获取消息ID"""
+        if isinstance(message, dict):
+            return message.get("id")
+        return getattr(message, "id", None)
+    
+    @staticmethod
+    def _get_tool_calls(message: Any) -> List[Any]:
+        """获取AI消息发起的工具调用列表"""
+        if isinstance(message, dict):
+            return message.get("tool_calls") or []
+        return getattr(message, "tool_calls", None) or []
+    
+    @staticmethod
+    def _tool_call_group_end(messages: List[Any], start: int) -> int:
+        """返回从start开始的驱逐单元的结束位置（不含）
+        
+        带tool_calls的AI消息与紧随其后的ToolMessage回复组成一个单元；
+        开头的孤立ToolMessage也与其后连续的ToolMessage一起处理。
+        """
+        end = start + 1
+        if (HistoryManager._get_message_type(messages[start]) != "tool"
+                and not HistoryManager._get_tool_calls(messages[start])):
+            return end
+        while end < len(messages) and HistoryManager._get_message_type(messages[end]) == "tool":
+            end += 1
+        return end
+    
+    @staticmethod
+    def _is_system_message(message: Any) -> bool:
+        """判断是否为系统消息"""
+        return HistoryManager._get_message_type(message) == "system"
+    
     @staticmethod
     def filter_messages(
         messages: List[BaseMessage], 
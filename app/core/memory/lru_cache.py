@@ -0,0 +1,52 @@
+"""
+线程安全LRU缓存 - 供token计数、提示词段落等进程内缓存共用
+
+OrderedDict本身不是线程安全的：并发的get/move_to_end/popitem可能抛出
+KeyError或破坏内部链表，因此所有访问都在同一把锁内完成。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """带容量上限的线程安全LRU缓存"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, int(max_size))
+        self._data: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        """读取缓存项，命中时刷新为最近使用"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        """写入缓存项，超出容量时淘汰最久未使用的项"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._data
@@ -22,6 +22,10 @@ from .enhanced_memory_namespace import AgentRole, DomainTag, MemoryType
 from .enhanced_langgraph_store import EnhancedMemoryEntry
 from .agent_memory_preferences import MemoryPreference, MemoryFeedback
 from .memory_relevance_scorer import RelevanceScore, ScoringContext
+from .usage_rollup_store import (
+    UsageRollup, UsageRollupStore, DistinctCounter,
+    DEFAULT_FINE_RETENTION_SECONDS, DEFAULT_HOUR_RETENTION_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
@@ -94,13 +98,21 @@ class MemoryUsageMonitor:
         self.config = config or {}
         self.logger = logging.getLogger(__name__)
         
-        # 数据存储
-        self.usage_events: deque = deque(maxlen=10000)  # 保留最近1万个事件
-        self.agent_metrics: Dict[str, AgentMetrics] = {}
-        self.daily_summaries: Dict[str, Dict[str, Any]] = {}  # date -> summary
-        
         # 监控配置
         self.monitoring_config = self._init_monitoring_config()
+        
+        # 数据存储：原始事件为定长环形缓冲，仅用于单条记忆分析；聚合指标读取预聚合汇总
+        self.usage_events: deque = deque(maxlen=self.config.get("event_capacity", 10000))
+        self.agent_metrics: Dict[str, AgentMetrics] = {}
+        self.daily_summaries: Dict[str, Dict[str, Any]] = {}  # date -> summary
+        bucket_seconds = self.config.get("rollup_bucket_seconds", 60)
+        retention = self.monitoring_config["retention_policy"]["events"]
+        self.rollups = UsageRollupStore(
+            bucket_seconds=bucket_seconds,
+            retention_buckets=int(retention.total_seconds() // bucket_seconds),
+            fine_retention_seconds=self.config.get("rollup_fine_retention_seconds", DEFAULT_FINE_RETENTION_SECONDS),
+            hour_retention_seconds=self.config.get("rollup_hour_retention_seconds", DEFAULT_HOUR_RETENTION_SECONDS)
+        )
         self.metric_calculators = self._init_metric_calculators()
         self.performance_analyzers = self._init_performance_analyzers()
         
@@ -145,8 +157,9 @@ class MemoryUsageMonitor:
         # 计算性能指标
         event.performance_metrics = self._calculate_event_metrics(event, memory)
         
-        # 存储事件
+        # 存储事件并累加到时间桶汇总
         self.usage_events.append(event)
+        self.rollups.add_event(event)
         self.monitor_stats["total_events_recorded"] += 1
         
         # 更新智能体指标
@@ -181,29 +194,29 @@ class MemoryUsageMonitor:
             start_time = end_time - timedelta(days=7)  # 默认最近7天
             time_range = (start_time, end_time)
         
-        # 筛选相关事件
-        relevant_events = self._filter_events_by_time_range(time_range)
-        if agent_roles:
-            relevant_events = [e for e in relevant_events if e.agent_role in agent_roles]
+        # 合并时间范围内的预聚合汇总
+        role_rollups = self.rollups.aggregate(time_range, agent_roles)
         
         # 计算智能体指标
         agent_metrics = {}
-        target_agents = agent_roles or list(set(e.agent_role for e in relevant_events))
+        target_agents = agent_roles or list(role_rollups.keys())
         
         for agent_role in target_agents:
-            agent_metrics[agent_role] = self._calculate_agent_metrics_for_period(
-                agent_role, time_range
+            rollup = role_rollups.get(agent_role)
+            agent_metrics[agent_role] = (
+                self._agent_metrics_from_rollup(agent_role, rollup)
+                if rollup else AgentMetrics(agent_role=agent_role)
             )
         
         # 计算整体统计
-        overall_stats = self._calculate_overall_statistics(relevant_events)
+        overall_stats = self._calculate_overall_statistics(role_rollups, time_range, agent_roles)
         
         # 生成洞察和建议
         insights = self._generate_performance_insights(agent_metrics, overall_stats)
         recommendations = self._generate_optimization_recommendations(agent_metrics, overall_stats)
         
         # 详细分析
-        detailed_analysis = self._perform_detailed_analysis(relevant_events, agent_metrics)
+        detailed_analysis = self._perform_detailed_analysis(role_rollups, agent_metrics)
         
         report = MemoryPerformanceReport(
             report_id=f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
@@ -380,31 +393,19 @@ class MemoryUsageMonitor:
             self._recalculate_complex_metrics(agent_role)
     
     def _recalculate_complex_metrics(self, agent_role: str):
-        """重新计算复杂指标"""
-        # 获取该智能体的最近事件
-        recent_events = [e for e in list(self.usage_events)[-1000:] 
-                        if e.agent_role == agent_role]
+        """重新计算复杂指标（读取最近一小时的汇总）"""
+        end_time = datetime.now()
+        start_time = end_time - self.monitoring_config["analysis_intervals"]["short_term"]
+        rollup = self.rollups.aggregate((start_time, end_time), [agent_role]).get(agent_role)
         
-        if not recent_events:
+        if not rollup:
             return
         
         metrics = self.agent_metrics[agent_role]
-        
-        # 计算独特记忆使用数量
-        unique_memories = len(set(e.memory_id for e in recent_events))
-        metrics.unique_memories_used = unique_memories
-        
-        # 计算记忆命中率
-        access_events = [e for e in recent_events if e.event_type == "access"]
-        successful_accesses = [e for e in access_events 
-                             if e.usage_result and e.usage_result.get("success", False)]
-        if access_events:
-            metrics.memory_hit_rate = len(successful_accesses) / len(access_events)
-        
-        # 计算新鲜度分数
-        freshness_scores = [e.performance_metrics.get("freshness", 0.5) for e in recent_events]
-        if freshness_scores:
-            metrics.memory_freshness_score = statistics.mean(freshness_scores)
+        metrics.unique_memories_used = len(rollup.memory_ids)
+        if rollup.access_count:
+            metrics.memory_hit_rate = rollup.hit_rate
+        metrics.memory_freshness_score = rollup.average_freshness
     
     def _calculate_agent_metrics_for_period(
         self,
@@ -412,100 +413,75 @@ class MemoryUsageMonitor:
         time_range: Tuple[datetime, datetime]
     ) -> AgentMetrics:
         """计算指定时间段的智能体指标"""
-        # 筛选相关事件
-        relevant_events = [
-            e for e in self.usage_events
-            if e.agent_role == agent_role and time_range[0] <= e.timestamp <= time_range[1]
-        ]
-        
-        if not relevant_events:
+        rollup = self.rollups.aggregate(time_range, [agent_role]).get(agent_role)
+        if not rollup:
             return AgentMetrics(agent_role=agent_role)
-        
-        metrics = AgentMetrics(agent_role=agent_role)
-        
-        # 基础计数
-        metrics.total_memory_accesses = len(relevant_events)
-        metrics.unique_memories_used = len(set(e.memory_id for e in relevant_events))
-        
-        # 平均相关性分数
-        relevance_scores = [e.relevance_score for e in relevant_events 
-                          if e.relevance_score is not None]
-        if relevance_scores:
-            metrics.average_relevance_score = statistics.mean(relevance_scores)
-        
-        # 记忆命中率
-        access_events = [e for e in relevant_events if e.event_type == "access"]
-        successful_accesses = [e for e in access_events 
-                             if e.usage_result and e.usage_result.get("success", False)]
-        if access_events:
-            metrics.memory_hit_rate = len(successful_accesses) / len(access_events)
-        
-        # 任务完成率
-        task_events = [e for e in relevant_events 
-                      if e.usage_result and "task_completed" in e.usage_result]
-        if task_events:
-            completed_tasks = sum(1 for e in task_events 
-                                if e.usage_result.get("task_completed", False))
-            metrics.task_completion_rate = completed_tasks / len(task_events)
-        
-        # 错误率
-        error_events = [e for e in relevant_events 
-                       if e.usage_result and e.usage_result.get("error", False)]
-        metrics.error_rate = len(error_events) / len(relevant_events)
-        
-        # 新鲜度分数
-        freshness_scores = [e.performance_metrics.get("freshness", 0.5) for e in relevant_events]
-        if freshness_scores:
-            metrics.memory_freshness_score = statistics.mean(freshness_scores)
-        
-        # 跨智能体使用比例
-        cross_agent_events = [e for e in relevant_events 
-                            if e.context.get("cross_agent_memory", False)]
-        metrics.cross_agent_usage_ratio = len(cross_agent_events) / len(relevant_events)
-        
-        metrics.last_updated = datetime.now()
-        return metrics
+        return self._agent_metrics_from_rollup(agent_role, rollup)
     
-    def _filter_events_by_time_range(
-        self,
-        time_range: Tuple[datetime, datetime]
-    ) -> List[MemoryUsageEvent]:
-        """按时间范围筛选事件"""
-        return [e for e in self.usage_events 
-                if time_range[0] <= e.timestamp <= time_range[1]]
+    def _agent_metrics_from_rollup(self, agent_role: str, rollup: UsageRollup) -> AgentMetrics:
+        """由合并后的汇总构建智能体指标"""
+        return AgentMetrics(
+            agent_role=agent_role,
+            total_memory_accesses=rollup.event_count,
+            unique_memories_used=len(rollup.memory_ids),
+            average_relevance_score=rollup.average_relevance,
+            memory_hit_rate=rollup.hit_rate,
+            task_completion_rate=rollup.task_completion_rate,
+            memory_freshness_score=rollup.average_freshness,
+            cross_agent_usage_ratio=rollup.cross_agent_ratio,
+            error_rate=rollup.error_rate,
+            last_updated=datetime.now()
+        )
     
     def _calculate_overall_statistics(
         self,
-        events: List[MemoryUsageEvent]
+        role_rollups: Dict[str, UsageRollup],
+        time_range: Optional[Tuple[datetime, datetime]] = None,
+        agent_roles: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """计算整体统计信息"""
-        if not events:
+        if not role_rollups:
             return {}
         
+        overall = UsageRollup()
+        for rollup in role_rollups.values():
+            overall.merge(rollup)
+        
         stats = {
-            "total_events": len(events),
-            "unique_agents": len(set(e.agent_role for e in events)),
-            "unique_memories": len(set(e.memory_id for e in events)),
-            "unique_sessions": len(set(e.session_id for e in events)),
-            "event_types": dict(defaultdict(int))
+            "total_events": overall.event_count,
+            "unique_agents": len(role_rollups),
+            "unique_memories": len(overall.memory_ids),
+            "unique_sessions": len(overall.sessions),
+            "event_types": dict(overall.event_types),
+            "relevance_histogram": list(overall.relevance_histogram)
         }
         
-        # 事件类型分布
-        for event in events:
-            stats["event_types"][event.event_type] = stats["event_types"].get(event.event_type, 0) + 1
-        
         # 平均相关性分数
-        relevance_scores = [e.relevance_score for e in events if e.relevance_score is not None]
-        if relevance_scores:
-            stats["average_relevance"] = statistics.mean(relevance_scores)
-            stats["relevance_std"] = statistics.stdev(relevance_scores) if len(relevance_scores) > 1 else 0
+        if overall.relevance_count:
+            stats["average_relevance"] = overall.average_relevance
+            stats["relevance_std"] = overall.relevance_std
         
         # 时间分析
-        time_distribution = self._analyze_time_distribution(events)
-        stats["time_distribution"] = time_distribution
+        stats["time_distribution"] = self._analyze_rollup_time_distribution(time_range, agent_roles)
         
         return stats
     
+    def _analyze_rollup_time_distribution(
+        self,
+        time_range: Optional[Tuple[datetime, datetime]] = None,
+        agent_roles: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """基于时间桶汇总分析时间分布"""
+        hourly_distribution = defaultdict(int)
+        daily_distribution = defaultdict(int)
+        for bucket_start, _, rollup in self.rollups.iter_rollups(time_range, agent_roles):
+            for hour, count in enumerate(rollup.hourly_events):
+                if count:
+                    hourly_distribution[hour] += count
+            daily_distribution[bucket_start.strftime("%Y-%m-%d")] += rollup.event_count
+        
+        return self._summarize_time_distribution(hourly_distribution, daily_distribution)
+    
     def _analyze_time_distribution(self, events: List[MemoryUsageEvent]) -> Dict[str, Any]:
         """分析时间分布"""
         if not events:
@@ -523,6 +499,17 @@ class MemoryUsageMonitor:
             day = event.timestamp.strftime("%Y-%m-%d")
             daily_distribution[day] += 1
         
+        return self._summarize_time_distribution(hourly_distribution, daily_distribution)
+    
+    def _summarize_time_distribution(
+        self,
+        hourly_distribution: Dict[int, int],
+        daily_distribution: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """汇总时间分布结果"""
+        if not hourly_distribution:
+            return {}
+        
         return {
             "hourly_distribution": dict(hourly_distribution),
             "daily_distribution": dict(daily_distribution),
@@ -619,7 +606,7 @@ class MemoryUsageMonitor:
     
     def _perform_detailed_analysis(
         self,
-        events: List[MemoryUsageEvent],
+        role_rollups: Dict[str, UsageRollup],
         agent_metrics: Dict[str, AgentMetrics]
     ) -> Dict[str, Any]:
         """执行详细分析"""
@@ -627,16 +614,23 @@ class MemoryUsageMonitor:
         
         # 记忆类型使用分析
         memory_type_usage = defaultdict(int)
-        for event in events:
-            memory_type_usage[event.memory_type] += 1
+        for rollup in role_rollups.values():
+            for memory_type, count in rollup.memory_types.items():
+                memory_type_usage[memory_type] += count
         analysis["memory_type_usage"] = dict(memory_type_usage)
         
         # 会话分析
-        session_analysis = defaultdict(lambda: {"events": 0, "agents": set(), "unique_memories": set()})
-        for event in events:
-            session_analysis[event.session_id]["events"] += 1
-            session_analysis[event.session_id]["agents"].add(event.agent_role)
-            session_analysis[event.session_id]["unique_memories"].add(event.memory_id)
+        session_analysis = defaultdict(lambda: {"events": 0, "agents": set(), "unique_memories": None})
+        for agent_role, rollup in role_rollups.items():
+            for session_id, count in rollup.session_events.items():
+                stats = session_analysis[session_id]
+                stats["events"] += count
+                stats["agents"].add(agent_role)
+                memory_ids = rollup.session_memories.get(session_id)
+                if memory_ids is not None:
+                    if stats["unique_memories"] is None:
+                        stats["unique_memories"] = DistinctCounter(memory_ids.k)
+                    stats["unique_memories"].merge(memory_ids)
         
         # 转换为可序列化格式
         session_stats = {}
@@ -644,7 +638,7 @@ class MemoryUsageMonitor:
             session_stats[session_id] = {
                 "events": stats["events"],
                 "agent_count": len(stats["agents"]),
-                "memory_count": len(stats["unique_memories"])
+                "memory_count": len(stats["unique_memories"] or ())
             }
         analysis["session_analysis"] = session_stats
         
@@ -784,6 +778,8 @@ class MemoryUsageMonitor:
             "monitor_stats": self.monitor_stats,
             "active_agents": len(self.agent_metrics),
             "total_events": len(self.usage_events),
+            "event_capacity": self.usage_events.maxlen,
+            "rollup_store": self.rollups.get_statistics(),
             "cache_size": len(self.metrics_cache),
             "uptime": (datetime.now() - self.monitor_stats["monitoring_start_time"]).total_seconds()
         }
@@ -0,0 +1,207 @@
+"""
+记忆写后队列模块 - 将记忆持久化移出请求路径
+
+本模块负责：
+1. 以有界队列接收记忆写入请求，调用方立即返回
+2. 后台线程按批次合并请求，批量生成向量并批量写入Elasticsearch
+3. 队列满时进行短暂背压等待，超时后回退为同步写入，保证记忆不丢失
+4. 关闭时刷新剩余请求，并导出队列深度与刷新延迟等指标
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MemoryWriteRequest:
+    """记忆写入请求 - 记忆ID在入队时预先分配，调用方可以立即拿到ID"""
+    user_id: str
+    agent_role: str
+    content: str
+    memory_type: str = "semantic"
+    domain_hint: Optional[str] = None
+    importance_score: float = 1.0
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    memory_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    enqueued_at: float = field(default_factory=time.time)
+
+
+class MemoryWriteBehindQueue:
+    """记忆写后队列 - 后台批量写入增强记忆存储"""
+
+    def __init__(
+        self,
+        store: Any,
+        max_queue_size: int = 1000,
+        batch_size: int = 32,
+        flush_interval: float = 0.5,
+        put_timeout: float = 0.05
+    ):
+        """
+        初始化写后队列
+
+        Args:
+            store: 增强记忆存储，需要提供put_agent_memories_bulk方法
+            max_queue_size: 队列最大长度
+            batch_size: 单次批量写入的最大请求数
+            flush_interval: 未攒满批次时的最长等待时间（秒）
+            put_timeout: 队列满时入队的最长等待时间（秒）
+        """
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._queue: "queue.Queue[MemoryWriteRequest]" = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._flush_latencies = deque(maxlen=256)
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'sync_fallback': 0,
+            'batches': 0,
+            'last_flush_at': None
+        }
+
+        self._worker = threading.Thread(
+            target=self._run, name="memory-write-behind", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+        logger.info(f"记忆写后队列已启动: 容量={max_queue_size}, 批次={self.batch_size}")
+
+    def submit(self, request: MemoryWriteRequest) -> str:
+        """提交写入请求，返回预分配的记忆ID
+
+        队列满时等待put_timeout，仍无法入队则在调用线程中同步写入（背压）。
+        """
+        if not self._stop_event.is_set():
+            try:
+                self._queue.put(request, timeout=self.put_timeout)
+                with self._stats_lock:
+                    self._stats['enqueued'] += 1
+                return request.memory_id
+            except queue.Full:
+                logger.warning("记忆写后队列已满，回退为同步写入")
+
+        with self._stats_lock:
+            self._stats['sync_fallback'] += 1
+        self._write_batch([request])
+        return request.memory_id
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到当前已入队的请求全部写入
+
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        Returns:
+            是否在超时前刷新完成
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """停止后台线程，关闭前刷新剩余请求"""
+        if self._stop_event.is_set():
+            return
+        self.flush(timeout)
+        self._stop_event.set()
+        self._worker.join(timeout=1.0)
+
+        # 后台线程退出后仍残留的请求在当前线程写入
+        remaining = self._drain(block=False)
+        if remaining:
+            self._write_batch(remaining)
+        logger.info("记忆写后队列已关闭")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取队列指标"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+            latencies = list(self._flush_latencies)
+
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['queue_capacity'] = self._queue.maxsize
+        if latencies:
+            sorted_latencies = sorted(latencies)
+            metrics['flush_latency_avg_ms'] = sum(latencies) / len(latencies) * 1000
+            p95_index = min(len(sorted_latencies) - 1, int(len(sorted_latencies) * 0.95))
+            metrics['flush_latency_p95_ms'] = sorted_latencies[p95_index] * 1000
+            metrics['flush_latency_max_ms'] = sorted_latencies[-1] * 1000
+        else:
+            metrics['flush_latency_avg_ms'] = 0.0
+            metrics['flush_latency_p95_ms'] = 0.0
+            metrics['flush_latency_max_ms'] = 0.0
+        return metrics
+
+    def _run(self) -> None:
+        """后台线程主循环"""
+        while not self._stop_event.is_set():
+            batch = self._drain(block=True)
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _drain(self, block: bool) -> List[MemoryWriteRequest]:
+        """从队列取出一个批次"""
+        batch: List[MemoryWriteRequest] = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            else:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if block and remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: List[MemoryWriteRequest]) -> None:
+        """批量写入存储并记录指标"""
+        start_time = time.time()
+        try:
+            written = self.store.put_agent_memories_bulk(batch)
+            failed = len(batch) - written
+        except Exception as e:
+            logger.error(f"批量写入记忆失败: {e}")
+            written, failed = 0, len(batch)
+
+        elapsed = time.time() - start_time
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._stats['last_flush_at'] = time.time()
+            self._flush_latencies.append(elapsed)
+
+        logger.debug(f"记忆批量写入完成: {written}/{len(batch)} 条, 耗时 {elapsed * 1000:.1f}ms")
@@ -7,10 +7,15 @@ Prompt长度控制系统 - 阶段3.3：控制prompt长度，避免信息过载
 3. 重要性导向的内容保留
 4. 多级压缩策略
 5. 性能优化和缓存
+
+长度按tokenizer计量：各部分的候选压缩版本及其token开销会被缓存，
+超出预算时按优先级做一次多选背包求解，而不是逐级反复压缩。
 """
 
 import logging
+import math
 import re
+from collections import OrderedDict
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
@@ -20,6 +25,7 @@ import json
 from .enhanced_langgraph_store import EnhancedMemoryEntry
 from .agent_memory_filter import FilteredMemoryResult
 from .dynamic_prompt_manager import GeneratedPrompt, PromptSection
+from .token_counter import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -39,15 +45,60 @@ class ContentPriority(str, Enum):
     LOW = "low"           # 低优先级
     OPTIONAL = "optional"  # 可选内容
 
+# 各部分之间"\n\n"分隔符的token开销
+SECTION_SEPARATOR_TOKENS = 1
+
+# 背包求解时预算的最大离散格数，控制求解开销
+KNAPSACK_BUDGET_UNITS = 256
+
+# 各优先级的保留价值权重
+PRIORITY_WEIGHTS = {
+    ContentPriority.CRITICAL: 100.0,
+    ContentPriority.HIGH: 8.0,
+    ContentPriority.MEDIUM: 4.0,
+    ContentPriority.LOW: 2.0,
+    ContentPriority.OPTIONAL: 1.0
+}
+
+# 各候选版本的信息保留率
+VARIANT_RETENTION = {
+    CompressionLevel.NONE: 1.0,
+    CompressionLevel.LIGHT: 0.85,
+    CompressionLevel.MODERATE: 0.65,
+    CompressionLevel.AGGRESSIVE: 0.35,
+    CompressionLevel.EXTREME: 0.0   # 删除该部分
+}
+
+# 删除某优先级的部分时对应的整体压缩级别
+DROP_COMPRESSION_LEVEL = {
+    ContentPriority.OPTIONAL: CompressionLevel.LIGHT,
+    ContentPriority.LOW: CompressionLevel.MODERATE,
+    ContentPriority.MEDIUM: CompressionLevel.AGGRESSIVE,
+    ContentPriority.HIGH: CompressionLevel.EXTREME,
+    ContentPriority.CRITICAL: CompressionLevel.EXTREME
+}
+
+_LEVEL_ORDER = [
+    CompressionLevel.NONE,
+    CompressionLevel.LIGHT,
+    CompressionLevel.MODERATE,
+    CompressionLevel.AGGRESSIVE,
+    CompressionLevel.EXTREME
+]
+
 @dataclass
 class LengthConstraint:
-    """长度约束配置"""
+    """长度约束配置
+    
+    max_total_tokens为token预算；未设置时按prompt自身的字符/token比例由max_total_length换算。
+    """
     max_total_length: int = 8000
     min_total_length: int = 1000
     max_memory_ratio: float = 0.4
     min_memory_ratio: float = 0.1
     section_limits: Dict[PromptSection, int] = field(default_factory=dict)
     compression_threshold: float = 0.8  # 触发压缩的阈值
+    max_total_tokens: Optional[int] = None
 
 @dataclass
 class CompressionResult:
@@ -60,6 +111,15 @@ class CompressionResult:
     content_preserved: float  # 内容保留率
     quality_score: float
     compression_time: float
+    original_tokens: int = 0
+    compressed_tokens: int = 0
+
+@dataclass
+class SectionVariant:
+    """部分的候选压缩版本"""
+    level: CompressionLevel
+    content: str
+    tokens: int
 
 class PromptLengthController:
     """Prompt长度控制器"""
@@ -68,6 +128,10 @@ class PromptLengthController:
         self.config = config or {}
         self.logger = logging.getLogger(__name__)
         
+        # 各部分候选版本及token开销缓存：内容 -> 候选列表
+        self.variant_cache_size = self.config.get("variant_cache_size", 256)
+        self._variant_cache: "OrderedDict[str, List[SectionVariant]]" = OrderedDict()
+        
         # 压缩策略配置
         self.compression_strategies = self._init_compression_strategies()
         self.content_analyzers = self._init_content_analyzers()
@@ -79,6 +143,7 @@ class PromptLengthController:
             "successful_compressions": 0,
             "average_compression_ratio": 0.0,
             "average_compression_time": 0.0,
+            "total_tokens_saved": 0,
             "compression_level_usage": {level.value: 0 for level in CompressionLevel}
         }
     
@@ -93,9 +158,13 @@ class PromptLengthController:
         start_time = datetime.now()
         
         original_length = len(generated_prompt.full_prompt)
+        original_tokens = count_tokens(generated_prompt.full_prompt)
+        token_budget = self._resolve_token_budget(
+            constraint, original_length, original_tokens
+        )
         
         # 如果不超过限制，直接返回
-        if original_length <= constraint.max_total_length:
+        if original_tokens <= token_budget:
             no_compression_result = CompressionResult(
                 original_length=original_length,
                 compressed_length=original_length,
@@ -104,19 +173,17 @@ class PromptLengthController:
                 compression_level=CompressionLevel.NONE,
                 content_preserved=1.0,
                 quality_score=1.0,
-                compression_time=0.0
+                compression_time=0.0,
+                original_tokens=original_tokens,
+                compressed_tokens=original_tokens
             )
             return generated_prompt, no_compression_result
         
-        # 确定压缩级别
-        compression_level = self._determine_compression_level(
-            original_length, constraint, preserve_quality
-        )
-        
         # 执行压缩
         compressed_prompt, compression_result = self._compress_prompt(
-            generated_prompt, constraint, compression_level, memory_result
+            generated_prompt, token_budget, memory_result, preserve_quality
         )
+        compression_result.original_tokens = original_tokens
         
         # 更新统计
         compression_time = (datetime.now() - start_time).total_seconds()
@@ -125,72 +192,66 @@ class PromptLengthController:
         
         return compressed_prompt, compression_result
     
-    def _determine_compression_level(
+    def _resolve_token_budget(
         self,
-        original_length: int,
         constraint: LengthConstraint,
-        preserve_quality: bool
-    ) -> CompressionLevel:
-        """确定压缩级别"""
-        max_length = constraint.max_total_length
-        overage_ratio = original_length / max_length
-        
-        if overage_ratio <= 1.2:
-            return CompressionLevel.LIGHT
-        elif overage_ratio <= 1.5:
-            return CompressionLevel.MODERATE
-        elif overage_ratio <= 2.0:
-            return CompressionLevel.AGGRESSIVE
-        else:
-            return CompressionLevel.EXTREME if not preserve_quality else CompressionLevel.AGGRESSIVE
+        original_length: int,
+        original_tokens: int
+    ) -> int:
+        """确定token预算"""
+        if constraint.max_total_tokens is not None:
+            return constraint.max_total_tokens
+        if original_length == 0:
+            return 0
+        # 按当前prompt的字符/token比例换算字符上限
+        return int(constraint.max_total_length * original_tokens / original_length)
     
     def _compress_prompt(
         self,
         generated_prompt: GeneratedPrompt,
-        constraint: LengthConstraint,
-        compression_level: CompressionLevel,
-        memory_result: FilteredMemoryResult
+        token_budget: int,
+        memory_result: FilteredMemoryResult,
+        preserve_quality: bool
     ) -> Tuple[GeneratedPrompt, CompressionResult]:
-        """执行prompt压缩"""
+        """执行prompt压缩：一次背包求解选出各部分的压缩版本"""
         original_length = len(generated_prompt.full_prompt)
-        sections_modified = []
         
         # 分析各部分的重要性
         section_priorities = self._analyze_section_priorities(
             generated_prompt.sections, memory_result
         )
         
-        # 创建副本进行修改
-        compressed_sections = generated_prompt.sections.copy()
-        
-        # 按压缩级别应用不同策略
-        if compression_level == CompressionLevel.LIGHT:
-            compressed_sections, modified = self._apply_light_compression(
-                compressed_sections, section_priorities, constraint
+        # 各部分的候选版本（带token开销）
+        section_variants = {
+            section: self._get_section_variants(
+                content, section_priorities.get(section, ContentPriority.MEDIUM), preserve_quality
             )
-            sections_modified.extend(modified)
-        
-        elif compression_level == CompressionLevel.MODERATE:
-            compressed_sections, modified = self._apply_moderate_compression(
-                compressed_sections, section_priorities, constraint
-            )
-            sections_modified.extend(modified)
+            for section, content in generated_prompt.sections.items()
+        }
         
-        elif compression_level == CompressionLevel.AGGRESSIVE:
-            compressed_sections, modified = self._apply_aggressive_compression(
-                compressed_sections, section_priorities, constraint
-            )
-            sections_modified.extend(modified)
+        selection = self._select_section_variants(
+            section_variants, section_priorities, token_budget
+        )
         
-        elif compression_level == CompressionLevel.EXTREME:
-            compressed_sections, modified = self._apply_extreme_compression(
-                compressed_sections, section_priorities, constraint
-            )
-            sections_modified.extend(modified)
+        compressed_sections = {}
+        sections_modified = []
+        compression_level = CompressionLevel.NONE
+        for section, variant in selection.items():
+            compressed_sections[section] = variant.content
+            if variant.level == CompressionLevel.NONE:
+                continue
+            sections_modified.append(section)
+            if variant.level == CompressionLevel.EXTREME:
+                section_level = DROP_COMPRESSION_LEVEL[section_priorities.get(section, ContentPriority.MEDIUM)]
+            else:
+                section_level = variant.level
+            if _LEVEL_ORDER.index(section_level) > _LEVEL_ORDER.index(compression_level):
+                compression_level = section_level
         
         # 重新组装prompt
         compressed_full_prompt = self._reassemble_prompt(compressed_sections)
         compressed_length = len(compressed_full_prompt)
+        compressed_tokens = count_tokens(compressed_full_prompt)
         
         # 创建压缩后的prompt对象
         compressed_prompt = GeneratedPrompt(
@@ -199,14 +260,14 @@ class PromptLengthController:
             metadata=generated_prompt.metadata.copy(),
             memory_integration_info=generated_prompt.memory_integration_info.copy(),
             optimization_applied=generated_prompt.optimization_applied + [f"compression_{compression_level.value}"],
-            estimated_tokens=len(compressed_full_prompt.split()),
+            estimated_tokens=compressed_tokens,
             confidence_score=self._calculate_post_compression_confidence(
                 generated_prompt.confidence_score, compression_level
             )
         )
         
         # 计算压缩指标
-        compression_ratio = compressed_length / original_length
+        compression_ratio = compressed_length / original_length if original_length else 1.0
         content_preserved = self._calculate_content_preservation(
             generated_prompt.sections, compressed_sections
         )
@@ -222,11 +283,109 @@ class PromptLengthController:
             compression_level=compression_level,
             content_preserved=content_preserved,
             quality_score=quality_score,
-            compression_time=0.0  # 会在外部设置
+            compression_time=0.0,  # 会在外部设置
+            compressed_tokens=compressed_tokens
         )
         
         return compressed_prompt, compression_result
     
+    def _get_section_variants(
+        self,
+        content: str,
+        priority: ContentPriority,
+        preserve_quality: bool
+    ) -> List[SectionVariant]:
+        """获取部分的候选压缩版本，按开销从大到小排列
+        
+        关键内容不可删除；preserve_quality时高优先级内容也不可删除。
+        """
+        variants = self._variant_cache.get(content)
+        if variants is None:
+            variants = self._build_section_variants(content)
+            self._variant_cache[content] = variants
+            if len(self._variant_cache) > self.variant_cache_size:
+                self._variant_cache.popitem(last=False)
+        else:
+            self._variant_cache.move_to_end(content)
+        
+        droppable = priority != ContentPriority.CRITICAL and not (
+            preserve_quality and priority == ContentPriority.HIGH
+        )
+        if droppable:
+            return variants
+        return [variant for variant in variants if variant.level != CompressionLevel.EXTREME]
+    
+    def _build_section_variants(self, content: str) -> List[SectionVariant]:
+        """生成各级压缩版本并计算token开销，去除不再缩短的重复版本"""
+        if not content.strip():
+            return [SectionVariant(CompressionLevel.NONE, content, 0)]
+        
+        candidates = [
+            (CompressionLevel.NONE, content),
+            (CompressionLevel.LIGHT, self._compress_text_light(content)),
+            (CompressionLevel.MODERATE, self._compress_text_moderate(content)),
+            (CompressionLevel.AGGRESSIVE, self._compress_text_aggressive(content))
+        ]
+        
+        variants = []
+        for level, text in candidates:
+            tokens = count_tokens(text.strip()) + SECTION_SEPARATOR_TOKENS
+            if variants and tokens >= variants[-1].tokens:
+                continue
+            variants.append(SectionVariant(level, text, tokens))
+        variants.append(SectionVariant(CompressionLevel.EXTREME, "", 0))
+        return variants
+    
+    def _select_section_variants(
+        self,
+        section_variants: Dict[PromptSection, List[SectionVariant]],
+        priorities: Dict[PromptSection, ContentPriority],
+        token_budget: int
+    ) -> Dict[PromptSection, SectionVariant]:
+        """多选背包：每个部分选一个版本，在token预算内最大化保留价值
+        
+        预算被离散为最多KNAPSACK_BUDGET_UNITS格，开销向上取整，保证结果不超预算。
+        预算不足以容纳各部分的最小版本时，退化为全部取最小版本。
+        """
+        sections = list(section_variants.keys())
+        minimal = {section: section_variants[section][-1] for section in sections}
+        if sum(variant.tokens for variant in minimal.values()) >= token_budget:
+            return minimal
+        
+        unit = max(1, math.ceil(token_budget / KNAPSACK_BUDGET_UNITS))
+        capacity = token_budget // unit
+        
+        # best[c]: 容量c内的最大价值；choices记录每个部分在各容量下的选择
+        best = [0.0] * (capacity + 1)
+        choices: List[List[int]] = []
+        for section in sections:
+            weight = PRIORITY_WEIGHTS[priorities.get(section, ContentPriority.MEDIUM)]
+            options = [
+                (math.ceil(variant.tokens / unit), weight * VARIANT_RETENTION[variant.level])
+                for variant in section_variants[section]
+            ]
+            new_best = [float("-inf")] * (capacity + 1)
+            choice = [-1] * (capacity + 1)
+            for c in range(capacity + 1):
+                for index, (cost, value) in enumerate(options):
+                    if cost <= c and best[c - cost] + value > new_best[c]:
+                        new_best[c] = best[c - cost] + value
+                        choice[c] = index
+            best = new_best
+            choices.append(choice)
+        
+        if best[capacity] == float("-inf"):
+            return minimal
+        
+        # 回溯选择
+        selection = {}
+        c = capacity
+        for section, choice in zip(reversed(sections), reversed(choices)):
+            variant = section_variants[section][choice[c]]
+            selection[section] = variant
+            c -= math.ceil(variant.tokens / unit)
+        return {section: selection[section] for section in sections}
+    
     def _analyze_section_priorities(
         self,
         sections: Dict[PromptSection, str],
@@ -283,104 +442,6 @@ class PromptLengthController:
         
         return base_priority
     
-    def _apply_light_compression(
-        self,
-        sections: Dict[PromptSection, str],
-        priorities: Dict[PromptSection, ContentPriority],
-        constraint: LengthConstraint
-    ) -> Tuple[Dict[PromptSection, str], List[PromptSection]]:
-        """应用轻度压缩"""
-        modified_sections = []
-        
-        for section, content in sections.items():
-            priority = priorities.get(section, ContentPriority.MEDIUM)
-            
-            if priority == ContentPriority.OPTIONAL and len(content) > 200:
-                # 删除可选的长内容
-                sections[section] = ""
-                modified_sections.append(section)
-            elif priority == ContentPriority.LOW and len(content) > 300:
-                # 压缩低优先级的长内容
-                sections[section] = self._compress_text_light(content)
-                modified_sections.append(section)
-        
-        return sections, modified_sections
-    
-    def _apply_moderate_compression(
-        self,
-        sections: Dict[PromptSection, str],
-        priorities: Dict[PromptSection, ContentPriority],
-        constraint: LengthConstraint
-    ) -> Tuple[Dict[PromptSection, str], List[PromptSection]]:
-        """应用中度压缩"""
-        modified_sections = []
-        
-        for section, content in sections.items():
-            priority = priorities.get(section, ContentPriority.MEDIUM)
-            
-            if priority == ContentPriority.OPTIONAL:
-                sections[section] = ""
-                modified_sections.append(section)
-            elif priority == ContentPriority.LOW:
-                sections[section] = self._compress_text_moderate(content)
-                modified_sections.append(section)
-            elif priority == ContentPriority.MEDIUM and len(content) > 400:
-                sections[section] = self._compress_text_light(content)
-                modified_sections.append(section)
-        
-        return sections, modified_sections
-    
-    def _apply_aggressive_compression(
-        self,
-        sections: Dict[PromptSection, str],
-        priorities: Dict[PromptSection, ContentPriority],
-        constraint: LengthConstraint
-    ) -> Tuple[Dict[PromptSection, str], List[PromptSection]]:
-        """应用激进压缩"""
-        modified_sections = []
-        
-        for section, content in sections.items():
-            priority = priorities.get(section, ContentPriority.MEDIUM)
-            
-            if priority in [ContentPriority.OPTIONAL, ContentPriority.LOW]:
-                sections[section] = ""
-                modified_sections.append(section)
-            elif priority == ContentPriority.MEDIUM:
-                sections[section] = self._compress_text_moderate(content)
-                modified_sections.append(section)
-            elif priority == ContentPriority.HIGH and len(content) > 300:
-                sections[section] = self._compress_text_light(content)
-                modified_sections.append(section)
-        
-        return sections, modified_sections
-    
-    def _apply_extreme_compression(
-        self,
-        sections: Dict[PromptSection, str],
-        priorities: Dict[PromptSection, ContentPriority],
-        constraint: LengthConstraint
-    ) -> Tuple[Dict[PromptSection, str], List[PromptSection]]:
-        """应用极度压缩"""
-        modified_sections = []
-        
-        for section, content in sections.items():
-            priority = priorities.get(section, ContentPriority.MEDIUM)
-            
-            if priority != ContentPriority.CRITICAL:
-                if priority in [ContentPriority.OPTIONAL, ContentPriority.LOW, ContentPriority.MEDIUM]:
-                    sections[section] = ""
-                    modified_sections.append(section)
-                elif priority == ContentPriority.HIGH:
-                    sections[section] = self._compress_text_aggressive(content)
-                    modified_sections.append(section)
-            else:
-                # 即使是关键内容也要压缩
-                if len(content) > 200:
-                    sections[section] = self._compress_text_light(content)
-                    modified_sections.append(section)
-        
-        return sections, modified_sections
-    
     def _compress_text_light(self, text: str) -> str:
         """轻度文本压缩"""
         if not text:
@@ -435,9 +496,9 @@ class PromptLengthController:
     def _extract_key_concepts(self, text: str) -> List[str]:
         """提取关键概念"""
         # 简化的关键词提取
-        import jieba
-        
         try:
+            import jieba
+            
             # 分词
             words = list(jieba.cut(text))
             
@@ -542,6 +603,7 @@ class PromptLengthController:
     def _update_compression_stats(self, result: CompressionResult):
         """更新压缩统计"""
         self.compression_stats["total_compressions"] += 1
+        self.compression_stats["total_tokens_saved"] += max(0, result.original_tokens - result.compressed_tokens)
         if result.compression_ratio < 1.0:
             self.compression_stats["successful_compressions"] += 1
         
@@ -0,0 +1,107 @@
+"""
+Token计数模块 - 提供缓存的分词器和消息token计数
+
+本模块负责：
+1. 懒加载并缓存tiktoken编码器（进程内只初始化一次）
+2. tiktoken不可用时回退到按字符估算（中文按字、英文按约4字符计）
+3. 按消息ID缓存消息token数，避免每轮重复分词
+"""
+
+import hashlib
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from app.core.memory.lru_cache import LRUCache
+
+# tiktoken为可选依赖
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r'[一-鿿　-〿＀-￯]')
+
+# 消息token数缓存：key为(消息ID, 内容摘要)，内容被改写（即使长度不变）时自动失效
+_MESSAGE_TOKEN_CACHE_SIZE = 20000
+_MESSAGE_TOKEN_CACHE: "LRUCache[int]" = LRUCache(_MESSAGE_TOKEN_CACHE_SIZE)
+
+
+@lru_cache(maxsize=4)
+def get_token_encoder(encoding_name: str = DEFAULT_ENCODING):
+    """获取缓存的tiktoken编码器，不可用时返回None"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"加载tiktoken编码器失败，使用字符估算: {e}")
+        return None
+
+
+def count_tokens(text: Optional[str], encoding_name: str = DEFAULT_ENCODING) -> int:
+    """计算文本的token数
+
+    Args:
+        text: 文本内容
+        encoding_name: tiktoken编码名称
+
+    Returns:
+        token数
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+
+    encoder = get_token_encoder(encoding_name)
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+
+    # 回退估算：CJK字符约1 token/字，其余约4字符/token
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def get_message_content(message: Any) -> str:
+    """提取消息文本内容，兼容BaseMessage与字典格式"""
+    if isinstance(message, dict):
+        content = message.get("content", "")
+    else:
+        content = getattr(message, "content", "")
+    if isinstance(content, str):
+        return content
+    return str(content) if content else ""
+
+
+def count_message_tokens(message: Any) -> int:
+    """计算单条消息的token数（带缓存）"""
+    content = get_message_content(message)
+    message_id = message.get("id") if isinstance(message, dict) else getattr(message, "id", None)
+
+    if message_id is None:
+        return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+    digest = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    cache_key = (message_id, digest)
+    cached = _MESSAGE_TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    _MESSAGE_TOKEN_CACHE.put(cache_key, tokens)
+    return tokens
+
+
+def count_messages_tokens(messages: Iterable[Any]) -> int:
+    """计算消息列表的总token数"""
+    return sum(count_message_tokens(message) for message in messages)
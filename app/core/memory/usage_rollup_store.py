@@ -0,0 +1,404 @@
+"""
+记忆使用预聚合存储 - 为记忆使用监控提供有界的分层时间汇总
+
+本模块负责：
+1. 按时间桶（默认1分钟）和智能体角色预聚合使用事件，单个事件O(1)更新
+2. 维护计数、求和、相关性直方图等可合并的汇总量；去重集合使用有界的KMV草图
+3. 分钟桶超出细粒度保留期后合并为小时桶，小时桶再合并为天桶，
+   天桶超出保留期后淘汰，桶数量与保留期长度近似对数关系
+4. 维护保留期内的运行总量，不限时间范围的查询无需扫描任何桶
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 相关性分数直方图的分桶数（[0, 1]等宽）
+RELEVANCE_HISTOGRAM_BINS = 10
+
+# 单个汇总中记忆ID草图保留的最小哈希数（该数量以内精确计数）
+MEMORY_SKETCH_SIZE = 1024
+# 单个会话的记忆ID草图大小
+SESSION_MEMORY_SKETCH_SIZE = 64
+# 单个汇总最多逐会话跟踪的会话数，其余会话只计入总量与会话草图
+MAX_TRACKED_SESSIONS = 256
+
+# 分层时间桶：细粒度桶 -> 小时桶 -> 天桶
+HOUR_SECONDS = 3600
+DEFAULT_FINE_RETENTION_SECONDS = 2 * HOUR_SECONDS
+DEFAULT_HOUR_RETENTION_SECONDS = 48 * HOUR_SECONDS
+
+_HASH_SPACE = float(1 << 64)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class DistinctCounter:
+    """有界的去重计数器（KMV草图）
+
+    只保留元素哈希中最小的k个：元素数不超过k时计数精确，超过后按第k小的哈希值
+    估算基数（相对误差约1/sqrt(k)）。两个计数器可以无损合并，内存上限与事件量无关。
+    """
+
+    __slots__ = ("k", "_hashes", "_heap")
+
+    def __init__(self, k: int = MEMORY_SKETCH_SIZE, items: Optional[Iterable[str]] = None):
+        self.k = max(2, k)
+        self._hashes: set = set()
+        # 以负值存储的最大堆，堆顶为当前保留的最大哈希
+        self._heap: List[int] = []
+        for item in items or ():
+            self.add(item)
+
+    def add(self, item: str) -> None:
+        self._add_hash(_hash64(item))
+
+    def merge(self, other: "DistinctCounter") -> "DistinctCounter":
+        for value in other._hashes:
+            self._add_hash(value)
+        return self
+
+    def estimate(self) -> float:
+        if len(self._hashes) < self.k:
+            return float(len(self._hashes))
+        return (self.k - 1) / ((-self._heap[0] + 1) / _HASH_SPACE)
+
+    @property
+    def is_exact(self) -> bool:
+        return len(self._hashes) < self.k
+
+    def __len__(self) -> int:
+        return int(round(self.estimate()))
+
+    def _add_hash(self, value: int) -> None:
+        if value in self._hashes:
+            return
+        if len(self._hashes) < self.k:
+            self._hashes.add(value)
+            heapq.heappush(self._heap, -value)
+            return
+        if value >= -self._heap[0]:
+            return
+        evicted = -heapq.heapreplace(self._heap, -value)
+        self._hashes.discard(evicted)
+        self._hashes.add(value)
+
+
+@dataclass
+class UsageRollup:
+    """单个时间桶内某智能体的预聚合指标，可与其他汇总合并"""
+    event_count: int = 0
+    relevance_count: int = 0
+    relevance_sum: float = 0.0
+    relevance_sq_sum: float = 0.0
+    relevance_histogram: List[int] = field(default_factory=lambda: [0] * RELEVANCE_HISTOGRAM_BINS)
+    access_count: int = 0
+    access_success_count: int = 0
+    task_event_count: int = 0
+    task_completed_count: int = 0
+    error_count: int = 0
+    freshness_sum: float = 0.0
+    cross_agent_count: int = 0
+    event_types: Dict[str, int] = field(default_factory=dict)
+    memory_types: Dict[str, int] = field(default_factory=dict)
+    # 按本地时间的小时分布，合并到粗粒度桶后仍可统计峰值时段
+    hourly_events: List[int] = field(default_factory=lambda: [0] * 24)
+    memory_ids: DistinctCounter = field(default_factory=DistinctCounter)
+    sessions: DistinctCounter = field(default_factory=DistinctCounter)
+    session_events: Dict[str, int] = field(default_factory=dict)
+    session_memories: Dict[str, DistinctCounter] = field(default_factory=dict)
+    untracked_session_events: int = 0
+
+    def add_event(self, event: Any) -> None:
+        """累加单个MemoryUsageEvent"""
+        self.event_count += 1
+
+        if event.relevance_score is not None:
+            score = event.relevance_score
+            self.relevance_count += 1
+            self.relevance_sum += score
+            self.relevance_sq_sum += score * score
+            bin_index = min(RELEVANCE_HISTOGRAM_BINS - 1, max(0, int(score * RELEVANCE_HISTOGRAM_BINS)))
+            self.relevance_histogram[bin_index] += 1
+
+        usage_result = event.usage_result or {}
+        if event.event_type == "access":
+            self.access_count += 1
+            if usage_result.get("success", False):
+                self.access_success_count += 1
+        if "task_completed" in usage_result:
+            self.task_event_count += 1
+            if usage_result.get("task_completed", False):
+                self.task_completed_count += 1
+        if usage_result.get("error", False):
+            self.error_count += 1
+
+        self.freshness_sum += event.performance_metrics.get("freshness", 0.5)
+        if event.context.get("cross_agent_memory", False):
+            self.cross_agent_count += 1
+
+        self.event_types[event.event_type] = self.event_types.get(event.event_type, 0) + 1
+        self.memory_types[event.memory_type] = self.memory_types.get(event.memory_type, 0) + 1
+        self.hourly_events[event.timestamp.hour] += 1
+        self.memory_ids.add(event.memory_id)
+        self.sessions.add(event.session_id)
+
+        session_id = event.session_id
+        if session_id in self.session_events or len(self.session_events) < MAX_TRACKED_SESSIONS:
+            self.session_events[session_id] = self.session_events.get(session_id, 0) + 1
+            self.session_memories.setdefault(
+                session_id, DistinctCounter(SESSION_MEMORY_SKETCH_SIZE)
+            ).add(event.memory_id)
+        else:
+            self.untracked_session_events += 1
+
+    def merge(self, other: "UsageRollup") -> "UsageRollup":
+        """将另一个汇总合并到当前汇总"""
+        self.event_count += other.event_count
+        self.relevance_count += other.relevance_count
+        self.relevance_sum += other.relevance_sum
+        self.relevance_sq_sum += other.relevance_sq_sum
+        for index, count in enumerate(other.relevance_histogram):
+            self.relevance_histogram[index] += count
+        self.access_count += other.access_count
+        self.access_success_count += other.access_success_count
+        self.task_event_count += other.task_event_count
+        self.task_completed_count += other.task_completed_count
+        self.error_count += other.error_count
+        self.freshness_sum += other.freshness_sum
+        self.cross_agent_count += other.cross_agent_count
+        for key, count in other.event_types.items():
+            self.event_types[key] = self.event_types.get(key, 0) + count
+        for key, count in other.memory_types.items():
+            self.memory_types[key] = self.memory_types.get(key, 0) + count
+        for hour, count in enumerate(other.hourly_events):
+            self.hourly_events[hour] += count
+        self.memory_ids.merge(other.memory_ids)
+        self.sessions.merge(other.sessions)
+        for session_id, count in other.session_events.items():
+            self.session_events[session_id] = self.session_events.get(session_id, 0) + count
+        for session_id, memory_ids in other.session_memories.items():
+            self.session_memories.setdefault(
+                session_id, DistinctCounter(SESSION_MEMORY_SKETCH_SIZE)
+            ).merge(memory_ids)
+        self.untracked_session_events += other.untracked_session_events
+        self._trim_sessions()
+        return self
+
+    def _trim_sessions(self) -> None:
+        """超出跟踪上限时保留事件数最多的会话，其余计入未跟踪事件"""
+        overflow = len(self.session_events) - MAX_TRACKED_SESSIONS
+        if overflow <= 0:
+            return
+        for session_id, count in heapq.nsmallest(overflow, self.session_events.items(), key=lambda item: item[1]):
+            self.untracked_session_events += count
+            del self.session_events[session_id]
+            self.session_memories.pop(session_id, None)
+
+    @property
+    def average_relevance(self) -> float:
+        return self.relevance_sum / self.relevance_count if self.relevance_count else 0.0
+
+    @property
+    def relevance_std(self) -> float:
+        """相关性样本标准差（与statistics.stdev一致）"""
+        if self.relevance_count < 2:
+            return 0.0
+        variance = (self.relevance_sq_sum - self.relevance_sum ** 2 / self.relevance_count) / (self.relevance_count - 1)
+        return math.sqrt(max(0.0, variance))
+
+    @property
+    def hit_rate(self) -> float:
+        return self.access_success_count / self.access_count if self.access_count else 0.0
+
+    @property
+    def task_completion_rate(self) -> float:
+        return self.task_completed_count / self.task_event_count if self.task_event_count else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.error_count / self.event_count if self.event_count else 0.0
+
+    @property
+    def average_freshness(self) -> float:
+        return self.freshness_sum / self.event_count if self.event_count else 0.0
+
+    @property
+    def cross_agent_ratio(self) -> float:
+        return self.cross_agent_count / self.event_count if self.event_count else 0.0
+
+
+class UsageRollupStore:
+    """按分层时间桶与智能体角色组织的有界汇总存储"""
+
+    FINE, HOUR, DAY = 0, 1, 2
+
+    def __init__(
+        self,
+        bucket_seconds: int = 60,
+        retention_buckets: int = 30 * 24 * 60,
+        fine_retention_seconds: int = DEFAULT_FINE_RETENTION_SECONDS,
+        hour_retention_seconds: int = DEFAULT_HOUR_RETENTION_SECONDS
+    ):
+        """
+        初始化汇总存储
+
+        Args:
+            bucket_seconds: 细粒度时间桶宽度（秒）
+            retention_buckets: 总保留期（以细粒度桶计），超出后淘汰最旧的天桶
+            fine_retention_seconds: 细粒度桶保留时长，超出后合并为小时桶
+            hour_retention_seconds: 小时桶保留时长，超出后合并为天桶
+        """
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.retention_buckets = max(1, retention_buckets)
+        self.retention = timedelta(seconds=self.bucket_seconds * self.retention_buckets)
+        self.fine_retention = timedelta(seconds=max(self.bucket_seconds, fine_retention_seconds))
+        self.hour_retention = timedelta(seconds=max(HOUR_SECONDS, hour_retention_seconds))
+        # 每层：桶编号 -> {智能体角色: 汇总}
+        self._tiers: List["OrderedDict[int, Dict[str, UsageRollup]]"] = [
+            OrderedDict(), OrderedDict(), OrderedDict()
+        ]
+        # 保留期内各智能体的运行总量
+        self._totals: Dict[str, UsageRollup] = {}
+        self.stats = {"rolled_up_fine": 0, "rolled_up_hour": 0, "evicted_days": 0}
+
+    def add_event(self, event: Any) -> None:
+        """累加事件到对应细粒度时间桶与运行总量"""
+        tier = self._tiers[self.FINE]
+        bucket = self._bucket_of(self.FINE, event.timestamp)
+        role_rollups = tier.get(bucket)
+        if role_rollups is None:
+            role_rollups = {}
+            tier[bucket] = role_rollups
+            self._compact(event.timestamp)
+
+        rollup = role_rollups.get(event.agent_role)
+        if rollup is None:
+            rollup = UsageRollup()
+            role_rollups[event.agent_role] = rollup
+        rollup.add_event(event)
+        self._totals.setdefault(event.agent_role, UsageRollup()).add_event(event)
+
+    def aggregate(
+        self,
+        time_range: Optional[Tuple[datetime, datetime]] = None,
+        agent_roles: Optional[List[str]] = None
+    ) -> Dict[str, UsageRollup]:
+        """合并时间范围内各智能体的汇总（按桶粒度包含与边界相交的桶）
+
+        不指定时间范围时直接复制运行总量。
+        """
+        merged: Dict[str, UsageRollup] = {}
+        if time_range is None:
+            role_filter = set(agent_roles) if agent_roles else None
+            for role, total in self._totals.items():
+                if role_filter is None or role in role_filter:
+                    merged[role] = UsageRollup().merge(total)
+            return merged
+
+        for _, role, rollup in self.iter_rollups(time_range, agent_roles):
+            merged.setdefault(role, UsageRollup()).merge(rollup)
+        return merged
+
+    def iter_rollups(
+        self,
+        time_range: Optional[Tuple[datetime, datetime]] = None,
+        agent_roles: Optional[List[str]] = None
+    ):
+        """遍历时间范围内的(桶起始时间, 智能体角色, 汇总)，由粗到细"""
+        role_filter = set(agent_roles) if agent_roles else None
+
+        for level in (self.DAY, self.HOUR, self.FINE):
+            for bucket, role_rollups in self._tiers[level].items():
+                bucket_start = self._bucket_start(level, bucket)
+                if time_range and not (
+                    bucket_start <= time_range[1] and self._bucket_end(level, bucket) > time_range[0]
+                ):
+                    continue
+                for role, rollup in role_rollups.items():
+                    if role_filter is None or role in role_filter:
+                        yield bucket_start, role, rollup
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "buckets": sum(len(tier) for tier in self._tiers),
+            "fine_buckets": len(self._tiers[self.FINE]),
+            "hour_buckets": len(self._tiers[self.HOUR]),
+            "day_buckets": len(self._tiers[self.DAY]),
+            "rollups": sum(
+                len(role_rollups) for tier in self._tiers for role_rollups in tier.values()
+            ),
+            **self.stats
+        }
+
+    def _bucket_of(self, level: int, timestamp: datetime) -> int:
+        if level == self.DAY:
+            # 天桶按本地日期对齐，便于按日期统计
+            return timestamp.toordinal()
+        width = self.bucket_seconds if level == self.FINE else HOUR_SECONDS
+        return int(timestamp.timestamp() // width)
+
+    def _bucket_start(self, level: int, bucket: int) -> datetime:
+        if level == self.DAY:
+            return datetime.fromordinal(bucket)
+        width = self.bucket_seconds if level == self.FINE else HOUR_SECONDS
+        return datetime.fromtimestamp(bucket * width)
+
+    def _bucket_end(self, level: int, bucket: int) -> datetime:
+        if level == self.DAY:
+            return datetime.fromordinal(bucket + 1)
+        width = self.bucket_seconds if level == self.FINE else HOUR_SECONDS
+        return datetime.fromtimestamp((bucket + 1) * width)
+
+    def _compact(self, now: datetime) -> None:
+        """细粒度桶合并为小时桶、小时桶合并为天桶，淘汰超出保留期的天桶
+
+        仅在新建细粒度桶时调用；各层只有几十到上百个桶，直接遍历以兼容乱序到达的事件。
+        """
+        self.stats["rolled_up_fine"] += self._roll_up(self.FINE, self.HOUR, now - self.fine_retention)
+        self.stats["rolled_up_hour"] += self._roll_up(self.HOUR, self.DAY, now - self.hour_retention)
+
+        cutoff = now - self.retention
+        day_tier = self._tiers[self.DAY]
+        expired = [bucket for bucket in day_tier if self._bucket_end(self.DAY, bucket) <= cutoff]
+        if expired:
+            for bucket in expired:
+                del day_tier[bucket]
+            self.stats["evicted_days"] += len(expired)
+            self._rebuild_totals()
+
+    def _roll_up(self, level: int, target_level: int, cutoff: datetime) -> int:
+        tier = self._tiers[level]
+        target = self._tiers[target_level]
+        expired = [bucket for bucket in tier if self._bucket_end(level, bucket) <= cutoff]
+        for bucket in expired:
+            target_bucket = self._bucket_of(target_level, self._bucket_start(level, bucket))
+            target_rollups = target.get(target_bucket)
+            if target_rollups is None:
+                target_rollups = {}
+                target[target_bucket] = target_rollups
+            for role, rollup in tier.pop(bucket).items():
+                existing = target_rollups.get(role)
+                if existing is None:
+                    target_rollups[role] = rollup
+                else:
+                    existing.merge(rollup)
+        return len(expired)
+
+    def _rebuild_totals(self) -> None:
+        """天桶淘汰后重建运行总量（每天至多一次）"""
+        totals: Dict[str, UsageRollup] = {}
+        for _, role, rollup in self.iter_rollups():
+            totals.setdefault(role, UsageRollup()).merge(rollup)
+        self._totals = totals
@@ -32,6 +32,7 @@ except ImportError:
     MemorySaver = None
 
 from app.core.config import ConfigManager
+from app.core.checkpoint_retention import CheckpointRetentionPolicy, INTERRUPT_CHANNEL
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +71,7 @@ class MySQLCheckpointManager:
         self._checkpointer = None
         self._mysql_config = self.config.get_mysql_config()
         self._connection_string = self._build_connection_string()
+        self._last_retention_report: Optional[Dict[str, Any]] = None
         
         # 初始化检查点器
         self._init_checkpointer()
@@ -184,6 +186,7 @@ class MySQLCheckpointManager:
                     try:
                         self._checkpointer.setup()
                         logger.info("MySQL检查点器表结构设置成功")
+                        self.ensure_retention_indexes()
                     except Exception as setup_error:
                         logger.warning(f"设置表结构失败，但将继续使用: {str(setup_error)}")
                     
@@ -350,9 +353,9 @@ class MySQLCheckpointManager:
                     import hashlib
                     unique_id = hashlib.md5(f"{thread_id}:{checkpoint_id}:{uuid.uuid4()}".encode()).hexdigest()
                     
-                    # 准备字段和值
-                    fields = ["id", "thread_id", "checkpoint_id", "name", "created_at"]
-                    values = [unique_id, thread_id, checkpoint_id, "state", time.strftime('%Y-%m-%d %H:%M:%S')]
+                    # 准备字段和值（created_at由数据库NOW()写入，与保留策略使用同一时钟）
+                    fields = ["id", "thread_id", "checkpoint_id", "name"]
+                    values = [unique_id, thread_id, checkpoint_id, "state"]
                     
                     # 添加数据字段
                     if "data" in columns:
@@ -367,15 +370,15 @@ class MySQLCheckpointManager:
                         fields.append("checkpoint")
                         values.append(serialized_data)
                     
-                    # 添加元数据
-                    if metadata and "metadata" in columns:
+                    # 添加元数据（保留策略把没有元数据的行视为受保护，空元数据也写入）
+                    if "metadata" in columns:
                         import json
                         fields.append("metadata")
-                        values.append(json.dumps(metadata))
+                        values.append(json.dumps(metadata or {}))
                     
                     # 构建SQL
-                    fields_str = ", ".join(fields)
-                    placeholders = ", ".join(["%s"] * len(fields))
+                    fields_str = ", ".join(fields + ["created_at"])
+                    placeholders = ", ".join(["%s"] * len(fields) + ["NOW()"])
                     
                     # 构建更新部分
                     update_parts = []
@@ -1093,6 +1096,160 @@ class MySQLCheckpointManager:
             logger.error(f"清理检查点失败: {str(e)}")
             return 0
     
+    def _connect(self):
+        """创建短连接，用于维护类SQL（pymysql连接不能跨线程共用检查点器的连接）"""
+        mysql_config = self._mysql_config
+        return pymysql.connect(
+            host=mysql_config.get("host", "localhost"),
+            user=mysql_config.get("user", "root"),
+            password=mysql_config.get("password", ""),
+            database=mysql_config.get("database", "isotope"),
+            port=mysql_config.get("port", 3306),
+            connect_timeout=5
+        )
+
+    def ensure_retention_indexes(self) -> bool:
+        """创建保留策略所需的索引与元数据列（setup之后调用，可重复执行）
+
+        - (thread_id, created_at)索引：按线程取最近N个、按时间过滤时避免全表排序
+        - metadata列：put补丁在该列存在时写入元数据，用于识别中断/审批检查点
+        """
+        if not self.is_mysql_available():
+            return False
+        try:
+            conn = self._connect()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SHOW COLUMNS FROM checkpoint_blobs LIKE 'metadata'")
+                    if not cursor.fetchone():
+                        cursor.execute("ALTER TABLE checkpoint_blobs ADD COLUMN metadata LONGTEXT")
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM information_schema.statistics
+                        WHERE table_schema = DATABASE()
+                          AND table_name = 'checkpoint_blobs'
+                          AND index_name = 'idx_thread_created'
+                    """)
+                    if not cursor.fetchone()[0]:
+                        cursor.execute(
+                            "CREATE INDEX idx_thread_created ON checkpoint_blobs (thread_id, created_at)"
+                        )
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info("检查点保留策略索引已就绪")
+            return True
+        except Exception as e:
+            logger.warning(f"创建检查点保留策略索引失败: {str(e)}")
+            return False
+
+    def _measure_checkpoint_table(self, cursor) -> int:
+        """获取checkpoint_blobs表的数据与索引占用（字节）"""
+        cursor.execute("""
+            SELECT COALESCE(data_length + index_length, 0)
+            FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'checkpoint_blobs'
+        """)
+        result = cursor.fetchone()
+        return int(result[0]) if result else 0
+
+    def _probe_list_latency(self, limit: int) -> float:
+        """测量列出最近检查点的延迟（毫秒）"""
+        start = time.perf_counter()
+        self.list_checkpoints(limit=limit)
+        return (time.perf_counter() - start) * 1000
+
+    def apply_retention_policy(self, policy: CheckpointRetentionPolicy) -> Dict[str, Any]:
+        """按保留策略分批删除过期检查点
+
+        满足以下任一条件的行保留：
+        - 所在线程中最近的keep_last_n行
+        - 创建时间在keep_within_hours以内
+        - 元数据包含中断/审批标记，或没有元数据无法判断（protect_interrupts开启时）
+
+        created_at由数据库NOW()写入，时间窗口同样按数据库时钟计算。
+
+        Args:
+            policy: 保留策略
+
+        Returns:
+            清理报告（删除数量、表大小与列表延迟的前后对比）
+        """
+        if not self.is_mysql_available():
+            return {"backend": "memory", "skipped": True, "ran_at": time.time()}
+
+        started = time.perf_counter()
+        report = {
+            "backend": "mysql",
+            "ran_at": time.time(),
+            "deleted_checkpoints": 0,
+            "batches": 0
+        }
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                report["table_bytes_before"] = self._measure_checkpoint_table(cursor)
+            report["list_latency_ms_before"] = self._probe_list_latency(policy.latency_probe_limit)
+
+            protect_clause = ""
+            params: List[Any] = [policy.keep_last_n, int(policy.keep_within_seconds)]
+            if policy.protect_interrupts:
+                markers = [INTERRUPT_CHANNEL] + [f'"{key}"' for key in policy.protected_metadata_keys]
+                protect_clause = "".join(
+                    " AND LOCATE(%s, ranked.metadata) = 0" for _ in markers
+                )
+                protect_clause = " AND ranked.metadata IS NOT NULL" + protect_clause
+                params.extend(markers)
+            params.append(policy.max_deletes_per_run)
+
+            # 需要MySQL 8.0+的窗口函数
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT ranked.id FROM (
+                        SELECT id, created_at, metadata,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY thread_id ORDER BY created_at DESC, id DESC
+                               ) AS rn
+                        FROM checkpoint_blobs
+                    ) ranked
+                    WHERE ranked.rn > %s
+                      AND ranked.created_at < DATE_SUB(NOW(), INTERVAL %s SECOND)
+                      {protect_clause}
+                    LIMIT %s
+                """, params)
+                candidates = [row[0] for row in cursor.fetchall()]
+
+            # 分批删除，每批独立提交，缩短锁持有时间
+            batch_size = max(1, policy.batch_size)
+            for offset in range(0, len(candidates), batch_size):
+                batch = candidates[offset:offset + batch_size]
+                with conn.cursor() as cursor:
+                    placeholders = ", ".join(["%s"] * len(batch))
+                    cursor.execute(f"DELETE FROM checkpoint_blobs WHERE id IN ({placeholders})", batch)
+                    report["deleted_checkpoints"] += cursor.rowcount
+                conn.commit()
+                report["batches"] += 1
+
+            # information_schema中的大小为统计值，InnoDB释放的页会被复用
+            with conn.cursor() as cursor:
+                report["table_bytes_after"] = self._measure_checkpoint_table(cursor)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"执行MySQL检查点保留策略失败: {str(e)}")
+            report["error"] = str(e)
+        finally:
+            conn.close()
+
+        report["list_latency_ms_after"] = self._probe_list_latency(policy.latency_probe_limit)
+        report["duration_ms"] = (time.perf_counter() - started) * 1000
+
+        self._last_retention_report = report
+        logger.info(
+            f"MySQL检查点保留策略完成: 删除 {report['deleted_checkpoints']} 行，"
+            f"列表延迟 {report.get('list_latency_ms_before', 0.0):.1f}ms -> {report['list_latency_ms_after']:.1f}ms"
+        )
+        return report
+
     def get_statistics(self) -> Dict[str, Any]:
         """获取检查点统计信息
         
@@ -1122,6 +1279,7 @@ class MySQLCheckpointManager:
                         cursor.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoint_blobs")
                         result = cursor.fetchone()
                         stats["unique_threads"] = result[0] if result else 0
+                    stats["retention"] = self._last_retention_report
                 else:
                     checkpoints = self.list_checkpoints(limit=1000)  # 限制查询数量
                     stats["total_checkpoints"] = len(checkpoints)
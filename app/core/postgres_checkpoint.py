@@ -38,6 +38,7 @@ except ImportError:
     MemorySaver = None
 
 from app.core.config import ConfigManager
+from app.core.checkpoint_retention import CheckpointRetentionPolicy, INTERRUPT_CHANNEL
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +63,7 @@ class PostgreSQLCheckpointManager:
         self._postgres_context = None  # 添加postgres_context属性
         self._postgres_config = self.config.get_postgresql_config()
         self._connection_string = self._build_connection_string()
+        self._last_retention_report: Optional[Dict[str, Any]] = None
         
         # 初始化检查点器
         self._init_checkpointer()
@@ -115,6 +117,7 @@ class PostgreSQLCheckpointManager:
                         # 必须调用setup方法来创建数据库表结构 - 根据官方文档这是必需的
                         actual_checkpointer.setup()
                         logger.info("PostgreSQL检查点器表结构设置成功")
+                        self.ensure_retention_indexes()
                         
                     except Exception as setup_error:
                         logger.warning(f"设置表结构时出现问题，但将继续使用: {str(setup_error)}")
@@ -548,6 +551,12 @@ class PostgreSQLCheckpointManager:
             
             # 尝试获取更多统计信息
             try:
+                if isinstance(self._checkpointer, PostgresSaver):
+                    # 直接在数据库中统计，不随表增长加载全部检查点
+                    stats.update(self._measure_checkpoint_tables())
+                    stats["retention"] = self._last_retention_report
+                    return stats
+
                 all_checkpoints = self.list_checkpoints(limit=1000)
                 stats["total_checkpoints"] = len(all_checkpoints)
                 
@@ -569,6 +578,284 @@ class PostgreSQLCheckpointManager:
             logger.error(f"获取统计信息失败: {str(e)}")
             return {"status": "错误", "error": str(e)}
     
+    def _connect(self):
+        """创建短连接，用于维护类SQL（不占用检查点器的连接）"""
+        postgres_config = self._postgres_config
+        return psycopg2.connect(
+            host=postgres_config.get("host", "localhost"),
+            user=postgres_config.get("user", "sweet"),
+            password=postgres_config.get("password", ""),
+            database=postgres_config.get("database", "isotope"),
+            port=postgres_config.get("port", 5432),
+            connect_timeout=10,
+            client_encoding='utf8'
+        )
+
+    def ensure_retention_indexes(self) -> bool:
+        """创建保留策略所需的索引（setup之后调用，可重复执行）
+
+        checkpoints/checkpoint_writes的主键已覆盖(thread_id, checkpoint_ns, checkpoint_id)，
+        这里补充中断写入的部分索引，保护中断检查点时无需扫描全部写入记录。
+        """
+        if psycopg2 is None:
+            return False
+        try:
+            conn = self._connect()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        CREATE INDEX IF NOT EXISTS checkpoint_writes_interrupt_idx
+                        ON checkpoint_writes (thread_id, checkpoint_ns, checkpoint_id)
+                        WHERE channel = '{INTERRUPT_CHANNEL}'
+                    """)
+                    cursor.execute("""
+                        CREATE INDEX IF NOT EXISTS checkpoint_blobs_thread_idx
+                        ON checkpoint_blobs (thread_id, checkpoint_ns)
+                    """)
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info("检查点保留策略索引已就绪")
+            return True
+        except Exception as e:
+            logger.warning(f"创建检查点保留策略索引失败: {str(e)}")
+            return False
+
+    def _measure_checkpoint_tables(self) -> Dict[str, Any]:
+        """统计检查点表的行数（估算）与磁盘占用"""
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT c.relname,
+                           GREATEST(c.reltuples, 0)::bigint,
+                           pg_total_relation_size(c.oid)
+                    FROM pg_class c
+                    WHERE c.relname IN ('checkpoints', 'checkpoint_writes', 'checkpoint_blobs')
+                      AND c.relkind = 'r'
+                      AND pg_table_is_visible(c.oid)
+                """)
+                tables = {
+                    name: {"estimated_rows": rows, "total_bytes": size}
+                    for name, rows, size in cursor.fetchall()
+                }
+                cursor.execute("SELECT count(DISTINCT thread_id) FROM checkpoints")
+                unique_threads = cursor.fetchone()[0]
+        finally:
+            conn.close()
+
+        return {
+            "total_checkpoints": tables.get("checkpoints", {}).get("estimated_rows", 0),
+            "unique_threads": unique_threads,
+            "table_bytes": sum(table["total_bytes"] for table in tables.values()),
+            "tables": tables
+        }
+
+    def _probe_list_latency(self, limit: int) -> float:
+        """测量列出最近检查点的延迟（毫秒）"""
+        start = time.perf_counter()
+        self.list_checkpoints(limit=limit)
+        return (time.perf_counter() - start) * 1000
+
+    def apply_retention_policy(self, policy: CheckpointRetentionPolicy) -> Dict[str, Any]:
+        """按保留策略分批删除过期检查点
+
+        满足以下任一条件的检查点保留：
+        - 所在线程/命名空间中最近的keep_last_n个（checkpoint_id为时间有序的uuid6）
+        - 创建时间在keep_within_hours以内
+        - 存在中断写入，或元数据包含中断/审批标记（protect_interrupts开启时）
+
+        每个线程/命名空间中最新的检查点始终保留。删除检查点及其写入记录后，在同一事务中
+        清理被删除检查点引用、且不再被剩余检查点引用的通道数据。put先写通道数据再写检查点行，
+        因此只清理版本低于最新检查点对应版本的数据，正在写入的新版本不受影响。
+
+        Args:
+            policy: 保留策略
+
+        Returns:
+            清理报告（删除数量、表大小与列表延迟的前后对比）
+        """
+        if psycopg2 is None or not isinstance(self._checkpointer, PostgresSaver):
+            return {"backend": "memory", "skipped": True, "ran_at": time.time()}
+
+        started = time.perf_counter()
+        report = {
+            "backend": "postgres",
+            "ran_at": time.time(),
+            "deleted_checkpoints": 0,
+            "deleted_writes": 0,
+            "deleted_blobs": 0,
+            "batches": 0
+        }
+
+        before = self._measure_checkpoint_tables()
+        report["table_bytes_before"] = before["table_bytes"]
+        report["rows_before"] = before["total_checkpoints"]
+        report["list_latency_ms_before"] = self._probe_list_latency(policy.latency_probe_limit)
+
+        protect_clause = ""
+        if policy.protect_interrupts:
+            protect_clause = f"""
+                  AND NOT EXISTS (
+                      SELECT 1 FROM checkpoint_writes w
+                      WHERE w.thread_id = ranked.thread_id
+                        AND w.checkpoint_ns = ranked.checkpoint_ns
+                        AND w.checkpoint_id = ranked.checkpoint_id
+                        AND w.channel = '{INTERRUPT_CHANNEL}'
+                  )
+                  AND NOT (ranked.metadata ?| %(protected_keys)s::text[])
+                  AND NOT (COALESCE(ranked.metadata -> 'writes', '{{}}'::jsonb) ? '{INTERRUPT_CHANNEL}')
+            """
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT thread_id, checkpoint_ns, checkpoint_id
+                    FROM (
+                        SELECT c.thread_id, c.checkpoint_ns, c.checkpoint_id, c.metadata,
+                               c.checkpoint ->> 'ts' AS ts,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY c.thread_id, c.checkpoint_ns
+                                   ORDER BY c.checkpoint_id DESC
+                               ) AS rn
+                        FROM checkpoints c
+                    ) ranked
+                    WHERE rn > %(keep_last_n)s
+                      AND ts IS NOT NULL
+                      AND ts::timestamptz < now() - make_interval(secs => %(keep_within_seconds)s)
+                      {protect_clause}
+                    LIMIT %(max_deletes)s
+                """, {
+                    "keep_last_n": max(1, policy.keep_last_n),
+                    "keep_within_seconds": policy.keep_within_seconds,
+                    "protected_keys": list(policy.protected_metadata_keys) or [""],
+                    "max_deletes": policy.max_deletes_per_run
+                })
+                candidates = cursor.fetchall()
+            conn.commit()
+
+            batch_size = max(1, policy.batch_size)
+
+            # 分批删除，每批独立提交，缩短锁持有时间
+            for offset in range(0, len(candidates), batch_size):
+                batch = candidates[offset:offset + batch_size]
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        WITH doomed AS (
+                            SELECT * FROM unnest(%s::text[], %s::text[], %s::text[])
+                                AS d(thread_id, checkpoint_ns, checkpoint_id)
+                        ),
+                        deleted_writes AS (
+                            DELETE FROM checkpoint_writes w USING doomed d
+                            WHERE w.thread_id = d.thread_id
+                              AND w.checkpoint_ns = d.checkpoint_ns
+                              AND w.checkpoint_id = d.checkpoint_id
+                            RETURNING 1
+                        ),
+                        deleted_checkpoints AS (
+                            DELETE FROM checkpoints c USING doomed d
+                            WHERE c.thread_id = d.thread_id
+                              AND c.checkpoint_ns = d.checkpoint_ns
+                              AND c.checkpoint_id = d.checkpoint_id
+                            RETURNING c.thread_id, c.checkpoint_ns, c.checkpoint -> 'channel_versions' AS channel_versions
+                        ),
+                        released AS (
+                            SELECT DISTINCT dc.thread_id, dc.checkpoint_ns, v.key AS channel, v.value AS version
+                            FROM deleted_checkpoints dc,
+                                 jsonb_each_text(COALESCE(dc.channel_versions, '{}'::jsonb)) v
+                        )
+                        SELECT (SELECT count(*) FROM deleted_checkpoints),
+                               (SELECT count(*) FROM deleted_writes),
+                               (SELECT COALESCE(json_agg(json_build_array(
+                                    r.thread_id, r.checkpoint_ns, r.channel, r.version
+                                )), '[]'::json) FROM released r)
+                    """, (
+                        [row[0] for row in batch],
+                        [row[1] for row in batch],
+                        [row[2] for row in batch]
+                    ))
+                    deleted_checkpoints, deleted_writes, released = cursor.fetchone()
+                    # 数据修改CTE看不到同一语句中的删除，引用检查放在下一条语句（同一事务）
+                    report["deleted_blobs"] += self._delete_released_blobs(cursor, released)
+                conn.commit()
+                report["deleted_checkpoints"] += deleted_checkpoints
+                report["deleted_writes"] += deleted_writes
+                report["batches"] += 1
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"执行PostgreSQL检查点保留策略失败: {str(e)}")
+            report["error"] = str(e)
+        finally:
+            conn.close()
+
+        # 删除后的空间由autovacuum回收复用，表文件大小不一定立即缩小
+        after = self._measure_checkpoint_tables()
+        report["table_bytes_after"] = after["table_bytes"]
+        report["rows_after"] = after["total_checkpoints"]
+        report["list_latency_ms_after"] = self._probe_list_latency(policy.latency_probe_limit)
+        report["duration_ms"] = (time.perf_counter() - started) * 1000
+
+        self._last_retention_report = report
+        logger.info(
+            f"PostgreSQL检查点保留策略完成: 删除检查点 {report['deleted_checkpoints']}，"
+            f"写入 {report['deleted_writes']}，通道数据 {report['deleted_blobs']}，"
+            f"列表延迟 {report['list_latency_ms_before']:.1f}ms -> {report['list_latency_ms_after']:.1f}ms"
+        )
+        return report
+
+    @staticmethod
+    def _delete_released_blobs(cursor, released: List[List[str]]) -> int:
+        """删除被删检查点引用过的通道数据
+
+        只删除不再被剩余检查点引用、且版本低于该线程最新检查点对应版本的数据：
+        put在写入检查点行之前先写入通道数据，最新检查点及更高的版本可能属于正在写入的检查点。
+        PostgresSaver的版本号为定长补零字符串，可以按字符串比较大小。
+
+        Args:
+            cursor: 数据库游标（与删除检查点在同一事务中）
+            released: [thread_id, checkpoint_ns, channel, version]列表
+
+        Returns:
+            删除的通道数据行数
+        """
+        if not released:
+            return 0
+        cursor.execute("""
+            WITH released AS (
+                SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[])
+                    AS r(thread_id, checkpoint_ns, channel, version)
+            ),
+            newest AS (
+                SELECT DISTINCT ON (c.thread_id, c.checkpoint_ns)
+                       c.thread_id, c.checkpoint_ns, c.checkpoint -> 'channel_versions' AS channel_versions
+                FROM checkpoints c
+                JOIN (SELECT DISTINCT thread_id, checkpoint_ns FROM released) t
+                  ON c.thread_id = t.thread_id AND c.checkpoint_ns = t.checkpoint_ns
+                ORDER BY c.thread_id, c.checkpoint_ns, c.checkpoint_id DESC
+            )
+            DELETE FROM checkpoint_blobs b
+            USING released r
+            JOIN newest n ON n.thread_id = r.thread_id AND n.checkpoint_ns = r.checkpoint_ns
+            WHERE b.thread_id = r.thread_id
+              AND b.checkpoint_ns = r.checkpoint_ns
+              AND b.channel = r.channel
+              AND b.version = r.version
+              AND r.version < n.channel_versions ->> r.channel
+              AND NOT EXISTS (
+                  SELECT 1 FROM checkpoints c
+                  WHERE c.thread_id = b.thread_id
+                    AND c.checkpoint_ns = b.checkpoint_ns
+                    AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+              )
+        """, (
+            [row[0] for row in released],
+            [row[1] for row in released],
+            [row[2] for row in released],
+            [row[3] for row in released]
+        ))
+        return cursor.rowcount
+
     def _validate_postgres_checkpointer(self) -> bool:
         """验证PostgreSQL检查点器是否真正可用
         
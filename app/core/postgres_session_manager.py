@@ -6,28 +6,53 @@
 2. 会话状态的恢复和加载
 3. 会话元数据管理
 4. 自动清理过期会话
+
+会话保存以增量为主：追加型字段只写入新增元素到增量表，
+定期（或前缀变化时）写入完整快照并清除旧增量，加载时按版本重放增量。
+
+连接通过线程安全的连接池按操作借出，借出时做健康检查，
+连接失效时丢弃并由连接池重建，多会话操作提供批量接口。
 """
 
 import logging
 import json
+import threading
+import time
 import uuid
-from typing import Dict, Any, Optional, List
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, timedelta
 import traceback
 
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
+    from psycopg2.pool import ThreadedConnectionPool, PoolError
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     psycopg2 = None
     RealDictCursor = None
+    execute_values = None
+    ThreadedConnectionPool = None
+    PoolError = None
     PSYCOPG2_AVAILABLE = False
 
 from app.core.config import ConfigManager
+from app.core.session_delta import SessionDeltaTracker, apply_session_deltas, DEFAULT_COMPACT_EVERY
+from app.core.state_codec import get_state_codec
 
 logger = logging.getLogger(__name__)
 
+
+def _to_naive_isoformat(dt: Optional[datetime]) -> Optional[str]:
+    """安全地转换时间格式，时区感知的时间去掉时区信息"""
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return dt.isoformat()
+
+
 class PostgreSQLSessionManager:
     """PostgreSQL会话持久化管理器
     
@@ -47,8 +72,29 @@ class PostgreSQLSessionManager:
         self.config = config or ConfigManager()
         self._postgres_config = self.config.get_postgresql_config()
         self._connection_string = self._build_connection_string()
-        self._connection = None
+        self._pool = None
+        self._pool_min_size = self._postgres_config.get("pool_min_size", 1)
+        self._pool_max_size = self._postgres_config.get("pool_max_size", 10)
+        # ThreadedConnectionPool耗尽时getconn直接抛出PoolError，借出前先占用名额，
+        # 名额用完时阻塞等待，超时后才报错
+        self._pool_timeout = self._postgres_config.get("pool_timeout", 30)
+        self._pool_slots = threading.BoundedSemaphore(self._pool_max_size)
+        # 连接空闲超过该秒数，借出前执行一次健康检查
+        self._health_check_interval = self._postgres_config.get("stale_timeout", 30)
+        self._last_used: Dict[int, float] = {}
+        self._pool_lock = threading.Lock()
+        self._pool_stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "reconnects": 0,
+            "waits": 0,
+            "timeouts": 0
+        }
         self._table_name = "isotope_sessions"
+        self._deltas_table_name = f"{self._table_name}_deltas"
+        self._delta_tracker = SessionDeltaTracker(
+            self._postgres_config.get("session_compact_every", DEFAULT_COMPACT_EVERY)
+        )
         
         # 初始化数据库连接和表结构
         self._init_database()
@@ -74,9 +120,11 @@ class PostgreSQLSessionManager:
             raise ImportError("psycopg2 is required for PostgreSQL session management")
         
         try:
-            # 建立数据库连接
+            # 建立数据库连接池
             postgres_config = self._postgres_config
-            self._connection = psycopg2.connect(
+            self._pool = ThreadedConnectionPool(
+                self._pool_min_size,
+                self._pool_max_size,
                 host=postgres_config.get("host", "localhost"),
                 user=postgres_config.get("user", "sweet"),
                 password=postgres_config.get("password", ""),
@@ -86,10 +134,7 @@ class PostgreSQLSessionManager:
                 client_encoding='utf8'
             )
             
-            # 设置自动提交
-            self._connection.autocommit = True
-            
-            logger.info("PostgreSQL会话管理器连接建立成功")
+            logger.info(f"PostgreSQL会话管理器连接池建立成功: {self._pool_min_size}-{self._pool_max_size}")
             
             # 创建会话表
             self._create_sessions_table()
@@ -98,10 +143,107 @@ class PostgreSQLSessionManager:
             logger.error(f"初始化PostgreSQL会话管理器失败: {str(e)}")
             raise
     
+    @contextmanager
+    def _connection_scope(self):
+        """从连接池借出一个连接，操作结束后归还
+        
+        连接全部借出时最多等待pool_timeout秒；借出时丢弃已关闭的连接，
+        空闲较久的连接先做健康检查；操作中出现连接级错误时关闭该连接，
+        连接池会在下次借出时重建。
+        """
+        self._acquire_pool_slot()
+        try:
+            conn = self._checkout_healthy_connection()
+        except Exception:
+            self._pool_slots.release()
+            raise
+        with self._pool_lock:
+            self._pool_stats["checkouts"] += 1
+            self._pool_stats["in_use"] += 1
+        
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            with self._pool_lock:
+                self._pool_stats["in_use"] -= 1
+            self._release_connection(conn, close=broken or conn.closed)
+            self._pool_slots.release()
+    
+    def _acquire_pool_slot(self):
+        """占用一个连接名额，连接池耗尽时阻塞等待直到超时"""
+        if self._pool_slots.acquire(blocking=False):
+            return
+        with self._pool_lock:
+            self._pool_stats["waits"] += 1
+        if not self._pool_slots.acquire(timeout=self._pool_timeout):
+            with self._pool_lock:
+                self._pool_stats["timeouts"] += 1
+            raise PoolError(f"等待PostgreSQL连接超时（{self._pool_timeout}秒），连接池已耗尽")
+    
+    @contextmanager
+    def _cursor(self, cursor_factory=None):
+        """借出连接并创建游标"""
+        with self._connection_scope() as conn:
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+    
+    def _checkout_healthy_connection(self):
+        """借出可用连接，失效连接会被丢弃并重试"""
+        for _ in range(self._pool_max_size + 1):
+            conn = self._pool.getconn()
+            if not conn.closed and self._is_connection_alive(conn):
+                conn.autocommit = True
+                return conn
+            self._release_connection(conn, close=True)
+            with self._pool_lock:
+                self._pool_stats["reconnects"] += 1
+            logger.warning("PostgreSQL连接已失效，丢弃并重新建立连接")
+        raise psycopg2.OperationalError("无法从连接池获取可用的PostgreSQL连接")
+    
+    def _is_connection_alive(self, conn) -> bool:
+        """空闲超过健康检查间隔的连接执行SELECT 1确认可用"""
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.time() - last_used < self._health_check_interval:
+            return True
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning(f"PostgreSQL连接健康检查失败: {str(e)}")
+            return False
+    
+    def _release_connection(self, conn, close: bool = False):
+        """归还连接到连接池"""
+        try:
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.time()
+            self._pool.putconn(conn, close=close)
+        except Exception as e:
+            logger.error(f"归还PostgreSQL连接失败: {str(e)}")
+    
+    def get_pool_statistics(self) -> Dict[str, Any]:
+        """获取连接池统计信息"""
+        with self._pool_lock:
+            return {
+                **self._pool_stats,
+                "min_size": self._pool_min_size,
+                "max_size": self._pool_max_size,
+                "timeout": self._pool_timeout,
+                "closed": self._pool is None or self._pool.closed
+            }
+    
     def _create_sessions_table(self):
         """创建会话表结构"""
         try:
-            with self._connection.cursor() as cursor:
+            with self._cursor() as cursor:
                 # 创建会话表
                 cursor.execute(f"""
                     CREATE TABLE IF NOT EXISTS {self._table_name} (
@@ -137,6 +279,34 @@ class PostgreSQLSessionManager:
                     ON {self._table_name}(expires_at)
                 """)
                 
+                # 会话列表按活跃会话的最后更新时间分页
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{self._table_name}_active_last_updated 
+                    ON {self._table_name}(last_updated DESC) WHERE is_active = TRUE
+                """)
+                
+                # 快照对应的版本，版本号大于它的增量需要在加载时重放
+                cursor.execute(f"""
+                    ALTER TABLE {self._table_name}
+                    ADD COLUMN IF NOT EXISTS snapshot_version INTEGER DEFAULT 1
+                """)
+                
+                # 创建增量表
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self._deltas_table_name} (
+                        id BIGSERIAL PRIMARY KEY,
+                        session_id VARCHAR(255) NOT NULL,
+                        version INTEGER NOT NULL,
+                        delta JSONB NOT NULL,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{self._deltas_table_name}_session_version 
+                    ON {self._deltas_table_name}(session_id, version)
+                """)
+                
                 # 创建触发器更新 last_updated 字段
                 cursor.execute(f"""
                     CREATE OR REPLACE FUNCTION update_{self._table_name}_timestamp()
@@ -185,35 +355,46 @@ class PostgreSQLSessionManager:
             是否保存成功
         """
         try:
-            # 准备序列化的状态数据
-            serializable_data = self._prepare_data_for_serialization(session_data)
-            
             # 计算过期时间
             expires_at = None
             if expires_in_hours:
                 expires_at = datetime.now() + timedelta(hours=expires_in_hours)
             
-            with self._connection.cursor() as cursor:
-                # 使用 UPSERT (INSERT ... ON CONFLICT) 语法
-                cursor.execute(f"""
-                    INSERT INTO {self._table_name} 
-                    (session_id, session_data, metadata, expires_at, version)
-                    VALUES (%s, %s, %s, %s, 1)
-                    ON CONFLICT (session_id) 
-                    DO UPDATE SET 
-                        session_data = EXCLUDED.session_data,
-                        metadata = EXCLUDED.metadata,
-                        expires_at = EXCLUDED.expires_at,
-                        version = {self._table_name}.version + 1,
-                        is_active = TRUE
-                """, (
-                    session_id,
-                    json.dumps(serializable_data, ensure_ascii=False),
-                    json.dumps(metadata or {}, ensure_ascii=False),
-                    expires_at
-                ))
-                
-                logger.info(f"会话 {session_id} 已保存到PostgreSQL")
+            # 同一会话的增量计算、写入与记录串行执行
+            with self._delta_tracker.session_lock(session_id):
+                delta = self._delta_tracker.compute_delta(session_id, session_data)
+                if delta is not None and self._save_session_delta(session_id, session_data, delta, metadata, expires_at):
+                    return True
+            
+                with self._cursor() as cursor:
+                    # 使用 UPSERT (INSERT ... ON CONFLICT) 写入快照，同一语句中清除旧增量
+                    cursor.execute(f"""
+                        WITH cleared AS (
+                            DELETE FROM {self._deltas_table_name} WHERE session_id = %s
+                        )
+                        INSERT INTO {self._table_name} 
+                        (session_id, session_data, metadata, expires_at, version, snapshot_version)
+                        VALUES (%s, %s, %s, %s, 1, 1)
+                        ON CONFLICT (session_id) 
+                        DO UPDATE SET 
+                            session_data = EXCLUDED.session_data,
+                            metadata = EXCLUDED.metadata,
+                            expires_at = EXCLUDED.expires_at,
+                            version = {self._table_name}.version + 1,
+                            snapshot_version = {self._table_name}.version + 1,
+                            is_active = TRUE
+                        RETURNING version
+                    """, (
+                        session_id,
+                        session_id,
+                        self._serialize_json(session_data),
+                        json.dumps(metadata or {}, ensure_ascii=False),
+                        expires_at
+                    ))
+                    version = cursor.fetchone()[0]
+            
+                self._delta_tracker.mark_snapshot(session_id, session_data, version)
+                logger.info(f"会话 {session_id} 已保存到PostgreSQL（快照，版本 {version}）")
                 return True
                 
         except Exception as e:
@@ -221,6 +402,95 @@ class PostgreSQLSessionManager:
             logger.error(f"错误详情: {traceback.format_exc()}")
             return False
     
+    def _save_session_delta(
+        self,
+        session_id: str,
+        session_data: Dict[str, Any],
+        delta: Dict[str, Any],
+        metadata: Optional[Dict[str, Any]],
+        expires_at: Optional[datetime]
+    ) -> bool:
+        """写入会话增量，同一语句中更新会话行的元数据与版本
+        
+        只有会话行的版本仍等于增量的基准版本时才追加，其他进程已写入新版本时
+        不会在旧基准上重复追加。
+        
+        Returns:
+            是否写入成功；会话行不存在或版本已变化时返回False，由调用方写入快照
+        """
+        payload = self._serialize_json({
+            "appends": delta["appends"],
+            "fields": delta["fields"]
+        })
+        with self._cursor() as cursor:
+            cursor.execute(f"""
+                WITH updated AS (
+                    UPDATE {self._table_name}
+                    SET metadata = %s, expires_at = %s, version = version + 1, is_active = TRUE
+                    WHERE session_id = %s AND version = %s
+                    RETURNING version
+                )
+                INSERT INTO {self._deltas_table_name} (session_id, version, delta)
+                SELECT %s, version, %s::jsonb FROM updated
+                RETURNING version
+            """, (
+                json.dumps(metadata or {}, ensure_ascii=False),
+                expires_at,
+                session_id,
+                delta["version"] - 1,
+                session_id,
+                payload
+            ))
+            row = cursor.fetchone()
+        
+        if row is None:
+            self._delta_tracker.forget(session_id)
+            return False
+        
+        delta["version"] = row[0]
+        self._delta_tracker.mark_delta(session_id, session_data, delta)
+        logger.debug(f"会话 {session_id} 增量已保存到PostgreSQL（版本 {row[0]}）")
+        return True
+    
+    def _load_session_deltas(self, cursor, session_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """批量读取各会话快照之后的增量，按版本升序
+        
+        Args:
+            cursor: 字典游标
+            session_ids: 会话ID列表
+        """
+        if not session_ids:
+            return {}
+        cursor.execute(f"""
+            SELECT d.session_id, d.delta
+            FROM {self._deltas_table_name} d
+            JOIN {self._table_name} s ON s.session_id = d.session_id
+            WHERE d.session_id = ANY(%s) AND d.version > COALESCE(s.snapshot_version, 0)
+            ORDER BY d.session_id, d.version
+        """, (list(session_ids),))
+        
+        deltas: Dict[str, List[Dict[str, Any]]] = {}
+        for row in cursor.fetchall():
+            deltas.setdefault(row['session_id'], []).append(row['delta'])
+        return deltas
+    
+    def _build_loaded_session(self, row: Dict[str, Any], deltas: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """由快照行和增量重建会话数据，并记录到增量跟踪器"""
+        state = apply_session_deltas(row['session_data'], deltas)
+        with self._delta_tracker.session_lock(row['session_id']):
+            self._delta_tracker.mark_snapshot(row['session_id'], state, row['version'])
+            if len(deltas) >= self._delta_tracker.compact_every:
+                # 增量积累过多时让下一次保存写入快照
+                self._delta_tracker.forget(row['session_id'])
+        return {
+            "session_id": row['session_id'],
+            "state": state,
+            "metadata": row['metadata'],
+            "created_at": _to_naive_isoformat(row['created_at']),
+            "last_updated": _to_naive_isoformat(row['last_updated']),
+            "version": row['version']
+        }
+    
     def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """从PostgreSQL加载会话状态
         
@@ -231,7 +501,7 @@ class PostgreSQLSessionManager:
             会话数据字典，如果不存在则返回None
         """
         try:
-            with self._connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(f"""
                     SELECT session_id, session_data, metadata, created_at, last_updated, 
                            expires_at, version, is_active
@@ -264,24 +534,9 @@ class PostgreSQLSessionManager:
                         self._deactivate_session(session_id)
                         return None
                 
-                # 安全地转换时间格式，确保时区一致性
-                def safe_datetime_to_isoformat(dt):
-                    if dt is None:
-                        return None
-                    # 如果是时区感知的时间，转换为本地时间
-                    if dt.tzinfo is not None:
-                        dt = dt.replace(tzinfo=None)
-                    return dt.isoformat()
-                
-                # 构建会话数据
-                session_data = {
-                    "session_id": row['session_id'],
-                    "state": row['session_data'],
-                    "metadata": row['metadata'],
-                    "created_at": safe_datetime_to_isoformat(row['created_at']),
-                    "last_updated": safe_datetime_to_isoformat(row['last_updated']),
-                    "version": row['version']
-                }
+                # 构建会话数据（重放快照之后的增量）
+                deltas = self._load_session_deltas(cursor, [session_id]).get(session_id, [])
+                session_data = self._build_loaded_session(row, deltas)
                 
                 logger.info(f"会话 {session_id} 已从PostgreSQL加载")
                 return session_data
@@ -290,54 +545,298 @@ class PostgreSQLSessionManager:
             logger.error(f"从PostgreSQL加载会话 {session_id} 失败: {str(e)}")
             return None
     
+    def load_session_messages(
+        self,
+        session_id: str,
+        limit: Optional[int] = 50,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """读取会话消息的一个窗口，不加载完整会话状态
+        
+        消息序号按快照消息在前、快照之后的增量按版本追加的顺序编号（从0开始）。
+        只读取快照与各增量的消息数，窗口在SQL中按下标从JSONB数组取出，不展开整个数组。
+        
+        Args:
+            session_id: 会话ID
+            limit: 窗口大小，None表示不限制
+            before: 只返回序号小于该值的消息（向前翻页）
+            after: 只返回序号大于等于该值的消息（向后翻页）；两者都未指定时返回最新的消息
+            
+        Returns:
+            {"total": 消息总数, "start": 窗口起始序号, "messages": 消息列表}，会话不存在时返回None
+        """
+        try:
+            with self._cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    WITH s AS (
+                        SELECT session_id, snapshot_version,
+                               CASE WHEN jsonb_typeof(session_data->'messages') = 'array'
+                                    THEN session_data->'messages' ELSE '[]'::jsonb END AS items
+                        FROM {self._table_name}
+                        WHERE session_id = %(session_id)s AND is_active = TRUE
+                    ),
+                    parts AS (
+                        SELECT 0 AS version, s.items FROM s
+                        UNION ALL
+                        SELECT d.version,
+                               CASE WHEN jsonb_typeof(d.delta->'appends'->'messages') = 'array'
+                                    THEN d.delta->'appends'->'messages' ELSE '[]'::jsonb END
+                        FROM s
+                        JOIN {self._deltas_table_name} d
+                          ON d.session_id = s.session_id AND d.version > COALESCE(s.snapshot_version, 0)
+                    ),
+                    sized AS (
+                        SELECT items,
+                               jsonb_array_length(items) AS n,
+                               SUM(jsonb_array_length(items)) OVER (ORDER BY version)
+                                   - jsonb_array_length(items) AS first_idx
+                        FROM parts
+                    ),
+                    totals AS (
+                        SELECT COALESCE((SELECT SUM(n) FROM sized), 0)::bigint AS total FROM s
+                    ),
+                    clamped AS (
+                        SELECT total,
+                               LEAST(GREATEST(%(after)s::bigint, 0), total) AS after_idx,
+                               LEAST(GREATEST(COALESCE(%(before)s::bigint, total), 0), total) AS before_idx
+                        FROM totals
+                    ),
+                    bounds AS (
+                        SELECT total,
+                               CASE WHEN %(after)s::bigint IS NOT NULL THEN after_idx
+                                    WHEN %(limit)s::bigint IS NULL THEN 0
+                                    ELSE GREATEST(0, before_idx - %(limit)s::bigint) END AS start_idx,
+                               CASE WHEN %(after)s::bigint IS NULL THEN before_idx
+                                    WHEN %(limit)s::bigint IS NULL THEN total
+                                    ELSE LEAST(total, after_idx + %(limit)s::bigint) END AS end_idx
+                        FROM clamped
+                    )
+                    SELECT b.total, b.start_idx, w.idx, w.msg
+                    FROM bounds b
+                    LEFT JOIN LATERAL (
+                        SELECT sized.first_idx + i AS idx, sized.items -> i::int AS msg
+                        FROM sized,
+                             generate_series(
+                                 GREATEST(b.start_idx - sized.first_idx, 0),
+                                 LEAST(b.end_idx - sized.first_idx, sized.n) - 1
+                             ) AS i
+                    ) w ON TRUE
+                    ORDER BY w.idx
+                """, {"session_id": session_id, "after": after, "before": before, "limit": limit})
+                rows = cursor.fetchall()
+            
+            if not rows:
+                return None
+            return {
+                "total": int(rows[0]['total']),
+                "start": int(rows[0]['start_idx']),
+                "messages": [row['msg'] for row in rows if row['idx'] is not None]
+            }
+                
+        except Exception as e:
+            logger.error(f"从PostgreSQL读取会话 {session_id} 的消息窗口失败: {str(e)}")
+            return None
+    
+    def save_sessions_bulk(
+        self,
+        sessions: List[Dict[str, Any]],
+        expires_in_hours: Optional[int] = None
+    ) -> int:
+        """批量保存会话，一次往返完成所有UPSERT
+        
+        Args:
+            sessions: 会话列表，每项包含session_id、state，可选metadata
+            expires_in_hours: 会话过期时间（小时），None表示不过期
+            
+        Returns:
+            保存的会话数量
+        """
+        if not sessions:
+            return 0
+        
+        try:
+            expires_at = None
+            if expires_in_hours:
+                expires_at = datetime.now() + timedelta(hours=expires_in_hours)
+            
+            rows = [
+                (
+                    session["session_id"],
+                    self._serialize_json(session["state"]),
+                    json.dumps(session.get("metadata") or {}, ensure_ascii=False),
+                    expires_at
+                )
+                for session in sessions
+            ]
+            
+            # 按会话ID顺序持有各会话的持久化锁，避免与单个会话的增量写入交错
+            with ExitStack() as stack:
+                for session_id in sorted({row[0] for row in rows}):
+                    stack.enter_context(self._delta_tracker.session_lock(session_id))
+                
+                with self._cursor() as cursor:
+                    versions = execute_values(cursor, f"""
+                        INSERT INTO {self._table_name}
+                        (session_id, session_data, metadata, expires_at)
+                        VALUES %s
+                        ON CONFLICT (session_id)
+                        DO UPDATE SET
+                            session_data = EXCLUDED.session_data,
+                            metadata = EXCLUDED.metadata,
+                            expires_at = EXCLUDED.expires_at,
+                            version = {self._table_name}.version + 1,
+                            snapshot_version = {self._table_name}.version + 1,
+                            is_active = TRUE
+                        RETURNING session_id, version
+                    """, rows, template="(%s, %s::jsonb, %s::jsonb, %s)", page_size=len(rows), fetch=True)
+                
+                    # 快照已包含全部内容，旧增量不再需要
+                    cursor.execute(f"""
+                        DELETE FROM {self._deltas_table_name} WHERE session_id = ANY(%s)
+                    """, ([row[0] for row in rows],))
+                
+                states = {session["session_id"]: session["state"] for session in sessions}
+                for session_id, version in versions:
+                    self._delta_tracker.mark_snapshot(session_id, states[session_id], version)
+            
+            logger.info(f"批量保存 {len(rows)} 个会话到PostgreSQL")
+            return len(rows)
+            
+        except Exception as e:
+            logger.error(f"批量保存会话到PostgreSQL失败: {str(e)}")
+            return 0
+    
+    def load_sessions_bulk(self, session_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量加载活跃且未过期的会话，一次查询完成
+        
+        Args:
+            session_ids: 会话ID列表
+            
+        Returns:
+            会话ID到会话数据的字典，不存在或已过期的会话不包含在内
+        """
+        if not session_ids:
+            return {}
+        
+        try:
+            with self._cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT session_id, session_data, metadata, created_at, last_updated, version
+                    FROM {self._table_name}
+                    WHERE session_id = ANY(%s)
+                    AND is_active = TRUE
+                    AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                """, (list(session_ids),))
+                rows = cursor.fetchall()
+                
+                deltas = self._load_session_deltas(cursor, [row['session_id'] for row in rows])
+                sessions = {
+                    row['session_id']: self._build_loaded_session(row, deltas.get(row['session_id'], []))
+                    for row in rows
+                }
+            
+            logger.info(f"从PostgreSQL批量加载了 {len(sessions)}/{len(session_ids)} 个会话")
+            return sessions
+            
+        except Exception as e:
+            logger.error(f"从PostgreSQL批量加载会话失败: {str(e)}")
+            return {}
+    
+    # list_sessions允许的排序字段
+    _SORTABLE_COLUMNS = {
+        "last_updated": "s.last_updated",
+        "created_at": "s.created_at",
+        "message_count": "message_count"
+    }
+    
+    def _build_session_filter(self, include_inactive: bool, name_filter: Optional[str]) -> Tuple[str, List[Any]]:
+        """构建会话列表的过滤条件"""
+        conditions = []
+        params: List[Any] = []
+        if not include_inactive:
+            conditions.append("s.is_active = TRUE")
+        if name_filter:
+            conditions.append("s.metadata->>'name' ILIKE %s")
+            params.append(f"%{name_filter}%")
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where_clause, params
+    
+    def count_sessions(self, include_inactive: bool = False, name_filter: Optional[str] = None) -> int:
+        """统计符合条件的会话数
+        
+        Args:
+            include_inactive: 是否包含非活跃会话
+            name_filter: 按会话名称过滤（不区分大小写的子串匹配）
+        """
+        try:
+            where_clause, params = self._build_session_filter(include_inactive, name_filter)
+            with self._cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {self._table_name} s {where_clause}", params)
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"从PostgreSQL统计会话数失败: {str(e)}")
+            return 0
+    
     def list_sessions(
         self, 
         limit: Optional[int] = 50, 
         offset: Optional[int] = 0,
-        include_inactive: bool = False
+        include_inactive: bool = False,
+        order_by: str = "last_updated",
+        descending: bool = True,
+        name_filter: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """列出所有会话
+        """列出所有会话（过滤、排序和分页都在数据库中完成）
         
         Args:
             limit: 返回数量限制
             offset: 偏移量
             include_inactive: 是否包含非活跃会话
+            order_by: 排序字段（last_updated、created_at、message_count）
+            descending: 是否降序
+            name_filter: 按会话名称过滤（不区分大小写的子串匹配）
             
         Returns:
             会话列表
         """
         try:
-            with self._connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._cursor(cursor_factory=RealDictCursor) as cursor:
                 # 构建查询条件
-                where_clause = "WHERE is_active = TRUE" if not include_inactive else ""
+                where_clause, params = self._build_session_filter(include_inactive, name_filter)
+                order_column = self._SORTABLE_COLUMNS.get(order_by, "s.last_updated")
+                direction = "DESC" if descending else "ASC"
                 
+                # 消息数包含快照之后增量中追加的消息
                 cursor.execute(f"""
-                    SELECT session_id, metadata, created_at, last_updated, 
-                           expires_at, version, is_active,
-                           jsonb_array_length(session_data->'messages') as message_count
-                    FROM {self._table_name} 
+                    SELECT s.session_id, s.metadata, s.created_at, s.last_updated, 
+                           s.expires_at, s.version, s.is_active,
+                           COALESCE(jsonb_array_length(s.session_data->'messages'), 0)
+                           + COALESCE((
+                               SELECT SUM(jsonb_array_length(d.delta->'appends'->'messages'))
+                               FROM {self._deltas_table_name} d
+                               WHERE d.session_id = s.session_id
+                               AND d.version > COALESCE(s.snapshot_version, 0)
+                               AND jsonb_typeof(d.delta->'appends'->'messages') = 'array'
+                           ), 0) as message_count,
+                           CASE WHEN jsonb_typeof(s.session_data->'files') = 'object'
+                                THEN (SELECT COUNT(*) FROM jsonb_object_keys(s.session_data->'files'))
+                                ELSE 0 END as file_count
+                    FROM {self._table_name} s
                     {where_clause}
-                    ORDER BY last_updated DESC
+                    ORDER BY {order_column} {direction}
                     LIMIT %s OFFSET %s
-                """, (limit, offset))
-                
-                # 安全地转换时间格式，确保时区一致性
-                def safe_datetime_to_isoformat(dt):
-                    if dt is None:
-                        return None
-                    # 如果是时区感知的时间，转换为本地时间
-                    if dt.tzinfo is not None:
-                        dt = dt.replace(tzinfo=None)
-                    return dt.isoformat()
+                """, (*params, limit, offset))
                 
                 sessions = []
                 for row in cursor.fetchall():
                     session_info = {
                         "session_id": row['session_id'],
                         "metadata": row['metadata'],
-                        "created_at": safe_datetime_to_isoformat(row['created_at']),
-                        "last_updated": safe_datetime_to_isoformat(row['last_updated']),
+                        "created_at": _to_naive_isoformat(row['created_at']),
+                        "last_updated": _to_naive_isoformat(row['last_updated']),
                         "message_count": row['message_count'] or 0,
+                        "file_count": row['file_count'] or 0,
                         "version": row['version'],
                         "is_active": row['is_active'],
                         "status": "active" if row['is_active'] else "inactive"
@@ -345,7 +844,7 @@ class PostgreSQLSessionManager:
                     
                     # 检查过期状态
                     if row['expires_at']:
-                        session_info["expires_at"] = safe_datetime_to_isoformat(row['expires_at'])
+                        session_info["expires_at"] = _to_naive_isoformat(row['expires_at'])
                         
                         # 确保时区一致性
                         now = datetime.now()
@@ -382,7 +881,7 @@ class PostgreSQLSessionManager:
             是否删除成功
         """
         try:
-            with self._connection.cursor() as cursor:
+            with self._cursor() as cursor:
                 if soft_delete:
                     # 软删除：标记为非活跃
                     cursor.execute(f"""
@@ -391,12 +890,16 @@ class PostgreSQLSessionManager:
                         WHERE session_id = %s
                     """, (session_id,))
                 else:
-                    # 硬删除：直接删除记录
+                    # 硬删除：直接删除记录及其增量
                     cursor.execute(f"""
-                        DELETE FROM {self._table_name} 
+                        WITH cleared AS (
+                            DELETE FROM {self._deltas_table_name} WHERE session_id = %s
+                        )
+                        DELETE FROM {self._table_name}
                         WHERE session_id = %s
-                    """, (session_id,))
-                
+                    """, (session_id, session_id))
+                    self._delta_tracker.forget(session_id)
+
                 affected_rows = cursor.rowcount
                 if affected_rows > 0:
                     action = "软删除" if soft_delete else "硬删除"
@@ -417,7 +920,7 @@ class PostgreSQLSessionManager:
             清理的会话数量
         """
         try:
-            with self._connection.cursor() as cursor:
+            with self._cursor() as cursor:
                 # 软删除过期会话
                 cursor.execute(f"""
                     UPDATE {self._table_name} 
@@ -444,7 +947,7 @@ class PostgreSQLSessionManager:
             统计信息字典
         """
         try:
-            with self._connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._cursor(cursor_factory=RealDictCursor) as cursor:
                 # 获取基本统计
                 cursor.execute(f"""
                     SELECT 
@@ -500,20 +1003,10 @@ class PostgreSQLSessionManager:
         try:
             sessions = self.list_sessions(limit=None, include_inactive=False)
             
-            restored_sessions = {}
-            failed_count = 0
-            
-            for session_info in sessions:
-                session_id = session_info['session_id']
-                try:
-                    session_data = self.load_session(session_id)
-                    if session_data:
-                        restored_sessions[session_id] = session_data
-                    else:
-                        failed_count += 1
-                except Exception as e:
-                    logger.error(f"恢复会话 {session_id} 失败: {str(e)}")
-                    failed_count += 1
+            restored_sessions = self.load_sessions_bulk(
+                [session_info['session_id'] for session_info in sessions]
+            )
+            failed_count = len(sessions) - len(restored_sessions)
             
             result = {
                 "success": True,
@@ -538,7 +1031,7 @@ class PostgreSQLSessionManager:
     def _deactivate_session(self, session_id: str):
         """标记会话为非活跃"""
         try:
-            with self._connection.cursor() as cursor:
+            with self._cursor() as cursor:
                 cursor.execute(f"""
                     UPDATE {self._table_name} 
                     SET is_active = FALSE 
@@ -547,78 +1040,9 @@ class PostgreSQLSessionManager:
         except Exception as e:
             logger.error(f"标记会话 {session_id} 为非活跃失败: {str(e)}")
     
-    def _prepare_data_for_serialization(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """准备数据进行序列化
-        
-        Args:
-            data: 原始数据
-            
-        Returns:
-            可序列化的数据
-        """
-        return self._make_serializable(data)
-    
-    def _make_serializable(self, obj):
-        """递归地将对象转换为可序列化格式"""
-        # 处理None
-        if obj is None:
-            return None
-        
-        # 处理基本类型
-        if isinstance(obj, (str, int, float, bool)):
-            return obj
-        
-        # 跳过不可序列化的已知类型
-        from app.core.memory.store import MemoryStore
-        if isinstance(obj, MemoryStore):
-            return "<MemoryStore实例，已跳过序列化>"
-        
-        # 跳过新的记忆系统组件
-        try:
-            from app.core.memory.enhanced_memory_integration import EnhancedMemoryIntegration
-            from app.core.memory.engine_adapter import MemoryAwareEngineAdapter
-            if isinstance(obj, (EnhancedMemoryIntegration, MemoryAwareEngineAdapter)):
-                return f"<{type(obj).__name__}实例，已跳过序列化>"
-        except ImportError:
-            pass
-        
-        # 处理LangChain消息对象
-        try:
-            from langchain_core.messages import BaseMessage
-            if isinstance(obj, BaseMessage):
-                msg_dict = {
-                    "type": obj.type,
-                    "content": self._make_serializable(obj.content)
-                }
-                # 添加额外属性
-                if hasattr(obj, "name") and obj.name:
-                    msg_dict["name"] = obj.name
-                if hasattr(obj, "tool_calls") and obj.tool_calls:
-                    msg_dict["tool_calls"] = obj.tool_calls
-                if hasattr(obj, "additional_kwargs") and obj.additional_kwargs:
-                    msg_dict["additional_kwargs"] = self._make_serializable(obj.additional_kwargs)
-                return msg_dict
-        except ImportError:
-            pass
-        
-        # 处理列表
-        if isinstance(obj, list):
-            return [self._make_serializable(item) for item in obj]
-        
-        # 处理字典
-        if isinstance(obj, dict):
-            return {k: self._make_serializable(v) for k, v in obj.items()}
-        
-        # 处理其他类型
-        try:
-            # 尝试转换为字典
-            if hasattr(obj, "__dict__"):
-                return self._make_serializable(obj.__dict__)
-            # 尝试转换为字符串
-            return str(obj)
-        except:
-            # 如果无法序列化，则转换为字符串
-            return f"<不可序列化的对象: {type(obj).__name__}>"
+    def _serialize_json(self, data: Any) -> str:
+        """使用状态编解码器将数据编码为JSON文本（写入JSONB列）"""
+        return get_state_codec().dumps_json(data).decode("utf-8")
     
     def test_connection(self) -> bool:
         """测试数据库连接
@@ -627,7 +1051,7 @@ class PostgreSQLSessionManager:
             连接是否正常
         """
         try:
-            with self._connection.cursor() as cursor:
+            with self._cursor() as cursor:
                 cursor.execute("SELECT 1")
                 result = cursor.fetchone()
                 return result is not None
@@ -636,21 +1060,23 @@ class PostgreSQLSessionManager:
             return False
     
     def close(self):
-        """关闭数据库连接"""
-        if self._connection:
+        """关闭数据库连接池"""
+        if self._pool and not self._pool.closed:
             try:
-                self._connection.close()
-                logger.info("PostgreSQL会话管理器连接已关闭")
+                self._pool.closeall()
+                logger.info("PostgreSQL会话管理器连接池已关闭")
             except Exception as e:
-                logger.error(f"关闭PostgreSQL连接失败: {str(e)}")
+                logger.error(f"关闭PostgreSQL连接池失败: {str(e)}")
     
     def __del__(self):
         """析构函数，确保关闭连接"""
-        self.close()
+        if getattr(self, "_pool", None) is not None:
+            self.close()
 
 
 # 全局实例管理
 _postgres_session_manager = None
+_postgres_session_manager_lock = threading.Lock()
 
 def get_postgres_session_manager(config: Optional[ConfigManager] = None) -> PostgreSQLSessionManager:
     """获取PostgreSQL会话管理器单例
@@ -664,6 +1090,8 @@ def get_postgres_session_manager(config: Optional[ConfigManager] = None) -> Post
     global _postgres_session_manager
     
     if _postgres_session_manager is None:
-        _postgres_session_manager = PostgreSQLSessionManager(config)
+        with _postgres_session_manager_lock:
+            if _postgres_session_manager is None:
+                _postgres_session_manager = PostgreSQLSessionManager(config)
     
     return _postgres_session_manager 
\ No newline at end of file
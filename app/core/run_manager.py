@@ -0,0 +1,392 @@
+"""
+图运行管理器
+
+将一次分析运行（图执行）作为后台任务调度，而不是绑定在发起它的请求上：
+1. 每个运行有独立的run_id，事件写入回放缓冲，客户端可随时附着、脱离、重新附着
+2. 按资源类别限制并发：图运行占用llm槽位，CPU密集型工具（如meanderpy、
+   reservior）执行时额外占用cpu槽位，超出上限的运行/工具排队等待
+3. 排队数有上限，超出时拒绝新运行；同一会话同时只允许一个未结束的运行
+   （两个运行并发写同一会话的检查点和消息历史会互相覆盖），其余提交被拒绝
+4. CPU密集型工具等待槽位有超时，超时后工具调用失败而不是无限阻塞运行
+5. 记录每个运行的排队等待和执行耗时，供运维接口查询
+
+运行不随连接断开而停止；只有声明为前台的运行（cancel_on_orphan）在所有
+客户端断开超过宽限期后被取消。
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterator
+
+from app.core.stream_replay import StreamReplayBuffer, get_stream_replay_registry
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_LLM = "llm"
+RESOURCE_CPU = "cpu"
+
+RUN_QUEUED = "queued"
+RUN_RUNNING = "running"
+RUN_COMPLETED = "completed"
+RUN_FAILED = "failed"
+RUN_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (RUN_COMPLETED, RUN_FAILED, RUN_CANCELLED)
+
+# 运行生产者：接收本次运行的回放缓冲，将事件写入其中
+RunProducer = Callable[[StreamReplayBuffer], Awaitable[None]]
+
+
+class RunQueueFullError(Exception):
+    """排队的运行数已达上限"""
+    pass
+
+
+class SessionRunActiveError(Exception):
+    """会话已有未结束的运行"""
+
+    def __init__(self, session_id: str, run_id: str):
+        super().__init__(f"会话 {session_id} 正在处理运行 {run_id}，请等待完成")
+        self.session_id = session_id
+        self.run_id = run_id
+
+
+class ToolSlotTimeoutError(Exception):
+    """等待工具资源槽位超时"""
+    pass
+
+
+@dataclass
+class RunRecord:
+    """单次运行的状态和耗时"""
+    run_id: str
+    session_id: Optional[str]
+    resource_class: str = RESOURCE_LLM
+    cancel_on_orphan: bool = False
+    status: str = RUN_QUEUED
+    error: Optional[str] = None
+    queued_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def timings(self, now: Optional[float] = None) -> Dict[str, Optional[float]]:
+        """排队等待和执行耗时（秒），进行中的阶段按当前时间计算"""
+        now = now or time.time()
+        queue_end = self.started_at or self.finished_at or now
+        timings = {
+            "queue_wait_seconds": round(queue_end - self.queued_at, 3),
+            "run_seconds": None
+        }
+        if self.started_at is not None:
+            timings["run_seconds"] = round((self.finished_at or now) - self.started_at, 3)
+        return timings
+
+    def to_dict(self, buffer: Optional[StreamReplayBuffer] = None) -> Dict[str, Any]:
+        info = {
+            "run_id": self.run_id,
+            "session_id": self.session_id,
+            "resource_class": self.resource_class,
+            "status": self.status,
+            "error": self.error,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.timings()
+        }
+        if buffer is not None:
+            info["last_seq"] = buffer.last_seq
+            info["attached_clients"] = buffer.readers
+        return info
+
+
+class RunManager:
+    """后台运行调度器（按资源类别限流）"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, replay_config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            config: 运行配置（runs段）
+            replay_config: 回放缓冲配置（ui.stream_replay段）
+        """
+        config = config or {}
+        self.limits: Dict[str, int] = {RESOURCE_LLM: 4, RESOURCE_CPU: 2}
+        self.limits.update(config.get("concurrency", {}))
+        self.max_queued = config.get("max_queued", 32)
+        self.max_finished_records = config.get("max_finished_records", 200)
+        self.orphan_grace_seconds = config.get("orphan_grace_seconds", 30)
+        # 工具等待资源槽位的最长时间（秒），None表示不限
+        self.tool_slot_timeout_seconds = config.get("tool_slot_timeout_seconds", 600)
+        # 工具分类 -> 资源类别
+        self.tool_classes: Dict[str, str] = dict(config.get("tool_classes", {}))
+
+        self.replay = get_stream_replay_registry(replay_config)
+        self._records: "OrderedDict[str, RunRecord]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # session_id -> 未结束的run_id（每个会话同时只有一个运行）
+        self._session_runs: Dict[str, str] = {}
+        # 运行级槽位在事件循环中使用；工具级槽位在执行工具的线程中使用
+        self._run_slots: Dict[str, asyncio.Semaphore] = {}
+        self._tool_slots = {name: threading.BoundedSemaphore(limit) for name, limit in self.limits.items()}
+        self._tool_usage = {name: {"running": 0, "waiting": 0, "timeouts": 0} for name in self.limits}
+        self._tool_lock = threading.Lock()
+
+    # ==================== 运行调度 ====================
+
+    def submit(
+        self,
+        producer: RunProducer,
+        session_id: Optional[str] = None,
+        resource_class: str = RESOURCE_LLM,
+        cancel_on_orphan: bool = False
+    ) -> RunRecord:
+        """提交一个运行，立即返回记录（须在事件循环中调用）
+
+        Args:
+            producer: 运行生产者，获得槽位后以本次运行的回放缓冲调用
+            session_id: 会话ID
+            resource_class: 运行占用的资源类别
+            cancel_on_orphan: 所有客户端断开超过宽限期后是否取消运行
+
+        Raises:
+            SessionRunActiveError: 会话已有未结束的运行
+            RunQueueFullError: 排队的运行数已达上限
+        """
+        if resource_class not in self.limits:
+            raise ValueError(f"未知的资源类别: {resource_class}")
+        active = self.active_run(session_id)
+        if active is not None:
+            raise SessionRunActiveError(session_id, active.run_id)
+        if self.queue_depth() >= self.max_queued:
+            raise RunQueueFullError(f"排队的运行已达上限 {self.max_queued}")
+
+        buffer = self.replay.create(session_id)
+        record = RunRecord(
+            run_id=buffer.run_id,
+            session_id=session_id,
+            resource_class=resource_class,
+            cancel_on_orphan=cancel_on_orphan
+        )
+        self._records[record.run_id] = record
+        if session_id:
+            self._session_runs[session_id] = record.run_id
+        task = asyncio.create_task(self._execute(record, buffer, producer))
+        self._tasks[record.run_id] = task
+        task.add_done_callback(lambda _: self._on_done(record, buffer))
+        self._trim_records()
+
+        logger.info(f"提交运行 {record.run_id}: session_id={session_id}, 资源类别={resource_class}, 排队数={self.queue_depth()}")
+        return record
+
+    async def _execute(self, record: RunRecord, buffer: StreamReplayBuffer, producer: RunProducer) -> None:
+        """等待资源槽位后执行生产者，并维护运行状态"""
+        try:
+            async with self._run_slot(record.resource_class):
+                record.status = RUN_RUNNING
+                record.started_at = time.time()
+                await producer(buffer)
+            record.status = RUN_COMPLETED
+        except asyncio.CancelledError:
+            record.status = RUN_CANCELLED
+            raise
+        except Exception as e:
+            logger.error(f"运行 {record.run_id} 执行失败: {e}")
+            record.status = RUN_FAILED
+            record.error = str(e)
+        finally:
+            record.finished_at = time.time()
+            buffer.close()
+            logger.info(f"运行 {record.run_id} 结束: 状态={record.status}, 耗时={record.timings()}")
+
+    def _on_done(self, record: RunRecord, buffer: StreamReplayBuffer) -> None:
+        """任务结束回调；任务在开始执行前被取消时_execute不会运行，在此补记状态"""
+        self._tasks.pop(record.run_id, None)
+        if record.session_id and self._session_runs.get(record.session_id) == record.run_id:
+            del self._session_runs[record.session_id]
+        if not record.finished:
+            record.status = RUN_CANCELLED
+            record.finished_at = time.time()
+            buffer.close()
+
+    def _run_slot(self, resource_class: str) -> asyncio.Semaphore:
+        """运行级槽位（首次使用时在当前事件循环中创建）"""
+        slot = self._run_slots.get(resource_class)
+        if slot is None:
+            slot = self._run_slots[resource_class] = asyncio.Semaphore(self.limits[resource_class])
+        return slot
+
+    def active_run(self, session_id: Optional[str]) -> Optional[RunRecord]:
+        """会话当前未结束的运行"""
+        if not session_id:
+            return None
+        record = self._records.get(self._session_runs.get(session_id, ""))
+        return record if record is not None and not record.finished else None
+
+    def cancel(self, run_id: str) -> bool:
+        """取消运行（排队中或执行中）"""
+        task = self._tasks.get(run_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        logger.info(f"已请求取消运行 {run_id}")
+        return True
+
+    async def shutdown(self) -> None:
+        """取消所有未结束的运行并等待其退出"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"已取消 {len(tasks)} 个未结束的运行")
+
+    def _trim_records(self) -> None:
+        """只保留最近的已结束运行记录"""
+        finished = [run_id for run_id, record in self._records.items() if record.finished]
+        for run_id in finished[:max(0, len(finished) - self.max_finished_records)]:
+            del self._records[run_id]
+
+    # ==================== 附着与脱离 ====================
+
+    def get(self, run_id: str) -> Optional[RunRecord]:
+        return self._records.get(run_id)
+
+    def get_buffer(self, run_id: str) -> Optional[StreamReplayBuffer]:
+        return self.replay.get(run_id)
+
+    def attach(self, run_id: str) -> Optional[StreamReplayBuffer]:
+        """客户端附着到运行的事件流，返回回放缓冲（运行不存在或已过期时返回None）"""
+        buffer = self.replay.get(run_id)
+        if buffer is not None:
+            buffer.readers += 1
+        return buffer
+
+    def detach(self, buffer: StreamReplayBuffer) -> None:
+        """客户端脱离；前台运行无人附着时，宽限期后取消"""
+        buffer.readers -= 1
+        record = self._records.get(buffer.run_id)
+        if buffer.readers > 0 or buffer.closed or record is None or not record.cancel_on_orphan:
+            return
+
+        def _cancel_if_orphaned():
+            if buffer.readers == 0 and self.cancel(buffer.run_id):
+                logger.info(f"运行 {buffer.run_id} 在 {self.orphan_grace_seconds}s 内无客户端重连，停止生成")
+
+        asyncio.get_running_loop().call_later(self.orphan_grace_seconds, _cancel_if_orphaned)
+
+    # ==================== 工具限流 ====================
+
+    def resource_class_for_tool(self, category: Optional[str]) -> Optional[str]:
+        """工具分类对应的资源类别；未配置的分类不限流"""
+        resource_class = self.tool_classes.get(category) if category else None
+        return resource_class if resource_class in self._tool_slots else None
+
+    @contextmanager
+    def tool_slot(self, category: Optional[str]) -> Iterator[None]:
+        """执行工具期间占用其资源类别的槽位（在工具线程中阻塞等待）
+
+        Raises:
+            ToolSlotTimeoutError: 超过tool_slot_timeout_seconds仍未获得槽位
+        """
+        resource_class = self.resource_class_for_tool(category)
+        if resource_class is None:
+            yield
+            return
+
+        usage = self._tool_usage[resource_class]
+        with self._tool_lock:
+            usage["waiting"] += 1
+        slot = self._tool_slots[resource_class]
+        acquired = slot.acquire(timeout=self.tool_slot_timeout_seconds)
+        with self._tool_lock:
+            usage["waiting"] -= 1
+            if acquired:
+                usage["running"] += 1
+            else:
+                usage["timeouts"] += 1
+        if not acquired:
+            logger.warning(f"工具 {category} 等待{resource_class}槽位超过 {self.tool_slot_timeout_seconds}s")
+            raise ToolSlotTimeoutError(
+                f"等待{resource_class}资源槽位超时（{self.tool_slot_timeout_seconds}s），请稍后重试"
+            )
+        try:
+            yield
+        finally:
+            with self._tool_lock:
+                usage["running"] -= 1
+            slot.release()
+
+    # ==================== 指标 ====================
+
+    def queue_depth(self) -> int:
+        return sum(1 for record in self._records.values() if record.status == RUN_QUEUED)
+
+    def list_runs(self, include_finished: bool = True) -> List[Dict[str, Any]]:
+        return [
+            record.to_dict(self.replay.get(run_id))
+            for run_id, record in reversed(self._records.items())
+            if include_finished or not record.finished
+        ]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """排队数、各资源类别占用情况和运行列表"""
+        records = list(self._records.values())
+        with self._tool_lock:
+            tools = {name: dict(usage) for name, usage in self._tool_usage.items()}
+        return {
+            "queue_depth": sum(1 for record in records if record.status == RUN_QUEUED),
+            "running": sum(1 for record in records if record.status == RUN_RUNNING),
+            "max_queued": self.max_queued,
+            "limits": dict(self.limits),
+            "runs_by_class": {
+                name: sum(1 for record in records if record.status == RUN_RUNNING and record.resource_class == name)
+                for name in self.limits
+            },
+            "tools_by_class": tools,
+            "replay": self.replay.get_metrics()
+        }
+
+
+_run_manager: Optional[RunManager] = None
+_run_manager_lock = threading.Lock()
+
+
+def get_run_manager(
+    config: Optional[Dict[str, Any]] = None,
+    replay_config: Optional[Dict[str, Any]] = None
+) -> RunManager:
+    """获取全局运行管理器（首次调用时按runs配置创建）"""
+    global _run_manager
+    if _run_manager is None:
+        with _run_manager_lock:
+            if _run_manager is None:
+                _run_manager = RunManager(config, replay_config)
+    return _run_manager
+
+
+def tool_slot(category: Optional[str]):
+    """工具执行的资源槽位；运行管理器未创建时（如命令行直接调用）不限流"""
+    manager = _run_manager
+    return manager.tool_slot(category) if manager is not None else nullcontext()
+
+
+def limit_tool_concurrency(func: Callable, category: Optional[str]) -> Callable:
+    """包装同步工具函数，执行时按分类占用资源槽位"""
+    if asyncio.iscoroutinefunction(func):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tool_slot(category):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,190 @@
+"""
+会话增量持久化 - 只写入自上次保存以来新增的内容
+
+本模块负责：
+1. 跟踪每个会话已持久化的追加型字段（消息、动作历史、工具结果）
+2. 计算增量：追加型字段只包含新增元素，其余字段整体写入
+3. 已持久化的前缀被修改（如历史压缩）或增量数达到阈值时要求写入完整快照
+4. 按版本顺序将增量应用到快照上重建会话状态
+
+追加型字段只记录已持久化的长度以及首、尾元素的指纹（ID、类型、长度），保存时只检查
+这两个边界元素，不再逐个比较整个已持久化前缀；假定元素追加后不再原地修改，
+即使有原地修改，也会在下一次快照压缩时写入。
+
+同一会话的“计算增量 -> 写入 -> 记录写入”必须在session_lock内完成，
+否则并发保存（后台持久化、淘汰回写、直接保存）会基于同一基准版本重复追加。
+"""
+
+import logging
+import threading
+from typing import Dict, List, Any, Iterable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 只会追加的状态字段
+APPEND_ONLY_FIELDS = ("messages", "action_history", "tool_results")
+
+# 默认每写入多少个增量后压缩为一次快照
+DEFAULT_COMPACT_EVERY = 20
+
+
+def _item_fingerprint(item: Any) -> Tuple:
+    """计算追加型字段元素的轻量指纹，不做序列化"""
+    if isinstance(item, dict):
+        content = item.get("content")
+        marker = item.get("id") or item.get("turn_id") or item.get("tool_call_id") or item.get("timestamp")
+        return (marker, item.get("type"), len(item), len(content) if isinstance(content, str) else None)
+    content = getattr(item, "content", None)
+    return (
+        getattr(item, "id", None),
+        getattr(item, "type", type(item).__name__),
+        len(content) if isinstance(content, str) else None
+    )
+
+
+def _field_boundary(items: Sequence[Any]) -> Tuple[int, Optional[Tuple], Optional[Tuple]]:
+    """计算追加型字段的边界：(长度, 首元素指纹, 尾元素指纹)"""
+    if not items:
+        return (0, None, None)
+    return (len(items), _item_fingerprint(items[0]), _item_fingerprint(items[-1]))
+
+
+def merge_appended_items(base_items: Sequence[Any], local_items: Sequence[Any]) -> List[Any]:
+    """将本地副本中基准列表没有的元素按原顺序追加到基准列表之后
+
+    元素按ID（或turn_id、tool_call_id、时间戳）识别，没有标识的元素按指纹识别。
+    """
+    def identity(item: Any) -> Any:
+        fingerprint = _item_fingerprint(item)
+        return fingerprint[0] if fingerprint[0] is not None else fingerprint
+
+    known = {identity(item) for item in base_items}
+    return list(base_items) + [item for item in local_items if identity(item) not in known]
+
+
+def apply_session_deltas(state: Dict[str, Any], deltas: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """将增量按顺序应用到快照状态上
+
+    Args:
+        state: 快照状态（会被原地更新）
+        deltas: 增量列表，按版本升序
+
+    Returns:
+        重建后的状态
+    """
+    for delta in deltas:
+        for field, items in (delta.get("appends") or {}).items():
+            state[field] = list(state.get(field) or []) + list(items)
+        for field, value in (delta.get("fields") or {}).items():
+            state[field] = value
+    return state
+
+
+class SessionDeltaTracker:
+    """记录各会话已持久化的内容，计算下一次保存的增量"""
+
+    def __init__(
+        self,
+        compact_every: int = DEFAULT_COMPACT_EVERY,
+        append_only_fields: Tuple[str, ...] = APPEND_ONLY_FIELDS
+    ):
+        """
+        初始化增量跟踪器
+
+        Args:
+            compact_every: 连续写入多少个增量后要求写入快照
+            append_only_fields: 只会追加的字段
+        """
+        self.compact_every = max(1, compact_every)
+        self.append_only_fields = tuple(append_only_fields)
+        self._lock = threading.Lock()
+        # 会话ID -> {"version", "deltas", "boundaries": {字段: (长度, 首元素指纹, 尾元素指纹)}}
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # 会话ID -> 持久化锁（会话删除后仍保留，避免持锁期间被替换）
+        self._session_locks: Dict[str, threading.RLock] = {}
+
+    def session_lock(self, session_id: str) -> threading.RLock:
+        """获取会话的持久化锁，保存与加载时在锁内完成增量计算、写入和记录"""
+        with self._lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = threading.RLock()
+                self._session_locks[session_id] = lock
+            return lock
+
+    def compute_delta(self, session_id: str, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """计算会话的增量（调用方需持有该会话的session_lock）
+
+        跟踪器的全局锁只用于读取记录，边界比较在锁外进行。
+
+        Returns:
+            增量字典；需要写入完整快照时返回None
+        """
+        with self._lock:
+            tracked = self._sessions.get(session_id)
+            if tracked is None or tracked["deltas"] >= self.compact_every:
+                return None
+            version = tracked["version"]
+            boundaries = dict(tracked["boundaries"])
+
+        appends = {}
+        for field in self.append_only_fields:
+            items = state.get(field) or []
+            length, first, last = boundaries.get(field, (0, None, None))
+            if len(items) < length:
+                return None
+            # 已持久化前缀有变化（如历史压缩）时需要快照，只检查首尾两个边界元素
+            if length and (
+                _item_fingerprint(items[0]) != first
+                or _item_fingerprint(items[length - 1]) != last
+            ):
+                return None
+            if len(items) > length:
+                appends[field] = items[length:]
+
+        fields = {key: value for key, value in state.items() if key not in self.append_only_fields}
+        return {
+            "version": version + 1,
+            "appends": appends,
+            "fields": fields
+        }
+
+    def mark_snapshot(self, session_id: str, state: Dict[str, Any], version: int = 0) -> None:
+        """记录快照已写入"""
+        boundaries = {
+            field: _field_boundary(state.get(field) or [])
+            for field in self.append_only_fields
+        }
+        with self._lock:
+            self._sessions[session_id] = {
+                "version": version,
+                "deltas": 0,
+                "boundaries": boundaries
+            }
+
+    def mark_delta(self, session_id: str, state: Dict[str, Any], delta: Dict[str, Any]) -> None:
+        """记录增量已写入"""
+        appended = {
+            field: _field_boundary(items)
+            for field, items in delta["appends"].items() if items
+        }
+        with self._lock:
+            tracked = self._sessions.get(session_id)
+            if tracked is None:
+                return
+            tracked["version"] = delta["version"]
+            tracked["deltas"] += 1
+            for field, (count, head, tail) in appended.items():
+                length, first, _ = tracked["boundaries"].get(field, (0, None, None))
+                tracked["boundaries"][field] = (length + count, first if length else head, tail)
+
+    def get_version(self, session_id: str) -> int:
+        """获取会话当前已持久化的版本"""
+        with self._lock:
+            tracked = self._sessions.get(session_id)
+            return tracked["version"] if tracked else 0
+
+    def forget(self, session_id: str) -> None:
+        """移除会话跟踪记录（会话删除时调用）"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
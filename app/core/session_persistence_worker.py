@@ -0,0 +1,227 @@
+"""
+会话持久化后台写入器 - 将自动保存移出请求路径
+
+本模块负责：
+1. 接收会话保存请求，同一会话的多次请求合并为一次写入（只写最新状态）
+2. 后台线程依次写入文件检查点与PostgreSQL检查点，请求线程立即返回
+3. 提供原子文件写入（临时文件 + 重命名），写入中断不会留下半截检查点
+4. 统计保存延迟（从首次请求到写入完成），关闭或显式中断时同步刷新
+"""
+
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_bytes(file_path: str, data: bytes) -> None:
+    """原子写入文件：先写同目录临时文件，刷盘后重命名覆盖目标文件"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def snapshot_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """复制状态的顶层容器，后台写入时请求线程继续追加消息不会影响正在序列化的数据"""
+    return {
+        key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+        for key, value in state.items()
+    }
+
+
+class SessionPersistenceWorker:
+    """会话持久化后台写入器"""
+
+    def __init__(
+        self,
+        save_fn: Callable[[str, Dict[str, Any]], bool],
+        coalesce_delay: float = 0.5
+    ):
+        """
+        初始化后台写入器
+
+        Args:
+            save_fn: 实际的保存函数，参数为会话ID与状态快照，返回是否成功
+            coalesce_delay: 请求入队后等待的秒数，期间同一会话的后续请求合并
+        """
+        self.save_fn = save_fn
+        self.coalesce_delay = coalesce_delay
+
+        # 会话ID -> {"state": 最新状态快照, "requested_at": 首次请求时间, "requests": 合并的请求数}
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._condition = threading.Condition()
+        # 保证同一时刻只有一次写入，显式刷新与后台写入不会交错
+        self._save_lock = threading.Lock()
+        self._in_flight = 0
+        self._flushing = 0
+        self._stop_event = threading.Event()
+        self._save_lags = deque(maxlen=256)
+        self._stats = {
+            'requested': 0,
+            'coalesced': 0,
+            'saved': 0,
+            'failed': 0,
+            'last_save_at': None
+        }
+
+        self._worker = threading.Thread(
+            target=self._run, name="session-persistence", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+        logger.info("会话持久化后台写入器已启动")
+
+    def schedule(self, session_id: str, state: Dict[str, Any]) -> None:
+        """提交保存请求，立即返回；已有待写入请求时只替换为最新状态"""
+        snapshot = snapshot_state(state)
+        if self._stop_event.is_set():
+            self._save(session_id, snapshot, time.time())
+            return
+
+        with self._condition:
+            self._stats['requested'] += 1
+            pending = self._pending.get(session_id)
+            if pending is not None:
+                pending["state"] = snapshot
+                pending["requests"] += 1
+                self._stats['coalesced'] += 1
+            else:
+                self._pending[session_id] = {
+                    "state": snapshot,
+                    "requested_at": time.time(),
+                    "requests": 1
+                }
+            self._condition.notify()
+
+    def save_now(self, session_id: str, state: Dict[str, Any]) -> bool:
+        """同步保存会话（显式中断等场景），取消该会话尚未写入的旧请求"""
+        with self._condition:
+            pending = self._pending.pop(session_id, None)
+        requested_at = pending["requested_at"] if pending else time.time()
+        return self._save(session_id, snapshot_state(state), requested_at)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到当前所有待写入请求完成
+
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        Returns:
+            是否在超时前刷新完成
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            # 刷新期间不再等待合并窗口
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(timeout=0.05 if remaining is None else min(0.05, remaining))
+            finally:
+                self._flushing -= 1
+        return True
+
+    def close(self, timeout: float = 30.0) -> None:
+        """停止后台线程，关闭前写入所有待保存的会话"""
+        if self._stop_event.is_set():
+            return
+        self.flush(timeout)
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._worker.join(timeout=1.0)
+
+        # 后台线程退出后仍残留的请求在当前线程写入
+        with self._condition:
+            remaining = list(self._pending.items())
+            self._pending.clear()
+        for session_id, pending in remaining:
+            self._save(session_id, pending["state"], pending["requested_at"])
+        logger.info("会话持久化后台写入器已关闭")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取写入指标（保存延迟为从首次请求到写入完成的时间）"""
+        with self._condition:
+            metrics = dict(self._stats)
+            lags = list(self._save_lags)
+            metrics['pending'] = len(self._pending)
+            oldest = next(iter(self._pending.values()), None)
+            metrics['oldest_pending_age_ms'] = (time.time() - oldest["requested_at"]) * 1000 if oldest else 0.0
+
+        if lags:
+            sorted_lags = sorted(lags)
+            p95_index = min(len(sorted_lags) - 1, int(len(sorted_lags) * 0.95))
+            metrics['save_lag_avg_ms'] = sum(lags) / len(lags) * 1000
+            metrics['save_lag_p95_ms'] = sorted_lags[p95_index] * 1000
+            metrics['save_lag_max_ms'] = sorted_lags[-1] * 1000
+        else:
+            metrics['save_lag_avg_ms'] = 0.0
+            metrics['save_lag_p95_ms'] = 0.0
+            metrics['save_lag_max_ms'] = 0.0
+        return metrics
+
+    def _run(self) -> None:
+        """后台线程主循环"""
+        while not self._stop_event.is_set():
+            with self._condition:
+                while not self._pending and not self._stop_event.is_set():
+                    self._condition.wait(timeout=1.0)
+                if self._stop_event.is_set():
+                    return
+
+                # 等待合并窗口，窗口内同一会话的请求会被合并
+                session_id, pending = next(iter(self._pending.items()))
+                wait_time = pending["requested_at"] + self.coalesce_delay - time.time()
+                if wait_time > 0 and not self._flushing:
+                    self._condition.wait(timeout=wait_time)
+                    continue
+
+                self._pending.popitem(last=False)
+                self._in_flight += 1
+
+            try:
+                self._save(session_id, pending["state"], pending["requested_at"])
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _save(self, session_id: str, state: Dict[str, Any], requested_at: float) -> bool:
+        """执行写入并记录指标"""
+        with self._save_lock:
+            try:
+                success = bool(self.save_fn(session_id, state))
+            except Exception as e:
+                logger.error(f"后台保存会话 {session_id} 失败: {e}")
+                success = False
+
+        lag = time.time() - requested_at
+        with self._condition:
+            if success:
+                self._stats['saved'] += 1
+            else:
+                self._stats['failed'] += 1
+            self._stats['last_save_at'] = time.time()
+            self._save_lags.append(lag)
+
+        logger.debug(f"会话 {session_id} 后台保存{'完成' if success else '失败'}，延迟 {lag * 1000:.1f}ms")
+        return success
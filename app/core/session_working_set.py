@@ -0,0 +1,485 @@
+"""
+会话工作集 - 按需加载会话状态并限制常驻内存的会话数量
+
+本模块负责：
+1. 维护轻量级会话目录（会话ID、元数据、时间戳、消息数、文件数），启动时只加载目录
+2. 首次访问会话时通过加载函数从持久化存储水合完整状态（在工作集锁之外加载，
+   同一会话的并发访问共享一次加载）
+3. 以LRU方式限制已加载会话数量，并淘汰长时间空闲的会话
+4. 淘汰前通过回调将会话写回持久化存储（在工作集锁之外执行，不阻塞其他会话的访问），
+   回写失败的会话保留在内存中，之后重试
+
+对外保持字典接口（in / [] / get / del / len / 迭代会话ID），
+引擎与路由中现有的 `engine.sessions` 用法无需修改。
+"""
+
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 目录条目中保留的轻量字段
+CATALOG_FIELDS = ("created_at", "last_updated", "metadata")
+
+
+class SessionLoadError(Exception):
+    """会话加载失败但会话可能仍然存在（存储暂时不可用等），目录条目保留"""
+    pass
+
+
+def build_catalog_entry(session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """从完整会话数据提取目录条目"""
+    entry = {field: session_data.get(field) for field in CATALOG_FIELDS}
+    if entry["metadata"] is None:
+        entry["metadata"] = {}
+    state = session_data.get("state") or {}
+    entry["message_count"] = len(state.get("messages", []) or [])
+    entry["file_count"] = len(state.get("files", {}) or {})
+    return entry
+
+
+class SessionWorkingSet(MutableMapping):
+    """会话工作集 - 目录常驻内存，完整状态按需水合并受LRU约束"""
+
+    def __init__(
+        self,
+        loader: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+        evictor: Optional[Callable[[str, Dict[str, Any]], Optional[bool]]] = None,
+        max_loaded: int = 200,
+        idle_timeout: Optional[float] = 3600.0
+    ):
+        """
+        初始化会话工作集
+
+        Args:
+            loader: 按会话ID加载完整会话数据的函数，确定不存在时返回None，
+                暂时无法加载时抛出异常
+            evictor: 会话被淘汰前调用的回写函数，返回False或抛出异常表示回写失败，
+                失败的会话保留在待回写列表中，之后重试
+            max_loaded: 最多常驻内存的完整会话数
+            idle_timeout: 空闲超过该秒数的会话会被淘汰，None表示不按空闲淘汰
+        """
+        self.loader = loader
+        self.evictor = evictor
+        self.max_loaded = max(1, max_loaded)
+        self.idle_timeout = idle_timeout
+
+        self._catalog: Dict[str, Dict[str, Any]] = {}
+        self._loaded: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        # 已移出工作集、回写尚未完成的会话；期间再次访问直接复用，避免读到旧数据
+        self._pending_write_back: Dict[str, Dict[str, Any]] = {}
+        # 回写失败、等待重试的会话（仍保存在_pending_write_back中）
+        self._failed_write_back: Set[str] = set()
+        # 正在加载的会话：加载在锁外执行，同一会话的并发访问等待同一个Future
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.RLock()
+        self._stats = {
+            "hydrations": 0,
+            "hydration_failures": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "write_back_failures": 0
+        }
+        # 目录汇总，随目录条目的增删改增量维护
+        self._totals = {
+            "messages": 0,
+            "files": 0,
+            "sessions_with_files": 0
+        }
+
+    # ---------- 字典接口 ----------
+
+    def __contains__(self, session_id: object) -> bool:
+        return session_id in self._catalog
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        victims: List[Tuple[str, Dict[str, Any]]] = []
+        try:
+            while True:
+                with self._lock:
+                    session = self._loaded.get(session_id)
+                    if session is not None:
+                        self._touch(session_id)
+                        return session
+
+                    if session_id not in self._catalog:
+                        raise KeyError(session_id)
+
+                    session = self._pending_write_back.get(session_id)
+                    if session is not None:
+                        # 回写尚未完成或已失败，直接放回工作集
+                        self._loaded[session_id] = session
+                        self._touch(session_id)
+                        if session_id in self._failed_write_back:
+                            self._failed_write_back.discard(session_id)
+                            del self._pending_write_back[session_id]
+                        victims = self._collect_evictions(exclude=session_id)
+                        return session
+
+                    if self.loader is None:
+                        raise KeyError(session_id)
+
+                    future = self._inflight.get(session_id)
+                    owner = future is None
+                    if owner:
+                        future = Future()
+                        self._inflight[session_id] = future
+
+                if owner:
+                    victims += self._hydrate(session_id, future)
+                # 加载失败时抛出SessionLoadError；成功、会话不存在或加载期间会话被修改时
+                # 回到循环开头按最新状态处理
+                future.result()
+        finally:
+            self._write_back_all(victims)
+
+    def __setitem__(self, session_id: str, session_data: Dict[str, Any]) -> None:
+        with self._lock:
+            # 正在进行的加载结果已过期，不再安装
+            self._inflight.pop(session_id, None)
+            self._failed_write_back.discard(session_id)
+            self._loaded[session_id] = session_data
+            self._set_catalog_entry(session_id, build_catalog_entry(session_data))
+            self._touch(session_id)
+            victims = self._collect_over_capacity(exclude=session_id)
+        self._write_back_all(victims)
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            if session_id not in self._catalog:
+                raise KeyError(session_id)
+            self._drop_catalog_entry(session_id)
+            self._loaded.pop(session_id, None)
+            self._last_access.pop(session_id, None)
+            self._pending_write_back.pop(session_id, None)
+            self._failed_write_back.discard(session_id)
+            self._inflight.pop(session_id, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._catalog.keys()))
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """逐个遍历会话，未加载的会话会被水合（仅需元数据时请使用catalog_items）"""
+        for session_id in self:
+            try:
+                session = self.get(session_id)
+            except SessionLoadError as e:
+                logger.warning(f"遍历时跳过暂时无法加载的会话 {session_id}: {e}")
+                continue
+            if session is not None:
+                yield session_id, session
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        """逐个遍历会话数据，未加载的会话会被水合"""
+        for _, session in self.items():
+            yield session
+
+    # ---------- 目录与工作集 ----------
+
+    def register(self, session_id: str, catalog_entry: Dict[str, Any]) -> None:
+        """登记未加载的会话到目录（启动时使用，不加载完整状态）"""
+        with self._lock:
+            if session_id in self._loaded:
+                return
+            entry = {field: catalog_entry.get(field) for field in CATALOG_FIELDS}
+            entry["metadata"] = entry["metadata"] or {}
+            entry["message_count"] = catalog_entry.get("message_count", 0) or 0
+            entry["file_count"] = catalog_entry.get("file_count", 0) or 0
+            self._set_catalog_entry(session_id, entry)
+
+    def catalog_items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """获取目录条目（已加载的会话使用实时数据刷新），不触发水合"""
+        with self._lock:
+            for session_id, session in self._loaded.items():
+                self._set_catalog_entry(session_id, build_catalog_entry(session))
+            return [(session_id, dict(entry)) for session_id, entry in self._catalog.items()]
+
+    def get_catalog_entry(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个会话的目录条目，不触发水合"""
+        with self._lock:
+            session = self._loaded.get(session_id)
+            if session is not None:
+                self._set_catalog_entry(session_id, build_catalog_entry(session))
+            entry = self._catalog.get(session_id)
+            return dict(entry) if entry is not None else None
+
+    def get_catalog_summary(self) -> Dict[str, Any]:
+        """获取目录汇总（会话数、消息总数、有文件的会话数），只刷新已加载的会话"""
+        with self._lock:
+            for session_id, session in self._loaded.items():
+                self._set_catalog_entry(session_id, build_catalog_entry(session))
+            return {
+                "total_sessions": len(self._catalog),
+                "total_messages": self._totals["messages"],
+                "total_files": self._totals["files"],
+                "sessions_with_files": self._totals["sessions_with_files"],
+                "loaded_sessions": len(self._loaded)
+            }
+
+    def catalog_page(
+        self,
+        limit: Optional[int] = 50,
+        offset: int = 0,
+        sort_by: str = "last_updated",
+        descending: bool = True,
+        name_filter: Optional[str] = None
+    ) -> Tuple[int, List[Tuple[str, Dict[str, Any]]]]:
+        """按字段排序分页获取目录条目，不触发水合
+
+        Args:
+            limit: 返回数量，None表示不限制
+            offset: 偏移量
+            sort_by: 排序字段（created_at、last_updated、message_count、file_count）
+            descending: 是否降序
+            name_filter: 按会话名称（metadata.name）过滤，不区分大小写
+
+        Returns:
+            (符合条件的会话总数, 当前页的(会话ID, 目录条目)列表)
+        """
+        items = self.catalog_items()
+        if name_filter:
+            keyword = name_filter.lower()
+            items = [
+                item for item in items
+                if keyword in str((item[1].get("metadata") or {}).get("name", "")).lower()
+            ]
+
+        def sort_key(item: Tuple[str, Dict[str, Any]]) -> Any:
+            value = item[1].get(sort_by)
+            return (value is not None, value if value is not None else "")
+
+        if limit is None:
+            ordered = sorted(items, key=sort_key, reverse=descending)[offset:]
+        else:
+            # 只需要前offset+limit个时用堆选择，避免全量排序
+            select = heapq.nlargest if descending else heapq.nsmallest
+            ordered = select(offset + limit, items, key=sort_key)[offset:]
+        return len(items), ordered
+
+    def is_loaded(self, session_id: str) -> bool:
+        """会话完整状态是否已在内存中"""
+        return session_id in self._loaded
+
+    def loaded_items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """获取已加载会话，不触发水合"""
+        with self._lock:
+            return list(self._loaded.items())
+
+    def evict(self, session_id: str) -> bool:
+        """将会话写回存储并从内存卸载，目录条目保留"""
+        with self._lock:
+            session = self._detach(session_id)
+        if session is None:
+            return False
+        self._write_back_all([(session_id, session)])
+        return True
+
+    def invalidate(
+        self,
+        session_id: str,
+        catalog_entry: Optional[Dict[str, Any]] = None,
+        deleted: bool = False
+    ) -> None:
+        """丢弃已加载的会话但不回写（会话已被其他进程修改），下次访问时重新水合
+
+        Args:
+            session_id: 会话ID
+            catalog_entry: 新的目录条目，None时保留原条目
+            deleted: 会话是否已被删除，删除时同时移除目录条目
+        """
+        with self._lock:
+            self._loaded.pop(session_id, None)
+            self._last_access.pop(session_id, None)
+            self._pending_write_back.pop(session_id, None)
+            self._failed_write_back.discard(session_id)
+            self._inflight.pop(session_id, None)
+            if deleted:
+                self._drop_catalog_entry(session_id)
+            elif catalog_entry is not None:
+                self.register(session_id, catalog_entry)
+            self._stats["invalidations"] += 1
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """淘汰空闲超时的会话并重试此前回写失败的会话，返回本次淘汰数量"""
+        with self._lock:
+            victims = self._collect_idle(now)
+            evicted_count = len(victims)
+            victims += self._collect_failed_write_backs()
+        self._write_back_all(victims)
+        return evicted_count
+
+    def retry_failed_write_backs(self) -> int:
+        """重试此前回写失败的会话，返回仍然失败的数量"""
+        with self._lock:
+            victims = self._collect_failed_write_backs()
+        self._write_back_all(victims)
+        with self._lock:
+            return len(self._failed_write_back)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取工作集统计信息"""
+        with self._lock:
+            return {
+                **self._stats,
+                "catalog_size": len(self._catalog),
+                "loaded": len(self._loaded),
+                "pending_write_back": len(self._pending_write_back),
+                "failed_write_back": len(self._failed_write_back),
+                "max_loaded": self.max_loaded
+            }
+
+    # ---------- 内部方法 ----------
+
+    def _set_catalog_entry(self, session_id: str, entry: Dict[str, Any]) -> None:
+        """写入目录条目并更新汇总（原地替换，保持目录顺序）"""
+        previous = self._catalog.get(session_id)
+        if previous is not None:
+            self._apply_totals(previous, -1)
+        self._catalog[session_id] = entry
+        self._apply_totals(entry, 1)
+
+    def _drop_catalog_entry(self, session_id: str) -> None:
+        """移除目录条目并更新汇总"""
+        entry = self._catalog.pop(session_id, None)
+        if entry is not None:
+            self._apply_totals(entry, -1)
+
+    def _apply_totals(self, entry: Dict[str, Any], sign: int) -> None:
+        file_count = entry.get("file_count", 0) or 0
+        self._totals["messages"] += sign * (entry.get("message_count", 0) or 0)
+        self._totals["files"] += sign * file_count
+        if file_count > 0:
+            self._totals["sessions_with_files"] += sign
+
+    def _touch(self, session_id: str) -> None:
+        self._loaded.move_to_end(session_id)
+        self._last_access[session_id] = time.time()
+
+    def _hydrate(self, session_id: str, future: Future) -> List[Tuple[str, Dict[str, Any]]]:
+        """在锁外从存储加载完整会话，再持锁安装结果，返回需要回写的被淘汰会话
+
+        加载期间会话被写入、删除或失效时（_inflight中已不是本次的Future）丢弃加载结果。
+        """
+        start_time = time.time()
+        try:
+            session = self.loader(session_id)
+        except Exception as e:
+            # 暂时性错误不能当作会话不存在，保留目录条目，下次访问时重试
+            logger.error(f"水合会话 {session_id} 失败: {e}")
+            with self._lock:
+                self._stats["hydration_failures"] += 1
+                if self._inflight.get(session_id) is future:
+                    del self._inflight[session_id]
+            future.set_exception(SessionLoadError(f"会话 {session_id} 暂时无法加载: {e}"))
+            return []
+
+        victims: List[Tuple[str, Dict[str, Any]]] = []
+        with self._lock:
+            if self._inflight.get(session_id) is not future:
+                logger.debug(f"会话 {session_id} 在加载期间已被修改，丢弃本次加载结果")
+            elif session is None:
+                # 存储中确定不存在的会话从目录移除，避免反复尝试加载
+                del self._inflight[session_id]
+                self._stats["hydration_failures"] += 1
+                self._drop_catalog_entry(session_id)
+                logger.warning(f"会话 {session_id} 在存储中不存在，已从目录移除")
+            else:
+                del self._inflight[session_id]
+                self._stats["hydrations"] += 1
+                self._loaded[session_id] = session
+                self._set_catalog_entry(session_id, build_catalog_entry(session))
+                self._touch(session_id)
+                victims = self._collect_evictions(exclude=session_id)
+                logger.debug(f"会话 {session_id} 已按需加载，耗时 {(time.time() - start_time) * 1000:.1f}ms")
+        future.set_result(None)
+        return victims
+
+    def _detach(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """将会话移出工作集并登记为待回写（需持有锁）"""
+        session = self._loaded.pop(session_id, None)
+        if session is None:
+            return None
+        self._set_catalog_entry(session_id, build_catalog_entry(session))
+        self._last_access.pop(session_id, None)
+        self._stats["evictions"] += 1
+        if self.evictor is not None:
+            self._pending_write_back[session_id] = session
+        return session
+
+    def _collect_idle(self, now: Optional[float] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """移出空闲超时的会话并返回待回写列表（需持有锁）"""
+        if self.idle_timeout is None:
+            return []
+        now = now or time.time()
+        victims = []
+        # _loaded按访问时间排序，从最久未访问的开始检查
+        while self._loaded:
+            session_id = next(iter(self._loaded))
+            if now - self._last_access.get(session_id, now) < self.idle_timeout:
+                break
+            victims.append((session_id, self._detach(session_id)))
+        if victims:
+            logger.info(f"已淘汰 {len(victims)} 个空闲会话")
+        return victims
+
+    def _collect_over_capacity(self, exclude: Optional[str] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """超过容量时移出最久未访问的会话并返回待回写列表（需持有锁）"""
+        victims = []
+        while len(self._loaded) > self.max_loaded:
+            session_id = next(iter(self._loaded))
+            if session_id == exclude:
+                break
+            victims.append((session_id, self._detach(session_id)))
+        return victims
+
+    def _collect_evictions(self, exclude: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """会话进入工作集后收集需要回写的会话：空闲、超容量以及此前回写失败的会话（需持有锁）"""
+        return (
+            self._collect_idle()
+            + self._collect_over_capacity(exclude=exclude)
+            + self._collect_failed_write_backs()
+        )
+
+    def _collect_failed_write_backs(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """取出回写失败的会话以便重试（需持有锁）"""
+        victims = [
+            (session_id, self._pending_write_back[session_id])
+            for session_id in self._failed_write_back
+            if session_id in self._pending_write_back
+        ]
+        self._failed_write_back.clear()
+        return victims
+
+    def _write_back_all(self, victims: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """在锁外逐个回写被淘汰的会话，失败的会话保留在待回写列表中等待重试"""
+        if self.evictor is None:
+            return
+        for session_id, session in victims:
+            succeeded = False
+            try:
+                succeeded = self.evictor(session_id, session) is not False
+                if not succeeded:
+                    logger.error(f"回写会话 {session_id} 失败，会话保留在内存中等待重试")
+            except Exception as e:
+                logger.error(f"回写会话 {session_id} 失败，会话保留在内存中等待重试: {e}")
+            finally:
+                with self._lock:
+                    if not succeeded:
+                        self._stats["write_back_failures"] += 1
+                    # 回写期间会话可能已被重新访问或再次淘汰，只处理本次登记的对象；
+                    # 已重新进入工作集的会话由下次淘汰负责回写
+                    if self._pending_write_back.get(session_id) is session:
+                        if succeeded or session_id in self._loaded:
+                            del self._pending_write_back[session_id]
+                        else:
+                            self._failed_write_back.add(session_id)
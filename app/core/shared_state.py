@@ -0,0 +1,820 @@
+"""
+跨进程共享会话状态 - 支持多个uvicorn工作进程或多节点部署
+
+本模块负责：
+1. 通过Redis兼容服务共享会话状态与对话轮次，任一工作进程写入后其他进程都能读取
+2. 写入后通过发布/订阅广播失效消息，各进程丢弃本地缓存的旧会话（本地缓存即会话工作集）
+3. 跨进程事件分发，WebSocket/SSE推送可以送达连接在其他进程上的客户端
+4. 单进程部署与测试可使用进程内后备实现；配置为Redis但无法连接时拒绝启动
+
+共享会话按版本化的写入日志存储：快照之后只追加新增的消息和对话轮次，
+写入时比较版本号，基于旧版本的写入被拒绝（StaleSessionVersionError）。
+失效消息携带会话目录条目，其他进程无需读取完整状态即可更新会话列表。
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+from app.core.state_codec import get_state_codec
+from app.core.session_delta import (
+    APPEND_ONLY_FIELDS,
+    DEFAULT_COMPACT_EVERY,
+    SessionDeltaTracker,
+    apply_session_deltas
+)
+
+logger = logging.getLogger(__name__)
+
+# 消息处理函数：参数为频道名与消息字节
+MessageHandler = Callable[[str, bytes], None]
+
+# 共享会话记录中的保留字段：会话元数据、对话轮次状态与已完成轮次（只追加）
+_SESSION_FIELD = "__session__"
+_TURNS_FIELD = "__turns__"
+_COMPLETED_TURNS_FIELD = "__completed_turns__"
+SHARED_APPEND_ONLY_FIELDS = APPEND_ONLY_FIELDS + (_COMPLETED_TURNS_FIELD,)
+
+DEFAULT_MAX_PENDING_EVENTS = 10000
+
+
+class StaleSessionVersionError(Exception):
+    """共享会话已被其他进程更新，本进程的写入基于旧版本"""
+
+
+class InProcessBroker:
+    """进程内后备实现 - 键值存储与发布/订阅都在当前进程内完成"""
+
+    backend_name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 键 -> (值, 过期时间或None)
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._counters: Dict[str, int] = {}
+        self._subscribers: Dict[str, List[MessageHandler]] = {}
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and time.time() > expires_at:
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._counters.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def versioned_append(
+        self,
+        version_key: str,
+        log_key: str,
+        expected_version: int,
+        entries: List[bytes],
+        reset: bool = False,
+        ttl: Optional[float] = None
+    ) -> Optional[int]:
+        """版本号等于expected_version时追加日志条目（reset时先清空），返回新版本；版本不符返回None"""
+        with self._lock:
+            log = self._live_item(log_key)
+            current = self._counters.get(version_key, 0) if log is not None else 0
+            if current != expected_version:
+                return None
+            items = [] if reset or log is None else log
+            items = items + list(entries)
+            version = current + 1
+            self._counters[version_key] = version
+            self._data[log_key] = (items, time.time() + ttl if ttl else None)
+            return version
+
+    def versioned_read(self, version_key: str, log_key: str) -> Tuple[int, List[bytes]]:
+        """读取版本号与日志条目，日志不存在时版本为0"""
+        with self._lock:
+            log = self._live_item(log_key)
+            if log is None:
+                return 0, []
+            return self._counters.get(version_key, 0), list(log)
+
+    def _live_item(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and time.time() > expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def publish(self, channel: str, message: bytes) -> int:
+        with self._lock:
+            handlers = list(self._subscribers.get(channel, []))
+        for handler in handlers:
+            try:
+                handler(channel, message)
+            except Exception as e:
+                logger.error(f"处理频道 {channel} 的消息失败: {e}")
+        return len(handlers)
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> Callable[[], None]:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(handler)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                handlers = self._subscribers.get(channel, [])
+                if handler in handlers:
+                    handlers.remove(handler)
+        return unsubscribe
+
+    def close(self) -> None:
+        with self._lock:
+            self._subscribers.clear()
+
+
+class RedisBroker:
+    """Redis兼容服务实现 - 订阅消息由后台线程接收并分发"""
+
+    backend_name = "redis"
+
+    # 比较版本号并追加日志条目：KEYS=[版本键, 日志键]，ARGV=[期望版本, 是否清空, 过期秒数, 条目...]
+    _VERSIONED_APPEND_SCRIPT = """
+local current = 0
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    current = tonumber(redis.call('GET', KEYS[1]) or '0')
+end
+if current ~= tonumber(ARGV[1]) then
+    return -1
+end
+if ARGV[2] == '1' then
+    redis.call('DEL', KEYS[2])
+end
+for i = 4, #ARGV do
+    redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+local version = current + 1
+redis.call('SET', KEYS[1], version)
+local ttl = tonumber(ARGV[3])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+return version
+"""
+
+    def __init__(self, client: Any, poll_interval: float = 0.2):
+        """
+        初始化Redis代理
+
+        Args:
+            client: redis.Redis客户端（decode_responses=False）
+            poll_interval: 后台线程轮询订阅消息的间隔秒数
+        """
+        self.client = client
+        self.poll_interval = poll_interval
+
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        # PubSub对象不是线程安全的，订阅与接收消息共用一把锁
+        self._pubsub_lock = threading.Lock()
+        self._handlers_lock = threading.Lock()
+        self._subscribers: Dict[str, List[MessageHandler]] = {}
+        self._stop_event = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._versioned_append = client.register_script(self._VERSIONED_APPEND_SCRIPT)
+
+    def ping(self) -> bool:
+        return bool(self.client.ping())
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self.client.set(key, value, ex=int(ttl))
+        else:
+            self.client.set(key, value)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+    def versioned_append(
+        self,
+        version_key: str,
+        log_key: str,
+        expected_version: int,
+        entries: List[bytes],
+        reset: bool = False,
+        ttl: Optional[float] = None
+    ) -> Optional[int]:
+        version = int(self._versioned_append(
+            keys=[version_key, log_key],
+            args=[expected_version, "1" if reset else "0", int(ttl or 0), *entries]
+        ))
+        return version if version >= 0 else None
+
+    def versioned_read(self, version_key: str, log_key: str) -> Tuple[int, List[bytes]]:
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.get(version_key)
+        pipeline.lrange(log_key, 0, -1)
+        version, entries = pipeline.execute()
+        if not entries:
+            return 0, []
+        return int(version or 0), list(entries)
+
+    def publish(self, channel: str, message: bytes) -> int:
+        return int(self.client.publish(channel, message))
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> Callable[[], None]:
+        with self._handlers_lock:
+            handlers = self._subscribers.setdefault(channel, [])
+            first_handler = not handlers
+            handlers.append(handler)
+        if first_handler:
+            with self._pubsub_lock:
+                self._pubsub.subscribe(channel)
+        self._ensure_listener()
+
+        def unsubscribe() -> None:
+            with self._handlers_lock:
+                handlers = self._subscribers.get(channel, [])
+                if handler in handlers:
+                    handlers.remove(handler)
+        return unsubscribe
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self._listener is not None:
+            self._listener.join(timeout=2.0)
+            self._listener = None
+        try:
+            with self._pubsub_lock:
+                self._pubsub.close()
+        except Exception as e:
+            logger.debug(f"关闭Redis订阅连接失败: {e}")
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(
+            target=self._listen, name="shared-state-listener", daemon=True
+        )
+        self._listener.start()
+
+    def _listen(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                with self._pubsub_lock:
+                    message = self._pubsub.get_message(timeout=self.poll_interval)
+            except Exception as e:
+                logger.error(f"接收Redis订阅消息失败: {e}")
+                self._stop_event.wait(1.0)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode("utf-8")
+            with self._handlers_lock:
+                handlers = list(self._subscribers.get(channel, []))
+            for handler in handlers:
+                try:
+                    handler(channel, message["data"])
+                except Exception as e:
+                    logger.error(f"处理频道 {channel} 的消息失败: {e}")
+
+
+class SharedSessionStore:
+    """共享会话存储 - 会话按版本化日志写入共享存储，并向其他进程广播失效消息
+
+    每个会话对应一个版本号和一个写入日志：日志首条为完整快照，之后每次保存只追加
+    新增的消息、动作历史、工具结果和已完成轮次（其余字段整体写入）。连续追加
+    compact_every次或已写入的前缀发生变化时重写快照。
+    """
+
+    def __init__(
+        self,
+        broker: Any,
+        worker_id: str,
+        key_prefix: str = "isotope",
+        session_ttl_seconds: Optional[float] = 86400.0,
+        compact_every: int = DEFAULT_COMPACT_EVERY
+    ):
+        """
+        初始化共享会话存储
+
+        Args:
+            broker: 键值与发布/订阅代理（RedisBroker或InProcessBroker）
+            worker_id: 当前进程标识，用于忽略自己发出的失效消息
+            key_prefix: 键名前缀
+            session_ttl_seconds: 共享会话的过期秒数，None表示不过期
+            compact_every: 连续追加多少次后重写快照
+        """
+        self.broker = broker
+        self.worker_id = worker_id
+        self.key_prefix = key_prefix
+        self.session_ttl_seconds = session_ttl_seconds
+        self.channel = f"{key_prefix}:sessions:invalidate"
+
+        self._codec = get_state_codec()
+        # 记录本进程最近写入或读取的版本与已写入内容，用于计算增量和比较版本
+        self._tracker = SessionDeltaTracker(compact_every, SHARED_APPEND_ONLY_FIELDS)
+        self._listeners: List[Callable[[str, str, Optional[Dict[str, Any]]], None]] = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "published": 0,
+            "snapshot_writes": 0,
+            "delta_writes": 0,
+            "stale_rejected": 0,
+            "loads": 0,
+            "load_misses": 0,
+            "remote_invalidations": 0,
+            "errors": 0
+        }
+        self._unsubscribe = broker.subscribe(self.channel, self._on_message)
+
+    def _log_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}:session_log:{session_id}"
+
+    def _version_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}:session_version:{session_id}"
+
+    def add_listener(self, listener: Callable[[str, str, Optional[Dict[str, Any]]], None]) -> None:
+        """注册失效监听函数，参数为操作（put/delete）、会话ID与目录条目
+
+        只在其他进程修改会话时调用。
+        """
+        self._listeners.append(listener)
+
+    def save_session(
+        self,
+        session_id: str,
+        session_data: Dict[str, Any],
+        turn_state: Optional[Dict[str, Any]] = None,
+        catalog_entry: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """写入会话（增量或快照）并广播失效消息
+
+        写入基于本进程最近写入或读取的版本，共享存储中的版本已被其他进程更新时拒绝写入。
+
+        Args:
+            session_id: 会话ID
+            session_data: 会话数据（state、created_at、last_updated、metadata）
+            turn_state: 对话轮次管理器的导出状态
+            catalog_entry: 会话目录条目，随失效消息发送
+
+        Returns:
+            写入后的版本号，失败返回None
+
+        Raises:
+            StaleSessionVersionError: 本进程的会话副本基于旧版本
+        """
+        record = self._build_record(session_data, turn_state)
+        with self._tracker.session_lock(session_id):
+            try:
+                delta = self._tracker.compute_delta(session_id, record)
+                if delta is None:
+                    expected_version = self._tracker.get_version(session_id)
+                    entry = {
+                        "appends": {field: list(record.get(field) or []) for field in SHARED_APPEND_ONLY_FIELDS},
+                        "fields": {key: value for key, value in record.items() if key not in SHARED_APPEND_ONLY_FIELDS}
+                    }
+                else:
+                    expected_version = delta["version"] - 1
+                    entry = {"appends": delta["appends"], "fields": delta["fields"]}
+
+                version = self.broker.versioned_append(
+                    self._version_key(session_id),
+                    self._log_key(session_id),
+                    expected_version,
+                    [self._codec.encode(entry, compress=True)],
+                    reset=delta is None,
+                    ttl=self.session_ttl_seconds
+                )
+            except Exception as e:
+                logger.error(f"写入共享会话 {session_id} 失败: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                return None
+
+            if version is None:
+                self._tracker.forget(session_id)
+                with self._lock:
+                    self._stats["stale_rejected"] += 1
+                raise StaleSessionVersionError(
+                    f"共享会话 {session_id} 已被其他进程更新，拒绝基于版本 {expected_version} 的写入"
+                )
+
+            if delta is None:
+                self._tracker.mark_snapshot(session_id, record, version)
+            else:
+                self._tracker.mark_delta(session_id, record, delta)
+
+        try:
+            self._publish("put", session_id, version, catalog_entry)
+        except Exception as e:
+            logger.error(f"广播共享会话 {session_id} 的失效消息失败: {e}")
+        with self._lock:
+            self._stats["published"] += 1
+            self._stats["snapshot_writes" if delta is None else "delta_writes"] += 1
+        return version
+
+    def load_session(self, session_id: str, track: bool = True) -> Optional[Dict[str, Any]]:
+        """读取共享会话
+
+        Args:
+            session_id: 会话ID
+            track: 是否将读取的版本作为本进程后续写入的基准（读取结果用作本地会话副本时为True）
+
+        Returns:
+            {"version", "session", "turns"}，不存在或读取失败返回None
+        """
+        with self._tracker.session_lock(session_id):
+            try:
+                version, entries = self.broker.versioned_read(
+                    self._version_key(session_id), self._log_key(session_id)
+                )
+                with self._lock:
+                    self._stats["loads"] += 1
+                    if not entries:
+                        self._stats["load_misses"] += 1
+                if not entries:
+                    return None
+                record = apply_session_deltas(
+                    {}, (self._codec.decode(entry, restore_objects=False) for entry in entries)
+                )
+                record = self._codec.restore(record)
+                if track:
+                    self._tracker.mark_snapshot(session_id, record, version)
+            except Exception as e:
+                logger.error(f"读取共享会话 {session_id} 失败: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                return None
+
+        session = dict(record.pop(_SESSION_FIELD, None) or {})
+        turns = record.pop(_TURNS_FIELD, None)
+        completed_turns = record.pop(_COMPLETED_TURNS_FIELD, None) or []
+        if turns is not None:
+            turns = dict(turns)
+            turns["completed_turns"] = completed_turns
+        session["state"] = record
+        return {"version": version, "session": session, "turns": turns}
+
+    def delete_session(self, session_id: str) -> None:
+        """删除共享会话并广播"""
+        try:
+            with self._tracker.session_lock(session_id):
+                self.broker.delete(self._log_key(session_id), self._version_key(session_id))
+                self._tracker.forget(session_id)
+            self._publish("delete", session_id, None, None)
+        except Exception as e:
+            logger.error(f"删除共享会话 {session_id} 失败: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取共享存储指标"""
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        self._unsubscribe()
+
+    @staticmethod
+    def _build_record(session_data: Dict[str, Any], turn_state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """将会话数据与对话轮次展开为一条记录，已完成轮次作为只追加字段"""
+        record = dict(session_data.get("state") or {})
+        record[_SESSION_FIELD] = {key: value for key, value in session_data.items() if key != "state"}
+        if turn_state is None:
+            record[_TURNS_FIELD] = None
+            record[_COMPLETED_TURNS_FIELD] = []
+        else:
+            turns = dict(turn_state)
+            record[_COMPLETED_TURNS_FIELD] = turns.pop("completed_turns", None) or []
+            record[_TURNS_FIELD] = turns
+        return record
+
+    def _publish(
+        self,
+        op: str,
+        session_id: str,
+        version: Optional[int],
+        catalog_entry: Optional[Dict[str, Any]]
+    ) -> None:
+        self.broker.publish(self.channel, self._codec.dumps_json({
+            "op": op,
+            "session_id": session_id,
+            "version": version,
+            "origin": self.worker_id,
+            "catalog": catalog_entry
+        }))
+
+    def _on_message(self, channel: str, data: bytes) -> None:
+        message = json.loads(data)
+        if message.get("origin") == self.worker_id:
+            return
+        with self._lock:
+            self._stats["remote_invalidations"] += 1
+        for listener in list(self._listeners):
+            try:
+                listener(message.get("op", "put"), message["session_id"], message.get("catalog"))
+            except Exception as e:
+                logger.error(f"处理会话 {message.get('session_id')} 的失效消息失败: {e}")
+
+
+class SharedEventBus:
+    """跨进程事件分发 - 发布到共享频道，由连接所在的进程推送给客户端
+
+    发布只把编码后的事件放入队列，由后台线程写入共享频道，
+    异步处理函数中逐块发布不会阻塞事件循环。
+    """
+
+    def __init__(
+        self,
+        broker: Any,
+        worker_id: str,
+        key_prefix: str = "isotope",
+        max_pending: int = DEFAULT_MAX_PENDING_EVENTS
+    ):
+        """
+        初始化事件分发
+
+        Args:
+            broker: 键值与发布/订阅代理
+            worker_id: 当前进程标识，订阅者只收到其他进程发布的事件
+            key_prefix: 频道名前缀
+            max_pending: 等待发布的事件数上限，队列满时丢弃新事件
+        """
+        self.broker = broker
+        self.worker_id = worker_id
+        self.channel = f"{key_prefix}:events"
+
+        self._codec = get_state_codec()
+        self._lock = threading.Lock()
+        self._handlers: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._stats = {"published": 0, "received": 0, "dropped": 0, "errors": 0}
+        # None为停止发布线程的标记
+        self._pending: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_pending)
+        self._publisher: Optional[threading.Thread] = None
+        self._unsubscribe = broker.subscribe(self.channel, self._on_message)
+
+    def publish(self, session_id: str, event: Dict[str, Any]) -> bool:
+        """将会话事件放入发布队列（本进程的连接由调用方直接推送）
+
+        Args:
+            session_id: 会话ID
+            event: 可JSON序列化的事件数据
+
+        Returns:
+            是否已放入发布队列
+        """
+        try:
+            message = self._codec.dumps_json({
+                "session_id": session_id,
+                "origin": self.worker_id,
+                "event": event
+            })
+        except Exception as e:
+            logger.error(f"编码会话 {session_id} 的事件失败: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            return False
+
+        self._ensure_publisher()
+        try:
+            self._pending.put_nowait(message)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            logger.warning(f"事件发布队列已满，丢弃会话 {session_id} 的事件")
+            return False
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中的事件全部发布
+
+        Returns:
+            超时前是否全部发布
+        """
+        deadline = time.monotonic() + timeout
+        with self._pending.all_tasks_done:
+            while self._pending.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._pending.all_tasks_done.wait(remaining)
+        return True
+
+    def subscribe(self, handler: Callable[[str, Dict[str, Any]], None]) -> Callable[[], None]:
+        """订阅其他进程发布的事件，处理函数参数为会话ID与事件数据
+
+        Returns:
+            取消订阅的函数
+        """
+        with self._lock:
+            self._handlers.append(handler)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if handler in self._handlers:
+                    self._handlers.remove(handler)
+        return unsubscribe
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取事件分发指标"""
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["subscribers"] = len(self._handlers)
+        metrics["pending"] = self._pending.qsize()
+        return metrics
+
+    def close(self) -> None:
+        self._unsubscribe()
+        with self._lock:
+            publisher, self._publisher = self._publisher, None
+        if publisher is not None:
+            try:
+                self._pending.put(None, timeout=2.0)
+            except queue.Full:
+                logger.warning("事件发布队列已满，未发布的事件将被丢弃")
+            publisher.join(timeout=2.0)
+
+    def _ensure_publisher(self) -> None:
+        if self._publisher is not None:
+            return
+        with self._lock:
+            if self._publisher is None:
+                self._publisher = threading.Thread(
+                    target=self._run_publisher, name="shared-event-publisher", daemon=True
+                )
+                self._publisher.start()
+
+    def _run_publisher(self) -> None:
+        while True:
+            message = self._pending.get()
+            try:
+                if message is None:
+                    return
+                self.broker.publish(self.channel, message)
+                with self._lock:
+                    self._stats["published"] += 1
+            except Exception as e:
+                logger.error(f"发布共享事件失败: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+            finally:
+                self._pending.task_done()
+
+    def _on_message(self, channel: str, data: bytes) -> None:
+        message = json.loads(data)
+        if message.get("origin") == self.worker_id:
+            return
+        with self._lock:
+            self._stats["received"] += 1
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler(message["session_id"], message.get("event") or {})
+            except Exception as e:
+                logger.error(f"处理会话 {message.get('session_id')} 的事件失败: {e}")
+
+
+class SharedStateLayer:
+    """共享状态层 - 组合共享会话存储与跨进程事件分发"""
+
+    def __init__(
+        self,
+        broker: Any,
+        key_prefix: str = "isotope",
+        session_ttl_seconds: Optional[float] = 86400.0,
+        worker_id: Optional[str] = None,
+        compact_every: int = DEFAULT_COMPACT_EVERY,
+        max_pending_events: int = DEFAULT_MAX_PENDING_EVENTS
+    ):
+        self.broker = broker
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sessions = SharedSessionStore(
+            broker, self.worker_id, key_prefix, session_ttl_seconds, compact_every
+        )
+        self.events = SharedEventBus(broker, self.worker_id, key_prefix, max_pending_events)
+
+    @property
+    def backend(self) -> str:
+        return self.broker.backend_name
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取共享状态层指标"""
+        return {
+            "backend": self.backend,
+            "worker_id": self.worker_id,
+            "sessions": self.sessions.get_metrics(),
+            "events": self.events.get_metrics()
+        }
+
+    def close(self) -> None:
+        """取消订阅并关闭连接"""
+        self.sessions.close()
+        self.events.close()
+        self.broker.close()
+
+
+def _create_redis_broker(redis_config: Dict[str, Any]) -> RedisBroker:
+    """创建Redis代理
+
+    Raises:
+        RuntimeError: redis未安装或无法连接
+    """
+    if not REDIS_AVAILABLE:
+        raise RuntimeError("共享状态配置为Redis后端，但redis未安装")
+    try:
+        if redis_config.get("url"):
+            client = redis.Redis.from_url(redis_config["url"])
+        else:
+            client = redis.Redis(
+                host=redis_config.get("host", "localhost"),
+                port=redis_config.get("port", 6379),
+                db=redis_config.get("db", 0),
+                password=redis_config.get("password"),
+                socket_timeout=redis_config.get("socket_timeout", 5)
+            )
+        broker = RedisBroker(client)
+        broker.ping()
+        return broker
+    except Exception as e:
+        # 各进程退回到互不相通的进程内实现会让会话与事件静默分裂，不能继续启动
+        raise RuntimeError(f"共享状态已启用但无法连接Redis: {e}") from e
+
+
+def create_shared_state_layer(
+    shared_state_config: Optional[Dict[str, Any]] = None,
+    redis_config: Optional[Dict[str, Any]] = None
+) -> Optional[SharedStateLayer]:
+    """根据配置创建共享状态层
+
+    Args:
+        shared_state_config: 共享状态配置（enabled、backend、key_prefix、session_ttl_seconds、
+            compact_every、max_pending_events）
+        redis_config: Redis连接配置（url或host、port、db、password），
+            未提供时使用shared_state_config中的redis配置
+
+    Returns:
+        共享状态层；未启用时返回None
+
+    Raises:
+        RuntimeError: backend为redis但redis未安装或无法连接
+    """
+    shared_state_config = shared_state_config or {}
+    if not shared_state_config.get("enabled", False):
+        return None
+
+    backend = shared_state_config.get("backend", "redis")
+    if backend == "redis":
+        broker = _create_redis_broker(shared_state_config.get("redis") or redis_config or {})
+    elif backend == "memory":
+        broker = InProcessBroker()
+    else:
+        raise ValueError(f"不支持的共享状态后端: {backend}")
+
+    layer = SharedStateLayer(
+        broker,
+        key_prefix=shared_state_config.get("key_prefix", "isotope"),
+        session_ttl_seconds=shared_state_config.get("session_ttl_seconds", 86400.0),
+        compact_every=shared_state_config.get("compact_every", DEFAULT_COMPACT_EVERY),
+        max_pending_events=shared_state_config.get("max_pending_events", DEFAULT_MAX_PENDING_EVENTS)
+    )
+    logger.info(f"共享会话状态已启用: 后端={layer.backend}, 进程={layer.worker_id}")
+    return layer
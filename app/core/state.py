@@ -265,6 +265,60 @@ class StateManager:
         """
         updated_metadata = {**state["metadata"], **metadata_updates, "last_updated": datetime.now().isoformat()}
         return {**state, "metadata": updated_metadata}
+
+    @staticmethod
+    def fork_state(state: IsotopeSystemState) -> IsotopeSystemState:
+        """创建写时复制的状态分支（替代整份状态的深拷贝）
+
+        顶层字典及其直接容器（消息、动作历史、工具结果等列表，文件、元数据等字典）
+        各复制一层引用，消息对象、工具输出、文件信息等内容与原状态共享。
+        分支上的追加、字段赋值和元数据顶层键修改不影响原状态，开销只与容器的
+        元素个数相关，不随消息内容和工具结果的大小增长。
+
+        共享的内容对象按只读使用，需要修改时像本类其他方法一样替换为新对象。
+
+        Args:
+            state: 原状态
+
+        Returns:
+            状态分支
+        """
+        forked = dict(state)
+        for key, value in forked.items():
+            if isinstance(value, list):
+                forked[key] = list(value)
+            elif isinstance(value, dict):
+                forked[key] = dict(value)
+        return forked
+
+    @staticmethod
+    def messages_added_since_fork(
+        base_state: IsotopeSystemState,
+        forked_state: IsotopeSystemState,
+        fork_message_count: int
+    ) -> List[BaseMessage]:
+        """获取分支上新增的消息
+
+        分支前的消息与原状态是同一批对象，按分支时的消息数切片即可；
+        分支改写了历史（如压缩）时，按对象身份排除原状态中已有的消息。
+
+        Args:
+            base_state: 原状态（分支后可能已追加了其他分支的消息）
+            forked_state: 分支执行后的状态
+            fork_message_count: 分支时原状态的消息数
+
+        Returns:
+            新增的消息列表
+        """
+        base_messages = base_state.get("messages") or []
+        forked_messages = forked_state.get("messages") or []
+        count = fork_message_count
+        if count <= len(forked_messages) and count <= len(base_messages) and (
+            count == 0 or forked_messages[count - 1] is base_messages[count - 1]
+        ):
+            return list(forked_messages[count:])
+        known = {id(message) for message in base_messages}
+        return [message for message in forked_messages if id(message) not in known]
     
     @staticmethod
     def get_last_message(state: IsotopeSystemState) -> Optional[BaseMessage]:
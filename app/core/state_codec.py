@@ -0,0 +1,420 @@
+"""
+状态编解码器 - IsotopeSystemState的快速序列化
+
+本模块负责：
+1. 按类型分派的编码器注册表，每种类型只解析一次编码函数
+2. 内置LangChain消息、Pydantic模型、数据类、NumPy/pandas数据、日期时间等编码器
+3. 生成JSON兼容结构（PostgreSQL JSONB与文件检查点），或以orjson/msgpack编码为字节
+4. 可选zstd压缩，编码结果带格式头，解码器自动识别并还原消息与数组
+
+orjson/msgpack只在遇到非原生类型时回调编码器，字典、列表、字符串的遍历在C扩展中完成。
+"""
+
+import dataclasses
+import json
+import logging
+import re
+import struct
+import threading
+from datetime import date, datetime
+from enum import Enum
+from typing import Dict, Any, Callable, Optional, Tuple
+
+# 可选依赖：orjson
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# 可选依赖：msgpack
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+# 可选依赖：zstandard
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# 可选依赖：LangChain消息
+try:
+    from langchain_core.messages import (
+        BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage, ChatMessage
+    )
+    LANGCHAIN_AVAILABLE = True
+except ImportError:
+    BaseMessage = None
+    LANGCHAIN_AVAILABLE = False
+
+# 可选依赖：NumPy / pandas
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    pd = None
+    PANDAS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 编码格式
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+
+# 字节编码的格式头：魔数 + 格式 + 压缩标志
+_MAGIC = b"ISC1"
+_HEADER = struct.Struct("!4sBB")
+_FORMAT_CODES = {FORMAT_JSON: 1, FORMAT_MSGPACK: 2}
+_FORMAT_NAMES = {code: name for name, code in _FORMAT_CODES.items()}
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZSTD = 1
+
+# NumPy/pandas数据的标记键
+NDARRAY_TAG = "__ndarray__"
+DATAFRAME_TAG = "__dataframe__"
+
+# 不参与序列化的运行时组件（按类名匹配，避免导入记忆系统）
+SKIPPED_TYPE_NAMES = frozenset({
+    "MemoryStore",
+    "EnhancedMemoryIntegration",
+    "MemoryAwareEngineAdapter"
+})
+
+# 历史版本中Gradio图片对象的字符串表示
+_GRADIO_IMAGE_REPR = "<gradio.components.image.Image object at"
+_GRADIO_IMAGE_REPR_BYTES = _GRADIO_IMAGE_REPR.encode("utf-8")
+_IMAGE_PATH_PATTERN = re.compile(
+    r'[\'"](?:[a-zA-Z]:\\|/)?(?:[\w\-\.]+[/\\])*[\w\-\.]+\.(?:jpg|jpeg|png|gif|bmp|webp)[\'"]'
+)
+
+# 可以直接输出的原生类型
+_PRIMITIVE_TYPES = (str, int, float, bool, type(None))
+
+if LANGCHAIN_AVAILABLE:
+    _MESSAGE_CLASSES = {
+        "human": HumanMessage,
+        "ai": AIMessage,
+        "system": SystemMessage,
+        "tool": ToolMessage,
+        "chat": ChatMessage
+    }
+else:
+    _MESSAGE_CLASSES = {}
+
+
+def _encode_message(message: Any) -> Dict[str, Any]:
+    """LangChain消息编码为字典（保持与历史检查点相同的字段）"""
+    msg_dict = {
+        "type": message.type,
+        "content": message.content
+    }
+    if getattr(message, "name", None):
+        msg_dict["name"] = message.name
+    if getattr(message, "id", None):
+        msg_dict["id"] = message.id
+    if getattr(message, "tool_calls", None):
+        msg_dict["tool_calls"] = message.tool_calls
+    if getattr(message, "tool_call_id", None):
+        msg_dict["tool_call_id"] = message.tool_call_id
+    if getattr(message, "role", None) and message.type == "chat":
+        msg_dict["role"] = message.role
+    if getattr(message, "additional_kwargs", None):
+        msg_dict["additional_kwargs"] = message.additional_kwargs
+    return msg_dict
+
+
+def _encode_ndarray(array: Any) -> Dict[str, Any]:
+    return {NDARRAY_TAG: array.tolist(), "dtype": str(array.dtype), "shape": list(array.shape)}
+
+
+def _encode_dataframe(frame: Any) -> Dict[str, Any]:
+    return {DATAFRAME_TAG: frame.to_dict(orient="split")}
+
+
+def _encode_series(series: Any) -> Dict[str, Any]:
+    return {DATAFRAME_TAG: series.to_frame().to_dict(orient="split"), "series": True}
+
+
+def _encode_gradio_image(image: Any) -> str:
+    value = getattr(image, "value", None)
+    if value:
+        return f"__IMAGE_PATH__:{value}"
+    return "<gradio.Image对象，无法获取路径>"
+
+
+def _encode_dataclass(obj: Any) -> Dict[str, Any]:
+    # 只取一层字段，嵌套值交给后续分派处理，避免dataclasses.asdict的深拷贝
+    return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+
+
+class StateCodec:
+    """按类型分派的状态编解码器"""
+
+    def __init__(self):
+        self._encoders: Dict[type, Callable[[Any], Any]] = {}
+        self._resolved: Dict[type, Callable[[Any], Any]] = {}
+        self._lock = threading.Lock()
+        self._register_builtin_encoders()
+
+    # ---------- 编码器注册 ----------
+
+    def register_encoder(self, cls: type, encoder: Callable[[Any], Any]) -> None:
+        """注册类型编码器，子类会继承父类的编码器
+
+        Args:
+            cls: 要处理的类型
+            encoder: 将实例转换为JSON兼容值的函数（返回值中的嵌套对象会继续分派）
+        """
+        with self._lock:
+            self._encoders[cls] = encoder
+            self._resolved.clear()
+
+    def _register_builtin_encoders(self) -> None:
+        self._encoders[datetime] = lambda value: value.isoformat()
+        self._encoders[date] = lambda value: value.isoformat()
+        self._encoders[Enum] = lambda value: value.value
+        self._encoders[set] = list
+        self._encoders[frozenset] = list
+        self._encoders[tuple] = list
+        self._encoders[bytes] = lambda value: value.decode("utf-8", errors="replace")
+        # 原生容器与标量的子类（如OrderedDict）按基类输出
+        self._encoders[dict] = dict
+        self._encoders[list] = list
+        self._encoders[str] = str.__str__
+        self._encoders[int] = int.__int__
+        self._encoders[float] = float.__float__
+        if LANGCHAIN_AVAILABLE:
+            self._encoders[BaseMessage] = _encode_message
+        if NUMPY_AVAILABLE:
+            self._encoders[np.ndarray] = _encode_ndarray
+            self._encoders[np.generic] = lambda value: value.item()
+        if PANDAS_AVAILABLE:
+            self._encoders[pd.DataFrame] = _encode_dataframe
+            self._encoders[pd.Series] = _encode_series
+            self._encoders[pd.Timestamp] = lambda value: value.isoformat()
+
+    def _resolve_encoder(self, cls: type) -> Callable[[Any], Any]:
+        """解析类型对应的编码器（结果按类型缓存）"""
+        encoder = self._resolved.get(cls)
+        if encoder is not None:
+            return encoder
+
+        encoder = None
+        if issubclass(cls, Enum):
+            # 混入str/int的枚举也按枚举值编码，不走str/int子类的编码器
+            encoder = self._encoders[Enum]
+        else:
+            for base in cls.__mro__:
+                if base in self._encoders:
+                    encoder = self._encoders[base]
+                    break
+                if base.__name__ in SKIPPED_TYPE_NAMES:
+                    skipped_name = cls.__name__
+                    encoder = lambda value, name=skipped_name: f"<{name}实例，已跳过序列化>"
+                    break
+
+        if encoder is None:
+            if cls.__module__.startswith("gradio") and cls.__name__ == "Image":
+                encoder = _encode_gradio_image
+            elif dataclasses.is_dataclass(cls):
+                encoder = _encode_dataclass
+            elif hasattr(cls, "model_dump"):
+                encoder = lambda value: value.model_dump()
+            else:
+                encoder = self._encode_fallback
+
+        with self._lock:
+            self._resolved[cls] = encoder
+        return encoder
+
+    @staticmethod
+    def _encode_fallback(obj: Any) -> Any:
+        try:
+            if hasattr(obj, "__dict__"):
+                return dict(vars(obj))
+            return str(obj)
+        except Exception:
+            return f"<不可序列化的对象: {type(obj).__name__}>"
+
+    def _default(self, obj: Any) -> Any:
+        """orjson/msgpack遇到非原生类型时的回调"""
+        return self._resolve_encoder(type(obj))(obj)
+
+    # ---------- JSON兼容结构 ----------
+
+    def to_serializable(self, obj: Any) -> Any:
+        """递归转换为JSON兼容结构（用于JSONB写入等需要Python对象的场景）"""
+        obj_type = type(obj)
+        if obj_type is str:
+            if _GRADIO_IMAGE_REPR in obj:
+                path_match = _IMAGE_PATH_PATTERN.search(obj)
+                if path_match:
+                    return f"__IMAGE_PATH__:{path_match.group(0)}"
+            return obj
+        if obj_type is dict:
+            return {key: self.to_serializable(value) for key, value in obj.items()}
+        if obj_type is list:
+            return [self.to_serializable(item) for item in obj]
+        if obj_type in _PRIMITIVE_TYPES:
+            return obj
+        return self.to_serializable(self._resolve_encoder(obj_type)(obj))
+
+    # ---------- 字节编码 ----------
+
+    def dumps_json(self, obj: Any, indent: bool = False) -> bytes:
+        """编码为JSON字节（orjson可用时走C扩展）"""
+        if ORJSON_AVAILABLE:
+            option = orjson.OPT_NON_STR_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            try:
+                payload = orjson.dumps(obj, default=self._default, option=option)
+                if _GRADIO_IMAGE_REPR_BYTES in payload:
+                    # orjson不会对字符串回调default，含旧版Gradio图片表示时按to_serializable改写后重新编码
+                    payload = orjson.dumps(self.to_serializable(obj), option=option)
+                return payload
+            except orjson.JSONEncodeError as e:
+                # 超出orjson支持范围（如超过64位的整数）时回退到标准库
+                logger.debug(f"orjson编码失败，回退到json: {e}")
+        return json.dumps(
+            self.to_serializable(obj), ensure_ascii=False, indent=2 if indent else None
+        ).encode("utf-8")
+
+    def encode(self, obj: Any, fmt: Optional[str] = None, compress: bool = False) -> bytes:
+        """编码为带格式头的字节
+
+        Args:
+            obj: 状态或任意可编码对象
+            fmt: "msgpack"或"json"，默认优先msgpack
+            compress: 是否使用zstd压缩（不可用时忽略）
+
+        Returns:
+            编码后的字节
+        """
+        fmt = fmt or (FORMAT_MSGPACK if MSGPACK_AVAILABLE else FORMAT_JSON)
+        if fmt == FORMAT_MSGPACK:
+            if not MSGPACK_AVAILABLE:
+                raise ValueError("msgpack不可用，无法使用msgpack格式")
+            payload = msgpack.packb(obj, default=self._default, use_bin_type=True, strict_types=True)
+            if _GRADIO_IMAGE_REPR_BYTES in payload:
+                # 与JSON路径一致：字符串不经过default，出现旧版Gradio图片表示时改写后重新编码
+                payload = msgpack.packb(
+                    self.to_serializable(obj), default=self._default, use_bin_type=True, strict_types=True
+                )
+        elif fmt == FORMAT_JSON:
+            payload = self.dumps_json(obj)
+        else:
+            raise ValueError(f"不支持的编码格式: {fmt}")
+
+        compression = _COMPRESSION_NONE
+        if compress and ZSTD_AVAILABLE:
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+            compression = _COMPRESSION_ZSTD
+
+        return _HEADER.pack(_MAGIC, _FORMAT_CODES[fmt], compression) + payload
+
+    def decode(self, data: bytes, restore_objects: bool = True) -> Any:
+        """解码encode的输出
+
+        Args:
+            data: 编码后的字节
+            restore_objects: 是否还原LangChain消息与NumPy/pandas数据
+
+        Returns:
+            解码后的对象
+        """
+        fmt, compression, payload = self._split_header(data)
+        if compression == _COMPRESSION_ZSTD:
+            if not ZSTD_AVAILABLE:
+                raise ValueError("数据使用zstd压缩，但zstandard不可用")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+
+        if fmt == FORMAT_MSGPACK:
+            if not MSGPACK_AVAILABLE:
+                raise ValueError("数据为msgpack格式，但msgpack不可用")
+            obj = msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        else:
+            obj = orjson.loads(payload) if ORJSON_AVAILABLE else json.loads(payload)
+
+        if restore_objects:
+            obj = self.restore(obj)
+        return obj
+
+    @staticmethod
+    def _split_header(data: bytes) -> Tuple[str, int, bytes]:
+        if len(data) < _HEADER.size:
+            raise ValueError("数据长度不足，不是有效的状态编码")
+        magic, format_code, compression = _HEADER.unpack_from(data)
+        if magic != _MAGIC or format_code not in _FORMAT_NAMES:
+            raise ValueError("无效的状态编码格式头")
+        return _FORMAT_NAMES[format_code], compression, data[_HEADER.size:]
+
+    # ---------- 对象还原 ----------
+
+    def restore(self, obj: Any) -> Any:
+        """还原编码时转换的对象：顶层messages还原为LangChain消息，标记的数组还原为NumPy/pandas"""
+        obj = self._restore_tagged(obj)
+        if isinstance(obj, dict) and isinstance(obj.get("messages"), list):
+            obj["messages"] = [self.restore_message(message) for message in obj["messages"]]
+        return obj
+
+    def _restore_tagged(self, obj: Any) -> Any:
+        if isinstance(obj, list):
+            return [self._restore_tagged(item) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+        if NDARRAY_TAG in obj and NUMPY_AVAILABLE:
+            return np.array(obj[NDARRAY_TAG], dtype=obj.get("dtype")).reshape(obj.get("shape", -1))
+        if DATAFRAME_TAG in obj and PANDAS_AVAILABLE:
+            split = obj[DATAFRAME_TAG]
+            frame = pd.DataFrame(split["data"], index=split["index"], columns=split["columns"])
+            return frame.iloc[:, 0] if obj.get("series") else frame
+        return {key: self._restore_tagged(value) for key, value in obj.items()}
+
+    @staticmethod
+    def restore_message(message: Any) -> Any:
+        """将消息字典还原为LangChain消息，无法识别时原样返回"""
+        if not isinstance(message, dict) or not LANGCHAIN_AVAILABLE:
+            return message
+        message_class = _MESSAGE_CLASSES.get(message.get("type"))
+        if message_class is None:
+            return message
+
+        kwargs = {key: value for key, value in message.items() if key != "type"}
+        if message_class is ToolMessage:
+            kwargs.setdefault("tool_call_id", "")
+        if message_class is ChatMessage:
+            kwargs.setdefault("role", "user")
+        try:
+            return message_class(**kwargs)
+        except Exception as e:
+            logger.debug(f"还原消息失败，保留字典格式: {e}")
+            return message
+
+
+_state_codec: Optional[StateCodec] = None
+_state_codec_lock = threading.Lock()
+
+
+def get_state_codec() -> StateCodec:
+    """获取全局状态编解码器（编码器注册表只构建一次）"""
+    global _state_codec
+    if _state_codec is None:
+        with _state_codec_lock:
+            if _state_codec is None:
+                _state_codec = StateCodec()
+    return _state_codec
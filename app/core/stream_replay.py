@@ -0,0 +1,265 @@
+"""
+流式事件回放缓冲
+
+每次流式运行（run）的事件按序号写入一个有界环形缓冲，客户端断线重连时
+携带最后收到的序号（SSE的Last-Event-ID或WebSocket的resume消息），只补发
+缺失的尾部事件。
+
+内存上界：
+1. 单个运行按事件数和字节数双重限制，超出时丢弃最早的事件
+   （重连点早于缓冲起点时读取方会得到truncated标记）
+2. 已结束的运行在保留期后回收；所有缓冲总字节数超限时优先回收最早结束的运行
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StreamReplayBuffer:
+    """单次运行的有界事件缓冲
+
+    写入方（生产者任务）调用append/close；读取方通过read_after按序号
+    补读，并用wait等待新事件。事件内容对缓冲透明（SSE存编码后的字节，
+    WebSocket存消息JSON），由写入方给出大小。
+    """
+
+    def __init__(self, run_id: str, session_id: Optional[str], max_events: int, max_bytes: int):
+        self.run_id = run_id
+        self.session_id = session_id
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.created_at = time.time()
+        self.closed_at: Optional[float] = None
+        self.readers = 0
+
+        self._events: deque = deque()  # (seq, event, size)
+        self._bytes = 0
+        self._next_seq = 1
+        self._evicted = 0
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_at is not None
+
+    @property
+    def last_seq(self) -> int:
+        """最后写入的序号（尚无事件时为0）"""
+        return self._next_seq - 1
+
+    @property
+    def first_seq(self) -> int:
+        """缓冲中最早的序号（为空时等于下一个序号）"""
+        with self._lock:
+            return self._events[0][0] if self._events else self._next_seq
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def append(self, event: Any, size: int) -> int:
+        """写入一个事件，返回分配的序号"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._events.append((seq, event, size))
+            self._bytes += size
+            while self._events and (len(self._events) > self.max_events or self._bytes > self.max_bytes):
+                _, _, evicted_size = self._events.popleft()
+                self._bytes -= evicted_size
+                self._evicted += 1
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+        return seq
+
+    def close(self) -> None:
+        """标记运行结束（不再有新事件）"""
+        with self._lock:
+            if self.closed_at is not None:
+                return
+            self.closed_at = time.time()
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+
+    def read_after(self, last_seq: int) -> Tuple[List[Tuple[int, Any]], bool]:
+        """读取序号大于last_seq的事件
+
+        Returns:
+            (事件列表[(seq, event)], truncated)。truncated为True表示last_seq之后
+            有事件已被淘汰，读取方收到的不是完整尾部
+        """
+        with self._lock:
+            if not self._events:
+                return [], last_seq < self.last_seq
+            first = self._events[0][0]
+            truncated = last_seq + 1 < first
+            if last_seq < first:
+                return [(seq, event) for seq, event, _ in self._events], truncated
+            # 序号连续，直接按偏移切片
+            start = last_seq - first + 1
+            return [(seq, event) for seq, event, _ in list(self._events)[start:]], False
+
+    async def wait(self, last_seq: int, timeout: Optional[float] = None) -> bool:
+        """等待序号大于last_seq的事件或运行结束
+
+        Returns:
+            有新事件或已结束返回True，超时返回False
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.last_seq > last_seq or self.closed_at is not None:
+                return True
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters = [(l, f) for l, f in self._waiters if f is not future]
+
+    @staticmethod
+    def _wake(waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]) -> None:
+        for loop, future in waiters:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(True))
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "session_id": self.session_id,
+            "first_seq": self.first_seq,
+            "last_seq": self.last_seq,
+            "buffered_events": len(self._events),
+            "buffered_bytes": self._bytes,
+            "evicted_events": self._evicted,
+            "readers": self.readers,
+            "closed": self.closed,
+            "created_at": self.created_at,
+            "closed_at": self.closed_at
+        }
+
+
+class StreamReplayRegistry:
+    """所有运行的回放缓冲登记表（按时间和总大小回收）"""
+
+    def __init__(
+        self,
+        max_events_per_run: int = 2000,
+        max_bytes_per_run: int = 4 * 1024 * 1024,
+        max_total_bytes: int = 64 * 1024 * 1024,
+        retention_seconds: float = 300
+    ):
+        self.max_events_per_run = max_events_per_run
+        self.max_bytes_per_run = max_bytes_per_run
+        self.max_total_bytes = max_total_bytes
+        self.retention_seconds = retention_seconds
+
+        self._buffers: Dict[str, StreamReplayBuffer] = {}
+        self._latest_by_session: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "expired": 0, "evicted_for_size": 0}
+
+    def create(self, session_id: Optional[str] = None, run_id: Optional[str] = None) -> StreamReplayBuffer:
+        """为新运行创建缓冲（顺带回收过期缓冲）"""
+        self.evict_expired()
+        run_id = run_id or uuid.uuid4().hex
+        buffer = StreamReplayBuffer(run_id, session_id, self.max_events_per_run, self.max_bytes_per_run)
+        with self._lock:
+            self._buffers[run_id] = buffer
+            if session_id:
+                self._latest_by_session[session_id] = run_id
+            self.stats["created"] += 1
+        return buffer
+
+    def get(self, run_id: str) -> Optional[StreamReplayBuffer]:
+        with self._lock:
+            return self._buffers.get(run_id)
+
+    def latest_for_session(self, session_id: str) -> Optional[StreamReplayBuffer]:
+        """会话最近一次运行的缓冲"""
+        with self._lock:
+            run_id = self._latest_by_session.get(session_id)
+            return self._buffers.get(run_id) if run_id else None
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        """回收保留期已过的已结束缓冲；总大小超限时按结束时间从早到晚回收
+
+        仍在运行的缓冲不会被回收（其大小已受单次运行上限约束）。
+
+        Returns:
+            回收的缓冲数量
+        """
+        now = now or time.time()
+        removed = 0
+        with self._lock:
+            for run_id, buffer in list(self._buffers.items()):
+                if buffer.closed and buffer.readers == 0 and now - buffer.closed_at > self.retention_seconds:
+                    self._remove_locked(run_id)
+                    self.stats["expired"] += 1
+                    removed += 1
+
+            total = sum(buffer.size_bytes for buffer in self._buffers.values())
+            if total > self.max_total_bytes:
+                closed = sorted(
+                    (buffer for buffer in self._buffers.values() if buffer.closed),
+                    key=lambda buffer: buffer.closed_at
+                )
+                for buffer in closed:
+                    if total <= self.max_total_bytes:
+                        break
+                    total -= buffer.size_bytes
+                    self._remove_locked(buffer.run_id)
+                    self.stats["evicted_for_size"] += 1
+                    removed += 1
+
+        if removed:
+            logger.debug(f"回收了 {removed} 个流式回放缓冲")
+        return removed
+
+    def _remove_locked(self, run_id: str) -> None:
+        buffer = self._buffers.pop(run_id, None)
+        if buffer and buffer.session_id and self._latest_by_session.get(buffer.session_id) == run_id:
+            del self._latest_by_session[buffer.session_id]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            buffers = list(self._buffers.values())
+        return {
+            "runs": len(buffers),
+            "active_runs": sum(1 for buffer in buffers if not buffer.closed),
+            "buffered_bytes": sum(buffer.size_bytes for buffer in buffers),
+            "max_total_bytes": self.max_total_bytes,
+            **self.stats
+        }
+
+
+_replay_registry: Optional[StreamReplayRegistry] = None
+_replay_registry_lock = threading.Lock()
+
+
+def get_stream_replay_registry(config: Optional[Dict[str, Any]] = None) -> StreamReplayRegistry:
+    """获取全局回放缓冲登记表（首次调用时按ui.stream_replay配置创建）"""
+    global _replay_registry
+    if _replay_registry is None:
+        with _replay_registry_lock:
+            if _replay_registry is None:
+                config = config or {}
+                _replay_registry = StreamReplayRegistry(
+                    max_events_per_run=config.get("max_events_per_run", 2000),
+                    max_bytes_per_run=config.get("max_bytes_per_run", 4 * 1024 * 1024),
+                    max_total_bytes=config.get("max_total_bytes", 64 * 1024 * 1024),
+                    retention_seconds=config.get("retention_seconds", 300)
+                )
+    return _replay_registry
@@ -22,6 +22,7 @@ from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, create_model, Field
 
 from app.core.task_decorator import task, TaskRegistry
+from app.core.run_manager import limit_tool_concurrency
 from app.core.system_capability_registry import (
     SystemCapability, CapabilityType, register_capability
 )
@@ -168,6 +169,9 @@ class ToolRegistry:
         func_name = name or func.__name__
         func_doc = description or inspect.getdoc(func) or ""
         
+        # CPU密集型分类的工具执行时占用运行管理器的资源槽位
+        func = limit_tool_concurrency(func, category)
+        
         # 检查函数参数，如果有多个参数则使用StructuredTool
         sig = inspect.signature(func)
         if len(sig.parameters) > 1 or use_structured_tool:
@@ -10,6 +10,7 @@ from .streaming import (
     StreamMode,
     get_stream_writer,
     create_stream_processor,
+    plan_stream_modes,
     DEFAULT_STREAM_MODES,
     ALL_STREAM_MODES
 )
@@ -46,6 +47,7 @@ __all__ = [
     # 工厂函数
     "get_stream_writer",
     "create_stream_processor",
+    "plan_stream_modes",
     
     # 消息类型
     "StreamMessageType",
@@ -386,6 +386,10 @@ export async function POST(req: NextRequest) {
               const decoder = new TextDecoder();
               let buffer = '';
         let totalChars = 0;
+        // 合并下发模式下信封字段只随start事件或在变化时发送，这里记住最近的值
+        const envelope: { session_id?: string; source?: string; llm_model?: string } = {
+          session_id: sessionId || undefined,
+        };
               
         const processStream = async () => {
               try {
@@ -429,25 +433,28 @@ export async function POST(req: NextRequest) {
                     
                     // 处理后端发送的token类型消息（LLM输出）
                     if (data.type === 'token' && data.content) {
+                      if (data.session_id !== undefined) envelope.session_id = data.session_id;
+                      if (data.source !== undefined) envelope.source = data.source;
+                      if (data.llm_model !== undefined) envelope.llm_model = data.llm_model;
                       const tokenContent = data.content;
                       if (tokenContent && typeof tokenContent === 'string' && tokenContent.trim()) {
                         // 构造llm_token格式的结构化消息并嵌入
                         const llmTokenMessage = {
                           type: 'llm_token',
                           timestamp: new Date().toISOString(),
-                          session_id: data.session_id,
-                          source: data.source, 
+                          session_id: envelope.session_id,
+                          source: envelope.source,
                           role: data.role,
                           content: tokenContent,
                           is_token: true,
                           token: tokenContent,
-                          llm_model: data.llm_model,
+                          llm_model: envelope.llm_model,
                           data: {
-                            source: data.source,
+                            source: envelope.source,
                             is_token: true,
                             is_complete: false,
                             token: tokenContent,
-                            llm_model: data.llm_model
+                            llm_model: envelope.llm_model
                           }
                         };
                         
@@ -468,6 +475,7 @@ export async function POST(req: NextRequest) {
 
                     // 处理start和end标记
                     else if (data.type === 'start') {
+                      envelope.session_id = data.session_id;
                       console.log('🎬 开始接收流式数据，会话ID:', data.session_id);
                     }
                     else if (data.type === 'end') {
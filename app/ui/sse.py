@@ -0,0 +1,359 @@
+"""
+SSE帧编码
+
+将引擎产出的流式消息（旧格式字典）转换为前端事件格式，并直接编码为
+SSE字节帧。流式热路径上每个token都会经过这里：
+1. 按消息类型值查表构建"data"事件详情，不逐个比较枚举
+2. 使用状态编解码器的dumps_json（orjson可用时走C扩展）一次性产出字节
+
+可续传的流中每个事件带"id: <run_id>:<序号>"行，浏览器重连时通过
+Last-Event-ID请求头回传，服务端据此只补发缺失的尾部。
+
+SSE流可按Accept-Encoding协商gzip/brotli压缩。压缩器在整个流上保持上下文
+（重复的JSON键和信封字段压缩率很高），每帧同步flush，客户端立即可解码。
+"""
+
+import logging
+import time
+import zlib
+from typing import Dict, Any, Optional, Tuple, AsyncIterator
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+from app.core.state_codec import get_state_codec
+from app.ui.streaming_types import StreamMessageType
+
+SSE_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
+SSE_KEEPALIVE = b": keepalive\n\n"
+
+SSE_COMPRESSION_MODES = ("auto", "gzip", "br", "off")
+
+logger = logging.getLogger(__name__)
+
+
+def encode_sse_frame(payload: Dict[str, Any]) -> bytes:
+    """将数据编码为一条SSE帧（orjson可用时走C扩展，直接产出字节）"""
+    return SSE_PREFIX + get_state_codec().dumps_json(payload) + SSE_SUFFIX
+
+
+def encode_sse_event(body: bytes, event_id: Optional[str] = None) -> bytes:
+    """将已编码的JSON数据封装为SSE帧，可附带事件ID"""
+    if event_id is None:
+        return SSE_PREFIX + body + SSE_SUFFIX
+    return b"id: " + event_id.encode("utf-8") + b"\n" + SSE_PREFIX + body + SSE_SUFFIX
+
+
+def format_event_id(run_id: str, seq: int) -> str:
+    """可续传流的事件ID"""
+    return f"{run_id}:{seq}"
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析Last-Event-ID，返回(run_id, 序号)；格式不符时返回None"""
+    if not event_id:
+        return None
+    run_id, _, seq = event_id.strip().rpartition(":")
+    if not run_id or not seq.isdigit():
+        return None
+    return run_id, int(seq)
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """解析Accept-Encoding为{编码: q值}"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate_sse_encoding(accept_encoding: Optional[str], mode: str = "auto") -> Optional[str]:
+    """按客户端Accept-Encoding和配置选择SSE压缩编码
+    
+    Args:
+        accept_encoding: 请求的Accept-Encoding头
+        mode: auto（br优先，其次gzip）、gzip、br或off
+        
+    Returns:
+        "br"、"gzip"，不压缩时返回None
+    """
+    if mode not in SSE_COMPRESSION_MODES:
+        logger.warning(f"未知的SSE压缩模式: {mode}，不压缩")
+        return None
+    if mode == "off":
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    candidates = ("br", "gzip") if mode == "auto" else (mode,)
+    for encoding in candidates:
+        if encoding == "br" and not BROTLI_AVAILABLE:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class SSECompressor:
+    """流式压缩器：整个流共享压缩上下文，每帧同步flush"""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 5):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=brotli_quality)
+            self._zlib = None
+        elif encoding == "gzip":
+            # wbits=31：带gzip头尾的deflate流
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._brotli = None
+        else:
+            raise ValueError(f"不支持的SSE压缩编码: {encoding}")
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def compress(self, frame: bytes) -> bytes:
+        """压缩一帧并flush，返回可立即发送的字节"""
+        self.raw_bytes += len(frame)
+        if self._zlib is not None:
+            out = self._zlib.compress(frame) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            out = self._brotli.process(frame) + self._brotli.flush()
+        self.compressed_bytes += len(out)
+        return out
+
+    def finish(self) -> bytes:
+        """结束压缩流"""
+        out = self._zlib.flush(zlib.Z_FINISH) if self._zlib is not None else self._brotli.finish()
+        self.compressed_bytes += len(out)
+        return out
+
+
+async def compress_sse_stream(
+    frames: AsyncIterator[bytes],
+    encoding: Optional[str],
+    gzip_level: int = 6,
+    brotli_quality: int = 5
+) -> AsyncIterator[bytes]:
+    """压缩SSE帧流；encoding为None时原样透传
+    
+    响应结束或客户端断开时显式关闭内层生成器，确保其清理逻辑（如脱离运行）执行。
+    """
+    compressor = SSECompressor(encoding, gzip_level, brotli_quality) if encoding else None
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame) if compressor else frame
+        if compressor:
+            yield compressor.finish()
+    finally:
+        aclose = getattr(frames, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        if compressor and compressor.raw_bytes:
+            logger.debug(
+                f"SSE流压缩({encoding}): {compressor.raw_bytes} -> {compressor.compressed_bytes} 字节"
+            )
+
+
+def _node_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """节点状态消息"""
+    return {
+        "node_name": chunk.get("node_name", "unknown"),
+        "status": chunk.get("status", "unknown"),
+        "details": chunk.get("details", "")
+    }
+
+
+def _thinking_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """Agent 思考过程"""
+    return {
+        "agent_name": chunk.get("agent_name", "unknown"),
+        "thinking_type": chunk.get("thinking_type", "analysis"),
+        "content": content
+    }
+
+
+def _tool_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """工具执行相关消息"""
+    return {
+        "tool_name": chunk.get("tool_name", "unknown"),
+        "action": chunk.get("action", "unknown"),
+        "progress": chunk.get("progress"),
+        "output": chunk.get("output", ""),
+        "error_message": chunk.get("error_message", "")
+    }
+
+
+def _file_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """文件相关消息"""
+    return {
+        "file_id": chunk.get("file_id", ""),
+        "file_name": chunk.get("file_name", "unknown"),
+        "file_type": chunk.get("file_type", "unknown"),
+        "file_path": chunk.get("file_path", ""),
+        "file_size": chunk.get("file_size")
+    }
+
+
+def _route_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """路由决策消息"""
+    return {
+        "from_node": chunk.get("from_node", ""),
+        "to_node": chunk.get("to_node", ""),
+        "reason": chunk.get("reason", "")
+    }
+
+
+def _state_diff_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """状态差量消息"""
+    return {
+        "ops": chunk.get("ops", []),
+        "version": chunk.get("version", 0),
+        "base_version": chunk.get("base_version", 0)
+    }
+
+
+def _system_detail(chunk: Dict[str, Any], content: Any) -> Dict[str, Any]:
+    """系统消息"""
+    return {
+        "message": content,
+        "error_code": chunk.get("error_code", ""),
+        "level": chunk.get("level", "info")
+    }
+
+
+# 消息类型值 -> "data"事件详情构建函数（按类型值查表，避免逐个比较枚举）
+_DATA_DETAIL_BUILDERS = {
+    **dict.fromkeys(
+        (StreamMessageType.NODE_START.value, StreamMessageType.NODE_COMPLETE.value,
+         StreamMessageType.NODE_ERROR.value),
+        _node_detail
+    ),
+    StreamMessageType.AGENT_THINKING.value: _thinking_detail,
+    StreamMessageType.STATE_DIFF.value: _state_diff_detail,
+    **dict.fromkeys(
+        (StreamMessageType.TOOL_START.value, StreamMessageType.TOOL_PROGRESS.value,
+         StreamMessageType.TOOL_COMPLETE.value, StreamMessageType.TOOL_ERROR.value),
+        _tool_detail
+    ),
+    **dict.fromkeys(
+        (StreamMessageType.FILE_GENERATED.value, StreamMessageType.FILE_UPLOADED.value),
+        _file_detail
+    ),
+    **dict.fromkeys(
+        (StreamMessageType.ROUTE_DECISION.value, StreamMessageType.ROUTE_CHANGE.value),
+        _route_detail
+    ),
+    **dict.fromkeys(
+        (StreamMessageType.ERROR.value, StreamMessageType.INFO.value, StreamMessageType.DEBUG.value),
+        _system_detail
+    ),
+}
+
+
+def build_stream_payload(
+    chunk: Dict[str, Any],
+    session_id: str,
+    chunk_id: int,
+    envelope: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """将引擎产出的流式消息转换为前端SSE数据格式
+    
+    Args:
+        chunk: 引擎产出的消息（旧格式字典，含type/role/content等字段）
+        session_id: 会话ID
+        chunk_id: 消息序号
+        envelope: 紧凑模式下本流已下发的信封字段（source/llm_model）。
+            传入时token帧省略session_id和时间戳，source/llm_model仅在变化时携带；
+            为None时每个token帧都带完整信封
+        
+    Returns:
+        待发送的数据；无需发送时返回None
+    """
+    msg_type = chunk.get("type")
+    # 兼容直接传入枚举成员的情况（str枚举的哈希与其值不同）
+    msg_type = getattr(msg_type, "value", msg_type)
+    content = chunk.get("content", "")
+    source = chunk.get("source", "")
+    
+    if msg_type == StreamMessageType.LLM_TOKEN.value:
+        # LLM token 流 - 直接发送给前端用于文本流显示
+        if not content:
+            return None
+        if envelope is not None:
+            return _compact_token_payload(chunk, content, source, chunk_id, envelope)
+        return {
+            "type": "token",  # 前端期待的token类型
+            "content": content,
+            "session_id": session_id,
+            "chunk_id": chunk_id,
+            "timestamp": time.time(),
+            "source": source,
+            "llm_model": chunk.get("llm_model", "unknown")
+        }
+    
+    build_detail = _DATA_DETAIL_BUILDERS.get(msg_type) if isinstance(msg_type, str) else None
+    if build_detail is not None:
+        detail = {"type": msg_type}
+        detail.update(build_detail(chunk, content))
+        detail["source"] = source
+        detail["timestamp"] = chunk.get("timestamp", time.time())
+        return {
+            "type": "data",
+            "content": detail,
+            "session_id": session_id,
+            "chunk_id": chunk_id,
+            "timestamp": time.time()
+        }
+    
+    if chunk.get("role") == "assistant" and content:
+        # 兼容旧格式的assistant消息，作为token流处理
+        return {
+            "type": "token",
+            "content": content,
+            "session_id": session_id,
+            "chunk_id": chunk_id,
+            "timestamp": time.time(),
+            "source": source
+        }
+    
+    # 其他未知消息类型，发送完整数据
+    return {
+        "type": "data",
+        "content": chunk,
+        "session_id": session_id,
+        "chunk_id": chunk_id,
+        "timestamp": time.time()
+    }
+
+
+def _compact_token_payload(
+    chunk: Dict[str, Any],
+    content: str,
+    source: str,
+    chunk_id: int,
+    envelope: Dict[str, Any]
+) -> Dict[str, Any]:
+    """紧凑token帧：信封字段只在首次出现或发生变化时携带"""
+    payload = {"type": "token", "content": content, "chunk_id": chunk_id}
+    llm_model = chunk.get("llm_model", "unknown")
+    if envelope.get("source") != source:
+        envelope["source"] = payload["source"] = source
+    if envelope.get("llm_model") != llm_model:
+        envelope["llm_model"] = payload["llm_model"] = llm_model
+    token_count = chunk.get("token_count")
+    if token_count:
+        payload["token_count"] = token_count
+    return payload
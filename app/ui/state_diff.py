@@ -0,0 +1,145 @@
+"""
+状态差量计算
+
+values流每个节点之后都会产出完整的IsotopeSystemState（含全部消息和工具结果），
+长会话中逐次推送完整快照的序列化和带宽开销都很大。StateDiffer记住上一次
+下发的状态，只产出JSON Patch（RFC 6902）风格的差量操作：
+- messages列表按消息ID比较前缀，只序列化新追加的消息（add /messages/-）
+- 字典按键递归比较，只下发变化的路径
+- 其他值变化时整体replace，删除的键remove
+"""
+
+import logging
+from typing import Dict, Any, List, Optional, Iterable
+
+from app.core.state_codec import get_state_codec
+
+logger = logging.getLogger(__name__)
+
+# 按消息ID做追加检测的列表字段
+APPEND_ONLY_KEYS = ("messages",)
+
+
+def _escape_pointer(key: Any) -> str:
+    """JSON Pointer路径段转义（~ -> ~0, / -> ~1）"""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _message_identity(message: Any) -> Any:
+    """消息的比较标识：消息ID（没有ID时退回对象身份）加内容长度
+
+    add_messages按ID替换消息时内容通常随之变化，带上长度可以识别这类替换。
+    """
+    if isinstance(message, dict):
+        message_id, content = message.get("id"), message.get("content")
+    else:
+        message_id, content = getattr(message, "id", None), getattr(message, "content", None)
+    if message_id is None:
+        message_id = id(message)
+    return (message_id, len(content) if isinstance(content, (str, list)) else None)
+
+
+def diff_values(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """计算两个JSON兼容值之间的差量操作
+
+    Args:
+        old: 旧值（已序列化）
+        new: 新值（已序列化）
+        path: 当前JSON Pointer路径
+
+    Returns:
+        差量操作列表
+    """
+    if old == new:
+        return []
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        return [{"op": "replace", "path": path, "value": new}]
+
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append({"op": "remove", "path": f"{path}/{_escape_pointer(key)}"})
+    for key, value in new.items():
+        child = f"{path}/{_escape_pointer(key)}"
+        if key not in old:
+            ops.append({"op": "add", "path": child, "value": value})
+        else:
+            ops.extend(diff_values(old[key], value, child))
+    return ops
+
+
+class StateDiffer:
+    """相邻状态快照之间的差量计算器（每个流一个实例）"""
+
+    def __init__(self, keys: Optional[Iterable[str]] = None):
+        """
+        Args:
+            keys: 只跟踪这些顶层字段；为None时跟踪全部字段
+        """
+        self.keys = set(keys) if keys else None
+        self.version = 0
+        self._codec = get_state_codec()
+        self._encoded: Dict[str, Any] = {}
+        self._message_ids: Dict[str, List[Any]] = {}
+
+    def diff(self, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """与上一次快照比较，返回差量操作并记住本次快照
+
+        第一次调用相对空状态计算，即完整状态以add操作下发一次。
+        """
+        ops: List[Dict[str, Any]] = []
+        current_keys = set()
+
+        for key, value in state.items():
+            if self.keys is not None and key not in self.keys:
+                continue
+            current_keys.add(key)
+            pointer = f"/{_escape_pointer(key)}"
+
+            if key in APPEND_ONLY_KEYS and isinstance(value, list):
+                ops.extend(self._diff_append_only(key, pointer, value))
+                continue
+
+            try:
+                encoded = self._codec.to_serializable(value)
+            except Exception as e:
+                logger.warning(f"状态字段 {key} 无法序列化，跳过差量: {e}")
+                continue
+
+            self._message_ids.pop(key, None)
+            if key not in self._encoded:
+                ops.append({"op": "add", "path": pointer, "value": encoded})
+            else:
+                ops.extend(diff_values(self._encoded[key], encoded, pointer))
+            self._encoded[key] = encoded
+
+        for key in list(self._encoded):
+            if key not in current_keys:
+                ops.append({"op": "remove", "path": f"/{_escape_pointer(key)}"})
+                del self._encoded[key]
+                self._message_ids.pop(key, None)
+
+        if ops:
+            self.version += 1
+        return ops
+
+    def _diff_append_only(self, key: str, pointer: str, items: List[Any]) -> List[Dict[str, Any]]:
+        """按消息ID比较：仅追加时只序列化新增部分，否则整体替换"""
+        identities = [_message_identity(item) for item in items]
+        previous = self._message_ids.get(key)
+        self._message_ids[key] = identities
+        # 消息列表只保存标识，不保留序列化结果
+        self._encoded[key] = None
+
+        if previous is None:
+            return [{"op": "add", "path": pointer, "value": self._codec.to_serializable(items)}]
+
+        prefix = len(previous)
+        if len(identities) >= prefix and identities[:prefix] == previous:
+            return [
+                {"op": "add", "path": f"{pointer}/-", "value": self._codec.to_serializable(item)}
+                for item in items[prefix:]
+            ]
+
+        # 历史被压缩或消息被移除：整体替换
+        return [{"op": "replace", "path": pointer, "value": self._codec.to_serializable(items)}]
@@ -0,0 +1,236 @@
+"""
+流式token合并输出
+
+快速模型每秒会产出上千个token，逐个作为独立事件下发会带来大量小写入，
+代理和前端的逐事件开销也随之放大。本模块在引擎输出与SSE/WebSocket
+下发之间合并相邻token：
+1. 时间窗口：首个待发token之后flush_interval内到达的同源token合并为一帧
+2. 字节阈值：待发内容达到flush_bytes时立即下发
+3. 非token事件（节点状态、工具等）到达时先下发已缓冲的token，保持顺序
+4. mode="token"时逐token透传，保留原有行为
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, AsyncIterator, AsyncGenerator, Callable
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ("coalesced", "token")
+
+# 单个请求可覆盖的上下限，避免客户端传入失控的值
+MAX_FLUSH_INTERVAL_MS = 1000
+MAX_FLUSH_BYTES = 64 * 1024
+
+
+@dataclass
+class StreamDeliveryConfig:
+    """流式下发配置"""
+    mode: str = "coalesced"
+    flush_interval_ms: int = 30
+    flush_bytes: int = 2048
+
+    @property
+    def coalesce(self) -> bool:
+        """是否启用token合并"""
+        return self.mode == "coalesced" and self.flush_interval_ms > 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "flush_interval_ms": self.flush_interval_ms,
+            "flush_bytes": self.flush_bytes
+        }
+
+
+def resolve_delivery_config(
+    overrides: Optional[Dict[str, Any]] = None,
+    defaults: Optional[Dict[str, Any]] = None
+) -> StreamDeliveryConfig:
+    """合并配置默认值与单个请求的覆盖项
+
+    Args:
+        overrides: 请求携带的下发选项（mode/flush_interval_ms/flush_bytes）
+        defaults: 配置文件中的ui.stream_delivery
+
+    Returns:
+        生效的下发配置
+    """
+    merged = dict(defaults or {})
+    merged.update({k: v for k, v in (overrides or {}).items() if v is not None})
+
+    mode = merged.get("mode", "coalesced")
+    if mode not in DELIVERY_MODES:
+        logger.warning(f"未知的流式下发模式: {mode}，使用coalesced")
+        mode = "coalesced"
+
+    try:
+        interval = int(merged.get("flush_interval_ms", 30))
+        flush_bytes = int(merged.get("flush_bytes", 2048))
+    except (TypeError, ValueError) as e:
+        logger.warning(f"流式下发参数无效: {e}，使用默认值")
+        interval, flush_bytes = 30, 2048
+
+    return StreamDeliveryConfig(
+        mode=mode,
+        flush_interval_ms=max(0, min(interval, MAX_FLUSH_INTERVAL_MS)),
+        flush_bytes=max(1, min(flush_bytes, MAX_FLUSH_BYTES))
+    )
+
+
+def is_token_chunk(chunk: Any) -> bool:
+    """判断引擎产出的消息是否为可合并的LLM token"""
+    return (
+        isinstance(chunk, dict)
+        and chunk.get("is_token") is True
+        and chunk.get("role") == "assistant"
+        and isinstance(chunk.get("content"), str)
+    )
+
+
+class TokenCoalescer:
+    """相邻token合并器
+
+    只维护状态，不涉及IO：push返回此刻应下发的消息，time_until_flush
+    告知调用方最迟何时调用flush。
+    """
+
+    def __init__(self, config: StreamDeliveryConfig, clock: Callable[[], float] = time.monotonic):
+        self.config = config
+        self._clock = clock
+        self._interval = config.flush_interval_ms / 1000.0
+        self._pending: Optional[Dict[str, Any]] = None
+        self._parts: List[str] = []
+        self._pending_bytes = 0
+        self._deadline = 0.0
+        self.stats = {"tokens_in": 0, "frames_out": 0}
+
+    @property
+    def has_pending(self) -> bool:
+        return self._pending is not None
+
+    def time_until_flush(self) -> Optional[float]:
+        """距离当前缓冲必须下发的剩余秒数；无缓冲时返回None"""
+        if self._pending is None:
+            return None
+        return max(0.0, self._deadline - self._clock())
+
+    def push(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """加入一条引擎消息，返回此刻应下发的消息列表"""
+        if not self.config.coalesce:
+            return [chunk]
+
+        if not is_token_chunk(chunk):
+            ready = self.flush()
+            ready.append(chunk)
+            return ready
+
+        self.stats["tokens_in"] += 1
+        ready: List[Dict[str, Any]] = []
+        if self._pending is not None and not self._same_stream(chunk):
+            ready = self.flush()
+
+        content = chunk["content"]
+        if self._pending is None:
+            self._pending = chunk
+            self._deadline = self._clock() + self._interval
+        self._parts.append(content)
+        self._pending_bytes += len(content.encode("utf-8"))
+
+        if self._pending_bytes >= self.config.flush_bytes or self._clock() >= self._deadline:
+            ready.extend(self.flush())
+        return ready
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """下发当前缓冲的token（合并为一条消息）"""
+        if self._pending is None:
+            return []
+
+        merged = self._pending
+        if len(self._parts) > 1:
+            merged = dict(merged)
+            content = "".join(self._parts)
+            merged["content"] = content
+            if "token" in merged:
+                merged["token"] = content
+            merged["token_count"] = len(self._parts)
+
+        self._pending = None
+        self._parts = []
+        self._pending_bytes = 0
+        self.stats["frames_out"] += 1
+        return [merged]
+
+    def _same_stream(self, chunk: Dict[str, Any]) -> bool:
+        """同一来源、同一模型的token才合并"""
+        pending = self._pending
+        return (
+            chunk.get("source") == pending.get("source")
+            and chunk.get("llm_model") == pending.get("llm_model")
+        )
+
+
+async def acoalesce(
+    stream: AsyncIterator[Dict[str, Any]],
+    config: StreamDeliveryConfig,
+    buffer_size: int = 256
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """对异步消息流应用token合并
+
+    上游由独立任务读取，这样时间窗口到期时即使上游暂时没有新消息，
+    已缓冲的token也能按时下发。
+
+    Args:
+        stream: 引擎产出的异步消息流
+        config: 下发配置
+        buffer_size: 读取任务与合并器之间的队列上限
+
+    Yields:
+        合并后的消息
+    """
+    if not config.coalesce:
+        async for chunk in stream:
+            yield chunk
+        return
+
+    coalescer = TokenCoalescer(config)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    done = object()
+
+    async def _reader():
+        try:
+            async for chunk in stream:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(done)
+
+    reader = asyncio.create_task(_reader())
+    try:
+        while True:
+            timeout = coalescer.time_until_flush()
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout) if timeout is not None else await queue.get()
+            except asyncio.TimeoutError:
+                for ready in coalescer.flush():
+                    yield ready
+                continue
+
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                for ready in coalescer.flush():
+                    yield ready
+                raise item
+            for ready in coalescer.push(item):
+                yield ready
+
+        for ready in coalescer.flush():
+            yield ready
+        logger.debug(f"token合并完成: 输入 {coalescer.stats['tokens_in']} 个token，输出 {coalescer.stats['frames_out']} 帧")
+    finally:
+        if not reader.done():
+            reader.cancel()
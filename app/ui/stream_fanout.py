@@ -0,0 +1,258 @@
+"""
+流式消息扇出
+
+同一会话可能有多个WebSocket连接（主客户端和旁观者）。逐个await发送时，
+一个慢连接会拖慢所有连接。本模块为每个连接维护独立的有界发送队列和
+发送任务，生产者只做不阻塞的入队：
+1. 合并（coalesce）：队列中尚未发出的相邻token帧合并为一帧，慢连接收到
+   更少但更大的帧，快连接不受影响
+2. 丢弃（drop_oldest）：队列写满时丢弃最早的可回放帧（带序号的流式消息），
+   随后向该连接发送gap通知，客户端可通过回放缓冲补读
+3. 控制消息（pong、错误等）不带序号，不会被丢弃
+4. 记录每个连接的排队深度、发送延迟、丢弃与合并次数
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+
+logger = logging.getLogger(__name__)
+
+FANOUT_POLICIES = ("coalesce", "drop_oldest")
+
+
+@dataclass
+class FanoutConfig:
+    """连接发送队列配置"""
+    queue_size: int = 256
+    policy: str = "coalesce"
+    send_timeout_seconds: float = 10.0
+
+
+def resolve_fanout_config(config: Optional[Dict[str, Any]] = None) -> FanoutConfig:
+    """从配置（ui.websocket_fanout）构建发送队列配置"""
+    config = config or {}
+    policy = config.get("policy", "coalesce")
+    if policy not in FANOUT_POLICIES:
+        logger.warning(f"未知的慢连接策略: {policy}，使用coalesce")
+        policy = "coalesce"
+    return FanoutConfig(
+        queue_size=max(1, int(config.get("queue_size", 256))),
+        policy=policy,
+        send_timeout_seconds=float(config.get("send_timeout_seconds", 10.0))
+    )
+
+
+class OutboundFrame:
+    """待发送帧
+
+    text为已编码内容（多个连接共享同一份编码）；帧被合并后置为None，
+    发送时由payload重新编码。
+    """
+
+    __slots__ = ("text", "payload", "merge_key", "run_id", "first_seq", "seq", "enqueued_at")
+
+    def __init__(
+        self,
+        text: Optional[str],
+        payload: Any = None,
+        merge_key: Optional[Tuple] = None,
+        run_id: Optional[str] = None,
+        seq: Optional[int] = None
+    ):
+        self.text = text
+        self.payload = payload
+        self.merge_key = merge_key
+        self.run_id = run_id
+        # 合并帧覆盖的序号区间为[first_seq, seq]
+        self.first_seq = seq
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+
+class ConnectionSender:
+    """单个连接的发送队列和发送任务"""
+
+    def __init__(
+        self,
+        send_text: Callable[[str], Awaitable[None]],
+        config: FanoutConfig,
+        encode: Optional[Callable[[Any], str]] = None,
+        merge: Optional[Callable[[Any, Any], Any]] = None,
+        gap_notice: Optional[Callable[[str, int, int], str]] = None,
+        name: str = ""
+    ):
+        """
+        Args:
+            send_text: 实际发送函数（如websocket.send_text）
+            config: 队列配置
+            encode: 合并后的payload编码函数
+            merge: 合并两个token帧payload的函数（较早的, 较新的）-> 合并结果
+            gap_notice: 生成gap通知文本的函数(run_id, from_seq, to_seq)
+            name: 连接标识（用于日志和指标）
+        """
+        self.config = config
+        self.name = name
+        self._send_text = send_text
+        self._encode = encode
+        self._merge = merge if config.policy == "coalesce" else None
+        self._gap_notice = gap_notice
+
+        self._frames: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._gaps: Dict[str, List[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.connected_at = time.time()
+        self.stats = {"enqueued": 0, "sent": 0, "dropped": 0, "coalesced": 0, "send_errors": 0}
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = 0.0
+
+    def start(self) -> None:
+        """启动发送任务（须在事件循环中调用）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def close(self) -> None:
+        """停止发送，丢弃未发出的帧"""
+        self.closed = True
+        self._frames.clear()
+        self._wakeup.set()
+        self._space.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._frames)
+
+    # ==================== 入队 ====================
+
+    def offer(self, frame: OutboundFrame) -> bool:
+        """不阻塞入队（生产者扇出时使用），队列满时按策略合并或丢弃
+
+        Returns:
+            连接已关闭时返回False
+        """
+        if self.closed:
+            return False
+        self.stats["enqueued"] += 1
+
+        if self._try_merge(frame):
+            return True
+        if len(self._frames) >= self.config.queue_size:
+            self._drop_oldest_replayable()
+        self._append(frame)
+        return True
+
+    async def put(self, frame: OutboundFrame) -> bool:
+        """等待队列有空位后入队（回复本连接自身请求时使用，只影响本连接）"""
+        while len(self._frames) >= self.config.queue_size and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+        if self.closed:
+            return False
+        self.stats["enqueued"] += 1
+        self._append(frame)
+        return True
+
+    def _append(self, frame: OutboundFrame) -> None:
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    def _try_merge(self, frame: OutboundFrame) -> bool:
+        """与队尾尚未发出的同类token帧合并"""
+        if self._merge is None or frame.merge_key is None or not self._frames:
+            return False
+        last = self._frames[-1]
+        if last.merge_key != frame.merge_key:
+            return False
+        try:
+            last.payload = self._merge(last.payload, frame.payload)
+        except Exception as e:
+            logger.error(f"合并待发送帧失败: {e}")
+            return False
+        last.text = None
+        last.seq = frame.seq
+        self.stats["coalesced"] += 1
+        return True
+
+    def _drop_oldest_replayable(self) -> None:
+        """丢弃最早的带序号帧并记录缺口；没有可丢弃的帧时允许暂时超出上限"""
+        for index, frame in enumerate(self._frames):
+            if frame.seq is None or frame.run_id is None:
+                continue
+            del self._frames[index]
+            self.stats["dropped"] += 1
+            gap = self._gaps.get(frame.run_id)
+            if gap is None:
+                self._gaps[frame.run_id] = [frame.first_seq, frame.seq]
+            else:
+                gap[0], gap[1] = min(gap[0], frame.first_seq), max(gap[1], frame.seq)
+            return
+
+    # ==================== 发送 ====================
+
+    async def _run(self) -> None:
+        try:
+            while not self.closed:
+                if not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                if self._gaps:
+                    for notice in self._pop_gap_notices():
+                        await self._send(notice, None)
+
+                frame = self._frames.popleft()
+                self._space.set()
+                text = frame.text if frame.text is not None else self._encode(frame.payload)
+                await self._send(text, frame.enqueued_at)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.stats["send_errors"] += 1
+            logger.warning(f"连接 {self.name} 发送失败，停止发送: {e}")
+            self.closed = True
+            self._frames.clear()
+            self._space.set()
+
+    async def _send(self, text: str, enqueued_at: Optional[float]) -> None:
+        await asyncio.wait_for(self._send_text(text), self.config.send_timeout_seconds)
+        self.stats["sent"] += 1
+        if enqueued_at is not None:
+            lag = time.monotonic() - enqueued_at
+            self._lag_last = lag
+            self._lag_max = max(self._lag_max, lag)
+            self._lag_total += lag
+
+    def _pop_gap_notices(self) -> List[str]:
+        gaps, self._gaps = self._gaps, {}
+        if self._gap_notice is None:
+            return []
+        return [self._gap_notice(run_id, start, end) for run_id, (start, end) in gaps.items()]
+
+    # ==================== 指标 ====================
+
+    def get_metrics(self) -> Dict[str, Any]:
+        sent = self.stats["sent"]
+        return {
+            "name": self.name,
+            "connected_at": self.connected_at,
+            "queue_depth": len(self._frames),
+            "queue_size": self.config.queue_size,
+            "policy": self.config.policy,
+            "closed": self.closed,
+            **self.stats,
+            "lag_last_ms": round(self._lag_last * 1000, 2),
+            "lag_max_ms": round(self._lag_max * 1000, 2),
+            "lag_avg_ms": round(self._lag_total / sent * 1000, 2) if sent else 0.0
+        }
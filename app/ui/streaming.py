@@ -4,9 +4,10 @@ LangGraph流式处理器主入口模块
 提供统一的流式处理接口，兼容现有系统
 """
 
+import asyncio
 import logging
 import time
-from typing import Dict, Any, Generator, List, Optional, Union
+from typing import Dict, Any, Generator, AsyncIterator, AsyncGenerator, List, Optional, Union
 from enum import Enum
 
 # 导入流式处理器和类型
@@ -39,6 +40,47 @@ class StreamMode(str, Enum):
 DEFAULT_STREAM_MODES = ["messages", "custom", "updates", "values"]
 ALL_STREAM_MODES = ["messages", "custom", "updates", "values", "events", "debug"]
 
+# 未指定或指定"all"时实际订阅的模式：token、自定义事件和节点更新。
+# values每步都会产出完整状态快照，只在客户端需要状态时订阅
+PLANNED_DEFAULT_MODES = ["messages", "custom", "updates"]
+# CompiledGraph.stream/astream接受的模式（events由astream_events单独提供）
+SUPPORTED_GRAPH_MODES = {"messages", "custom", "updates", "values", "debug"}
+
+
+def plan_stream_modes(
+    stream_mode: Union[str, List[str], None] = None,
+    include_state: bool = False
+) -> List[str]:
+    """规划本次执行需要订阅的LangGraph流模式
+    
+    Args:
+        stream_mode: 请求/配置中的流模式，可以是"all"、逗号分隔字符串或列表
+        include_state: 客户端是否需要状态（需要时订阅values并以差量下发）
+        
+    Returns:
+        去重后的流模式列表：不含图不支持的模式，values仅在include_state时保留
+    """
+    if stream_mode is None or (isinstance(stream_mode, str) and stream_mode.strip().lower() == "all"):
+        requested = list(PLANNED_DEFAULT_MODES)
+    elif isinstance(stream_mode, str):
+        requested = [mode.strip() for mode in stream_mode.split(",")]
+    elif isinstance(stream_mode, (list, tuple)):
+        requested = [str(mode).strip() for mode in stream_mode]
+    else:
+        requested = list(PLANNED_DEFAULT_MODES)
+    
+    modes = []
+    for mode in requested:
+        if mode in SUPPORTED_GRAPH_MODES and mode != "values" and mode not in modes:
+            modes.append(mode)
+        elif mode not in SUPPORTED_GRAPH_MODES and mode:
+            logger.debug(f"忽略不支持的流模式: {mode}")
+    
+    if include_state:
+        modes.append("values")
+    
+    return modes or ["messages"]
+
 class LangGraphStreamer:
     """
     LangGraph流处理器 - 兼容现有代码接口
@@ -58,14 +100,18 @@ class LangGraphStreamer:
         Args:
             stream_modes: 流模式列表
             session_id: 会话ID
-            config: 配置参数
+            config: 配置参数（state_diff: 是否以差量下发状态；state_keys: 差量跟踪的字段）
         """
         self.stream_modes = stream_modes or DEFAULT_STREAM_MODES
         self.session_id = session_id
         self.config = config or {}
         
         # 内部使用新的流处理器
-        self.processor = LangGraphStreamingProcessor(session_id=session_id)
+        self.processor = LangGraphStreamingProcessor(
+            session_id=session_id,
+            state_diff=self.config.get("state_diff", False),
+            state_keys=self.config.get("state_keys")
+        )
         
         logger.info(f"LangGraph流处理器初始化，使用流模式: {self.stream_modes}")
     
@@ -89,7 +135,8 @@ class LangGraphStreamer:
         try:
             for chunk in stream_generator:
                 chunk_count += 1
-                logger.debug(f"[DEBUG] 原始chunk消息内容: {chunk}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"[DEBUG] 原始chunk消息内容: {chunk}")
                 # 使用新的处理器处理数据块
                 processed_chunks = self.processor._process_stream_chunk(chunk)
                 
@@ -110,6 +157,42 @@ class LangGraphStreamer:
         finally:
             logger.info(f"流处理完成，共处理 {chunk_count} 个数据块")
     
+    async def aprocess_stream(
+        self,
+        stream_iterator: AsyncIterator[Any]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        处理LangGraph异步流输出 - process_stream的异步版本
+        
+        Args:
+            stream_iterator: LangGraph的异步流迭代器（CompiledGraph.astream）
+            
+        Yields:
+            Dict[str, Any]: 处理后的流数据，格式与process_stream一致
+        """
+        chunk_count = 0
+        try:
+            async for chunk in stream_iterator:
+                chunk_count += 1
+                processed_chunks = self.processor._process_stream_chunk(chunk)
+                
+                if not processed_chunks:
+                    converted_chunk = self._handle_raw_chunk(chunk)
+                    if converted_chunk:
+                        yield converted_chunk
+                else:
+                    for processed_chunk in processed_chunks:
+                        yield self._convert_to_legacy_format(processed_chunk)
+        
+        except asyncio.CancelledError:
+            logger.info(f"异步流处理被取消，已处理 {chunk_count} 个数据块")
+            raise
+        except Exception as e:
+            logger.error(f"异步流处理过程中出现错误: {e}")
+            raise
+        finally:
+            logger.info(f"异步流处理完成，共处理 {chunk_count} 个数据块")
+    
     def _convert_to_legacy_format(self, stream_message: StreamMessage) -> Dict[str, Any]:
         """
         将新格式的流消息转换为旧格式以保持兼容性
@@ -201,6 +284,14 @@ class LangGraphStreamer:
             result["to_node"] = to_node
             result["reason"] = reason
             
+        elif stream_message.type == StreamMessageType.STATE_DIFF:
+            # 状态差量不是对话内容，不设置content，避免被计入会话消息
+            result["role"] = "state"
+            result["content"] = ""
+            result["ops"] = getattr(stream_message, "ops", [])
+            result["version"] = getattr(stream_message, "version", 0)
+            result["base_version"] = getattr(stream_message, "base_version", 0)
+            
         elif stream_message.type in [StreamMessageType.ERROR, StreamMessageType.INFO]:
             # 错误和信息消息作为system角色
             result["role"] = "system"
@@ -217,7 +308,7 @@ class LangGraphStreamer:
         # 构建data字段用于向后兼容性
         result["data"] = {
             key: value for key, value in result.items() 
-            if key not in ["type", "timestamp", "session_id", "role", "content"]
+            if key not in ["type", "timestamp", "session_id", "role", "content", "ops"]
         }
         
         return result
@@ -13,13 +13,14 @@ LangGraph流式处理器
 
 import logging
 import time
-from typing import Dict, Any, Optional, Generator, List, Callable, Union
+from typing import Dict, Any, Optional, Generator, AsyncIterator, AsyncGenerator, List, Callable, Union
 from datetime import datetime
 import asyncio
 import json
 
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk, HumanMessage, ToolMessage
 
+from app.ui.state_diff import StateDiffer
 from app.ui.streaming_types import (
     StreamMessageType, BaseStreamMessage, NodeStatusMessage, RouterMessage,
     LLMTokenMessage, ToolExecutionMessage, FileGeneratedMessage, 
@@ -33,14 +34,22 @@ logger = logging.getLogger(__name__)
 class LangGraphStreamingProcessor:
     """LangGraph流式处理器 - 基于官方文档优化"""
     
-    def __init__(self, session_id: Optional[str] = None):
+    def __init__(
+        self,
+        session_id: Optional[str] = None,
+        state_diff: bool = False,
+        state_keys: Optional[List[str]] = None
+    ):
         """
         初始化流式处理器
         
         Args:
             session_id: 会话ID
+            state_diff: 是否将values快照转换为状态差量下发
+            state_keys: 状态差量只跟踪的顶层字段（None表示全部）
         """
         self.session_id = session_id
+        self.state_differ = StateDiffer(state_keys) if state_diff else None
         self.active_nodes: Dict[str, float] = {}  # 节点名 -> 开始时间
         self.message_buffer: List[BaseStreamMessage] = []
         
@@ -57,6 +66,15 @@ class LangGraphStreamingProcessor:
             "on_tool_error": self._handle_tool_error,
         }
         
+        # 流模式 -> 处理函数，标准的(mode, payload)二元组直接查表分发，
+        # 不再逐个调用_is_*_chunk判断
+        self._chunk_dispatch: Dict[str, Callable[[tuple], List[BaseStreamMessage]]] = {
+            "messages": self._handle_message_chunk,
+            "updates": self._handle_update_chunk,
+            "custom": self._handle_custom_chunk,
+            "values": self._handle_values_chunk_selective,
+        }
+        
         logger.info(f"LangGraph流式处理器初始化完成，会话ID: {session_id}")
     
     def process_langgraph_stream(
@@ -99,6 +117,47 @@ class LangGraphStreamingProcessor:
             )
             yield serialize_message(error_msg)
     
+    async def aprocess_langgraph_stream(
+        self,
+        stream_iterator: AsyncIterator,
+        stream_modes: List[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        处理LangGraph异步流式输出（配合CompiledGraph.astream使用）
+        
+        与process_langgraph_stream共用同一套chunk解析逻辑，区别仅在于
+        迭代过程不阻塞事件循环，调用方被取消时上游astream随之关闭。
+        
+        Args:
+            stream_iterator: LangGraph异步流迭代器
+            stream_modes: 流模式列表
+            
+        Yields:
+            处理后的流式消息
+        """
+        if stream_modes is None:
+            stream_modes = ["messages", "custom", "updates"]
+        
+        logger.info(f"开始异步处理LangGraph流，模式: {stream_modes}")
+        
+        try:
+            async for chunk in stream_iterator:
+                for message in self._process_stream_chunk(chunk):
+                    yield serialize_message(message)
+        except asyncio.CancelledError:
+            logger.info("异步流处理被取消")
+            raise
+        except Exception as e:
+            logger.error(f"异步处理LangGraph流时出错: {str(e)}")
+            error_msg = create_message(
+                StreamMessageType.ERROR,
+                session_id=self.session_id,
+                source="streaming_processor",
+                error_message=f"流处理错误: {str(e)}",
+                error_code="STREAM_PROCESSING_ERROR"
+            )
+            yield serialize_message(error_msg)
+    
     def _process_stream_chunk(self, chunk: Any) -> List[BaseStreamMessage]:
         """
         处理单个流数据块 - 基于真实格式优化
@@ -112,10 +171,17 @@ class LangGraphStreamingProcessor:
         messages = []
         
         try:
-            # 添加调试日志来查看chunk格式
-            logger.debug(f"[DEBUG] 收到chunk类型: {type(chunk)}, 内容预览: {str(chunk)[:200]}...")
+            # 快速路径：标准的(mode, payload)二元组查表分发
+            if type(chunk) is tuple and len(chunk) == 2 and type(chunk[0]) is str:
+                handler = self._chunk_dispatch.get(chunk[0])
+                if handler is not None:
+                    return handler(chunk)
             
-            # 基于LangGraph官方文档的chunk类型判断
+            # 仅在DEBUG级别下格式化chunk，避免对values快照等大对象做字符串化
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[DEBUG] 收到chunk类型: {type(chunk)}, 内容预览: {str(chunk)[:200]}...")
+            
+            # 基于LangGraph官方文档的chunk类型判断（非标准格式的兼容路径）
             if self._is_message_chunk(chunk):
                 logger.debug(f"[DEBUG] 识别为messages流chunk")
                 messages.extend(self._handle_message_chunk(chunk))
@@ -231,90 +297,73 @@ class LangGraphStreamingProcessor:
             logger.warning(f"[DEBUG] 消息chunk格式错误: {chunk}")
             return messages
         
-        logger.debug(f"[DEBUG] 处理消息chunk: 长度={len(chunk)}")
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
         
-        try:
-            from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage, ToolMessage, BaseMessage
+        # 解析chunk格式
+        if chunk[0] == 'messages':
+            # 标准格式: ('messages', message_data)
+            message_data = chunk[1]
             
-            # 解析chunk格式
-            if chunk[0] == 'messages':
-                # 标准格式: ('messages', message_data)
-                message_data = chunk[1]
-                
-                if isinstance(message_data, tuple) and len(message_data) >= 1:
-                    # ('messages', (message, metadata))
-                    message = message_data[0]
-                    metadata = message_data[1] if len(message_data) > 1 else {}
-                else:
-                    # ('messages', message)
-                    message = message_data
-                    metadata = {}
+            if isinstance(message_data, tuple) and len(message_data) >= 1:
+                # ('messages', (message, metadata))
+                message = message_data[0]
+                metadata = message_data[1] if len(message_data) > 1 else {}
             else:
-                # 直接格式: (LLM token, metadata)
-                message = chunk[0]
-                metadata = chunk[1] if len(chunk) > 1 else {}
+                # ('messages', message)
+                message = message_data
+                metadata = {}
+        else:
+            # 直接格式: (LLM token, metadata)
+            message = chunk[0]
+            metadata = chunk[1] if len(chunk) > 1 else {}
+        
+        # 处理不同类型的消息
+        if isinstance(message, (AIMessage, AIMessageChunk)):
+            # AI消息 - LLM输出
+            content = getattr(message, 'content', '')
             
-            # 处理不同类型的消息
-            if isinstance(message, (AIMessage, AIMessageChunk)):
-                # AI消息 - LLM输出
-                content = getattr(message, 'content', '')
+            if content and str(content).strip():  # 只处理非空内容
+                # 确定是否为完整消息
+                is_complete = isinstance(message, AIMessage)
+                
+                # 从metadata中提取节点信息
+                source = "ai_assistant"
+                llm_model = "unknown"
+                if isinstance(metadata, dict):
+                    source = metadata.get('langgraph_node', metadata.get('node', source))
+                    llm_model = metadata.get('ls_model_name', llm_model)
                 
-                if content and str(content).strip():  # 只处理非空内容
-                    # 确定是否为完整消息
-                    is_complete = isinstance(message, AIMessage)
-                    
-                    # 从metadata中提取节点信息
-                    source = "ai_assistant"
-                    llm_model = "unknown"
-                    if isinstance(metadata, dict):
-                        source = metadata.get('langgraph_node', metadata.get('node', source))
-                        llm_model = metadata.get('ls_model_name', llm_model)
-                    
-                    llm_msg = create_message(
-                        StreamMessageType.LLM_TOKEN,
-                        session_id=self.session_id,
-                        source=source,
-                        content=str(content),
-                        is_complete=is_complete,
-                        llm_model=llm_model,
-                        metadata=metadata if isinstance(metadata, dict) else {}
-                    )
-                    messages.append(llm_msg)
-                    logger.debug(f"[DEBUG] 创建LLM消息: 完整={is_complete}, 长度={len(str(content))}")
-            
-            elif isinstance(message, ToolMessage):
-                # 工具消息
-                tool_msg = create_message(
-                    StreamMessageType.TOOL_COMPLETE,
-                    session_id=self.session_id,
-                    source="tool_executor",
-                    tool_name=getattr(message, 'name', 'unknown'),
-                    action="complete",
-                    output=getattr(message, 'content', ''),
-                    metadata=metadata if isinstance(metadata, dict) else {}
-                )
-                messages.append(tool_msg)
-                logger.debug(f"[DEBUG] 创建工具消息")
-            
-            # 注意：HumanMessage通常不需要推送到前端，因为是用户输入
-            
-        except ImportError:
-            # 降级处理：无法导入LangChain消息类型
-            logger.warning("无法导入LangChain消息类型，使用降级处理")
-            message = chunk[1] if chunk[0] == 'messages' else chunk[0]
-            content = getattr(message, 'content', str(message))
-            
-            if content and str(content).strip():
                 llm_msg = create_message(
                     StreamMessageType.LLM_TOKEN,
                     session_id=self.session_id,
-                    source="ai_assistant",
+                    source=source,
                     content=str(content),
-                    is_complete=True
+                    is_complete=is_complete,
+                    llm_model=llm_model,
+                    metadata=metadata if isinstance(metadata, dict) else {}
                 )
                 messages.append(llm_msg)
+                if debug_enabled:
+                    logger.debug(f"[DEBUG] 创建LLM消息: 完整={is_complete}, 长度={len(str(content))}")
         
-        logger.debug(f"[DEBUG] 消息chunk处理结果: 生成了 {len(messages)} 个消息")
+        elif isinstance(message, ToolMessage):
+            # 工具消息
+            tool_msg = create_message(
+                StreamMessageType.TOOL_COMPLETE,
+                session_id=self.session_id,
+                source="tool_executor",
+                tool_name=getattr(message, 'name', 'unknown'),
+                action="complete",
+                output=getattr(message, 'content', ''),
+                metadata=metadata if isinstance(metadata, dict) else {}
+            )
+            messages.append(tool_msg)
+            logger.debug("[DEBUG] 创建工具消息")
+        
+        # 注意：HumanMessage通常不需要推送到前端，因为是用户输入
+        
+        if debug_enabled:
+            logger.debug(f"[DEBUG] 消息chunk处理结果: 生成了 {len(messages)} 个消息")
         return messages
 
     def _handle_update_chunk(self, chunk: tuple) -> List[BaseStreamMessage]:
@@ -730,6 +779,10 @@ class LangGraphStreamingProcessor:
         if not isinstance(values_data, dict):
             return messages
         
+        # 客户端订阅了状态：只下发与上一快照之间的差量
+        if self.state_differ is not None:
+            return self._handle_values_as_diff(values_data)
+        
         logger.debug(f"[DEBUG] values chunk包含: {list(values_data.keys())}")
         
         # 只提取最新的AI回复（如果有）
@@ -769,6 +822,22 @@ class LangGraphStreamingProcessor:
         logger.debug(f"[DEBUG] values选择性处理结果: 生成了 {len(messages)} 个消息")
         return messages
 
+    def _handle_values_as_diff(self, values_data: dict) -> List[BaseStreamMessage]:
+        """将values快照转换为状态差量消息（无变化时不产出）"""
+        base_version = self.state_differ.version
+        ops = self.state_differ.diff(values_data)
+        if not ops:
+            return []
+        
+        return [create_message(
+            StreamMessageType.STATE_DIFF,
+            session_id=self.session_id,
+            source="state",
+            ops=ops,
+            version=self.state_differ.version,
+            base_version=base_version
+        )]
+
     def _handle_unknown_chunk(self, chunk: Any) -> List[BaseStreamMessage]:
         """处理未识别的数据块"""
         messages = []
@@ -39,6 +39,9 @@ class StreamMessageType(str, Enum):
     AGENT_THINKING = "agent_thinking"  # Agent思考过程
     AGENT_ANALYSIS = "agent_analysis" # Agent分析结果
     
+    # 状态相关
+    STATE_DIFF = "state_diff"          # 状态差量（JSON Patch风格）
+    
     # 系统状态相关
     SESSION_START = "session_start"    # 会话开始
     SESSION_END = "session_end"        # 会话结束
@@ -144,6 +147,13 @@ class InfoMessage(BaseStreamMessage):
     action_data: Optional[Dict[str, Any]] = None
 
 
+class StateDiffMessage(BaseStreamMessage):
+    """状态差量消息"""
+    ops: List[Dict[str, Any]]  # JSON Patch风格操作: {"op", "path", "value"}
+    version: int  # 应用本差量后的状态版本
+    base_version: int  # 本差量所基于的版本，0表示相对空状态
+
+
 # 消息类型映射
 MESSAGE_TYPE_MAP = {
     StreamMessageType.NODE_START: NodeStatusMessage,
@@ -162,6 +172,7 @@ MESSAGE_TYPE_MAP = {
     StreamMessageType.AGENT_THINKING: AgentThinkingMessage,
     StreamMessageType.ERROR: ErrorMessage,
     StreamMessageType.INFO: InfoMessage,
+    StreamMessageType.STATE_DIFF: StateDiffMessage,
 }
 
 
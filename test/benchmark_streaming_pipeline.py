@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+流式热路径微基准
+
+模拟LangGraph messages流，测量token经过
+LangGraphStreamer -> SSE载荷构建 -> SSE帧编码 的吞吐量（tokens/sec），
+分别在日志关闭（WARNING）和开启（DEBUG）两种情况下运行。
+
+用法:
+    python test/benchmark_streaming_pipeline.py [token数]
+"""
+import sys
+import os
+import time
+import logging
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from langchain_core.messages import AIMessageChunk
+
+from app.ui.streaming import LangGraphStreamer
+from app.ui.sse import encode_sse_frame, build_stream_payload
+
+HOT_PATH_LOGGERS = ["app.ui.streaming", "app.ui.streaming_processor", "app.ui.sse"]
+
+
+def make_chunks(token_count: int):
+    """构造messages流数据块，并穿插少量values快照（模拟大状态对象）"""
+    metadata = {"langgraph_node": "agent", "ls_model_name": "bench-model"}
+    snapshot = {"messages": [AIMessageChunk(content="历史消息" * 50) for _ in range(20)]}
+    chunks = []
+    for i in range(token_count):
+        chunks.append(("messages", (AIMessageChunk(content=f"tok{i} "), metadata)))
+        if i % 200 == 0:
+            chunks.append(("values", snapshot))
+    return chunks
+
+
+def run_pipeline(chunks) -> int:
+    """跑一遍流式管道，返回产出的SSE字节数"""
+    streamer = LangGraphStreamer(session_id="bench")
+    total_bytes = 0
+    for chunk_id, item in enumerate(streamer.process_stream(iter(chunks)), 1):
+        payload = build_stream_payload(item, "bench", chunk_id)
+        if payload is not None:
+            total_bytes += len(encode_sse_frame(payload))
+    return total_bytes
+
+
+def benchmark(token_count: int, level: int) -> float:
+    """在指定日志级别下运行基准，返回tokens/sec"""
+    # 日志输出丢弃，只衡量格式化开销
+    handler = logging.NullHandler()
+    for name in HOT_PATH_LOGGERS:
+        lg = logging.getLogger(name)
+        lg.setLevel(level)
+        lg.addHandler(handler)
+        lg.propagate = False
+
+    chunks = make_chunks(token_count)
+    run_pipeline(chunks[:100])  # 预热
+
+    start = time.perf_counter()
+    total_bytes = run_pipeline(chunks)
+    elapsed = time.perf_counter() - start
+
+    rate = token_count / elapsed
+    print(f"  日志级别={logging.getLevelName(level):<7} 耗时={elapsed:.3f}s  "
+          f"吞吐={rate:,.0f} tokens/sec  SSE字节={total_bytes:,}")
+    return rate
+
+
+def run_streaming_benchmark(token_count: int = 20000):
+    print(f"\n{'='*50}")
+    print(f"流式热路径微基准: {token_count} tokens")
+    print(f"{'='*50}")
+    off_rate = benchmark(token_count, logging.WARNING)
+    on_rate = benchmark(token_count, logging.DEBUG)
+    print(f"  日志关闭/开启 吞吐比: {off_rate / on_rate:.2f}x")
+    return off_rate, on_rate
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    run_streaming_benchmark(count)
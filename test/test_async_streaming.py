@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+异步流式处理管道单元测试
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import AIMessageChunk
+    from app.ui.streaming_processor import LangGraphStreamingProcessor
+    from app.ui.streaming import LangGraphStreamer
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过异步流式处理测试: {e}")
+
+# 与时间相关的字段不参与比较
+_VOLATILE_FIELDS = ("timestamp", "id", "message_id", "created_at")
+
+
+def graph_chunks():
+    return [
+        ("custom", {"agent_thinking": "正在分析测井数据"}),
+        ("messages", (AIMessageChunk(content="孔隙度"), {"langgraph_node": "main_agent"})),
+        ("messages", (AIMessageChunk(content="为18%"), {"langgraph_node": "main_agent"})),
+        ("messages", (AIMessageChunk(content=""), {"langgraph_node": "main_agent"})),
+    ]
+
+
+async def astream(chunks, error=None, started=None, closed=None):
+    """模拟CompiledGraph.astream：逐个产出数据块，可在末尾抛出异常或无限等待"""
+    try:
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+        if error is not None:
+            raise error
+        if started is not None:
+            started.set()
+            await asyncio.Event().wait()
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def stable(messages):
+    return [{k: v for k, v in message.items() if k not in _VOLATILE_FIELDS} for message in messages]
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+class TestAsyncStreamingProcessor(unittest.TestCase):
+    """测试异步处理与同步处理共用解析逻辑"""
+    
+    def test_async_output_matches_sync(self):
+        sync_messages = list(LangGraphStreamingProcessor("s1").process_langgraph_stream(iter(graph_chunks())))
+        async_messages = asyncio.run(collect(
+            LangGraphStreamingProcessor("s1").aprocess_langgraph_stream(astream(graph_chunks()))
+        ))
+        self.assertEqual(stable(async_messages), stable(sync_messages))
+        self.assertEqual(len(async_messages), 3)
+        print("✅ 异步流处理与同步流处理输出一致")
+    
+    def test_upstream_error_becomes_error_message(self):
+        """测试上游异步流出错时以错误消息结束，而不是中断调用方"""
+        messages = asyncio.run(collect(
+            LangGraphStreamingProcessor("s1").aprocess_langgraph_stream(
+                astream(graph_chunks()[:1], error=RuntimeError("图执行失败"))
+            )
+        ))
+        self.assertEqual(messages[-1]["error_code"], "STREAM_PROCESSING_ERROR")
+        self.assertIn("图执行失败", messages[-1]["error_message"])
+    
+    def test_cancellation_closes_upstream(self):
+        """测试消费方被取消时取消传递到上游，上游流被关闭"""
+        closed = []
+        
+        async def scenario():
+            started = asyncio.Event()
+            processor = LangGraphStreamingProcessor("s1")
+            consumer = asyncio.ensure_future(collect(
+                processor.aprocess_langgraph_stream(astream(graph_chunks(), started=started, closed=closed))
+            ))
+            await started.wait()
+            consumer.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await consumer
+        
+        asyncio.run(scenario())
+        self.assertEqual(closed, [True])
+        print("✅ 取消时上游流被关闭")
+
+
+class TestAsyncStreamer(unittest.TestCase):
+    """测试LangGraphStreamer的异步接口"""
+    
+    def test_aprocess_stream_matches_process_stream(self):
+        sync_chunks = list(LangGraphStreamer(session_id="s1").process_stream(iter(graph_chunks())))
+        async_chunks = asyncio.run(collect(LangGraphStreamer(session_id="s1").aprocess_stream(astream(graph_chunks()))))
+        self.assertEqual(stable(async_chunks), stable(sync_chunks))
+        self.assertTrue(any(chunk.get("content") == "孔隙度" for chunk in async_chunks))
+    
+    def test_aprocess_stream_propagates_errors(self):
+        """测试异步接口与同步接口一样向调用方抛出上游异常"""
+        streamer = LangGraphStreamer(session_id="s1")
+        with self.assertRaises(RuntimeError):
+            asyncio.run(collect(streamer.aprocess_stream(astream([], error=RuntimeError("断开")))))
+
+
+class TestEngineAsyncStreamingFinalize(unittest.TestCase):
+    """测试异步流被中断时，会话保存在工作线程中执行且不会被再次取消打断"""
+    
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from app.core.engine import IsotopeEngine
+        except ImportError as e:
+            raise unittest.SkipTest(f"依赖不可用，跳过引擎异步流式测试: {e}")
+        cls.engine_class = IsotopeEngine
+    
+    def make_engine(self, started, finalize):
+        # 只使用异步流式处理路径需要的属性，不初始化完整引擎
+        engine = self.engine_class.__new__(self.engine_class)
+        engine.config = {}
+        engine.workflow_graph = type("Graph", (), {
+            "astream": staticmethod(lambda state, config=None, stream_mode=None: astream(graph_chunks(), started=started))
+        })()
+        engine.graph_builder = type("Builder", (), {
+            "create_thread_config": staticmethod(lambda session_id: {"configurable": {"thread_id": session_id}})
+        })()
+        engine._prepare_streaming_turn = lambda message, session_id, *args: {
+            "session_id": session_id,
+            "modes": ["messages", "custom"],
+            "include_state": False,
+            "state": {"messages": []},
+            "finished": False,
+            "yielded_count": 0
+        }
+        engine._absorb_streaming_item = lambda turn, item: turn.update(yielded_count=turn["yielded_count"] + 1)
+        engine._finalize_streaming_turn = finalize
+        return engine
+    
+    def test_interrupted_turn_is_saved_off_loop_and_survives_second_cancel(self):
+        """测试客户端断开后部分回复的保存不阻塞事件循环，保存期间再次取消也会完成保存"""
+        release = threading.Event()
+        finalize_started = threading.Event()
+        finalized = threading.Event()
+        calls = []
+        
+        def finalize(turn, save_memory=True):
+            calls.append((threading.current_thread() is threading.main_thread(), save_memory))
+            finalize_started.set()
+            # 在事件循环线程中执行时，循环无法运行下面的release.set()，这里会超时
+            calls.append(release.wait(5))
+            finalized.set()
+        
+        async def scenario():
+            started = asyncio.Event()
+            engine = self.make_engine(started, finalize)
+            consumer = asyncio.ensure_future(collect(engine.aprocess_message_streaming("问题", "s1")))
+            await started.wait()
+            consumer.cancel()
+            
+            while not finalize_started.is_set():
+                await asyncio.sleep(0.01)
+            consumer.cancel()
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await consumer
+        
+        asyncio.run(scenario())
+        self.assertTrue(finalized.wait(5))
+        self.assertEqual(calls, [(False, False), True])
+        print("✅ 中断后的会话保存在工作线程中完成")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
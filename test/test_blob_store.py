@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+大负载内容存储与SSE压缩单元测试
+"""
+
+import base64
+import gc
+import zlib
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.blob_store import BlobStore, PayloadExternalizer
+    from app.core.shared_state import InProcessBroker
+    from app.core.stream_replay import StreamReplayBuffer
+    from app.ui.sse import SSECompressor, negotiate_sse_encoding
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过大负载传输测试: {e}")
+
+
+class TestLargePayloadTransport(unittest.TestCase):
+    """测试大负载引用与SSE压缩"""
+    
+    def test_externalize_large_values(self):
+        """测试超过阈值的值替换为内容引用，相同内容只存一份"""
+        store = BlobStore(max_bytes=1024 * 1024)
+        externalizer = PayloadExternalizer(store, threshold_bytes=1024)
+        image = "data:image/png;base64," + base64.b64encode(b"\x89PNG" + b"\0" * 4000).decode()
+        rows = [{"depth": i, "value": i * 0.5} for i in range(200)]
+        payload = {"type": "data", "content": {"output": image, "table": rows, "name": "短字段"}}
+        
+        result = externalizer.externalize(payload)
+        again = externalizer.externalize(payload)
+        
+        image_ref = result["content"]["output"]
+        self.assertEqual(image_ref["content_type"], "image/png")
+        self.assertEqual(image_ref["size"], 4004)
+        self.assertEqual(store.get(image_ref["$ref"][7:])[0][:4], b"\x89PNG")
+        self.assertTrue(image_ref["url"].endswith(image_ref["$ref"][7:]))
+        self.assertEqual(result["content"]["table"]["content_type"], "application/json")
+        self.assertEqual(result["content"]["name"], "短字段")
+        self.assertIs(payload["content"]["output"], image)
+        self.assertEqual(again, result)
+        self.assertEqual(store.get_metrics()["blobs"], 2)
+        self.assertEqual(store.stats["deduplicated"], 2)
+        print("✅ 大负载替换为内容引用并去重")
+    
+    def test_sse_compression(self):
+        """测试SSE压缩协商和逐帧flush"""
+        self.assertEqual(negotiate_sse_encoding("gzip, deflate", "auto"), "gzip")
+        self.assertIsNone(negotiate_sse_encoding("gzip;q=0", "gzip"))
+        self.assertIsNone(negotiate_sse_encoding("gzip", "off"))
+        self.assertIsNone(negotiate_sse_encoding(None, "auto"))
+        
+        compressor = SSECompressor("gzip")
+        decoder = zlib.decompressobj(31)
+        frames = [f'data: {{"type": "token", "content": "片段{i}"}}\n\n'.encode() for i in range(20)]
+        for frame in frames:
+            # 每帧压缩后立即可完整解码
+            self.assertEqual(decoder.decompress(compressor.compress(frame)), frame)
+        decoder.decompress(compressor.finish())
+        self.assertTrue(decoder.eof)
+        self.assertLess(compressor.compressed_bytes, compressor.raw_bytes)
+        print("✅ SSE流压缩逐帧可解码")
+
+
+class TestBlobStoreRetention(unittest.TestCase):
+    """测试多进程共享和回放缓冲引用的内容保留"""
+    
+    def test_other_worker_reads_from_shared_layer(self):
+        """测试另一个工作进程的存储从共享层解析引用"""
+        broker = InProcessBroker()
+        producer = BlobStore(max_bytes=1024 * 1024, shared=broker)
+        other_worker = BlobStore(max_bytes=1024 * 1024, shared=broker)
+        isolated = BlobStore(max_bytes=1024 * 1024)
+        
+        digest = producer.put(b"<html>" + b"x" * 2000, "text/html; charset=utf-8")
+        self.assertIsNone(isolated.get(digest))
+        self.assertEqual(other_worker.get(digest), (b"<html>" + b"x" * 2000, "text/html; charset=utf-8"))
+        self.assertEqual(other_worker.stats["shared_hits"], 1)
+        # 第二次从本进程LRU命中
+        other_worker.get(digest)
+        self.assertEqual(other_worker.stats["hits"], 1)
+        print("✅ 其他工作进程从共享层获取内容")
+    
+    def test_evicted_blob_recovered_from_shared_layer(self):
+        """测试进程内淘汰后仍可从共享层取回"""
+        store = BlobStore(max_bytes=3000, shared=InProcessBroker())
+        first = store.put(b"a" * 2000, "text/plain")
+        store.put(b"b" * 2000, "text/plain")
+        self.assertEqual(store.stats["evicted"], 1)
+        self.assertEqual(store.get(first)[0], b"a" * 2000)
+    
+    def test_blobs_referenced_by_live_buffer_are_not_evicted(self):
+        """测试被回放缓冲引用的内容在缓冲存活期间不被LRU淘汰"""
+        store = BlobStore(max_bytes=3000)
+        externalizer = PayloadExternalizer(store, threshold_bytes=1024)
+        buffer = StreamReplayBuffer("run1", "s1", max_events=100, max_bytes=1024 * 1024)
+        
+        ref = externalizer.externalize({"output": "a" * 2000}, owner=buffer)["output"]
+        digest = ref["$ref"][7:]
+        unpinned = store.put(b"b" * 2000, "text/plain")
+        store.put(b"c" * 2000, "text/plain")
+        self.assertIsNotNone(store.get(digest))
+        self.assertIsNone(store.get(unpinned))
+        self.assertEqual(store.get_metrics()["pinned"], 1)
+        
+        # 缓冲被回收后内容恢复为普通LRU项
+        del buffer
+        gc.collect()
+        store.put(b"d" * 2000, "text/plain")
+        self.assertIsNone(store.get(digest))
+        print("✅ 回放缓冲存活期间引用的内容不被淘汰")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+检查点读缓存单元测试
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langgraph.checkpoint.base import CheckpointTuple, empty_checkpoint
+    from app.core.checkpoint_cache import CachedCheckpointer, create_cached_checkpointer
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过检查点读缓存测试: {e}")
+
+
+class _FakeSaver:
+    """内存中的检查点器，可以让读取停在返回结果之前"""
+
+    serde = None
+    config_specs = []
+
+    def __init__(self):
+        self.latest = {}
+        self.reads = 0
+        self.read_started = threading.Event()
+        self.release_read = None
+
+    def _tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_id = self.latest.get(thread_id)
+        if checkpoint_id is None:
+            return None
+        checkpoint = empty_checkpoint()
+        checkpoint["id"] = checkpoint_id
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": "", "checkpoint_id": checkpoint_id}},
+            checkpoint=checkpoint,
+            metadata={},
+            parent_config=None,
+            pending_writes=[]
+        )
+
+    def get_tuple(self, config):
+        self.reads += 1
+        result = self._tuple(config)
+        if self.release_read is not None:
+            self.read_started.set()
+            self.release_read.wait(5)
+        return result
+
+    async def aget_tuple(self, config):
+        self.reads += 1
+        result = self._tuple(config)
+        if self.release_read is not None:
+            self.read_started.set()
+            while not self.release_read.is_set():
+                await asyncio.sleep(0.01)
+        return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self.latest[config["configurable"]["thread_id"]] = checkpoint["id"]
+        return config
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+
+def _checkpoint(checkpoint_id):
+    checkpoint = empty_checkpoint()
+    checkpoint["id"] = checkpoint_id
+    return checkpoint
+
+
+class TestCachedCheckpointer(unittest.TestCase):
+    """测试最新检查点缓存"""
+
+    def setUp(self):
+        self.inner = _FakeSaver()
+        self.inner.latest["t1"] = "c1"
+        self.cache = CachedCheckpointer(self.inner, max_threads=10, ttl_seconds=None)
+
+    def _checkpoint_id(self, checkpoint_tuple):
+        return checkpoint_tuple.checkpoint["id"]
+
+    def test_hit_and_invalidation_on_put(self):
+        """测试命中缓存，put后重新读取"""
+        self.assertEqual(self._checkpoint_id(self.cache.get_tuple(_config("t1"))), "c1")
+        self.assertEqual(self._checkpoint_id(self.cache.get_tuple(_config("t1"))), "c1")
+        self.assertEqual(self.inner.reads, 1)
+
+        self.cache.put(_config("t1"), _checkpoint("c2"), {}, {})
+        self.assertEqual(self._checkpoint_id(self.cache.get_tuple(_config("t1"))), "c2")
+        self.assertEqual(self.inner.reads, 2)
+        print("✅ 缓存命中与写入失效正常")
+
+    def test_load_racing_with_put_is_not_cached(self):
+        """测试读取期间发生put时，读到的旧检查点不放入缓存"""
+        self.inner.release_read = threading.Event()
+        results = []
+        reader = threading.Thread(target=lambda: results.append(self.cache.get_tuple(_config("t1"))))
+        reader.start()
+        self.assertTrue(self.inner.read_started.wait(5))
+
+        # 读取已拿到c1但尚未返回，此时写入c2
+        self.cache.put(_config("t1"), _checkpoint("c2"), {}, {})
+        self.inner.release_read.set()
+        reader.join(5)
+        self.assertEqual(self._checkpoint_id(results[0]), "c1")
+
+        self.inner.release_read = None
+        self.assertEqual(self._checkpoint_id(self.cache.get_tuple(_config("t1"))), "c2")
+        self.assertEqual(self.cache.get_metrics()["stale_loads_dropped"], 1)
+        print("✅ 与写入竞争的读取结果不进入缓存")
+
+    def test_async_load_racing_with_put_is_not_cached(self):
+        """测试异步读取期间发生put时，读到的旧检查点不放入缓存"""
+        async def scenario():
+            self.inner.release_read = threading.Event()
+            reader = asyncio.ensure_future(self.cache.aget_tuple(_config("t1")))
+            while not self.inner.read_started.is_set():
+                await asyncio.sleep(0.01)
+            self.cache.put(_config("t1"), _checkpoint("c2"), {}, {})
+            self.inner.release_read.set()
+            stale = await reader
+            self.inner.release_read = None
+            return stale, await self.cache.aget_tuple(_config("t1"))
+
+        stale, latest = asyncio.run(scenario())
+        self.assertEqual(self._checkpoint_id(stale), "c1")
+        self.assertEqual(self._checkpoint_id(latest), "c2")
+        print("✅ 异步读取与写入竞争时不缓存旧结果")
+
+    def test_evicted_generation_still_rejects_stale_load(self):
+        """测试失效代数记录被淘汰后，读取期间发生的失效仍然生效"""
+        cache = CachedCheckpointer(self.inner, max_threads=1, ttl_seconds=None)
+        self.inner.release_read = threading.Event()
+        reader = threading.Thread(target=lambda: cache.get_tuple(_config("t1")))
+        reader.start()
+        self.assertTrue(self.inner.read_started.wait(5))
+
+        cache.put(_config("t1"), _checkpoint("c2"), {}, {})
+        cache.invalidate("t2")
+        self.inner.release_read.set()
+        reader.join(5)
+
+        self.assertEqual(cache.get_metrics()["cached_threads"], 0)
+        self.assertEqual(cache.get_metrics()["stale_loads_dropped"], 1)
+        print("✅ 代数记录淘汰后仍拒绝旧结果")
+
+
+class TestCreateCachedCheckpointer(unittest.TestCase):
+    """测试缓存包装的创建"""
+
+    def test_wraps_database_checkpointer(self):
+        self.assertIsInstance(create_cached_checkpointer(_FakeSaver()), CachedCheckpointer)
+
+    def test_shared_state_bypasses_cache(self):
+        """测试启用跨进程共享状态时不使用进程内缓存"""
+        inner = _FakeSaver()
+        self.assertIs(create_cached_checkpointer(inner, {"enabled": True}, {"enabled": True}), inner)
+        print("✅ 启用共享状态时不使用检查点缓存")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
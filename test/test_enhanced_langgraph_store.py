@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+增强LangGraph记忆存储单元测试
+"""
+
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.memory import enhanced_langgraph_store
+    from app.core.memory.enhanced_langgraph_store import EnhancedLangGraphMemoryStore
+    from app.core.memory.memory_write_queue import MemoryWriteRequest
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过增强记忆存储测试: {e}")
+
+
+class _OfflineVectorStore:
+    """不连接Elasticsearch的向量存储"""
+    
+    def __init__(self, *args, **kwargs):
+        self.es = None
+        self.encoder = None
+    
+    def add_memory(self, memory):
+        return False
+    
+    def add_memories(self, memories):
+        return 0
+    
+    def search_similar(self, *args, **kwargs):
+        return []
+
+
+class TestEnhancedMemoryStoreConcurrency(unittest.TestCase):
+    """测试后台批量写入与读取并发"""
+    
+    def setUp(self):
+        patcher = mock.patch.object(
+            enhanced_langgraph_store, "ElasticsearchVectorStore", _OfflineVectorStore
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = EnhancedLangGraphMemoryStore({})
+    
+    def _requests(self, batch, size=20):
+        return [
+            MemoryWriteRequest(
+                user_id="u1",
+                agent_role="geophysics_agent",
+                content=f"批次{batch}的孔隙度分析{i}",
+                memory_type="semantic"
+            )
+            for i in range(size)
+        ]
+    
+    def test_bulk_writes_with_concurrent_readers(self):
+        """测试批量写入时读取方遍历不抛出字典大小变化错误"""
+        errors = []
+        done = threading.Event()
+        
+        def writer():
+            try:
+                for batch in range(50):
+                    self.store.put_agent_memories_bulk(self._requests(batch))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+        
+        def reader():
+            try:
+                while not done.is_set():
+                    self.store.get_agent_memory_statistics("u1", "geophysics_agent")
+                    self.store.search(("u1",), "孔隙度")
+                    self.store.cleanup_agent_memories("u1", "geophysics_agent", min_importance=0.0)
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.store.memories), 50 * 20)
+        self.assertEqual(len(self.store.enhanced_memories), 50 * 20)
+        print("✅ 批量写入与并发读取测试通过")
+    
+    def test_bulk_write_updates_both_caches(self):
+        """测试批量写入同时更新两份缓存"""
+        requests = self._requests(0, size=3)
+        self.assertEqual(self.store.put_agent_memories_bulk(requests), 3)
+        
+        for request in requests:
+            keys = [key for key in self.store.enhanced_memories if key.endswith(request.memory_id)]
+            self.assertEqual(len(keys), 1)
+            self.assertIn(keys[0], self.store.memories)
+        print("✅ 批量写入缓存测试通过")
+
+
+
+class _PartialVectorStore(_OfflineVectorStore):
+    """已配置Elasticsearch、但批量索引只成功一部分的向量存储"""
+    
+    def __init__(self, *args, **kwargs):
+        self.es = object()
+        self.encoder = object()
+        self.indexed = 0
+    
+    def add_memories(self, memories):
+        return self.indexed
+
+
+class TestBulkWriteResult(unittest.TestCase):
+    """测试批量写入返回实际索引数量"""
+    
+    def setUp(self):
+        patcher = mock.patch.object(
+            enhanced_langgraph_store, "ElasticsearchVectorStore", _PartialVectorStore
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = EnhancedLangGraphMemoryStore({})
+    
+    def _requests(self, size):
+        return [
+            MemoryWriteRequest(user_id="u1", agent_role="geophysics_agent", content=f"渗透率记录{i}")
+            for i in range(size)
+        ]
+    
+    def test_returns_indexed_count(self):
+        self.store.vector_store.indexed = 2
+        self.assertEqual(self.store.put_agent_memories_bulk(self._requests(5)), 2)
+        self.store.vector_store.indexed = 0
+        self.assertEqual(self.store.put_agent_memories_bulk(self._requests(3)), 0)
+        self.assertEqual(self.store.put_agent_memories_bulk([]), 0)
+        print("✅ 批量写入返回实际索引数量")
+    
+    def test_index_failures_counted_by_write_queue(self):
+        """测试索引失败计入写后队列的failed指标"""
+        from app.core.memory.memory_write_queue import MemoryWriteBehindQueue
+        self.store.vector_store.indexed = 0
+        queue = MemoryWriteBehindQueue(self.store, batch_size=10, flush_interval=0.01)
+        try:
+            for request in self._requests(4):
+                queue.submit(request)
+            self.assertTrue(queue.flush(timeout=5))
+            metrics = queue.get_metrics()
+            self.assertEqual((metrics["written"], metrics["failed"]), (0, 4))
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+文件索引汇总单元测试
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.file_manager import FileIndexSummary
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过文件索引汇总测试: {e}")
+
+
+def file_info(session_id, file_name, size, upload_time, source="upload"):
+    return {
+        "session_id": session_id,
+        "file_name": file_name,
+        "size": size,
+        "upload_time": upload_time,
+        "source": source
+    }
+
+
+class TestFileIndexSummary(unittest.TestCase):
+    """测试文件登记/删除时增量维护的统计"""
+    
+    def setUp(self):
+        self.summary = FileIndexSummary()
+        self.summary.add("f1", file_info("s1", "well.las", 100, "2025-03-01T08:00:00"))
+        self.summary.add("f2", file_info("s1", "report.html", 50, "2025-03-02 09:00:00", source="generated"))
+        self.summary.add("f3", file_info("s2", "core.LAS", 30, "2025-03-02T10:00:00"))
+        # 未关联会话的文件不计入
+        self.summary.add("f4", file_info(None, "temp.csv", 999, "2025-03-02T11:00:00"))
+    
+    def test_totals_by_scope(self):
+        overall = self.summary.snapshot(today=date(2025, 3, 2))
+        self.assertEqual(overall["total_files"], 3)
+        self.assertEqual(overall["total_size"], 180)
+        self.assertEqual(overall["file_types"], {"las": 2, "html": 1})
+        self.assertEqual((overall["uploaded_today"], overall["generated_today"]), (1, 1))
+        self.assertEqual(overall["earliest_upload"], "2025-03-01T08:00:00")
+        self.assertEqual(overall["latest_upload"], "2025-03-02T10:00:00")
+        
+        session = self.summary.snapshot("s1", today=date(2025, 3, 1))
+        self.assertEqual((session["total_files"], session["total_size"], session["uploaded_today"]), (2, 150, 1))
+        self.assertEqual(self.summary.snapshot("missing")["total_files"], 0)
+        print("✅ 文件汇总按会话与全局维护")
+    
+    def test_remove_and_reassign(self):
+        """测试删除边界文件后重新计算时间范围，改关联会话后按新会话计入"""
+        self.assertEqual(self.summary.remove("f1"), "s1")
+        overall = self.summary.snapshot(today=date(2025, 3, 2))
+        self.assertEqual((overall["total_files"], overall["total_size"]), (2, 80))
+        self.assertEqual(overall["earliest_upload"], "2025-03-02T09:00:00")
+        
+        self.summary.add("f3", file_info("s1", "core.LAS", 30, "2025-03-02T10:00:00"))
+        self.assertEqual(self.summary.snapshot("s2")["total_files"], 0)
+        self.assertEqual(self.summary.snapshot("s1")["file_types"], {"html": 1, "las": 1})
+        self.assertEqual(self.summary.snapshot()["total_files"], 2)
+        
+        self.assertIsNone(self.summary.remove("f1"))
+        print("✅ 删除与重新关联后汇总保持一致")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+对话历史压缩单元测试
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+    from app.core.memory.history_manager import HistoryManager, HISTORY_SUMMARY_MESSAGE_ID
+    from app.core.memory.token_counter import count_message_tokens, count_tokens, MESSAGE_OVERHEAD_TOKENS
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过历史压缩测试: {e}")
+
+
+class TestHistoryCompaction(unittest.TestCase):
+    """测试基于token预算的增量历史压缩"""
+    
+    def _build_messages(self, turns: int, start: int = 0):
+        messages = [SystemMessage(content="系统提示", id="system_prompt")]
+        for i in range(start, start + turns):
+            messages.append(HumanMessage(content=f"第{i}个问题：" + "同位素分析" * 20, id=f"h{i}"))
+            messages.append(AIMessage(content=f"第{i}个回答：" + "碳同位素特征" * 20, id=f"a{i}"))
+        return messages
+    
+    def test_under_budget_is_noop(self):
+        """测试未超出预算时不压缩"""
+        messages = self._build_messages(2)
+        result = HistoryManager.compact_history(messages, llm=None, max_tokens=100000)
+        self.assertFalse(result.compacted)
+        self.assertIs(result.messages, messages)
+        print("✅ 预算内不压缩")
+    
+    def test_compaction_evicts_oldest_and_keeps_summary(self):
+        """测试超出预算时驱逐最旧消息并生成单条摘要"""
+        messages = self._build_messages(10)
+        result = HistoryManager.compact_history(
+            messages, llm=None, max_tokens=500, target_tokens=300, keep_last_n=4
+        )
+        self.assertTrue(result.compacted)
+        self.assertLessEqual(result.tokens_after, result.tokens_before)
+        self.assertEqual(result.messages[0].id, "system_prompt")
+        self.assertEqual(result.messages[1].id, HISTORY_SUMMARY_MESSAGE_ID)
+        self.assertEqual([m.id for m in result.messages[-4:]], ["h8", "a8", "h9", "a9"])
+        self.assertIn("h0", result.evicted_ids)
+        
+        # 再次压缩时复用同一条摘要消息
+        again = HistoryManager.compact_history(
+            result.messages + self._build_messages(10, start=10)[1:], llm=None,
+            running_summary=result.summary, max_tokens=500, target_tokens=300
+        )
+        summary_ids = [m.id for m in again.messages if m.id == HISTORY_SUMMARY_MESSAGE_ID]
+        self.assertEqual(len(summary_ids), 1)
+        print("✅ 历史增量压缩成功")
+    
+    def _build_tool_call_messages(self):
+        filler = "同位素分析" * 20
+        return [
+            SystemMessage(content="系统提示", id="system_prompt"),
+            HumanMessage(content="问题一：" + filler, id="h0"),
+            AIMessage(
+                content="",
+                id="a0",
+                tool_calls=[
+                    {"name": "query_data", "args": {"well": "W1"}, "id": "call_1"},
+                    {"name": "query_data", "args": {"well": "W2"}, "id": "call_2"},
+                ],
+            ),
+            ToolMessage(content="W1结果：" + filler, tool_call_id="call_1", id="t1"),
+            ToolMessage(content="W2结果：" + filler, tool_call_id="call_2", id="t2"),
+            AIMessage(content="回答一：" + filler, id="a1"),
+            HumanMessage(content="问题二：" + filler, id="h1"),
+            AIMessage(content="回答二：" + filler, id="a2"),
+        ]
+    
+    def test_tool_call_group_evicted_as_unit(self):
+        """测试带tool_calls的AI消息与其ToolMessage回复一起驱逐"""
+        messages = self._build_tool_call_messages()
+        # 目标只需驱逐h0与a0即可达成，但a0的工具结果必须随之驱逐
+        target = sum(count_message_tokens(m) for m in messages) - count_message_tokens(messages[1]) - 1
+        result = HistoryManager.compact_history(
+            messages, llm=None, max_tokens=1, target_tokens=target, keep_last_n=3
+        )
+        self.assertTrue(result.compacted)
+        kept_ids = [m.id for m in result.messages]
+        self.assertEqual(result.evicted_ids, ["h0", "a0", "t1", "t2"])
+        self.assertEqual(kept_ids, ["system_prompt", HISTORY_SUMMARY_MESSAGE_ID, "a1", "h1", "a2"])
+        print("✅ 工具调用组整体驱逐")
+    
+    def test_tool_call_group_crossing_keep_boundary_is_kept(self):
+        """测试工具调用组跨入保留区时整组保留，不留下孤立的ToolMessage"""
+        messages = self._build_tool_call_messages()[:5]
+        # 保留区只覆盖t1、t2，a0不能单独驱逐
+        result = HistoryManager.compact_history(
+            messages, llm=None, max_tokens=1, target_tokens=1, keep_last_n=2
+        )
+        kept_ids = [m.id for m in result.messages]
+        self.assertEqual(result.evicted_ids, ["h0"])
+        self.assertEqual(kept_ids[-3:], ["a0", "t1", "t2"])
+        for position, msg in enumerate(result.messages):
+            if isinstance(msg, ToolMessage):
+                self.assertIsInstance(result.messages[position - 1], (AIMessage, ToolMessage))
+        print("✅ 跨保留边界的工具调用组完整保留")
+
+
+class TestMessageTokenCache(unittest.TestCase):
+    """测试消息token数缓存"""
+    
+    def test_same_length_rewrite_is_not_stale(self):
+        """测试同ID、同长度但内容不同的消息不会命中旧缓存"""
+        first = AIMessage(content="a" * 40, id="cache_stale_check")
+        second = AIMessage(content="碳" * 40, id="cache_stale_check")
+        self.assertEqual(len(first.content), len(second.content))
+        self.assertEqual(count_message_tokens(first), count_tokens(first.content) + MESSAGE_OVERHEAD_TOKENS)
+        self.assertEqual(count_message_tokens(second), count_tokens(second.content) + MESSAGE_OVERHEAD_TOKENS)
+        print("✅ 内容改写后缓存失效")
+    
+    def test_concurrent_counting(self):
+        """测试多线程并发计数时缓存不出错且结果一致"""
+        messages = [
+            HumanMessage(content=f"并发消息{i}：" + "同位素" * (i % 7 + 1), id=f"concurrent_{i % 50}_{i % 7}")
+            for i in range(400)
+        ]
+        expected = [count_tokens(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages]
+        errors = []
+        
+        def worker():
+            try:
+                for _ in range(20):
+                    if [count_message_tokens(m) for m in messages] != expected:
+                        errors.append("mismatch")
+                        return
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        print("✅ 并发计数结果一致")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+会话历史游标分页单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage
+    from app.core.conversation_turn_manager import ConversationTurnManager
+    from app.core.session_working_set import SessionWorkingSet, build_catalog_entry
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过历史分页测试: {e}")
+
+
+class TestSessionHistoryPage(unittest.TestCase):
+    """测试引擎的历史分页（轮次记录与状态消息两个序号空间）"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from app.core.engine import IsotopeEngine
+        except ImportError as e:
+            raise unittest.SkipTest(f"依赖不可用，跳过引擎历史分页测试: {e}")
+        cls.engine_class = IsotopeEngine
+
+    def setUp(self):
+        # 状态中10条消息，轮次管理器中只有4条对话记录
+        self.session = {
+            "state": {"messages": [
+                (HumanMessage if i % 2 == 0 else AIMessage)(content=f"消息{i}", id=f"m{i}")
+                for i in range(10)
+            ]},
+            "created_at": "2024-01-01T12:00:00",
+            "last_updated": "2024-01-01T12:05:00",
+            "metadata": {}
+        }
+        self.engine = self.engine_class.__new__(self.engine_class)
+        self.engine.sessions = SessionWorkingSet(loader=lambda session_id: self.session if session_id == "s1" else None)
+        self.engine.sessions.register("s1", build_catalog_entry(self.session))
+        self.engine.turn_managers = {}
+        self.engine.session_persistence_enabled = False
+        self.engine.postgres_session_manager = None
+
+    def add_turns(self, count):
+        manager = ConversationTurnManager(session_id="s1")
+        for i in range(count):
+            manager.start_user_turn(f"轮次{i}")
+        self.engine.turn_managers["s1"] = manager
+
+    def contents(self, page):
+        return [msg["content"] for msg in page["messages"]]
+
+    def test_pages_state_messages(self):
+        page = self.engine.get_session_history_page("s1", limit=4)
+        self.assertEqual((page["source"], page["start"], page["end"], page["total"]), ("messages", 6, 10, 10))
+
+        previous = self.engine.get_session_history_page("s1", limit=4, before=page["start"], source=page["source"])
+        self.assertEqual(self.contents(previous), ["消息2", "消息3", "消息4", "消息5"])
+        self.assertFalse(previous["cursor_reset"])
+        print("✅ 状态消息分页正常")
+
+    def test_cursor_from_other_source_is_reset(self):
+        """测试游标来自另一个序号空间时不在当前空间中使用"""
+        self.add_turns(4)
+        page = self.engine.get_session_history_page("s1", limit=2)
+        self.assertEqual((page["source"], page["start"], page["total"]), ("turns", 2, 4))
+
+        # 轮次管理器不在本进程（如请求落到其他工作进程）时，turns空间的游标被忽略
+        del self.engine.turn_managers["s1"]
+        next_page = self.engine.get_session_history_page("s1", limit=2, before=page["start"], source=page["source"])
+        self.assertTrue(next_page["cursor_reset"])
+        self.assertEqual(next_page["source"], "messages")
+        self.assertEqual(self.contents(next_page), ["消息8", "消息9"])
+        print("✅ 其他序号空间的游标被重置")
+
+    def test_explicit_messages_source_with_turns_present(self):
+        """测试轮次记录存在时仍可按状态消息空间翻页"""
+        self.add_turns(4)
+        page = self.engine.get_session_history_page("s1", limit=3, before=5, source="messages")
+        self.assertEqual(page["source"], "messages")
+        self.assertEqual(self.contents(page), ["消息2", "消息3", "消息4"])
+        self.assertFalse(page["cursor_reset"])
+
+    def test_etag_depends_on_source(self):
+        """测试同样的游标在不同序号空间下ETag不同，304不会跨空间复用"""
+        self.add_turns(4)
+        turns_page = self.engine.get_session_history_page("s1", limit=2)
+        messages_page = self.engine.get_session_history_page("s1", limit=2, source="messages")
+        self.assertNotEqual(turns_page["etag"], messages_page["etag"])
+
+        cached = self.engine.get_session_history_page("s1", limit=2, if_none_match=turns_page["etag"])
+        self.assertTrue(cached["not_modified"])
+        del self.engine.turn_managers["s1"]
+        fresh = self.engine.get_session_history_page("s1", limit=2, if_none_match=turns_page["etag"])
+        self.assertFalse(fresh["not_modified"])
+        print("✅ ETag包含序号空间")
+
+    def test_invalid_source(self):
+        with self.assertRaises(ValueError):
+            self.engine.get_session_history_page("s1", source="unknown")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -14,6 +14,7 @@ import os
 import sys
 import tempfile
 import shutil
+import threading
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
@@ -332,6 +333,66 @@ class TestDynamicPromptManager(unittest.TestCase):
         
         self.assertIsInstance(result, GeneratedPrompt)
         print("✅ 生成动态Prompt成功")
+    
+    def test_section_cache_reused_on_repeat(self):
+        """测试输入不变时复用片段与优化结果缓存"""
+        memory_result = create_sample_filtered_result()
+        context = PromptContext(current_task="测试任务")
+        
+        first = self.manager.generate_dynamic_prompt(
+            "geophysics_analysis", "基础prompt", memory_result, context
+        )
+        second = self.manager.generate_dynamic_prompt(
+            "geophysics_analysis", "基础prompt", memory_result, context
+        )
+        
+        self.assertEqual(first.full_prompt, second.full_prompt)
+        self.assertEqual(first.confidence_score, second.confidence_score)
+        cache_stats = self.manager.get_cache_statistics()["sections"]
+        self.assertGreater(cache_stats["system_identity"]["hits"], 0)
+        self.assertEqual(cache_stats["optimization"]["hits"], 1)
+        
+        # 任务变化只重建task_context
+        self.manager.generate_dynamic_prompt(
+            "geophysics_analysis", "基础prompt", memory_result,
+            PromptContext(current_task="新任务")
+        )
+        cache_stats = self.manager.get_cache_statistics()["sections"]
+        self.assertEqual(cache_stats["task_context"]["misses"], 2)
+        self.assertEqual(cache_stats["system_identity"]["misses"], 1)
+        print("✅ Prompt片段缓存命中正常")
+    
+    def test_caches_consistent_under_concurrent_generation(self):
+        """测试多线程并发生成时缓存与命中统计保持一致"""
+        memory_result = create_sample_filtered_result()
+        self.manager._section_cache.max_size = 4
+        self.manager._optimization_cache.max_size = 2
+        errors = []
+        rounds = 15
+        
+        def worker(index: int):
+            try:
+                for i in range(rounds):
+                    self.manager.generate_dynamic_prompt(
+                        "geophysics_analysis", "基础prompt", memory_result,
+                        PromptContext(current_task=f"任务{(index + i) % 5}")
+                    )
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        statistics = self.manager.get_cache_statistics()
+        self.assertLessEqual(statistics["section_cache_size"], 4)
+        self.assertLessEqual(statistics["optimization_cache_size"], 2)
+        task_stats = statistics["sections"]["task_context"]
+        self.assertEqual(task_stats["hits"] + task_stats["misses"], 6 * rounds)
+        print("✅ 并发生成时缓存一致")
 
 class TestMemoryRelevanceScorer(unittest.TestCase):
     """测试记忆相关性评分器"""
@@ -395,6 +456,41 @@ class TestPromptLengthController(unittest.TestCase):
             print("✅ Prompt长度控制成功")
         except Exception as e:
             print(f"⚠️ Prompt长度控制测试失败: {e}")
+    
+    def test_token_budget_selection(self):
+        """测试按token预算选择各部分压缩版本"""
+        sections = {
+            PromptSection.SYSTEM_IDENTITY: "你是一个专业的地球物理分析专家。",
+            PromptSection.MEMORY_SECTION: "\n".join(
+                f"- 记忆{i}：储层孔隙度分析结论。第二句。第三句。第四句。" for i in range(20)
+            ),
+            PromptSection.EXAMPLES: "示例内容" * 100
+        }
+        full_prompt = self.controller._reassemble_prompt(sections)
+        generated_prompt = GeneratedPrompt(
+            full_prompt=full_prompt,
+            sections=sections,
+            metadata={},
+            memory_integration_info={},
+            optimization_applied=[],
+            estimated_tokens=0,
+            confidence_score=0.8
+        )
+        
+        controlled_prompt, compression_result = self.controller.control_prompt_length(
+            generated_prompt=generated_prompt,
+            constraint=LengthConstraint(max_total_tokens=200),
+            memory_result=create_sample_filtered_result()
+        )
+        
+        self.assertLessEqual(compression_result.compressed_tokens, 200)
+        self.assertGreater(compression_result.original_tokens, 200)
+        self.assertEqual(
+            controlled_prompt.sections[PromptSection.SYSTEM_IDENTITY],
+            sections[PromptSection.SYSTEM_IDENTITY]
+        )
+        self.assertEqual(controlled_prompt.estimated_tokens, compression_result.compressed_tokens)
+        print("✅ Token预算内的部分选择正常")
 
 class TestMemoryUsageMonitor(unittest.TestCase):
     """测试记忆使用监控器"""
@@ -439,6 +535,30 @@ class TestMemoryUsageMonitor(unittest.TestCase):
         
         self.assertIsInstance(metrics, AgentMetrics)
         print("✅ 获取智能体指标成功")
+    
+    def test_report_reads_rollups_with_bounded_events(self):
+        """测试原始事件有界且报告基于汇总统计"""
+        monitor = MemoryUsageMonitor({"event_capacity": 5})
+        memory = create_sample_memory_entry()
+        for i in range(20):
+            monitor.record_memory_usage(
+                session_id=f"session_{i % 2}",
+                agent_role="geophysics_analysis",
+                memory=memory,
+                event_type="access",
+                context={},
+                relevance_score=0.8,
+                usage_result={"success": i % 2 == 0}
+            )
+        
+        self.assertEqual(len(monitor.usage_events), 5)
+        report = monitor.generate_performance_report()
+        metrics = report.agent_metrics["geophysics_analysis"]
+        self.assertEqual(metrics.total_memory_accesses, 20)
+        self.assertAlmostEqual(metrics.memory_hit_rate, 0.5)
+        self.assertAlmostEqual(report.overall_statistics["average_relevance"], 0.8)
+        self.assertEqual(report.overall_statistics["unique_sessions"], 2)
+        print("✅ 记忆使用汇总统计正常")
 
 class TestAdaptiveMemoryOptimizer(unittest.TestCase):
     """测试自适应记忆优化器"""
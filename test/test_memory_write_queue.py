@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+记忆写后队列单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.memory.memory_write_queue import MemoryWriteBehindQueue, MemoryWriteRequest
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过记忆写后队列测试: {e}")
+
+
+class TestMemoryWriteBehindQueue(unittest.TestCase):
+    """测试记忆写后队列"""
+    
+    class _FakeStore:
+        def __init__(self):
+            self.batches = []
+        
+        def put_agent_memories_bulk(self, requests):
+            self.batches.append(list(requests))
+            return len(requests)
+    
+    def setUp(self):
+        self.store = self._FakeStore()
+        self.queue = MemoryWriteBehindQueue(self.store, batch_size=8, flush_interval=0.05)
+    
+    def tearDown(self):
+        self.queue.close()
+    
+    def test_submit_returns_preassigned_id(self):
+        """测试入队立即返回预分配ID"""
+        request = MemoryWriteRequest(user_id="u1", agent_role="system", content="测试记忆内容")
+        memory_id = self.queue.submit(request)
+        self.assertEqual(memory_id, request.memory_id)
+        print("✅ 写后队列入队成功")
+    
+    def test_flush_writes_in_batches(self):
+        """测试刷新后请求被批量写入"""
+        for i in range(20):
+            self.queue.submit(MemoryWriteRequest(user_id="u1", agent_role="system", content=f"记忆 {i}"))
+        self.assertTrue(self.queue.flush(timeout=5))
+        
+        written = sum(len(batch) for batch in self.store.batches)
+        self.assertEqual(written, 20)
+        self.assertTrue(all(len(batch) <= 8 for batch in self.store.batches))
+        
+        metrics = self.queue.get_metrics()
+        self.assertEqual(metrics['written'], 20)
+        self.assertEqual(metrics['queue_depth'], 0)
+        print("✅ 写后队列批量写入成功")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL会话管理器单元测试
+
+连接池测试使用内存中的假连接池，不需要数据库；消息窗口和会话列表测试需要真实数据库，
+通过环境变量ISOTOPE_TEST_POSTGRES_DSN指定（测试创建临时数据库，结束后删除，未设置时跳过）。
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.postgres_session_manager import PostgreSQLSessionManager, PSYCOPG2_AVAILABLE
+    import psycopg2
+    from psycopg2.pool import PoolError
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过PostgreSQL会话管理器测试: {e}")
+
+if not PSYCOPG2_AVAILABLE:
+    raise unittest.SkipTest("psycopg2不可用，跳过PostgreSQL会话管理器测试")
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.autocommit = False
+    
+    def cursor(self, cursor_factory=None):
+        return _FakeCursor(self)
+
+
+class _FakePool:
+    """与ThreadedConnectionPool行为一致：超出maxconn时getconn抛出PoolError"""
+    
+    def __init__(self, maxconn):
+        self.maxconn = maxconn
+        self.closed = False
+        self.in_use = set()
+        self.idle = []
+        self.created = 0
+        self.lock = threading.Lock()
+    
+    def getconn(self):
+        with self.lock:
+            if len(self.in_use) >= self.maxconn:
+                raise PoolError("connection pool exhausted")
+            conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                conn = _FakeConnection()
+                self.created += 1
+            self.in_use.add(conn)
+            return conn
+    
+    def putconn(self, conn, close=False):
+        with self.lock:
+            self.in_use.discard(conn)
+            if close:
+                conn.closed = 1
+            else:
+                self.idle.append(conn)
+
+
+class _Config:
+    def __init__(self, **overrides):
+        self.postgres = {"pool_max_size": 2, "pool_timeout": 2, "stale_timeout": 0, **overrides}
+    
+    def get_postgresql_config(self):
+        return self.postgres
+
+
+class TestConnectionPoolCheckout(unittest.TestCase):
+    """测试连接借出"""
+    
+    def make_manager(self, **overrides):
+        with mock.patch.object(PostgreSQLSessionManager, "_init_database", lambda self: None):
+            manager = PostgreSQLSessionManager(_Config(**overrides))
+        manager._pool = _FakePool(manager._pool_max_size)
+        return manager
+    
+    def hold_connections(self, manager, count, release):
+        acquired = threading.Barrier(count + 1)
+        
+        def hold():
+            with manager._connection_scope():
+                acquired.wait(5)
+                release.wait(5)
+        
+        threads = [threading.Thread(target=hold) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        acquired.wait(5)
+        return threads
+    
+    def test_exhausted_pool_waits_for_release(self):
+        """测试连接池耗尽时借出阻塞等待，而不是立即抛出PoolError"""
+        manager = self.make_manager()
+        release = threading.Event()
+        holders = self.hold_connections(manager, 2, release)
+        
+        threading.Timer(0.2, release.set).start()
+        start = time.time()
+        with manager._connection_scope() as conn:
+            self.assertFalse(conn.closed)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        
+        for thread in holders:
+            thread.join(5)
+        stats = manager.get_pool_statistics()
+        self.assertEqual(stats["waits"], 1)
+        self.assertEqual(stats["in_use"], 0)
+        print("✅ 连接池耗尽等待测试通过")
+    
+    def test_exhausted_pool_times_out(self):
+        """测试等待超过pool_timeout后抛出PoolError并归还名额"""
+        manager = self.make_manager(pool_timeout=0.1)
+        release = threading.Event()
+        holders = self.hold_connections(manager, 2, release)
+        
+        with self.assertRaises(PoolError):
+            with manager._connection_scope():
+                pass
+        release.set()
+        for thread in holders:
+            thread.join(5)
+        
+        self.assertEqual(manager.get_pool_statistics()["timeouts"], 1)
+        with manager._connection_scope():
+            pass
+        print("✅ 连接池等待超时测试通过")
+    
+    def test_dead_connection_is_replaced(self):
+        """测试健康检查失败的连接被关闭并重新建立"""
+        manager = self.make_manager()
+        with manager._connection_scope() as conn:
+            first = conn
+        first.broken = True
+        
+        with manager._connection_scope() as conn:
+            self.assertIsNot(conn, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(manager.get_pool_statistics()["reconnects"], 1)
+        print("✅ 失效连接重建测试通过")
+    
+    def test_connection_error_closes_connection(self):
+        """测试操作中出现连接级错误时连接被关闭而不是放回池中"""
+        manager = self.make_manager()
+        with self.assertRaises(psycopg2.OperationalError):
+            with manager._connection_scope() as conn:
+                broken = conn
+                raise psycopg2.OperationalError("connection reset")
+        
+        self.assertTrue(broken.closed)
+        self.assertNotIn(broken, manager._pool.idle)
+        print("✅ 连接错误关闭测试通过")
+
+
+class _TemporaryDatabaseTestCase(unittest.TestCase):
+    """在临时数据库上创建会话管理器，测试结束后删除数据库"""
+    
+    @classmethod
+    def setUpClass(cls):
+        from psycopg2.extensions import parse_dsn
+        params = parse_dsn(os.environ["ISOTOPE_TEST_POSTGRES_DSN"])
+        cls.database = f"session_test_{uuid.uuid4().hex[:8]}"
+        cls.admin = psycopg2.connect(**params)
+        cls.admin.autocommit = True
+        with cls.admin.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {cls.database}")
+        cls.manager = PostgreSQLSessionManager(_Config(
+            host=params.get("host", "localhost"),
+            port=int(params.get("port", 5432)),
+            user=params.get("user"),
+            password=params.get("password", ""),
+            database=cls.database,
+            pool_max_size=2,
+            session_compact_every=10
+        ))
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.manager._pool.closeall()
+        with cls.admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE {cls.database}")
+        cls.admin.close()
+
+
+@unittest.skipUnless(
+    os.environ.get("ISOTOPE_TEST_POSTGRES_DSN"),
+    "未设置ISOTOPE_TEST_POSTGRES_DSN，跳过PostgreSQL消息窗口测试"
+)
+class TestLoadSessionMessages(_TemporaryDatabaseTestCase):
+    """测试按窗口读取会话消息（快照与增量统一编号，真实数据库）"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 5条快照消息 + 两次增量（3条、4条）
+        cls.messages = [{"type": "human", "content": f"消息{i}", "id": f"m{i}"} for i in range(12)]
+        for count in (5, 8, 12):
+            assert cls.manager.save_session("s1", {"messages": cls.messages[:count]})
+        cls.manager.save_session("empty", {"messages": []})
+    
+    def window(self, **kwargs):
+        page = self.manager.load_session_messages("s1", **kwargs)
+        return page["total"], page["start"], [msg["content"] for msg in page["messages"]]
+    
+    def expected(self, start, end):
+        return [msg["content"] for msg in self.messages[start:end]]
+    
+    def test_snapshot_and_deltas_share_one_index_space(self):
+        with self.manager._cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {self.manager._deltas_table_name} WHERE session_id = 's1'")
+            self.assertEqual(cursor.fetchone()[0], 2)
+        
+        self.assertEqual(self.window(limit=4), (12, 8, self.expected(8, 12)))
+        self.assertEqual(self.window(limit=4, before=8), (12, 4, self.expected(4, 8)))
+        self.assertEqual(self.window(limit=4, before=3), (12, 0, self.expected(0, 3)))
+        self.assertEqual(self.window(limit=3, after=4), (12, 4, self.expected(4, 7)))
+        self.assertEqual(self.window(limit=None, after=6), (12, 6, self.expected(6, 12)))
+        self.assertEqual(self.window(limit=None), (12, 0, self.expected(0, 12)))
+        print("✅ 快照与增量消息统一编号，窗口跨越快照与增量正确")
+    
+    def test_empty_windows(self):
+        self.assertEqual(self.window(limit=5, after=12), (12, 12, []))
+        self.assertEqual(self.window(limit=5, before=0), (12, 0, []))
+        page = self.manager.load_session_messages("empty", limit=5)
+        self.assertEqual((page["total"], page["start"], page["messages"]), (0, 0, []))
+        self.assertIsNone(self.manager.load_session_messages("missing", limit=5))
+        print("✅ 空窗口与不存在的会话处理正确")
+
+
+@unittest.skipUnless(
+    os.environ.get("ISOTOPE_TEST_POSTGRES_DSN"),
+    "未设置ISOTOPE_TEST_POSTGRES_DSN，跳过PostgreSQL会话列表测试"
+)
+class TestListSessions(_TemporaryDatabaseTestCase):
+    """测试会话列表的过滤、排序和分页在数据库中完成（真实数据库）"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        message = {"type": "human", "content": "消息"}
+        cls.manager.save_session("a", {"messages": [message] * 2, "files": {"f1": {}}}, metadata={"name": "储层分析"})
+        cls.manager.save_session("b", {"messages": [message] * 5}, metadata={"name": "沉积模拟"})
+        cls.manager.save_session("c", {"messages": [message] * 3}, metadata={"name": "储层建模"})
+        # 增量中追加的消息计入消息数
+        cls.manager.save_session("c", {"messages": [message] * 7}, metadata={"name": "储层建模"})
+    
+    def ids(self, **kwargs):
+        return [session["session_id"] for session in self.manager.list_sessions(**kwargs)]
+    
+    def test_order_and_paging(self):
+        self.assertEqual(self.ids(order_by="message_count"), ["c", "b", "a"])
+        self.assertEqual(self.ids(order_by="message_count", descending=False, limit=2), ["a", "b"])
+        self.assertEqual(self.ids(order_by="message_count", limit=2, offset=2), ["a"])
+        
+        counts = {s["session_id"]: (s["message_count"], s["file_count"]) for s in self.manager.list_sessions()}
+        self.assertEqual(counts, {"a": (2, 1), "b": (5, 0), "c": (7, 0)})
+        print("✅ 会话列表排序和分页由数据库完成")
+    
+    def test_name_filter(self):
+        self.assertEqual(sorted(self.ids(name_filter="储层")), ["a", "c"])
+        self.assertEqual(self.manager.count_sessions(name_filter="储层"), 2)
+        self.assertEqual(self.manager.count_sessions(), 3)
+        self.assertEqual(self.ids(name_filter="不存在"), [])
+        print("✅ 会话名称过滤由数据库完成")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+后台运行管理器单元测试
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.run_manager import (
+        RunManager, RunQueueFullError, SessionRunActiveError, ToolSlotTimeoutError
+    )
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过运行管理器测试: {e}")
+
+
+class TestRunManager(unittest.TestCase):
+    """测试后台运行调度"""
+    
+    def test_runs_limited_per_resource_class(self):
+        """测试超出并发上限的运行排队，结束后记录耗时和事件"""
+        async def scenario():
+            manager = RunManager({"concurrency": {"llm": 1, "cpu": 1}, "max_queued": 1})
+            release = asyncio.Event()
+            
+            async def producer(buffer):
+                buffer.append("token", 5)
+                await release.wait()
+            
+            first = manager.submit(producer, session_id="s1")
+            await asyncio.sleep(0)
+            second = manager.submit(producer, session_id="s2")
+            await asyncio.sleep(0)
+            self.assertEqual(manager.get_metrics()["running"], 1)
+            self.assertEqual(manager.queue_depth(), 1)
+            with self.assertRaises(RunQueueFullError):
+                manager.submit(producer, session_id="s3")
+            
+            release.set()
+            await asyncio.sleep(0.05)
+            return manager, first, second
+        
+        manager, first, second = asyncio.run(scenario())
+        self.assertEqual((first.status, second.status), ("completed", "completed"))
+        self.assertIsNotNone(second.timings()["run_seconds"])
+        buffer = manager.get_buffer(second.run_id)
+        self.assertTrue(buffer.closed)
+        self.assertEqual(buffer.read_after(0)[0], [(1, "token")])
+        print("✅ 运行按资源类别限流并记录耗时")
+    
+    def test_tool_slot_only_for_configured_categories(self):
+        """测试只有配置的工具分类占用资源槽位"""
+        manager = RunManager({"tool_classes": {"meanderpy": "cpu"}})
+        self.assertEqual(manager.resource_class_for_tool("meanderpy"), "cpu")
+        self.assertIsNone(manager.resource_class_for_tool("file"))
+        with manager.tool_slot("meanderpy"):
+            self.assertEqual(manager.get_metrics()["tools_by_class"]["cpu"]["running"], 1)
+        self.assertEqual(manager.get_metrics()["tools_by_class"]["cpu"]["running"], 0)
+        print("✅ CPU密集型工具按分类限流")
+    
+    def test_one_active_run_per_session(self):
+        """测试同一会话已有未结束的运行时拒绝新运行，结束后可再次提交"""
+        async def scenario():
+            manager = RunManager({"concurrency": {"llm": 1, "cpu": 1}})
+            release = asyncio.Event()
+            
+            async def producer(buffer):
+                await release.wait()
+            
+            # 排队中的运行同样占用会话
+            first = manager.submit(producer, session_id="s1")
+            queued = manager.submit(producer, session_id="s2")
+            with self.assertRaises(SessionRunActiveError) as ctx:
+                manager.submit(producer, session_id="s2")
+            self.assertEqual(ctx.exception.run_id, queued.run_id)
+            self.assertIs(manager.active_run("s1"), first)
+            
+            release.set()
+            await asyncio.sleep(0.05)
+            self.assertIsNone(manager.active_run("s1"))
+            again = manager.submit(producer, session_id="s1")
+            await asyncio.sleep(0.05)
+            return again
+        
+        again = asyncio.run(scenario())
+        self.assertEqual(again.status, "completed")
+        print("✅ 每个会话同时只有一个运行")
+    
+    def test_cancelled_queued_run_releases_session(self):
+        """测试排队中被取消的运行释放会话"""
+        async def scenario():
+            manager = RunManager({"concurrency": {"llm": 1, "cpu": 1}})
+            release = asyncio.Event()
+            
+            async def producer(buffer):
+                await release.wait()
+            
+            manager.submit(producer, session_id="s1")
+            queued = manager.submit(producer, session_id="s2")
+            manager.cancel(queued.run_id)
+            await asyncio.sleep(0.05)
+            self.assertEqual(queued.status, "cancelled")
+            self.assertIsNone(manager.active_run("s2"))
+            release.set()
+        
+        asyncio.run(scenario())
+    
+    def test_tool_slot_wait_times_out(self):
+        """测试工具等待资源槽位超时后失败，不会无限阻塞"""
+        manager = RunManager({
+            "concurrency": {"llm": 1, "cpu": 1},
+            "tool_classes": {"meanderpy": "cpu"},
+            "tool_slot_timeout_seconds": 0.05
+        })
+        holding = threading.Event()
+        release = threading.Event()
+        
+        def hold_slot():
+            with manager.tool_slot("meanderpy"):
+                holding.set()
+                release.wait(5)
+        
+        holder = threading.Thread(target=hold_slot)
+        holder.start()
+        self.assertTrue(holding.wait(5))
+        try:
+            with self.assertRaises(ToolSlotTimeoutError):
+                with manager.tool_slot("meanderpy"):
+                    pass
+        finally:
+            release.set()
+            holder.join(5)
+        
+        usage = manager.get_metrics()["tools_by_class"]["cpu"]
+        self.assertEqual((usage["running"], usage["waiting"], usage["timeouts"]), (0, 0, 1))
+        # 槽位释放后可再次获得
+        with manager.tool_slot("meanderpy"):
+            pass
+        print("✅ 工具等待槽位超时")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+会话增量持久化单元测试
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core import session_delta
+    from app.core.session_delta import SessionDeltaTracker, apply_session_deltas
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过会话增量测试: {e}")
+
+
+def message(index):
+    return {"id": f"msg_{index}", "type": "human", "content": f"第{index}条消息"}
+
+
+class TestSessionDeltaTracker(unittest.TestCase):
+    """测试增量计算与重放"""
+    
+    def setUp(self):
+        self.tracker = SessionDeltaTracker(compact_every=3)
+    
+    def test_untracked_session_requires_snapshot(self):
+        """测试未写过快照的会话需要完整快照"""
+        self.assertIsNone(self.tracker.compute_delta("s1", {"messages": []}))
+        print("✅ 首次保存快照测试通过")
+    
+    def test_delta_contains_only_new_items(self):
+        """测试增量只包含新增消息，重放后与原状态一致"""
+        snapshot = {"messages": [message(0)], "current_task": "a"}
+        self.tracker.mark_snapshot("s1", snapshot, version=1)
+        
+        state = {"messages": [message(0), message(1), message(2)], "current_task": "b"}
+        delta = self.tracker.compute_delta("s1", state)
+        self.assertEqual(delta["version"], 2)
+        self.assertEqual(delta["appends"], {"messages": [message(1), message(2)]})
+        self.tracker.mark_delta("s1", state, delta)
+        
+        replayed = apply_session_deltas({"messages": [message(0)], "current_task": "a"}, [delta])
+        self.assertEqual(replayed["messages"], state["messages"])
+        self.assertEqual(replayed["current_task"], "b")
+        self.assertEqual(self.tracker.get_version("s1"), 2)
+        print("✅ 增量重放测试通过")
+    
+    def test_compaction_after_threshold(self):
+        """测试增量数达到阈值后要求写入快照"""
+        state = {"messages": [message(0)]}
+        self.tracker.mark_snapshot("s1", state, version=1)
+        for index in range(1, 4):
+            state = {"messages": state["messages"] + [message(index)]}
+            delta = self.tracker.compute_delta("s1", state)
+            self.assertIsNotNone(delta)
+            self.tracker.mark_delta("s1", state, delta)
+        
+        self.assertIsNone(self.tracker.compute_delta("s1", {"messages": state["messages"] + [message(9)]}))
+        print("✅ 增量压缩阈值测试通过")
+    
+    def test_rewritten_prefix_requires_snapshot(self):
+        """测试已持久化的消息被改写（历史压缩）时要求写入快照"""
+        self.tracker.mark_snapshot("s1", {"messages": [message(0), message(1)]}, version=1)
+        self.assertIsNone(self.tracker.compute_delta("s1", {"messages": [message(1)]}))
+        print("✅ 前缀改写测试通过")
+    
+    def test_same_length_rewrite_requires_snapshot(self):
+        """测试压缩后消息数不少于已持久化数量时仍能检测到前缀改写"""
+        self.tracker.mark_snapshot("s1", {"messages": [message(0), message(1), message(2)]}, version=1)
+        compacted = {"messages": [message(100), message(2), message(3), message(4)]}
+        self.assertIsNone(self.tracker.compute_delta("s1", compacted))
+        print("✅ 同长度前缀改写测试通过")
+    
+    def test_delta_checks_only_boundary(self):
+        """测试计算增量只对边界元素求指纹，开销不随已持久化消息数增长"""
+        persisted = [message(index) for index in range(2000)]
+        self.tracker.mark_snapshot("s1", {"messages": persisted}, version=1)
+        state = {"messages": persisted + [message(2000)]}
+        
+        with mock.patch.object(
+            session_delta, "_item_fingerprint", wraps=session_delta._item_fingerprint
+        ) as fingerprint:
+            delta = self.tracker.compute_delta("s1", state)
+            self.tracker.mark_delta("s1", state, delta)
+        
+        self.assertEqual(delta["appends"], {"messages": [message(2000)]})
+        self.assertLessEqual(fingerprint.call_count, 4)
+        next_state = {"messages": state["messages"] + [message(2001)]}
+        self.assertEqual(self.tracker.compute_delta("s1", next_state)["appends"], {"messages": [message(2001)]})
+        print("✅ 边界检查测试通过")
+    
+    def test_session_lock_is_stable(self):
+        """测试同一会话总是得到同一把锁，删除跟踪记录后也不替换"""
+        lock = self.tracker.session_lock("s1")
+        self.tracker.forget("s1")
+        self.assertIs(self.tracker.session_lock("s1"), lock)
+        self.assertIsNot(self.tracker.session_lock("s2"), lock)
+        print("✅ 会话持久化锁测试通过")
+
+
+class TestSessionDeltaFiles(unittest.TestCase):
+    """测试引擎的文件增量写入与重放"""
+    
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from app.core.engine import IsotopeEngine
+        except ImportError as e:
+            raise unittest.SkipTest(f"依赖不可用，跳过引擎文件增量测试: {e}")
+        cls.engine_class = IsotopeEngine
+    
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.checkpoint_dir, ignore_errors=True)
+        # 只使用文件检查点相关的属性，不初始化完整引擎
+        self.engine = self.engine_class.__new__(self.engine_class)
+        self.engine.checkpoint_dir = self.checkpoint_dir
+        self.engine.session_delta_tracker = SessionDeltaTracker(compact_every=5)
+    
+    def reload(self):
+        self.engine.session_delta_tracker = SessionDeltaTracker(compact_every=5)
+        loaded = self.engine._read_session_file(
+            os.path.join(self.checkpoint_dir, "session_s1.json")
+        )
+        return loaded[1]["state"]
+    
+    def test_replay_after_compaction(self):
+        """测试跨越快照压缩的多次保存重放后与内存状态一致"""
+        state = {"messages": [], "current_task": None}
+        for index in range(12):
+            state["messages"].append(message(index))
+            state["current_task"] = f"task_{index}"
+            self.engine._write_session_checkpoint_file("s1", state)
+        
+        self.assertTrue(os.path.exists(self.engine._session_delta_file_path("s1")))
+        replayed = self.reload()
+        self.assertEqual(replayed["messages"], state["messages"])
+        self.assertEqual(replayed["current_task"], "task_11")
+        print("✅ 压缩后重放测试通过")
+    
+    def test_concurrent_saves_do_not_duplicate_appends(self):
+        """测试并发保存同一会话时不会基于同一基准重复追加"""
+        state = {"messages": [message(0)]}
+        self.engine._write_session_checkpoint_file("s1", state)
+        errors = []
+        
+        for round_index in range(1, 8):
+            state = {"messages": state["messages"] + [message(round_index)]}
+            barrier = threading.Barrier(4)
+            
+            def save(snapshot=state):
+                barrier.wait(5)
+                try:
+                    self.engine._write_session_checkpoint_file("s1", snapshot)
+                except Exception as e:
+                    errors.append(e)
+            
+            threads = [threading.Thread(target=save) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        
+        self.assertEqual(errors, [])
+        replayed = self.reload()
+        self.assertEqual([m["id"] for m in replayed["messages"]], [m["id"] for m in state["messages"]])
+        print("✅ 并发保存不重复追加测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+会话持久化后台写入器单元测试
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.session_persistence_worker import (
+        SessionPersistenceWorker, atomic_write_bytes, snapshot_state
+    )
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过会话持久化写入器测试: {e}")
+
+
+class _RecordingSaver:
+    """记录每次写入的会话ID和消息数"""
+
+    def __init__(self):
+        self.saves = []
+        self.lock = threading.Lock()
+
+    def __call__(self, session_id, state):
+        with self.lock:
+            self.saves.append((session_id, len(state["messages"])))
+        return True
+
+
+class TestSessionPersistenceWorker(unittest.TestCase):
+    """测试后台保存的合并、同步保存与关闭刷新"""
+
+    def setUp(self):
+        self.saver = _RecordingSaver()
+        self.worker = SessionPersistenceWorker(self.saver, coalesce_delay=0.2)
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_repeated_saves_are_coalesced(self):
+        """测试合并窗口内同一会话的多次请求只写入最新状态"""
+        state = {"messages": []}
+        for i in range(5):
+            state["messages"].append(f"消息{i}")
+            self.worker.schedule("s1", state)
+        self.worker.schedule("s2", {"messages": ["其他会话"]})
+
+        self.assertTrue(self.worker.flush(timeout=5))
+        self.assertEqual(sorted(self.saver.saves), [("s1", 5), ("s2", 1)])
+        metrics = self.worker.get_metrics()
+        self.assertEqual((metrics["requested"], metrics["coalesced"], metrics["saved"]), (6, 4, 2))
+        self.assertEqual(metrics["pending"], 0)
+        print("✅ 同一会话的保存请求被合并")
+
+    def test_snapshot_isolated_from_later_mutation(self):
+        """测试入队后请求线程继续追加消息不影响已提交的快照"""
+        state = {"messages": ["a", "b"], "metadata": {"k": 1}}
+        snapshot = snapshot_state(state)
+        state["messages"].append("c")
+        state["metadata"]["k"] = 2
+        self.assertEqual(snapshot, {"messages": ["a", "b"], "metadata": {"k": 1}})
+
+    def test_save_now_replaces_pending_request(self):
+        """测试同步保存立即写入并取消该会话尚未写入的旧请求"""
+        self.worker.schedule("s1", {"messages": ["旧"]})
+        self.assertTrue(self.worker.save_now("s1", {"messages": ["新", "新"]}))
+        self.assertEqual(self.saver.saves, [("s1", 2)])
+
+        self.worker.flush(timeout=5)
+        self.assertEqual(self.saver.saves, [("s1", 2)])
+        print("✅ 显式中断时同步保存")
+
+    def test_close_flushes_pending_saves(self):
+        """测试关闭时写入合并窗口内尚未写入的请求"""
+        worker = SessionPersistenceWorker(self.saver, coalesce_delay=60)
+        worker.schedule("s1", {"messages": ["a"]})
+        worker.schedule("s2", {"messages": ["a", "b"]})
+        self.assertEqual(self.saver.saves, [])
+
+        started = time.time()
+        worker.close()
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(sorted(self.saver.saves), [("s1", 1), ("s2", 2)])
+
+        # 关闭后的请求同步写入
+        worker.schedule("s3", {"messages": []})
+        self.assertIn(("s3", 0), self.saver.saves)
+        print("✅ 关闭时刷新所有待保存会话")
+
+    def test_failed_save_is_counted(self):
+        """测试保存函数抛出异常时记录失败，不影响后台线程"""
+        def failing_save(session_id, state):
+            raise IOError("磁盘已满")
+
+        worker = SessionPersistenceWorker(failing_save, coalesce_delay=0)
+        try:
+            worker.schedule("s1", {"messages": []})
+            self.assertTrue(worker.flush(timeout=5))
+            worker.schedule("s1", {"messages": []})
+            self.assertTrue(worker.flush(timeout=5))
+            self.assertEqual(worker.get_metrics()["failed"], 2)
+        finally:
+            worker.close()
+
+
+class TestAtomicWrite(unittest.TestCase):
+    """测试原子文件写入"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_replaces_target(self):
+        atomic_write_bytes(self.path, b'{"v": 1}')
+        atomic_write_bytes(self.path, b'{"v": 2}')
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b'{"v": 2}')
+        self.assertEqual(os.listdir(self.temp_dir.name), ["checkpoint.json"])
+
+    def test_interrupted_write_keeps_previous_file(self):
+        """测试写入中断时保留原文件且不留下临时文件"""
+        atomic_write_bytes(self.path, b'{"v": 1}')
+        with mock.patch("app.core.session_persistence_worker.os.replace", side_effect=OSError("中断")):
+            with self.assertRaises(OSError):
+                atomic_write_bytes(self.path, b'{"v": 2}')
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b'{"v": 1}')
+        self.assertEqual(os.listdir(self.temp_dir.name), ["checkpoint.json"])
+        print("✅ 写入中断不会留下半截检查点")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
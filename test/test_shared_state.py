@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+跨进程共享会话状态单元测试
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage
+    from app.core.shared_state import (
+        InProcessBroker,
+        SharedStateLayer,
+        StaleSessionVersionError,
+        create_shared_state_layer
+    )
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过共享会话状态测试: {e}")
+
+# Redis代理测试使用fakeredis，版本化写入的Lua脚本（EVALSHA）需要lupa才能执行
+try:
+    import fakeredis
+    import lupa  # noqa: F401
+    FAKEREDIS_LUA_AVAILABLE = True
+except ImportError:
+    FAKEREDIS_LUA_AVAILABLE = False
+
+
+class TestSharedSessionState(unittest.TestCase):
+    """测试跨进程共享会话状态（使用进程内后备实现模拟两个工作进程）"""
+    
+    def setUp(self):
+        broker = InProcessBroker()
+        self.worker_a = SharedStateLayer(broker, worker_id="worker-a")
+        self.worker_b = SharedStateLayer(broker, worker_id="worker-b")
+        self.session = {
+            "state": {"messages": [HumanMessage(content="你好", id="h1"), AIMessage(content="您好", id="a1")]},
+            "created_at": "2024-01-01T12:00:00",
+            "last_updated": "2024-01-01T12:05:00",
+            "metadata": {"name": "测试会话"}
+        }
+    
+    def test_save_notifies_other_workers(self):
+        """测试写入会话后其他进程收到失效消息并能读取最新状态"""
+        received_a, received_b = [], []
+        self.worker_a.sessions.add_listener(lambda *args: received_a.append(args))
+        self.worker_b.sessions.add_listener(lambda *args: received_b.append(args))
+        
+        version = self.worker_a.sessions.save_session(
+            "s1", self.session, catalog_entry={"message_count": 2}
+        )
+        self.assertEqual(version, 1)
+        self.assertEqual(received_a, [])
+        self.assertEqual(received_b, [("put", "s1", {"message_count": 2})])
+        
+        loaded = self.worker_b.sessions.load_session("s1")
+        self.assertEqual(loaded["version"], 1)
+        self.assertEqual(loaded["session"]["metadata"], {"name": "测试会话"})
+        self.assertEqual(
+            [(type(m), m.content) for m in loaded["session"]["state"]["messages"]],
+            [(HumanMessage, "你好"), (AIMessage, "您好")]
+        )
+        
+        self.worker_b.sessions.delete_session("s1")
+        self.assertEqual(received_a[-1][:2], ("delete", "s1"))
+        self.assertIsNone(self.worker_a.sessions.load_session("s1"))
+        print("✅ 共享会话写入与失效通知正常")
+    
+    def test_events_fan_out_to_other_workers(self):
+        """测试事件只分发给其他进程"""
+        received_a, received_b = [], []
+        self.worker_a.events.subscribe(lambda session_id, event: received_a.append((session_id, event)))
+        self.worker_b.events.subscribe(lambda session_id, event: received_b.append((session_id, event)))
+        
+        self.assertTrue(self.worker_a.events.publish("s1", {"kind": "websocket", "data": 1}))
+        self.assertTrue(self.worker_a.events.flush())
+        self.assertEqual(received_a, [])
+        self.assertEqual(received_b, [("s1", {"kind": "websocket", "data": 1})])
+        print("✅ 跨进程事件分发正常")
+    
+    def test_appends_are_written_as_deltas(self):
+        """测试后续保存只追加新增内容，其他进程读取到完整会话与对话轮次"""
+        turns = {"session_id": "s1", "summarized_turn_ids": [], "completed_turns": [
+            {"turn_id": "t1", "complete_content": "您好"}
+        ]}
+        self.worker_a.sessions.save_session("s1", self.session, turn_state=turns)
+        
+        self.session["state"]["messages"].append(HumanMessage(content="再见", id="h2"))
+        turns["completed_turns"].append({"turn_id": "t2", "complete_content": "再见"})
+        version = self.worker_a.sessions.save_session("s1", self.session, turn_state=turns)
+        self.assertEqual(version, 2)
+        
+        metrics = self.worker_a.sessions.get_metrics()
+        self.assertEqual((metrics["snapshot_writes"], metrics["delta_writes"]), (1, 1))
+        
+        loaded = self.worker_b.sessions.load_session("s1")
+        self.assertEqual(loaded["version"], 2)
+        self.assertEqual(
+            [m.content for m in loaded["session"]["state"]["messages"]],
+            ["你好", "您好", "再见"]
+        )
+        self.assertEqual([t["turn_id"] for t in loaded["turns"]["completed_turns"]], ["t1", "t2"])
+        self.assertEqual(loaded["session"]["metadata"], {"name": "测试会话"})
+        print("✅ 共享会话增量写入正常")
+    
+    def test_rewritten_prefix_writes_snapshot(self):
+        """测试已写入的消息被改写（如历史压缩）时重写快照"""
+        self.worker_a.sessions.save_session("s1", self.session)
+        self.session["state"]["messages"] = [AIMessage(content="摘要", id="summary")]
+        self.worker_a.sessions.save_session("s1", self.session)
+        
+        self.assertEqual(self.worker_a.sessions.get_metrics()["snapshot_writes"], 2)
+        loaded = self.worker_b.sessions.load_session("s1")
+        self.assertEqual([m.content for m in loaded["session"]["state"]["messages"]], ["摘要"])
+        print("✅ 前缀变化时重写快照正常")
+    
+    def test_stale_write_is_rejected(self):
+        """测试基于旧版本的写入被拒绝，重新读取后可以继续写入"""
+        self.worker_a.sessions.save_session("s1", self.session)
+        loaded = self.worker_b.sessions.load_session("s1")
+        
+        self.session["state"]["messages"].append(HumanMessage(content="来自A", id="h2"))
+        self.assertEqual(self.worker_a.sessions.save_session("s1", self.session), 2)
+        
+        stale = loaded["session"]
+        stale["state"]["messages"].append(HumanMessage(content="来自B", id="h3"))
+        with self.assertRaises(StaleSessionVersionError):
+            self.worker_b.sessions.save_session("s1", stale)
+        self.assertEqual(self.worker_b.sessions.get_metrics()["stale_rejected"], 1)
+        
+        latest = self.worker_b.sessions.load_session("s1")
+        self.assertEqual([m.content for m in latest["session"]["state"]["messages"]][-1], "来自A")
+        latest["session"]["state"]["messages"].append(HumanMessage(content="来自B", id="h3"))
+        self.assertEqual(self.worker_b.sessions.save_session("s1", latest["session"]), 3)
+        print("✅ 旧版本写入被拒绝")
+    
+    def test_publish_does_not_wait_for_broker(self):
+        """测试发布事件不等待共享频道写入完成"""
+        release = threading.Event()
+        broker = InProcessBroker()
+        original_publish = broker.publish
+        
+        def slow_publish(channel, message):
+            release.wait(5)
+            return original_publish(channel, message)
+        
+        broker.publish = slow_publish
+        worker_a = SharedStateLayer(broker, worker_id="worker-a")
+        worker_b = SharedStateLayer(broker, worker_id="worker-b")
+        received = []
+        worker_b.events.subscribe(lambda session_id, event: received.append(event))
+        
+        start = time.monotonic()
+        for index in range(20):
+            self.assertTrue(worker_a.events.publish("s1", {"index": index}))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(received, [])
+        
+        release.set()
+        self.assertTrue(worker_a.events.flush())
+        self.assertEqual([event["index"] for event in received], list(range(20)))
+        worker_a.close()
+        worker_b.close()
+        print("✅ 事件异步发布正常")
+
+
+class TestEnginePublishRebase(unittest.TestCase):
+    """测试引擎发布共享会话遇到版本冲突时重新应用本地新增的轮次"""
+    
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from app.core.engine import IsotopeEngine
+            from app.core.conversation_turn_manager import ConversationTurnManager
+            from app.core.session_working_set import SessionWorkingSet
+        except ImportError as e:
+            raise unittest.SkipTest(f"依赖不可用，跳过引擎共享会话测试: {e}")
+        cls.engine_class = IsotopeEngine
+        cls.turn_manager_class = ConversationTurnManager
+        cls.working_set_class = SessionWorkingSet
+    
+    def make_engine(self, layer):
+        # 只使用共享会话相关的属性，不初始化完整引擎；不注册失效监听，模拟失效消息尚未到达
+        engine = self.engine_class.__new__(self.engine_class)
+        engine.shared_state = layer
+        engine.sessions = self.working_set_class()
+        engine.turn_managers = {}
+        return engine
+    
+    @staticmethod
+    def add_turn(engine, question, answer):
+        manager = engine.turn_managers["s1"]
+        manager.start_user_turn(question)
+        manager.start_assistant_turn(source="main_agent")
+        manager.add_assistant_content(answer)
+        manager.complete_assistant_turn()
+        engine.sessions["s1"]["state"]["messages"] = manager.get_conversation_history()
+        engine._publish_shared_session("s1")
+    
+    def test_stale_publish_reapplies_local_turn(self):
+        """测试其他进程先写入新版本时，本进程刚完成的轮次在最新版本上重新写入"""
+        broker = InProcessBroker()
+        layer_a = SharedStateLayer(broker, worker_id="worker-a")
+        layer_b = SharedStateLayer(broker, worker_id="worker-b")
+        self.addCleanup(layer_a.close)
+        self.addCleanup(layer_b.close)
+        engine_a, engine_b = self.make_engine(layer_a), self.make_engine(layer_b)
+        
+        engine_a.turn_managers["s1"] = self.turn_manager_class(session_id="s1")
+        engine_a.sessions["s1"] = {"state": {"messages": [], "current_task": "a"}, "metadata": {}}
+        self.add_turn(engine_a, "你好", "您好")
+        
+        shared = layer_b.sessions.load_session("s1")
+        engine_b.sessions["s1"] = shared["session"]
+        engine_b.turn_managers["s1"] = self.turn_manager_class.from_state(shared["turns"])
+        
+        self.add_turn(engine_a, "来自A的问题", "来自A的回答")
+        self.add_turn(engine_b, "来自B的问题", "来自B的回答")
+        
+        self.assertTrue(engine_b.sessions.is_loaded("s1"))
+        self.assertEqual(layer_b.sessions.get_metrics()["stale_rejected"], 1)
+        expected = ["你好", "您好", "来自A的问题", "来自A的回答", "来自B的问题", "来自B的回答"]
+        latest = layer_a.sessions.load_session("s1", track=False)
+        self.assertEqual(latest["version"], 3)
+        self.assertEqual([m.content for m in latest["session"]["state"]["messages"]], expected)
+        self.assertEqual(
+            [turn["complete_content"] for turn in latest["turns"]["completed_turns"]], expected
+        )
+        self.assertEqual(
+            [m.content for m in engine_b.sessions["s1"]["state"]["messages"]], expected
+        )
+        self.assertEqual(
+            [m.content for m in engine_b.turn_managers["s1"].get_conversation_history()], expected
+        )
+        print("✅ 版本冲突时重新应用本地轮次")
+
+
+@unittest.skipUnless(FAKEREDIS_LUA_AVAILABLE, "fakeredis或lupa不可用，跳过Redis代理测试")
+class TestRedisBroker(unittest.TestCase):
+    """测试Redis代理的版本化写入（使用fakeredis与lupa，未安装时跳过）"""
+    
+    def setUp(self):
+        try:
+            from app.core.shared_state import RedisBroker
+        except ImportError as e:
+            self.skipTest(f"依赖不可用: {e}")
+        server = fakeredis.FakeServer()
+        self.worker_a = SharedStateLayer(RedisBroker(fakeredis.FakeRedis(server=server)), worker_id="worker-a")
+        self.worker_b = SharedStateLayer(RedisBroker(fakeredis.FakeRedis(server=server)), worker_id="worker-b")
+        self.addCleanup(self.worker_a.close)
+        self.addCleanup(self.worker_b.close)
+    
+    def test_versioned_writes(self):
+        """测试Redis上的增量写入、读取与旧版本拒绝"""
+        session = {"state": {"messages": [HumanMessage(content="你好", id="h1")]}, "metadata": {}}
+        self.assertEqual(self.worker_a.sessions.save_session("s1", session), 1)
+        session["state"]["messages"].append(AIMessage(content="您好", id="a1"))
+        self.assertEqual(self.worker_a.sessions.save_session("s1", session), 2)
+        
+        loaded = self.worker_b.sessions.load_session("s1")
+        self.assertEqual(loaded["version"], 2)
+        self.assertEqual([m.content for m in loaded["session"]["state"]["messages"]], ["你好", "您好"])
+        
+        session["state"]["messages"].append(HumanMessage(content="再见", id="h2"))
+        self.assertEqual(self.worker_a.sessions.save_session("s1", session), 3)
+        with self.assertRaises(StaleSessionVersionError):
+            self.worker_b.sessions.save_session("s1", loaded["session"])
+        self.assertEqual(self.worker_a.sessions.get_metrics()["delta_writes"], 2)
+        print("✅ Redis版本化写入正常")
+
+
+class TestCreateSharedStateLayer(unittest.TestCase):
+    """测试共享状态层的创建"""
+    
+    def test_disabled_returns_none(self):
+        self.assertIsNone(create_shared_state_layer({"enabled": False}))
+    
+    def test_memory_backend(self):
+        layer = create_shared_state_layer({"enabled": True, "backend": "memory"})
+        self.assertEqual(layer.backend, "memory")
+        layer.close()
+    
+    def test_unreachable_redis_refuses_to_start(self):
+        """测试启用共享状态但无法连接Redis时不退回进程内实现"""
+        with self.assertRaises(RuntimeError):
+            create_shared_state_layer(
+                {"enabled": True, "backend": "redis"},
+                {"host": "127.0.0.1", "port": 1, "socket_timeout": 0.5}
+            )
+        print("✅ 无法连接Redis时拒绝启动")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
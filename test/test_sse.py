@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+SSE帧编码与同步聊天接口单元测试
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.ui.sse import (
+        build_stream_payload, encode_sse_frame, encode_sse_event,
+        format_event_id, parse_event_id
+    )
+    from app.ui.streaming_types import StreamMessageType
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过SSE测试: {e}")
+
+
+def decode_frame(frame):
+    body = frame.split(b"data: ", 1)[1]
+    return json.loads(body[:-2])
+
+
+class TestStreamPayload(unittest.TestCase):
+    """测试按消息类型查表构建SSE数据"""
+    
+    def test_token_payload(self):
+        """测试token帧携带完整信封，空token不发送"""
+        chunk = {"type": StreamMessageType.LLM_TOKEN, "content": "孔隙", "source": "main", "llm_model": "m1"}
+        payload = build_stream_payload(chunk, "s1", 3)
+        self.assertEqual(payload["type"], "token")
+        self.assertEqual((payload["content"], payload["session_id"], payload["chunk_id"]), ("孔隙", "s1", 3))
+        self.assertIsNone(build_stream_payload({**chunk, "content": ""}, "s1", 4))
+        print("✅ token帧构建测试通过")
+    
+    def test_compact_token_envelope(self):
+        """测试紧凑模式下信封字段只在变化时携带"""
+        envelope = {}
+        chunk = {"type": "llm_token", "content": "a", "source": "main", "llm_model": "m1"}
+        first = build_stream_payload(chunk, "s1", 1, envelope)
+        second = build_stream_payload(chunk, "s1", 2, envelope)
+        switched = build_stream_payload({**chunk, "source": "expert"}, "s1", 3, envelope)
+        
+        self.assertEqual(first["source"], "main")
+        self.assertNotIn("session_id", first)
+        self.assertNotIn("source", second)
+        self.assertNotIn("llm_model", second)
+        self.assertEqual(switched["source"], "expert")
+        print("✅ 紧凑信封测试通过")
+    
+    def test_data_detail_dispatch(self):
+        """测试工具与节点消息按类型生成data事件详情"""
+        tool = build_stream_payload(
+            {"type": StreamMessageType.TOOL_COMPLETE.value, "content": "完成", "tool_name": "plot", "source": "tool"},
+            "s1", 5
+        )
+        self.assertEqual(tool["type"], "data")
+        self.assertEqual(tool["content"]["type"], StreamMessageType.TOOL_COMPLETE.value)
+        self.assertEqual(tool["content"]["source"], "tool")
+        
+        legacy = build_stream_payload({"role": "assistant", "content": "你好"}, "s1", 6)
+        self.assertEqual((legacy["type"], legacy["content"]), ("token", "你好"))
+        
+        unknown = build_stream_payload({"type": "custom_kind", "value": 1}, "s1", 7)
+        self.assertEqual(unknown["content"], {"type": "custom_kind", "value": 1})
+        print("✅ data事件分派测试通过")
+    
+    def test_frames_and_event_ids(self):
+        """测试SSE帧编码与事件ID往返"""
+        frame = encode_sse_frame({"type": "token", "content": "δ13C"})
+        self.assertTrue(frame.startswith(b"data: ") and frame.endswith(b"\n\n"))
+        self.assertEqual(decode_frame(frame)["content"], "δ13C")
+        
+        event_id = format_event_id("run-1", 42)
+        framed = encode_sse_event(b"{}", event_id)
+        self.assertTrue(framed.startswith(b"id: run-1:42\n"))
+        self.assertEqual(parse_event_id(event_id), ("run-1", 42))
+        self.assertIsNone(parse_event_id("bad"))
+        print("✅ SSE帧与事件ID测试通过")
+
+
+class TestSendMessageLogging(unittest.TestCase):
+    """测试同步聊天接口不逐块记录INFO日志"""
+    
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from app.api.routes import chat
+            from app.api.models import ChatRequest
+        except ImportError as e:
+            raise unittest.SkipTest(f"依赖不可用，跳过聊天接口测试: {e}")
+        cls.chat = chat
+        cls.request_class = ChatRequest
+    
+    def _info_records(self, chunk_count):
+        class _Engine:
+            config = {}
+            
+            def get_session_by_id(self, session_id):
+                return {"state": {}}
+            
+            async def aprocess_message_streaming(self, message, session_id, stream_mode):
+                for index in range(chunk_count):
+                    yield {"role": "assistant", "content": f"{index} "}
+        
+        request = self.request_class(message="分析", session_id="s1", stream=False)
+        with self.assertLogs(self.chat.logger, level=logging.INFO) as captured:
+            response = asyncio.run(self.chat.send_message(request, engine=_Engine()))
+        self.assertTrue(response.success)
+        return [record for record in captured.records if record.levelno >= logging.INFO]
+    
+    def test_info_logs_do_not_scale_with_chunks(self):
+        """测试INFO日志条数与chunk数量无关"""
+        self.assertEqual(len(self._info_records(2)), len(self._info_records(50)))
+        print("✅ 同步聊天日志测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
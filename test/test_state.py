@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+状态管理单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage
+    from app.core.state import StateManager
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过状态管理测试: {e}")
+
+
+class TestStateFork(unittest.TestCase):
+    """测试写时复制的状态分支"""
+    
+    def test_fork_shares_content_and_isolates_changes(self):
+        """测试分支共享内容对象、隔离修改，并只合并新增消息"""
+        base = StateManager.create_initial_state()
+        base["messages"] = [HumanMessage(content="问题"), AIMessage(content="回答")]
+        base["tool_results"] = [{"output": "x" * 10000}]
+        
+        first = StateManager.fork_state(base)
+        second = StateManager.fork_state(base)
+        self.assertIs(first["messages"][0], base["messages"][0])
+        self.assertIs(first["tool_results"][0], base["tool_results"][0])
+        
+        first["messages"].append(AIMessage(content="分支一"))
+        first["metadata"]["step_id"] = "step_1"
+        second = StateManager.update_messages(second, AIMessage(content="分支二"))
+        self.assertEqual(len(base["messages"]), 2)
+        self.assertNotIn("step_id", base["metadata"])
+        
+        for forked in (first, second):
+            base["messages"].extend(StateManager.messages_added_since_fork(base, forked, 2))
+        self.assertEqual([m.content for m in base["messages"]], ["问题", "回答", "分支一", "分支二"])
+        print("✅ 状态分支共享内容并只合并新增消息")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+状态编解码器单元测试
+"""
+
+from datetime import datetime
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+    from app.core.state_codec import StateCodec, FORMAT_JSON, FORMAT_MSGPACK, MSGPACK_AVAILABLE
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过状态编解码器测试: {e}")
+
+
+class TestStateCodec(unittest.TestCase):
+    """测试状态编解码器的往返一致性"""
+    
+    def setUp(self):
+        self.codec = StateCodec()
+        self.state = {
+            "messages": [
+                SystemMessage(content="系统提示", id="s1"),
+                HumanMessage(content="分析碳同位素数据", id="h1"),
+                AIMessage(content="好的", id="a1", tool_calls=[
+                    {"name": "plot", "args": {"x": 1}, "id": "call_1", "type": "tool_call"}
+                ])
+            ],
+            "files": {"f1": {"file_id": "f1", "file_name": "data.csv", "size": 1024}},
+            "tool_results": [{"tool_name": "plot", "status": "success", "output": [1, 2, 3]}],
+            "current_task": None,
+            "created": datetime(2024, 1, 1, 12, 0, 0)
+        }
+    
+    def _assert_round_trip(self, fmt: str, compress: bool):
+        decoded = self.codec.decode(self.codec.encode(self.state, fmt=fmt, compress=compress))
+        self.assertEqual(
+            [(type(m), m.content, m.id) for m in decoded["messages"]],
+            [(type(m), m.content, m.id) for m in self.state["messages"]]
+        )
+        self.assertEqual(decoded["messages"][2].tool_calls[0]["id"], "call_1")
+        self.assertEqual(decoded["files"], self.state["files"])
+        self.assertEqual(decoded["tool_results"], self.state["tool_results"])
+        self.assertIsNone(decoded["current_task"])
+        self.assertEqual(decoded["created"], "2024-01-01T12:00:00")
+    
+    def test_json_round_trip(self):
+        """测试JSON编码往返"""
+        self._assert_round_trip(FORMAT_JSON, compress=False)
+        self._assert_round_trip(FORMAT_JSON, compress=True)
+        print("✅ JSON编码往返一致")
+    
+    @unittest.skipUnless(MSGPACK_AVAILABLE, "msgpack不可用")
+    def test_msgpack_round_trip(self):
+        """测试msgpack编码往返"""
+        self._assert_round_trip(FORMAT_MSGPACK, compress=False)
+        self._assert_round_trip(FORMAT_MSGPACK, compress=True)
+        print("✅ msgpack编码往返一致")
+    
+    def test_serializable_matches_json_bytes(self):
+        """测试JSON兼容结构与直接编码结果一致"""
+        serializable = self.codec.to_serializable(self.state)
+        self.assertEqual(serializable["messages"][1], {"type": "human", "content": "分析碳同位素数据", "id": "h1"})
+        self.assertEqual(self.codec.decode(self.codec.encode(serializable, fmt=FORMAT_JSON), restore_objects=False),
+                         self.codec.decode(self.codec.encode(self.state, fmt=FORMAT_JSON), restore_objects=False))
+        print("✅ JSON兼容结构一致")
+    
+    def test_legacy_gradio_repr_rewritten_on_every_path(self):
+        """测试旧版Gradio图片表示在orjson、标准库与msgpack路径上都改写为图片路径"""
+        legacy = "<gradio.components.image.Image object at 0x7f> value='/data/plots/d13c.png'"
+        state = {"tool_results": [{"output": legacy}], "note": "普通文本"}
+        expected = "__IMAGE_PATH__:'/data/plots/d13c.png'"
+        
+        self.assertEqual(self.codec.to_serializable(state)["tool_results"][0]["output"], expected)
+        decoded = self.codec.decode(self.codec.encode(state, fmt=FORMAT_JSON), restore_objects=False)
+        self.assertEqual(decoded["tool_results"][0]["output"], expected)
+        self.assertEqual(decoded["note"], "普通文本")
+        if MSGPACK_AVAILABLE:
+            decoded = self.codec.decode(self.codec.encode(state, fmt=FORMAT_MSGPACK), restore_objects=False)
+            self.assertEqual(decoded["tool_results"][0]["output"], expected)
+        print("✅ 旧版Gradio图片表示改写一致")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+流模式规划与状态差量单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from langchain_core.messages import HumanMessage, AIMessage
+    from app.ui.state_diff import StateDiffer
+    from app.ui.streaming import plan_stream_modes
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过状态差量测试: {e}")
+
+
+class TestStreamStateDiff(unittest.TestCase):
+    """测试流模式规划与状态差量"""
+    
+    def test_plan_stream_modes(self):
+        """测试values只在需要状态时订阅，不支持的模式被过滤"""
+        self.assertEqual(plan_stream_modes("all"), ["messages", "custom", "updates"])
+        self.assertEqual(plan_stream_modes("messages,custom,values,events"), ["messages", "custom"])
+        self.assertEqual(
+            plan_stream_modes(["messages", "updates"], include_state=True),
+            ["messages", "updates", "values"]
+        )
+        print("✅ 流模式规划正常")
+    
+    def test_diff_sends_only_changes(self):
+        """测试首次下发完整状态，之后只下发新增消息和变化字段"""
+        differ = StateDiffer()
+        first = {
+            "messages": [HumanMessage(content="你好", id="h1")],
+            "metadata": {"step": 1, "flags": {"a": True}},
+            "current_task": None
+        }
+        ops = differ.diff(first)
+        self.assertEqual([op["path"] for op in ops], ["/messages", "/metadata", "/current_task"])
+        self.assertEqual(differ.version, 1)
+        
+        second = {
+            "messages": first["messages"] + [AIMessage(content="您好", id="a1")],
+            "metadata": {"step": 2, "flags": {"a": True}},
+            "current_task": None
+        }
+        ops = differ.diff(second)
+        self.assertEqual(
+            [(op["op"], op["path"]) for op in ops],
+            [("add", "/messages/-"), ("replace", "/metadata/step")]
+        )
+        self.assertEqual(ops[0]["value"]["content"], "您好")
+        self.assertEqual(differ.diff(second), [])
+        self.assertEqual(differ.version, 2)
+        print("✅ 状态差量只包含变化部分")
+    
+    def test_diff_replaces_rewritten_history(self):
+        """测试历史被压缩时整体替换消息列表，删除的字段产生remove"""
+        differ = StateDiffer()
+        differ.diff({"messages": [HumanMessage(content="旧消息", id="h1")], "current_task": "t"})
+        ops = differ.diff({"messages": [AIMessage(content="摘要", id="s1")]})
+        self.assertEqual(
+            [(op["op"], op["path"]) for op in ops],
+            [("replace", "/messages"), ("remove", "/current_task")]
+        )
+        print("✅ 历史重写与字段删除差量正常")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+流式token合并单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.ui.stream_coalescer import TokenCoalescer, resolve_delivery_config
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过token合并测试: {e}")
+
+
+class TestTokenCoalescer(unittest.TestCase):
+    """测试流式token合并"""
+    
+    def setUp(self):
+        self.now = 0.0
+        config = resolve_delivery_config({"flush_interval_ms": 30, "flush_bytes": 16})
+        self.coalescer = TokenCoalescer(config, clock=lambda: self.now)
+    
+    @staticmethod
+    def token(content, source="agent"):
+        return {"type": "llm_token", "role": "assistant", "is_token": True,
+                "content": content, "token": content, "source": source, "llm_model": "m"}
+    
+    def test_merges_tokens_within_window(self):
+        """测试时间窗口内的token合并，非token事件前先下发缓冲"""
+        self.assertEqual(self.coalescer.push(self.token("你")), [])
+        self.now = 0.01
+        self.assertEqual(self.coalescer.push(self.token("好")), [])
+        self.assertAlmostEqual(self.coalescer.time_until_flush(), 0.02)
+        
+        node_event = {"type": "node_complete", "role": "system", "content": "节点完成"}
+        ready = self.coalescer.push(node_event)
+        self.assertEqual([c["content"] for c in ready], ["你好", "节点完成"])
+        self.assertEqual(ready[0]["token"], "你好")
+        self.assertEqual(ready[0]["token_count"], 2)
+        self.assertIsNone(self.coalescer.time_until_flush())
+        print("✅ 时间窗口内token合并正常")
+    
+    def test_flushes_on_bytes_and_source_change(self):
+        """测试字节阈值和来源变化触发下发"""
+        self.coalescer.push(self.token("a" * 10))
+        ready = self.coalescer.push(self.token("b" * 10))
+        self.assertEqual([c["content"] for c in ready], ["a" * 10 + "b" * 10])
+        
+        self.coalescer.push(self.token("x", source="agent"))
+        ready = self.coalescer.push(self.token("y", source="reviewer"))
+        self.assertEqual([c["content"] for c in ready], ["x"])
+        self.assertEqual([c["source"] for c in self.coalescer.flush()], ["reviewer"])
+        print("✅ 字节阈值与来源切换下发正常")
+    
+    def test_token_mode_passes_through(self):
+        """测试逐token模式原样透传"""
+        coalescer = TokenCoalescer(resolve_delivery_config({"mode": "token"}))
+        chunk = self.token("你")
+        self.assertEqual(coalescer.push(chunk), [chunk])
+        self.assertFalse(coalescer.has_pending)
+        print("✅ 逐token模式透传正常")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+WebSocket连接级发送队列单元测试
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.ui.stream_fanout import ConnectionSender, OutboundFrame, FanoutConfig
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过发送队列测试: {e}")
+
+
+class TestStreamFanout(unittest.TestCase):
+    """测试连接级发送队列"""
+    
+    def test_slow_viewer_does_not_block_fast_client(self):
+        """测试慢连接合并token帧、队满时丢弃并发送gap通知，快连接完整收到"""
+        async def scenario():
+            fast_received, slow_received = [], []
+            release = asyncio.Event()
+            
+            async def fast_send(text):
+                fast_received.append(text)
+            
+            async def slow_send(text):
+                await release.wait()
+                slow_received.append(text)
+            
+            def make_sender(send_text, policy):
+                return ConnectionSender(
+                    send_text,
+                    FanoutConfig(queue_size=2, policy=policy),
+                    encode=lambda payload: payload,
+                    merge=lambda a, b: a + b,
+                    gap_notice=lambda run_id, start, end: f"gap:{start}-{end}"
+                )
+            
+            fast = make_sender(fast_send, "coalesce")
+            slow = make_sender(slow_send, "coalesce")
+            lossy = make_sender(slow_send, "drop_oldest")
+            senders = (fast, slow, lossy)
+            for sender in senders:
+                sender.start()
+            
+            try:
+                for seq in range(1, 5):
+                    for sender in senders:
+                        sender.offer(OutboundFrame(f"t{seq}", payload=f"t{seq}", merge_key=("r",), run_id="r", seq=seq))
+                    await asyncio.sleep(0.01)
+                fast_metrics = fast.get_metrics()
+                slow_metrics = slow.get_metrics()
+                lossy_metrics = lossy.get_metrics()
+                
+                release.set()
+                await asyncio.sleep(0.01)
+            finally:
+                for sender in senders:
+                    sender.close()
+            return fast_received, slow_received, fast_metrics, slow_metrics, lossy_metrics
+        
+        fast_received, slow_received, fast_metrics, slow_metrics, lossy_metrics = asyncio.run(scenario())
+        self.assertEqual(fast_received, ["t1", "t2", "t3", "t4"])
+        self.assertEqual(fast_metrics["queue_depth"], 0)
+        self.assertEqual(slow_metrics["coalesced"], 2)
+        self.assertEqual(lossy_metrics["dropped"], 1)
+        self.assertIn("t2t3t4", slow_received)
+        self.assertIn("gap:2-2", slow_received)
+        print("✅ 慢连接合并/丢弃，不影响快连接")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+流式事件回放缓冲单元测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.stream_replay import StreamReplayBuffer, StreamReplayRegistry
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过回放缓冲测试: {e}")
+
+
+class TestStreamReplayBuffer(unittest.TestCase):
+    """测试断线续传的回放缓冲"""
+    
+    def test_resume_returns_missed_tail(self):
+        """测试按序号补读，缓冲超限时淘汰最早事件并标记截断"""
+        buffer = StreamReplayBuffer("run1", "s1", max_events=3, max_bytes=1024)
+        for i in range(5):
+            self.assertEqual(buffer.append(f"e{i}", 2), i + 1)
+        
+        events, truncated = buffer.read_after(3)
+        self.assertEqual(events, [(4, "e3"), (5, "e4")])
+        self.assertFalse(truncated)
+        
+        events, truncated = buffer.read_after(0)
+        self.assertEqual([seq for seq, _ in events], [3, 4, 5])
+        self.assertTrue(truncated)
+        self.assertEqual(buffer.read_after(5), ([], False))
+        print("✅ 回放缓冲只补发缺失尾部")
+    
+    def test_registry_evicts_closed_runs(self):
+        """测试已结束的运行按保留期和总大小回收，进行中的运行保留"""
+        registry = StreamReplayRegistry(max_total_bytes=10, retention_seconds=60)
+        old = registry.create("s1")
+        old.append("x" * 8, 8)
+        old.close()
+        running = registry.create("s1")
+        running.append("y" * 8, 8)
+        
+        self.assertEqual(registry.evict_expired(), 1)
+        self.assertIsNone(registry.get(old.run_id))
+        self.assertIs(registry.latest_for_session("s1"), running)
+        
+        running.close()
+        self.assertEqual(registry.evict_expired(now=running.closed_at + 61), 1)
+        self.assertEqual(registry.get_metrics()["runs"], 0)
+        print("✅ 回放缓冲按时间和大小回收")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+记忆使用预聚合存储单元测试
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# 添加项目路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from app.core.memory.usage_rollup_store import (
+        DistinctCounter, UsageRollup, UsageRollupStore, MAX_TRACKED_SESSIONS
+    )
+except ImportError as e:
+    raise unittest.SkipTest(f"依赖不可用，跳过记忆使用汇总测试: {e}")
+
+
+def make_event(timestamp, memory_id="m1", session_id="s1", agent_role="geophysics_analysis",
+               relevance_score=0.8):
+    return SimpleNamespace(
+        timestamp=timestamp,
+        session_id=session_id,
+        agent_role=agent_role,
+        memory_id=memory_id,
+        memory_type="semantic",
+        event_type="access",
+        context={},
+        relevance_score=relevance_score,
+        usage_result={"success": True},
+        performance_metrics={"freshness": 1.0}
+    )
+
+
+class TestDistinctCounter(unittest.TestCase):
+    """测试有界去重计数器"""
+    
+    def test_exact_below_capacity(self):
+        """测试元素数不超过k时精确计数"""
+        counter = DistinctCounter(k=64, items=[f"m{i % 50}" for i in range(500)])
+        self.assertTrue(counter.is_exact)
+        self.assertEqual(len(counter), 50)
+        print("✅ 小基数精确计数测试通过")
+    
+    def test_estimate_is_bounded(self):
+        """测试大基数时内存有界且估算误差可控"""
+        counter = DistinctCounter(k=1024)
+        for i in range(50000):
+            counter.add(f"memory_{i}")
+        self.assertFalse(counter.is_exact)
+        self.assertEqual(len(counter._hashes), 1024)
+        self.assertLess(abs(counter.estimate() - 50000) / 50000, 0.1)
+        print("✅ 大基数估算测试通过")
+    
+    def test_merge_matches_union(self):
+        """测试合并结果与对并集计数一致"""
+        left = DistinctCounter(k=256, items=[f"m{i}" for i in range(0, 3000)])
+        right = DistinctCounter(k=256, items=[f"m{i}" for i in range(2000, 5000)])
+        union = DistinctCounter(k=256, items=[f"m{i}" for i in range(0, 5000)])
+        self.assertEqual(left.merge(right)._hashes, union._hashes)
+        print("✅ 草图合并测试通过")
+
+
+class TestUsageRollupStore(unittest.TestCase):
+    """测试分层汇总存储"""
+    
+    def setUp(self):
+        self.store = UsageRollupStore(bucket_seconds=60, retention_buckets=7 * 24 * 60)
+        self.now = datetime.now().replace(microsecond=0)
+    
+    def test_old_buckets_roll_up_into_coarser_tiers(self):
+        """测试分钟桶合并为小时桶和天桶且总量不变"""
+        start = self.now - timedelta(days=3)
+        for minute in range(0, 3 * 24 * 60, 7):
+            self.store.add_event(make_event(start + timedelta(minutes=minute), memory_id=f"m{minute % 40}"))
+        self.store.add_event(make_event(self.now))
+        
+        stats = self.store.get_statistics()
+        self.assertLessEqual(stats["fine_buckets"], 2 * 60 + 2)
+        self.assertLessEqual(stats["hour_buckets"], 48 + 2)
+        self.assertGreater(stats["day_buckets"], 0)
+        self.assertLess(stats["buckets"], 3 * 24 * 60 // 7)
+        
+        expected_events = len(range(0, 3 * 24 * 60, 7)) + 1
+        totals = self.store.aggregate()["geophysics_analysis"]
+        ranged = self.store.aggregate((start - timedelta(days=1), self.now))["geophysics_analysis"]
+        self.assertEqual(totals.event_count, expected_events)
+        self.assertEqual(ranged.event_count, expected_events)
+        self.assertEqual(len(ranged.memory_ids), 40)
+        self.assertEqual(sum(ranged.hourly_events), expected_events)
+        print("✅ 分层合并测试通过")
+    
+    def test_range_selects_recent_fine_buckets(self):
+        """测试近期时间范围只合并相交的细粒度桶"""
+        self.store.add_event(make_event(self.now - timedelta(hours=30)))
+        for i in range(5):
+            self.store.add_event(make_event(self.now - timedelta(minutes=i)))
+        
+        recent = self.store.aggregate((self.now - timedelta(minutes=10), self.now))
+        self.assertEqual(recent["geophysics_analysis"].event_count, 5)
+        print("✅ 时间范围查询测试通过")
+    
+    def test_expired_days_are_evicted_from_totals(self):
+        """测试超出保留期的天桶被淘汰且运行总量随之重建"""
+        store = UsageRollupStore(bucket_seconds=60, retention_buckets=2 * 24 * 60)
+        store.add_event(make_event(self.now - timedelta(days=5)))
+        store.add_event(make_event(self.now - timedelta(hours=1)))
+        store.add_event(make_event(self.now))
+        
+        self.assertEqual(store.aggregate()["geophysics_analysis"].event_count, 2)
+        self.assertGreaterEqual(store.get_statistics()["evicted_days"], 1)
+        print("✅ 保留期淘汰测试通过")
+    
+    def test_session_tracking_is_capped(self):
+        """测试逐会话统计有上限而会话去重计数仍覆盖全部会话"""
+        rollup = UsageRollup()
+        sessions = MAX_TRACKED_SESSIONS + 50
+        for i in range(sessions):
+            rollup.add_event(make_event(self.now, session_id=f"s{i}"))
+        
+        self.assertEqual(len(rollup.session_events), MAX_TRACKED_SESSIONS)
+        self.assertEqual(rollup.untracked_session_events, 50)
+        self.assertEqual(len(rollup.sessions), sessions)
+        
+        merged = UsageRollup().merge(rollup)
+        other = UsageRollup()
+        for i in range(sessions, sessions + 10):
+            other.add_event(make_event(self.now, session_id=f"s{i}"))
+        merged.merge(other)
+        self.assertEqual(len(merged.session_events), MAX_TRACKED_SESSIONS)
+        self.assertEqual(sum(merged.session_events.values()) + merged.untracked_session_events, sessions + 10)
+        print("✅ 会话跟踪上限测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)